@@ -0,0 +1,270 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include "config.h"
+#include <glib.h>
+#include <string.h>
+
+/**
+ * @file
+ *
+ * Precompiled protocol decoder bundles.
+ */
+
+/*
+ * A bundle is a zip archive made by tools/bundle-decoders, with all PDs
+ * compiled to bytecode, and a manifest of their metadata. Python imports
+ * from it like from any other zip archive in sys.path.
+ *
+ * The manifest is the first file in the archive, stored uncompressed, so
+ * it can be read right out of the mapped file, without going through
+ * Python's zipimport. It's a GVariant in text form, of MANIFEST_TYPE.
+ * Decoders are loaded from it just like from the decoder index, and their
+ * modules are only imported when they're needed.
+ */
+
+/** @cond PRIVATE */
+
+/* Must match MANIFEST_VERSION in tools/bundle-decoders. */
+#define MANIFEST_VERSION 1
+
+/* Format version, Python bytecode magic number, and the decoders. */
+#define MANIFEST_TYPE "(uua" SRD_DECODER_META_TYPE ")"
+
+#define MANIFEST_NAME "MANIFEST"
+
+/* A zip archive's local file header, up to the file name. */
+#define ZIP_LOCAL_HEADER_SIG 0x04034b50
+#define ZIP_LOCAL_HEADER_SIZE 30
+/* The sizes follow the data, rather than being in the header. */
+#define ZIP_FLAG_DATA_DESCRIPTOR (1 << 3)
+#define ZIP_METHOD_STORED 0
+
+struct bundle {
+	/* Module names of the decoders, in the manifest's order. */
+	GPtrArray *names;
+	/* Maps a module name to the decoder's metadata. */
+	GHashTable *decoders;
+};
+
+/* Maps a search path to its bundle, or to NULL if it isn't one. */
+static GHashTable *bundles = NULL;
+
+static guint16 le16(const guint8 *p)
+{
+	return p[0] | (p[1] << 8);
+}
+
+static guint32 le32(const guint8 *p)
+{
+	return le16(p) | ((guint32)le16(p + 2) << 16);
+}
+
+/* Find the manifest, which must be the first file in the archive. */
+static gboolean manifest_find(const guint8 *data, gsize len,
+		const char **text, gsize *text_len)
+{
+	guint32 size;
+	guint16 flags, method, name_len, extra_len;
+	gsize offset;
+
+	if (len < ZIP_LOCAL_HEADER_SIZE || le32(data) != ZIP_LOCAL_HEADER_SIG)
+		return FALSE;
+
+	flags = le16(data + 6);
+	method = le16(data + 8);
+	size = le32(data + 18);
+	name_len = le16(data + 26);
+	extra_len = le16(data + 28);
+	if ((flags & ZIP_FLAG_DATA_DESCRIPTOR) || method != ZIP_METHOD_STORED)
+		return FALSE;
+	if (name_len != strlen(MANIFEST_NAME) || memcmp(data
+			+ ZIP_LOCAL_HEADER_SIZE, MANIFEST_NAME, name_len))
+		return FALSE;
+
+	offset = ZIP_LOCAL_HEADER_SIZE + name_len + extra_len;
+	if (offset > len || size > len - offset)
+		return FALSE;
+
+	*text = (const char *)data + offset;
+	*text_len = size;
+
+	return TRUE;
+}
+
+static void bundle_free(struct bundle *b)
+{
+	if (!b)
+		return;
+
+	g_hash_table_destroy(b->decoders);
+	g_ptr_array_free(b->names, TRUE);
+	g_free(b);
+}
+
+/* Read a bundle's manifest. Returns NULL if the file isn't a bundle. */
+static struct bundle *bundle_read(const char *path)
+{
+	struct bundle *b;
+	GMappedFile *file;
+	GVariant *manifest, *meta;
+	GVariantIter *iter;
+	GError *error;
+	const char *text;
+	char *module_name;
+	gsize text_len;
+	guint32 version, magic;
+
+	if (!g_file_test(path, G_FILE_TEST_IS_REGULAR))
+		return NULL;
+	if (!(file = g_mapped_file_new(path, FALSE, NULL)))
+		return NULL;
+	if (!manifest_find((const guint8 *)g_mapped_file_get_contents(file),
+			g_mapped_file_get_length(file), &text, &text_len)) {
+		/* Maybe just a zip archive of PDs. */
+		g_mapped_file_unref(file);
+		return NULL;
+	}
+
+	error = NULL;
+	manifest = g_variant_parse(G_VARIANT_TYPE(MANIFEST_TYPE), text,
+			text + text_len, NULL, &error);
+	g_mapped_file_unref(file);
+	if (!manifest) {
+		srd_err("Invalid manifest in decoder bundle '%s': %s.", path,
+				error->message);
+		g_error_free(error);
+	}
+
+	/* Even if it's unusable, don't treat it as a plain zip archive. */
+	b = g_malloc0(sizeof(struct bundle));
+	b->names = g_ptr_array_new_with_free_func(g_free);
+	b->decoders = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+			(GDestroyNotify)g_variant_unref);
+	if (!manifest)
+		return b;
+
+	g_variant_get(manifest, "(uu@a" SRD_DECODER_META_TYPE ")", &version,
+			&magic, NULL);
+	if (version != MANIFEST_VERSION) {
+		srd_err("Decoder bundle '%s' has unsupported version %u.",
+				path, version);
+	} else if (magic != (guint32)PyImport_GetMagicNumber()) {
+		/* Its bytecode can't be imported. */
+		srd_err("Decoder bundle '%s' was made for another Python "
+				"version.", path);
+	} else {
+		g_variant_get_child(manifest, 2, "a" SRD_DECODER_META_TYPE,
+				&iter);
+		while ((meta = g_variant_iter_next_value(iter))) {
+			g_variant_get_child(meta, 0, "s", &module_name);
+			g_ptr_array_add(b->names, module_name);
+			g_hash_table_insert(b->decoders, module_name, meta);
+		}
+		g_variant_iter_free(iter);
+		srd_dbg("Decoder bundle '%s' has %u decoders.", path,
+				b->names->len);
+	}
+	g_variant_unref(manifest);
+
+	return b;
+}
+
+/* Get the bundle at a search path, reading it the first time around. */
+static struct bundle *bundle_get(const char *path)
+{
+	struct bundle *b;
+	gpointer value;
+
+	if (!bundles)
+		bundles = g_hash_table_new_full(g_str_hash, g_str_equal,
+				g_free, (GDestroyNotify)bundle_free);
+
+	if (g_hash_table_lookup_extended(bundles, path, NULL, &value))
+		return value;
+
+	b = bundle_read(path);
+	g_hash_table_insert(bundles, g_strdup(path), b);
+
+	return b;
+}
+
+/** @endcond */
+
+/**
+ * List the decoders in a decoder bundle.
+ *
+ * The bundle's manifest is only read once. Must be called with the GIL
+ * held.
+ *
+ * @param path A decoder search path.
+ *
+ * @return The module names of the decoders in the bundle, or NULL if the
+ *         search path isn't a bundle. Owned by the bundle.
+ *
+ * @private
+ */
+SRD_PRIV const GPtrArray *srd_bundle_decoders(const char *path)
+{
+	struct bundle *b;
+
+	if (!(b = bundle_get(path)))
+		return NULL;
+
+	return b->names;
+}
+
+/**
+ * Get a decoder's metadata from a decoder bundle.
+ *
+ * Must be called with the GIL held.
+ *
+ * @param path A decoder search path.
+ * @param module_name The module name of the decoder.
+ *
+ * @return The decoder's metadata, of SRD_DECODER_META_TYPE, or NULL if
+ *         the search path isn't a bundle or the decoder isn't in it.
+ *         Owned by the bundle.
+ *
+ * @private
+ */
+SRD_PRIV GVariant *srd_bundle_decoder_get(const char *path,
+		const char *module_name)
+{
+	struct bundle *b;
+
+	if (!(b = bundle_get(path)))
+		return NULL;
+
+	return g_hash_table_lookup(b->decoders, module_name);
+}
+
+/**
+ * Forget all decoder bundles read so far.
+ *
+ * @private
+ */
+SRD_PRIV void srd_bundle_free_all(void)
+{
+	if (!bundles)
+		return;
+
+	g_hash_table_destroy(bundles);
+	bundles = NULL;
+}
@@ -291,54 +291,159 @@ static int get_options(struct srd_decoder *d)
 	return SRD_OK;
 }
 
-/**
- * Load a protocol decoder module into the embedded Python interpreter.
- *
- * @param module_name The module name to be loaded.
- *
- * @return SRD_OK upon success, a (negative) error code otherwise.
- *
- * @since 0.1.0
- */
-SRD_API int srd_decoder_load(const char *module_name)
+static int get_sample_iteration(struct srd_decoder *d)
 {
-	PyObject *py_basedec, *py_method, *py_attr, *py_annlist, *py_ann;
-	PyObject *py_bin_classes, *py_bin_class, *py_ann_rows, *py_ann_row;
-	PyObject *py_ann_classes, *py_long;
-	struct srd_decoder *d;
-	int ret, i, j;
-	char **ann, **bin, *ann_row_id, *ann_row_desc;
-	struct srd_channel *pdch;
-	GSList *l, *ann_classes;
+	char *iter;
+	int ret;
+
+	d->sample_iteration = SRD_SAMPLE_ITER_ALL;
+
+	if (!PyObject_HasAttrString(d->py_dec, "sample_iteration"))
+		/* Decoder wants every sample, that's the default. */
+		return SRD_OK;
+
+	if (py_attr_as_str(d->py_dec, "sample_iteration", &iter) != SRD_OK) {
+		srd_err("Protocol decoder %s sample_iteration attribute is "
+				"not a string.", d->name);
+		return SRD_ERR_PYTHON;
+	}
+
+	ret = SRD_OK;
+	if (!strcmp(iter, "all"))
+		d->sample_iteration = SRD_SAMPLE_ITER_ALL;
+	else if (!strcmp(iter, "changes"))
+		d->sample_iteration = SRD_SAMPLE_ITER_CHANGES;
+	else {
+		srd_err("Protocol decoder %s has invalid sample_iteration "
+				"'%s'.", d->name, iter);
+		ret = SRD_ERR_PYTHON;
+	}
+	g_free(iter);
+
+	return ret;
+}
+
+static void free_channels(GSList *channellist);
+
+/* Free a decoder and whatever metadata was loaded into it. */
+static void decoder_free(struct srd_decoder *dec)
+{
+	struct srd_decoder_option *o;
 	struct srd_decoder_annotation_row *ann_row;
+	GSList *l;
 
-	if (!srd_check_init())
-		return SRD_ERR;
+	for (l = dec->options; l; l = l->next) {
+		o = l->data;
+		g_free(o->id);
+		g_free(o->desc);
+		if (o->def)
+			g_variant_unref(o->def);
+		g_slist_free_full(o->values, (GDestroyNotify)g_variant_unref);
+		g_free(o);
+	}
+	g_slist_free(dec->options);
 
-	if (!module_name)
-		return SRD_ERR_ARG;
+	for (l = dec->annotation_rows; l; l = l->next) {
+		ann_row = l->data;
+		g_free(ann_row->id);
+		g_free(ann_row->desc);
+		g_slist_free(ann_row->ann_classes);
+		g_free(ann_row);
+	}
+	g_slist_free(dec->annotation_rows);
+	g_slist_free_full(dec->annotations, (GDestroyNotify)g_strfreev);
+	g_slist_free_full(dec->binary, (GDestroyNotify)g_strfreev);
 
-	if (PyDict_GetItemString(PyImport_GetModuleDict(), module_name)) {
-		/* Module was already imported. */
-		return SRD_OK;
+	free_channels(dec->channels);
+	free_channels(dec->opt_channels);
+	g_free(dec->module_name);
+	g_free(dec->id);
+	g_free(dec->name);
+	g_free(dec->longname);
+	g_free(dec->desc);
+	g_free(dec->license);
+
+	/* The module's Decoder class. */
+	Py_XDECREF((PyObject *)dec->py_dec);
+	/* The module itself. */
+	Py_XDECREF((PyObject *)dec->py_mod);
+
+	g_free(dec);
+}
+
+static struct srd_decoder *decoder_get_by_module(const char *module_name)
+{
+	GSList *l;
+	struct srd_decoder *dec;
+
+	for (l = pd_list; l; l = l->next) {
+		dec = l->data;
+		if (!strcmp(dec->module_name, module_name))
+			return dec;
 	}
 
-	srd_dbg("Loading protocol decoder '%s'.", module_name);
+	return NULL;
+}
 
-	py_basedec = py_method = py_attr = NULL;
+/*
+ * Find where a PD's Python package is: either the directory it's in, or
+ * its metadata if it's in a decoder bundle. The search path added last
+ * comes first in sys.path, so that's where the module would be imported
+ * from. Both are NULL if it isn't in any of them.
+ */
+static void module_find(const char *module_name, char **dir,
+		GVariant **meta)
+{
+	GSList *l;
+	GVariant *bundle_meta;
+	char *pd_dir, *init;
 
-	d = g_malloc0(sizeof(struct srd_decoder));
+	*dir = NULL;
+	*meta = NULL;
+
+	if (!*module_name || strchr(module_name, '/')
+			|| strchr(module_name, G_DIR_SEPARATOR))
+		return;
+
+	for (l = searchpaths; l; l = l->next) {
+		if ((bundle_meta = srd_bundle_decoder_get(l->data, module_name))) {
+			g_free(*dir);
+			*dir = NULL;
+			*meta = bundle_meta;
+			continue;
+		}
+		pd_dir = g_build_filename(l->data, module_name, NULL);
+		init = g_build_filename(pd_dir, "__init__.py", NULL);
+		if (g_file_test(init, G_FILE_TEST_IS_REGULAR)) {
+			g_free(*dir);
+			*dir = pd_dir;
+			*meta = NULL;
+		} else {
+			g_free(pd_dir);
+		}
+		g_free(init);
+	}
+}
+
+/* Import a PD's Python module, and check its Decoder class. */
+static int decoder_class_import(const char *module_name, PyObject **mod,
+		PyObject **dec)
+{
+	PyObject *py_basedec, *py_method, *py_long, *py_mod, *py_dec;
+	int ret;
+
+	py_basedec = py_method = py_long = py_dec = NULL;
 
 	ret = SRD_ERR_PYTHON;
 
 	/* Import the Python module. */
-	if (!(d->py_mod = PyImport_ImportModule(module_name))) {
+	if (!(py_mod = PyImport_ImportModule(module_name))) {
 		srd_exception_catch("Import of '%s' failed.", module_name);
 		goto err_out;
 	}
 
 	/* Get the 'Decoder' class as Python object. */
-	if (!(d->py_dec = PyObject_GetAttrString(d->py_mod, "Decoder"))) {
+	if (!(py_dec = PyObject_GetAttrString(py_mod, "Decoder"))) {
 		/* This generated an AttributeError exception. */
 		PyErr_Clear();
 		srd_err("Decoder class not found in protocol decoder %s.",
@@ -351,7 +456,7 @@ SRD_API int srd_decoder_load(const char *module_name)
 		goto err_out;
 	}
 
-	if (!PyObject_IsSubclass(d->py_dec, py_basedec)) {
+	if (!PyObject_IsSubclass(py_dec, py_basedec)) {
 		srd_err("Decoder class in protocol decoder module %s is not "
 			"a subclass of sigrokdecode.Decoder.", module_name);
 		goto err_out;
@@ -362,7 +467,7 @@ SRD_API int srd_decoder_load(const char *module_name)
 	 * Check that this decoder has the correct PD API version.
 	 * PDs of different API versions are incompatible and cannot work.
 	 */
-	py_long = PyObject_GetAttrString(d->py_dec, "api_version");
+	py_long = PyObject_GetAttrString(py_dec, "api_version");
 	if (PyLong_AsLong(py_long) != 2) {
 		srd_err("Only PDs of API version 2 are supported.");
 		goto err_out;
@@ -370,12 +475,12 @@ SRD_API int srd_decoder_load(const char *module_name)
 	Py_CLEAR(py_long);
 
 	/* Check for a proper start() method. */
-	if (!PyObject_HasAttrString(d->py_dec, "start")) {
+	if (!PyObject_HasAttrString(py_dec, "start")) {
 		srd_err("Protocol decoder %s has no start() method Decoder "
 			"class.", module_name);
 		goto err_out;
 	}
-	py_method = PyObject_GetAttrString(d->py_dec, "start");
+	py_method = PyObject_GetAttrString(py_dec, "start");
 	if (!PyFunction_Check(py_method)) {
 		srd_err("Protocol decoder %s Decoder class attribute 'start' "
 			"is not a method.", module_name);
@@ -384,12 +489,12 @@ SRD_API int srd_decoder_load(const char *module_name)
 	Py_CLEAR(py_method);
 
 	/* Check for a proper decode() method. */
-	if (!PyObject_HasAttrString(d->py_dec, "decode")) {
+	if (!PyObject_HasAttrString(py_dec, "decode")) {
 		srd_err("Protocol decoder %s has no decode() method Decoder "
 			"class.", module_name);
 		goto err_out;
 	}
-	py_method = PyObject_GetAttrString(d->py_dec, "decode");
+	py_method = PyObject_GetAttrString(py_dec, "decode");
 	if (!PyFunction_Check(py_method)) {
 		srd_err("Protocol decoder %s Decoder class attribute 'decode' "
 			"is not a method.", module_name);
@@ -397,6 +502,47 @@ SRD_API int srd_decoder_load(const char *module_name)
 	}
 	Py_CLEAR(py_method);
 
+	*mod = py_mod;
+	*dec = py_dec;
+	ret = SRD_OK;
+
+err_out:
+	if (ret != SRD_OK) {
+		Py_XDECREF(py_long);
+		Py_XDECREF(py_method);
+		Py_XDECREF(py_basedec);
+		Py_XDECREF(py_dec);
+		Py_XDECREF(py_mod);
+	}
+
+	return ret;
+}
+
+/* Load a PD's metadata from its Python module. */
+static int decoder_import_new(const char *module_name,
+		struct srd_decoder **dec)
+{
+	PyObject *py_annlist, *py_ann, *py_mod, *py_dec, *py_long;
+	PyObject *py_bin_classes, *py_bin_class, *py_ann_rows, *py_ann_row;
+	PyObject *py_ann_classes;
+	struct srd_decoder *d;
+	int ret, i, j;
+	char **ann, **bin, *ann_row_id, *ann_row_desc;
+	struct srd_channel *pdch;
+	GSList *l, *ann_classes;
+	struct srd_decoder_annotation_row *ann_row;
+
+	if ((ret = decoder_class_import(module_name, &py_mod,
+			&py_dec)) != SRD_OK)
+		return ret;
+
+	d = g_malloc0(sizeof(struct srd_decoder));
+	d->module_name = g_strdup(module_name);
+	d->py_mod = py_mod;
+	d->py_dec = py_dec;
+
+	ret = SRD_ERR_PYTHON;
+
 	/* Store required fields in newly allocated strings. */
 	if (py_attr_as_str(d->py_dec, "id", &(d->id)) != SRD_OK)
 		goto err_out;
@@ -417,6 +563,10 @@ SRD_API int srd_decoder_load(const char *module_name)
 	if (get_options(d) != SRD_OK)
 		goto err_out;
 
+	/* Which samples the decoder wants to be passed. */
+	if (get_sample_iteration(d) != SRD_OK)
+		goto err_out;
+
 	/* Check and import required channels. */
 	if (get_channels(d, "channels", &d->channels) != SRD_OK)
 		goto err_out;
@@ -546,34 +696,200 @@ SRD_API int srd_decoder_load(const char *module_name)
 		}
 	}
 
-	/* Append it to the list of supported/loaded decoders. */
-	pd_list = g_slist_append(pd_list, d);
-
+	*dec = d;
 	ret = SRD_OK;
 
 err_out:
-	if (ret != SRD_OK) {
-		Py_XDECREF(py_method);
-		Py_XDECREF(py_basedec);
-		Py_XDECREF(d->py_dec);
-		Py_XDECREF(d->py_mod);
-		g_free(d);
+	if (ret != SRD_OK)
+		decoder_free(d);
+
+	return ret;
+}
+
+static int decoder_load(const char *module_name)
+{
+	struct srd_decoder *d;
+	GVariant *meta;
+	char *dir, *signature;
+	int ret;
+
+	if (!srd_check_init())
+		return SRD_ERR;
+
+	if (!module_name)
+		return SRD_ERR_ARG;
+
+	if (decoder_get_by_module(module_name)) {
+		/* Decoder was already loaded. */
+		return SRD_OK;
+	}
+
+	module_find(module_name, &dir, &meta);
+	if (meta) {
+		/* Bundles come with the metadata of all their decoders. */
+		srd_dbg("Loading protocol decoder '%s' from a bundle.",
+				module_name);
+		pd_list = g_slist_append(pd_list, srd_index_decoder_new(meta));
+		return SRD_OK;
 	}
 
+	/* Unless its files changed, the decoder is in the index. */
+	signature = NULL;
+	if (dir)
+		signature = srd_index_signature(dir);
+	if (signature && (d = srd_index_lookup(dir, signature))) {
+		srd_dbg("Loading protocol decoder '%s' from the index.",
+				module_name);
+		pd_list = g_slist_append(pd_list, d);
+		g_free(signature);
+		g_free(dir);
+		return SRD_OK;
+	}
+
+	srd_dbg("Loading protocol decoder '%s'.", module_name);
+
+	if ((ret = decoder_import_new(module_name, &d)) == SRD_OK) {
+		/* Append it to the list of supported/loaded decoders. */
+		pd_list = g_slist_append(pd_list, d);
+		if (signature)
+			srd_index_store(dir, signature, d);
+	}
+	g_free(signature);
+	g_free(dir);
+
 	return ret;
 }
 
 /**
- * Return a protocol decoder's docstring.
+ * Import the Python module of a protocol decoder, unless that happened
+ * already. Decoders loaded from the metadata index only get imported when
+ * they are needed, e.g. to create an instance.
  *
- * @param dec The loaded protocol decoder.
+ * Must be called with the GIL held.
  *
- * @return A newly allocated buffer containing the protocol decoder's
- *         documentation. The caller is responsible for free'ing the buffer.
+ * @param dec The decoder. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_decoder_import(struct srd_decoder *dec)
+{
+	PyObject *py_mod, *py_dec;
+	int ret;
+
+	if (dec->py_dec)
+		return SRD_OK;
+
+	srd_dbg("Importing protocol decoder '%s'.", dec->module_name);
+
+	if ((ret = decoder_class_import(dec->module_name, &py_mod,
+			&py_dec)) != SRD_OK)
+		return ret;
+	dec->py_mod = py_mod;
+	dec->py_dec = py_dec;
+
+	return SRD_OK;
+}
+
+/**
+ * Map every annotation class of a decoder to its annotation row.
+ *
+ * A class in several rows is mapped to the first of them. Classes in no
+ * row are mapped to a row of their own, after the decoder's rows.
+ *
+ * @param dec The decoder. Must not be NULL.
+ * @param num_rows Gets the number of rows, including the one for classes
+ *                 in no row.
+ *
+ * @return A newly allocated array of the row of every class.
+ *
+ * @private
+ */
+SRD_PRIV int *srd_decoder_class_rows_new(const struct srd_decoder *dec,
+		int *num_rows)
+{
+	const struct srd_decoder_annotation_row *ann_row;
+	const GSList *l, *c;
+	int *class_row;
+	int num_classes, i, r, cls;
+
+	num_classes = g_slist_length(dec->annotations);
+	*num_rows = g_slist_length(dec->annotation_rows) + 1;
+
+	class_row = g_malloc(sizeof(int) * MAX(num_classes, 1));
+	for (i = 0; i < num_classes; i++)
+		class_row[i] = *num_rows - 1;
+	r = 0;
+	for (l = dec->annotation_rows; l; l = l->next, r++) {
+		ann_row = l->data;
+		for (c = ann_row->ann_classes; c; c = c->next) {
+			cls = GPOINTER_TO_INT(c->data);
+			if (cls >= 0 && cls < num_classes
+					&& class_row[cls] == *num_rows - 1)
+				class_row[cls] = r;
+		}
+	}
+
+	return class_row;
+}
+
+/**
+ * Find an annotation row of a decoder, as mapped to by
+ * srd_decoder_class_rows_new().
+ *
+ * @param dec The decoder. Must not be NULL.
+ * @param row_id The ID of the row, or NULL for the row of the classes in
+ *               no row.
+ *
+ * @return The index of the row, or -1 if the decoder has no such row.
+ *
+ * @private
+ */
+SRD_PRIV int srd_decoder_row_find(const struct srd_decoder *dec,
+		const char *row_id)
+{
+	const struct srd_decoder_annotation_row *ann_row;
+	const GSList *l;
+	int r;
+
+	r = 0;
+	for (l = dec->annotation_rows; l; l = l->next, r++) {
+		ann_row = l->data;
+		if (row_id && !strcmp(ann_row->id, row_id))
+			return r;
+	}
+
+	return row_id ? -1 : r;
+}
+
+/**
+ * Load a protocol decoder module into the embedded Python interpreter.
+ *
+ * If the decoder's files didn't change since it was last loaded, its
+ * metadata is taken from the decoder index instead, and the module is
+ * only imported once an instance of the decoder is created.
+ *
+ * @param module_name The module name to be loaded.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
  *
  * @since 0.1.0
  */
-SRD_API char *srd_decoder_doc_get(const struct srd_decoder *dec)
+SRD_API int srd_decoder_load(const char *module_name)
+{
+	PyGILState_STATE gstate;
+	int ret;
+
+	gstate = srd_gil_ensure();
+	ret = decoder_load(module_name);
+	srd_index_save();
+	srd_gil_release(gstate);
+
+	return ret;
+}
+
+static char *decoder_doc_get(const struct srd_decoder *dec)
 {
 	PyObject *py_str;
 	char *doc;
@@ -584,6 +900,10 @@ SRD_API char *srd_decoder_doc_get(const struct srd_decoder *dec)
 	if (!dec)
 		return NULL;
 
+	/* The docstring isn't in the index. */
+	if (srd_decoder_import((struct srd_decoder *)dec) != SRD_OK)
+		return NULL;
+
 	if (!PyObject_HasAttrString(dec->py_mod, "__doc__"))
 		return NULL;
 
@@ -600,6 +920,28 @@ SRD_API char *srd_decoder_doc_get(const struct srd_decoder *dec)
 	return doc;
 }
 
+/**
+ * Return a protocol decoder's docstring.
+ *
+ * @param dec The loaded protocol decoder.
+ *
+ * @return A newly allocated buffer containing the protocol decoder's
+ *         documentation. The caller is responsible for free'ing the buffer.
+ *
+ * @since 0.1.0
+ */
+SRD_API char *srd_decoder_doc_get(const struct srd_decoder *dec)
+{
+	PyGILState_STATE gstate;
+	char *doc;
+
+	gstate = srd_gil_ensure();
+	doc = decoder_doc_get(dec);
+	srd_gil_release(gstate);
+
+	return doc;
+}
+
 static void free_channels(GSList *channellist)
 {
 	GSList *l;
@@ -629,7 +971,8 @@ static void free_channels(GSList *channellist)
  */
 SRD_API int srd_decoder_unload(struct srd_decoder *dec)
 {
-	struct srd_decoder_option *o;
+	PyGILState_STATE gstate;
+	struct srd_gil gil;
 	struct srd_session *sess;
 	GSList *l;
 
@@ -641,40 +984,32 @@ SRD_API int srd_decoder_unload(struct srd_decoder *dec)
 
 	srd_dbg("Unloading protocol decoder '%s'.", dec->name);
 
+	gstate = srd_gil_ensure();
+
 	/*
 	 * Since any instances of this decoder need to be released as well,
 	 * but they could be anywhere in the stack, just free the entire
 	 * stack. A frontend reloading a decoder thus has to restart all
 	 * instances, and rebuild the stack.
 	 */
+	srd_sessions_lock();
 	for (l = sessions; l; l = l->next) {
 		sess = l->data;
+		srd_session_gil_ensure(sess, &gil);
+		srd_session_thread_stop(sess);
+		srd_workers_stop(sess);
 		srd_inst_free_all(sess, NULL);
+		/* The decoder's class in the session's own interpreter. */
+		if (sess->interp)
+			g_hash_table_remove(sess->interp->classes, dec);
+		srd_session_gil_release(sess, &gil);
 	}
+	srd_sessions_unlock();
 
-	for (l = dec->options; l; l = l->next) {
-		o = l->data;
-		g_free(o->id);
-		g_free(o->desc);
-		g_variant_unref(o->def);
-		g_free(o);
-	}
-	g_slist_free(dec->options);
-
-	free_channels(dec->channels);
-	free_channels(dec->opt_channels);
-	g_free(dec->id);
-	g_free(dec->name);
-	g_free(dec->longname);
-	g_free(dec->desc);
-	g_free(dec->license);
-
-	/* The module's Decoder class. */
-	Py_XDECREF(dec->py_dec);
-	/* The module itself. */
-	Py_XDECREF(dec->py_mod);
+	pd_list = g_slist_remove(pd_list, dec);
+	decoder_free(dec);
 
-	g_free(dec);
+	srd_gil_release(gstate);
 
 	return SRD_OK;
 }
@@ -744,7 +1079,7 @@ static void srd_decoder_load_all_zip_path(char *path)
 		char *modname_str;
 		if (py_str_as_str(modname, &modname_str) == SRD_OK) {
 			/* The directory name is the module name (e.g. "i2c"). */
-			srd_decoder_load(modname_str);
+			decoder_load(modname_str);
 			free(modname_str);
 		}
 		Py_XDECREF(modname);
@@ -763,21 +1098,28 @@ err_out:
 static void srd_decoder_load_all_path(char *path)
 {
 	GDir *dir;
+	const GPtrArray *names;
 	const gchar *direntry;
+	guint i;
 
 	if (!(dir = g_dir_open(path, 0, NULL))) {
 		/* Not really fatal */
+		if ((names = srd_bundle_decoders(path))) {
+			for (i = 0; i < names->len; i++)
+				decoder_load(g_ptr_array_index(names, i));
+			return;
+		}
 		/* Try zipimport method too */
 		srd_decoder_load_all_zip_path(path);
 		return;
 	}
 
-	/* This ignores errors returned by srd_decoder_load(). That
+	/* This ignores errors returned by decoder_load(). That
 	 * function will have logged the cause, but in any case we
 	 * want to continue anyway. */
 	while ((direntry = g_dir_read_name(dir)) != NULL) {
 		/* The directory name is the module name (e.g. "i2c"). */
-		srd_decoder_load(direntry);
+		decoder_load(direntry);
 	}
 	g_dir_close(dir);
 
@@ -786,19 +1128,26 @@ static void srd_decoder_load_all_path(char *path)
 /**
  * Load all installed protocol decoders.
  *
+ * Like srd_decoder_load(), this mostly reads the decoder index, and only
+ * imports the modules of new or changed decoders.
+ *
  * @return SRD_OK upon success, a (negative) error code otherwise.
  *
  * @since 0.1.0
  */
 SRD_API int srd_decoder_load_all(void)
 {
+	PyGILState_STATE gstate;
 	GSList *l;
 
 	if (!srd_check_init())
 		return SRD_ERR;
 
+	gstate = srd_gil_ensure();
 	for (l = searchpaths; l; l = l->next)
 		srd_decoder_load_all_path(l->data);
+	srd_index_save();
+	srd_gil_release(gstate);
 
 	return SRD_OK;
 }
@@ -812,15 +1161,13 @@ SRD_API int srd_decoder_load_all(void)
  */
 SRD_API int srd_decoder_unload_all(void)
 {
-	GSList *l;
-	struct srd_decoder *dec;
+	PyGILState_STATE gstate;
 
-	for (l = pd_list; l; l = l->next) {
-		dec = l->data;
-		srd_decoder_unload(dec);
-	}
-	g_slist_free(pd_list);
-	pd_list = NULL;
+	gstate = srd_gil_ensure();
+	/* Every decoder removes itself from the list. */
+	while (pd_list)
+		srd_decoder_unload(pd_list->data);
+	srd_gil_release(gstate);
 
 	return SRD_OK;
 }
@@ -100,10 +100,13 @@ class Decoder(srd.Decoder):
         self.ss_bit12 = None
         self.ss_databytebits = []
 
+    # Return the sample number at which the given bit is sampled.
+    def bit_samplenum(self, bitnum):
+        return int(self.sof + (self.bit_width * bitnum) + self.bitpos)
+
     # Return True if we reached the desired bit position, False otherwise.
     def reached_bit(self, bitnum):
-        bitpos = int(self.sof + (self.bit_width * bitnum) + self.bitpos)
-        if self.samplenum >= bitpos:
+        if self.samplenum >= self.bit_samplenum(bitnum):
             return True
         return False
 
@@ -371,11 +374,13 @@ class Decoder(srd.Decoder):
             if self.state == 'IDLE':
                 # Wait for a dominant state (logic 0) on the bus.
                 if can_rx == 1:
+                    self.wait_match((0,))
                     continue
                 self.sof = self.samplenum
                 self.state = 'GET BITS'
             elif self.state == 'GET BITS':
                 # Wait until we're in the correct bit/sampling position.
                 if not self.reached_bit(self.curbit):
+                    self.wait_samplenum(self.bit_samplenum(self.curbit))
                     continue
                 self.handle_bit(can_rx)
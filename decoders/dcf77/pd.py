@@ -37,6 +37,7 @@ class Decoder(srd.Decoder):
     license = 'gplv2+'
     inputs = ['logic']
     outputs = ['dcf77']
+    sample_iteration = 'changes'
     channels = (
         {'id': 'data', 'name': 'DATA', 'desc': 'DATA line'},
     )
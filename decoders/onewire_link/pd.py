@@ -189,99 +189,119 @@ class Decoder(srd.Decoder):
         self.cnt_reset = [self.cnt_normal_reset, self.cnt_overdrive_reset]
         self.cnt_slot = [self.cnt_normal_slot, self.cnt_overdrive_slot]
 
+    # Let the sample iterator skip all samples the current state doesn't
+    # look at, i.e. wait for a level on OWR or for a sample time.
+    def wait_for_state(self):
+        if self.state == 'WAIT FOR FALLING EDGE':
+            self.wait_match((0,))
+        elif self.state == 'WAIT FOR RISING EDGE':
+            self.wait_match((1,))
+        elif self.state == 'WAIT FOR DATA SAMPLE':
+            self.wait_samplenum(self.fall + self.cnt_bit[self.overdrive])
+        elif self.state == 'WAIT FOR DATA SLOT END':
+            self.wait_samplenum(self.fall + self.cnt_slot[self.overdrive])
+        elif self.state == 'WAIT FOR PRESENCE DETECT':
+            self.wait_samplenum(self.rise + self.cnt_presence[self.overdrive])
+        elif self.state == 'WAIT FOR RESET SLOT END':
+            self.wait_samplenum(self.rise + self.cnt_reset[self.overdrive])
+
+    def handle_sample(self, owr):
+        # State machine.
+        if self.state == 'WAIT FOR FALLING EDGE':
+            # The start of a cycle is a falling edge.
+            if owr != 0:
+                return
+            # Save the sample number for the falling edge.
+            self.fall = self.samplenum
+            # Go to waiting for sample time.
+            self.state = 'WAIT FOR DATA SAMPLE'
+        elif self.state == 'WAIT FOR DATA SAMPLE':
+            # Sample data bit.
+            t = self.samplenum - self.fall
+            if t == self.cnt_bit[self.overdrive]:
+                self.bit = owr
+                self.state = 'WAIT FOR DATA SLOT END'
+        elif self.state == 'WAIT FOR DATA SLOT END':
+            # A data slot ends in a recovery period, otherwise, this is
+            # probably a reset.
+            t = self.samplenum - self.fall
+            if t != self.cnt_slot[self.overdrive]:
+                return
+
+            if owr == 0:
+                # This seems to be a reset slot, wait for its end.
+                self.state = 'WAIT FOR RISING EDGE'
+                return
+
+            self.putb([0, ['Bit: %d' % self.bit, '%d' % self.bit]])
+            self.putpb(['BIT', self.bit])
+
+            # Checking the first command to see if overdrive mode
+            # should be entered.
+            if self.bit_cnt <= 8:
+                self.command |= (self.bit << self.bit_cnt)
+            elif self.bit_cnt == 8 and self.command in [0x3c, 0x69]:
+                self.putx([4, ['Entering overdrive mode', 'Overdrive on']])
+            # Increment the bit counter.
+            self.bit_cnt += 1
+            # Wait for next slot.
+            self.state = 'WAIT FOR FALLING EDGE'
+        elif self.state == 'WAIT FOR RISING EDGE':
+            # The end of a cycle is a rising edge.
+            if owr != 1:
+                return
+
+            # Check if this was a reset cycle.
+            t = self.samplenum - self.fall
+            if t > self.cnt_normal_reset:
+                # Save the sample number for the rising edge.
+                self.rise = self.samplenum
+                self.putfr([2, ['Reset', 'Rst', 'R']])
+                self.state = 'WAIT FOR PRESENCE DETECT'
+                # Exit overdrive mode.
+                if self.overdrive:
+                    self.putx([4, ['Exiting overdrive mode', 'Overdrive off']])
+                    self.overdrive = 0
+                # Clear command bit counter and data register.
+                self.bit_cnt = 0
+                self.command = 0
+            elif (t > self.cnt_overdrive_reset) and self.overdrive:
+                # Save the sample number for the rising edge.
+                self.rise = self.samplenum
+                self.putfr([2, ['Reset', 'Rst', 'R']])
+                self.state = 'WAIT FOR PRESENCE DETECT'
+            # Otherwise this is assumed to be a data bit.
+            else:
+                self.state = 'WAIT FOR FALLING EDGE'
+        elif self.state == 'WAIT FOR PRESENCE DETECT':
+            # Sample presence status.
+            t = self.samplenum - self.rise
+            if t == self.cnt_presence[self.overdrive]:
+                self.present = owr
+                self.state = 'WAIT FOR RESET SLOT END'
+        elif self.state == 'WAIT FOR RESET SLOT END':
+            # A reset slot ends in a long recovery period.
+            t = self.samplenum - self.rise
+            if t != self.cnt_reset[self.overdrive]:
+                return
+
+            if owr == 0:
+                # This seems to be a reset slot, wait for its end.
+                self.state = 'WAIT FOR RISING EDGE'
+                return
+
+            p = 'false' if self.present else 'true'
+            self.putrs([3, ['Presence: %s' % p, 'Presence', 'Pres', 'P']])
+            self.putprs(['RESET/PRESENCE', not self.present])
+
+            # Wait for next slot.
+            self.state = 'WAIT FOR FALLING EDGE'
+
     def decode(self, ss, es, data):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
         for (self.samplenum, (owr, pwr)) in data:
             if self.samplenum == 0:
                 self.checks()
-            # State machine.
-            if self.state == 'WAIT FOR FALLING EDGE':
-                # The start of a cycle is a falling edge.
-                if owr != 0:
-                    continue
-                # Save the sample number for the falling edge.
-                self.fall = self.samplenum
-                # Go to waiting for sample time.
-                self.state = 'WAIT FOR DATA SAMPLE'
-            elif self.state == 'WAIT FOR DATA SAMPLE':
-                # Sample data bit.
-                t = self.samplenum - self.fall
-                if t == self.cnt_bit[self.overdrive]:
-                    self.bit = owr
-                    self.state = 'WAIT FOR DATA SLOT END'
-            elif self.state == 'WAIT FOR DATA SLOT END':
-                # A data slot ends in a recovery period, otherwise, this is
-                # probably a reset.
-                t = self.samplenum - self.fall
-                if t != self.cnt_slot[self.overdrive]:
-                    continue
-
-                if owr == 0:
-                    # This seems to be a reset slot, wait for its end.
-                    self.state = 'WAIT FOR RISING EDGE'
-                    continue
-
-                self.putb([0, ['Bit: %d' % self.bit, '%d' % self.bit]])
-                self.putpb(['BIT', self.bit])
-
-                # Checking the first command to see if overdrive mode
-                # should be entered.
-                if self.bit_cnt <= 8:
-                    self.command |= (self.bit << self.bit_cnt)
-                elif self.bit_cnt == 8 and self.command in [0x3c, 0x69]:
-                    self.putx([4, ['Entering overdrive mode', 'Overdrive on']])
-                # Increment the bit counter.
-                self.bit_cnt += 1
-                # Wait for next slot.
-                self.state = 'WAIT FOR FALLING EDGE'
-            elif self.state == 'WAIT FOR RISING EDGE':
-                # The end of a cycle is a rising edge.
-                if owr != 1:
-                    continue
-
-                # Check if this was a reset cycle.
-                t = self.samplenum - self.fall
-                if t > self.cnt_normal_reset:
-                    # Save the sample number for the rising edge.
-                    self.rise = self.samplenum
-                    self.putfr([2, ['Reset', 'Rst', 'R']])
-                    self.state = 'WAIT FOR PRESENCE DETECT'
-                    # Exit overdrive mode.
-                    if self.overdrive:
-                        self.putx([4, ['Exiting overdrive mode', 'Overdrive off']])
-                        self.overdrive = 0
-                    # Clear command bit counter and data register.
-                    self.bit_cnt = 0
-                    self.command = 0
-                elif (t > self.cnt_overdrive_reset) and self.overdrive:
-                    # Save the sample number for the rising edge.
-                    self.rise = self.samplenum
-                    self.putfr([2, ['Reset', 'Rst', 'R']])
-                    self.state = 'WAIT FOR PRESENCE DETECT'
-                # Otherwise this is assumed to be a data bit.
-                else:
-                    self.state = 'WAIT FOR FALLING EDGE'
-            elif self.state == 'WAIT FOR PRESENCE DETECT':
-                # Sample presence status.
-                t = self.samplenum - self.rise
-                if t == self.cnt_presence[self.overdrive]:
-                    self.present = owr
-                    self.state = 'WAIT FOR RESET SLOT END'
-            elif self.state == 'WAIT FOR RESET SLOT END':
-                # A reset slot ends in a long recovery period.
-                t = self.samplenum - self.rise
-                if t != self.cnt_reset[self.overdrive]:
-                    continue
-
-                if owr == 0:
-                    # This seems to be a reset slot, wait for its end.
-                    self.state = 'WAIT FOR RISING EDGE'
-                    continue
-
-                p = 'false' if self.present else 'true'
-                self.putrs([3, ['Presence: %s' % p, 'Presence', 'Pres', 'P']])
-                self.putprs(['RESET/PRESENCE', not self.present])
-
-                # Wait for next slot.
-                self.state = 'WAIT FOR FALLING EDGE'
+            self.handle_sample(owr)
+            self.wait_for_state()
@@ -30,6 +30,7 @@ class Decoder(srd.Decoder):
     license = 'gplv2+'
     inputs = ['logic']
     outputs = ['pwm']
+    sample_iteration = 'changes'
     channels = (
         {'id': 'data', 'name': 'Data', 'desc': 'Data line'},
     )
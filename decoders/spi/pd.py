@@ -78,6 +78,7 @@ class Decoder(srd.Decoder):
     license = 'gplv2+'
     inputs = ['logic']
     outputs = ['spi']
+    sample_iteration = 'changes'
     channels = (
         {'id': 'clk', 'name': 'CLK', 'desc': 'Clock'},
     )
@@ -135,6 +136,14 @@ class Decoder(srd.Decoder):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
 
+    def resync(self):
+        # Decoding can start anywhere CS# is deasserted. The extra sample
+        # lets the decoder pick up the current CS# level first.
+        if not self.samplerate:
+            return None
+        deasserted = 1 if self.options['cs_polarity'] == 'active-low' else 0
+        return ((None, None, None, deasserted), 2)
+
     def start(self):
         self.out_python = self.register(srd.OUTPUT_PYTHON)
         self.out_ann = self.register(srd.OUTPUT_ANN)
@@ -162,11 +171,11 @@ class Decoder(srd.Decoder):
         self.put(ss, es, self.out_python, ['BITS', si_bits, so_bits])
         self.put(ss, es, self.out_python, ['DATA', si, so])
 
-        # Bit annotations.
-        if self.have_miso:
+        # Bit annotations, unless nobody looks at them.
+        if self.have_miso and self.wants(2):
             for bit in self.misobits:
                 self.put(bit[1], bit[2], self.out_ann, [2, ['%d' % bit[0]]])
-        if self.have_mosi:
+        if self.have_mosi and self.wants(3):
             for bit in self.mosibits:
                 self.put(bit[1], bit[2], self.out_ann, [3, ['%d' % bit[0]]])
 
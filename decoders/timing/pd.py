@@ -45,6 +45,7 @@ class Decoder(srd.Decoder):
     license = 'gplv2+'
     inputs = ['logic']
     outputs = ['timing']
+    sample_iteration = 'changes'
     channels = (
         {'id': 'data', 'name': 'Data', 'desc': 'Data line'},
     )
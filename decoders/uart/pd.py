@@ -185,8 +185,20 @@ class Decoder(srd.Decoder):
             # The width of one UART bit in number of samples.
             self.bit_width = float(self.samplerate) / float(self.options['baudrate'])
 
-    # Return true if we reached the middle of the desired bit, false otherwise.
-    def reached_bit(self, rxtx, bitnum):
+    def resync(self):
+        # Decoding can start anywhere both lines have been idle for a whole
+        # frame (plus one sample), so no frame is in progress.
+        if not self.samplerate:
+            return None
+        idle = [0 if self.options['invert_rx'] == 'yes' else 1,
+                0 if self.options['invert_tx'] == 'yes' else 1]
+        parity = 0 if self.options['parity_type'] == 'none' else 1
+        bits = 1 + self.options['num_data_bits'] + parity + \
+               self.options['num_stop_bits']
+        return (tuple(idle), int(ceil(self.bit_width * bits)) + 1)
+
+    # Return the number of the first sample in the middle of the desired bit.
+    def bit_samplenum(self, rxtx, bitnum):
         # bitpos is the samplenumber which is in the middle of the
         # specified UART bit (0 = start bit, 1..x = data, x+1 = parity bit
         # (if used) or the first stop bit, and so on).
@@ -194,7 +206,11 @@ class Decoder(srd.Decoder):
         # index of the middle sample within bit window is (bit_width - 1) / 2.
         bitpos = self.frame_start[rxtx] + (self.bit_width - 1) / 2.0
         bitpos += bitnum * self.bit_width
-        if self.samplenum >= bitpos:
+        return ceil(bitpos)
+
+    # Return true if we reached the middle of the desired bit, false otherwise.
+    def reached_bit(self, rxtx, bitnum):
+        if self.samplenum >= self.bit_samplenum(rxtx, bitnum):
             return True
         return False
 
@@ -254,7 +270,8 @@ class Decoder(srd.Decoder):
             self.databyte[rxtx] <<= 1
             self.databyte[rxtx] |= (signal << 0)
 
-        self.putg([rxtx + 12, ['%d' % signal]])
+        if self.wants(rxtx + 12):
+            self.putg([rxtx + 12, ['%d' % signal]])
 
         # Store individual data bits and their start/end samplenumbers.
         s, halfbit = self.samplenum, int(self.bit_width / 2)
@@ -271,17 +288,18 @@ class Decoder(srd.Decoder):
             (self.databyte[rxtx], self.databits[rxtx])])
 
         b, f = self.databyte[rxtx], self.options['format']
-        if f == 'ascii':
-            c = chr(b) if b in range(30, 126 + 1) else '[%02X]' % b
-            self.putx(rxtx, [rxtx, [c]])
-        elif f == 'dec':
-            self.putx(rxtx, [rxtx, [str(b)]])
-        elif f == 'hex':
-            self.putx(rxtx, [rxtx, [hex(b)[2:].zfill(2).upper()]])
-        elif f == 'oct':
-            self.putx(rxtx, [rxtx, [oct(b)[2:].zfill(3)]])
-        elif f == 'bin':
-            self.putx(rxtx, [rxtx, [bin(b)[2:].zfill(8)]])
+        if self.wants(rxtx):
+            if f == 'ascii':
+                c = chr(b) if b in range(30, 126 + 1) else '[%02X]' % b
+                self.putx(rxtx, [rxtx, [c]])
+            elif f == 'dec':
+                self.putx(rxtx, [rxtx, [str(b)]])
+            elif f == 'hex':
+                self.putx(rxtx, [rxtx, [hex(b)[2:].zfill(2).upper()]])
+            elif f == 'oct':
+                self.putx(rxtx, [rxtx, [oct(b)[2:].zfill(3)]])
+            elif f == 'bin':
+                self.putx(rxtx, [rxtx, [bin(b)[2:].zfill(8)]])
 
         self.putbin(rxtx, (rxtx, bytes([b])))
         self.putbin(rxtx, (2, bytes([b])))
@@ -332,6 +350,41 @@ class Decoder(srd.Decoder):
         self.putp(['STOPBIT', rxtx, self.stopbit1[rxtx]])
         self.putg([rxtx + 4, ['Stop bit', 'Stop', 'T']])
 
+    # Return the number of the next sample RX (or TX) needs to see, or None
+    # if it waits for a start bit.
+    def next_samplenum(self, rxtx):
+        state = self.state[rxtx]
+        skip_parity = 0 if self.options['parity_type'] == 'none' else 1
+        if state == 'GET START BIT':
+            return self.bit_samplenum(rxtx, 0)
+        elif state == 'GET DATA BITS':
+            return self.bit_samplenum(rxtx, self.cur_data_bit[rxtx] + 1)
+        elif state == 'GET PARITY BIT':
+            # Without parity, this state is left on the next sample.
+            if not skip_parity:
+                return self.samplenum + 1
+            return self.bit_samplenum(rxtx, self.options['num_data_bits'] + 1)
+        elif state == 'GET STOP BITS':
+            b = self.options['num_data_bits'] + 1 + skip_parity
+            return self.bit_samplenum(rxtx, b)
+        return None
+
+    # Let the sample iterator skip the samples neither RX nor TX look at.
+    # There is only one condition to wait for, so while one of them waits
+    # for a start bit, the other one must not be in the middle of a frame.
+    def wait_for_state(self, has_pin):
+        used = [rxtx for rxtx in (RX, TX) if has_pin[rxtx]]
+        targets = [self.next_samplenum(rxtx) for rxtx in used]
+        if None not in targets:
+            self.wait_samplenum(min(targets))
+        elif len(used) == 1:
+            # The start bit begins with a falling edge, or a rising one
+            # if inverted. The sample before the edge is the idle level.
+            rxtx = used[0]
+            invert = self.options['invert_rx' if rxtx == RX else 'invert_tx']
+            self.wait_edge(rxtx, 'rising' if invert == 'yes' else 'falling')
+            self.oldbit[rxtx] = 1
+
     def decode(self, ss, es, data):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
@@ -343,16 +396,16 @@ class Decoder(srd.Decoder):
             #     continue
             self.oldpins, (rx, tx) = pins, pins
 
-            if self.options['invert_rx'] == 'yes':
-                rx = not rx
-            if self.options['invert_tx'] == 'yes':
-                tx = not tx
-
             # Either RX or TX (but not both) can be omitted.
             has_pin = [rx in (0, 1), tx in (0, 1)]
             if has_pin == [False, False]:
                 raise ChannelError('Either TX or RX (or both) pins required.')
 
+            if self.options['invert_rx'] == 'yes':
+                rx = not rx
+            if self.options['invert_tx'] == 'yes':
+                tx = not tx
+
             # State machine.
             for rxtx in (RX, TX):
                 # Don't try to handle RX (or TX) if not supplied.
@@ -374,3 +427,5 @@ class Decoder(srd.Decoder):
 
                 # Save current RX/TX values for the next round.
                 self.oldbit[rxtx] = signal
+
+            self.wait_for_state(has_pin)
@@ -85,6 +85,7 @@ class Decoder(srd.Decoder):
     license = 'gplv2+'
     inputs = ['logic']
     outputs = ['usb_signalling']
+    sample_iteration = 'changes'
     channels = (
         {'id': 'dp', 'name': 'D+', 'desc': 'USB D+ signal'},
         {'id': 'dm', 'name': 'D-', 'desc': 'USB D- signal'},
@@ -119,7 +120,6 @@ class Decoder(srd.Decoder):
         self.bitwidth = None
         self.bitnum = 0
         self.samplenum_target = None
-        self.oldpins = None
         self.consecutive_ones = 0
         self.state = 'IDLE'
 
@@ -223,20 +223,20 @@ class Decoder(srd.Decoder):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
         for (self.samplenum, pins) in data:
-            # State machine.
+            # State machine. Only samples where D+ or D- change are passed
+            # on, unless we wait for the middle of a bit.
             if self.state == 'IDLE':
-                # Ignore identical samples early on (for performance reasons).
-                if self.oldpins == pins:
-                    continue
-                self.oldpins = pins
                 sym = symbols[self.options['signalling']][tuple(pins)]
                 self.wait_for_sop(sym)
             elif self.state in ('GET BIT', 'GET EOP'):
                 # Wait until we're in the middle of the desired bit.
                 if self.samplenum < self.samplenum_target:
+                    self.wait_samplenum(self.samplenum_target)
                     continue
                 sym = symbols[self.options['signalling']][tuple(pins)]
                 if self.state == 'GET BIT':
                     self.get_bit(sym)
                 elif self.state == 'GET EOP':
                     self.get_eop(sym)
+            if self.state != 'IDLE':
+                self.wait_samplenum(self.samplenum_target)
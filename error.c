@@ -83,6 +83,9 @@ SRD_API const char *srd_strerror(int error_code)
 	case SRD_ERR_DECODERS_DIR:
 		str = "decoders directory access error";
 		break;
+	case SRD_ERR_QUEUE_FULL:
+		str = "decode queue full";
+		break;
 	default:
 		str = "unknown error";
 		break;
@@ -141,6 +144,9 @@ SRD_API const char *srd_strerror_name(int error_code)
 	case SRD_ERR_DECODERS_DIR:
 		str = "SRD_ERR_DECODERS_DIR";
 		break;
+	case SRD_ERR_QUEUE_FULL:
+		str = "SRD_ERR_QUEUE_FULL";
+		break;
 	default:
 		str = "unknown error code";
 		break;
@@ -0,0 +1,521 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include "config.h"
+#include <glib.h>
+#include <glib/gstdio.h>
+#include <string.h>
+
+/**
+ * @file
+ *
+ * Persistent index of protocol decoder metadata.
+ */
+
+/*
+ * Loading a decoder's metadata means importing its Python module, which
+ * executes all of its code, including big tables of constants some PDs
+ * have. Frontends listing all decoders at startup spend most of their
+ * startup time doing that.
+ *
+ * So the metadata of all decoders loaded from a directory (e.g. .../i2c)
+ * is kept in an index file in the user's cache directory, together with a
+ * signature of that directory's files. As long as the signature matches,
+ * the decoder is loaded from the index, and its module is only imported
+ * when an instance of it is created, see srd_decoder_import().
+ *
+ * The signature is a hash of the names, sizes and modification times of
+ * the files, the same information Python uses to invalidate its bytecode
+ * caches. The location of the index can be changed with the
+ * SIGROKDECODE_CACHE_DIR environment variable; setting it to an empty
+ * string disables the index.
+ */
+
+/** @cond PRIVATE */
+
+/* Bump this whenever SRD_DECODER_META_TYPE changes. */
+#define INDEX_VERSION 1
+
+/* Signature of the directory's files, and the decoder's metadata. */
+#define ENTRY_TYPE "(s" SRD_DECODER_META_TYPE ")"
+
+#define INDEX_TYPE "(ua{s" ENTRY_TYPE "})"
+
+#define INDEX_FILENAME "decoders.index"
+
+/* Maps a decoder's directory to its entry, or NULL if not read yet. */
+static GHashTable *index_entries = NULL;
+
+/* Whether entries were added since the index file was read. */
+static gboolean index_dirty = FALSE;
+
+/* Where the index file is, or NULL if there is none. */
+static char *index_path(void)
+{
+	const char *dir;
+
+	if ((dir = g_getenv("SIGROKDECODE_CACHE_DIR"))) {
+		if (!*dir)
+			return NULL;
+		return g_build_filename(dir, INDEX_FILENAME, NULL);
+	}
+
+	return g_build_filename(g_get_user_cache_dir(), "libsigrokdecode",
+			INDEX_FILENAME, NULL);
+}
+
+/* Read the index file, if that didn't happen yet. */
+static void index_read(void)
+{
+	GVariant *index, *entry;
+	GVariantIter *iter;
+	char *path, *data, *dir;
+	gsize len;
+	guint32 version;
+
+	if (index_entries)
+		return;
+
+	index_entries = g_hash_table_new_full(g_str_hash, g_str_equal,
+			g_free, (GDestroyNotify)g_variant_unref);
+	index_dirty = FALSE;
+
+	if (!(path = index_path()))
+		return;
+	if (!g_file_get_contents(path, &data, &len, NULL)) {
+		/* Nothing indexed yet. */
+		g_free(path);
+		return;
+	}
+
+	/* Untrusted, so a broken file just yields empty values. */
+	index = g_variant_new_from_data(G_VARIANT_TYPE(INDEX_TYPE), data, len,
+			FALSE, g_free, data);
+	g_variant_ref_sink(index);
+	g_variant_get(index, "(ua{s" ENTRY_TYPE "})", &version, &iter);
+	if (version == INDEX_VERSION) {
+		while (g_variant_iter_next(iter, "{s@" ENTRY_TYPE "}",
+				&dir, &entry))
+			g_hash_table_insert(index_entries, dir, entry);
+	} else {
+		srd_dbg("Ignoring decoder index '%s' of version %u.", path,
+				version);
+	}
+	g_variant_iter_free(iter);
+	g_variant_unref(index);
+
+	srd_dbg("Read %u entries from decoder index '%s'.",
+			g_hash_table_size(index_entries), path);
+	g_free(path);
+}
+
+static int strcmp_cb(const void *a, const void *b)
+{
+	return strcmp(*(const char **)a, *(const char **)b);
+}
+
+static GSList *channels_new(GVariant *v, int order)
+{
+	struct srd_channel *pdch;
+	GVariantIter iter;
+	GSList *channels;
+	const char *id, *name, *desc;
+
+	channels = NULL;
+	g_variant_iter_init(&iter, v);
+	while (g_variant_iter_next(&iter, "(&s&s&s)", &id, &name, &desc)) {
+		pdch = g_malloc(sizeof(struct srd_channel));
+		pdch->id = g_strdup(id);
+		pdch->name = g_strdup(name);
+		pdch->desc = g_strdup(desc);
+		pdch->order = order++;
+		channels = g_slist_append(channels, pdch);
+	}
+
+	return channels;
+}
+
+static GVariant *channels_variant(const GSList *channels)
+{
+	const struct srd_channel *pdch;
+	GVariantBuilder b;
+	const GSList *l;
+
+	g_variant_builder_init(&b, G_VARIANT_TYPE("a(sss)"));
+	for (l = channels; l; l = l->next) {
+		pdch = l->data;
+		g_variant_builder_add(&b, "(sss)", pdch->id, pdch->name,
+				pdch->desc);
+	}
+
+	return g_variant_builder_end(&b);
+}
+
+/* A list of NULL-terminated pairs of strings. */
+static GSList *pairs_new(GVariant *v)
+{
+	GVariantIter iter;
+	GSList *pairs;
+	const char *a, *b;
+	char **pair;
+
+	pairs = NULL;
+	g_variant_iter_init(&iter, v);
+	while (g_variant_iter_next(&iter, "(&s&s)", &a, &b)) {
+		pair = g_malloc0(sizeof(char *) * 3);
+		pair[0] = g_strdup(a);
+		pair[1] = g_strdup(b);
+		pairs = g_slist_append(pairs, pair);
+	}
+
+	return pairs;
+}
+
+static GVariant *pairs_variant(const GSList *pairs)
+{
+	GVariantBuilder b;
+	const GSList *l;
+	char **pair;
+
+	g_variant_builder_init(&b, G_VARIANT_TYPE("a(ss)"));
+	for (l = pairs; l; l = l->next) {
+		pair = l->data;
+		g_variant_builder_add(&b, "(ss)", pair[0], pair[1]);
+	}
+
+	return g_variant_builder_end(&b);
+}
+
+static GSList *options_new(GVariant *v)
+{
+	struct srd_decoder_option *o;
+	GVariantIter iter, values_iter;
+	GVariant *def, *values, *value;
+	GSList *options;
+	const char *id, *desc;
+
+	options = NULL;
+	g_variant_iter_init(&iter, v);
+	while (g_variant_iter_next(&iter, "(&sm&smv@av)", &id, &desc, &def,
+			&values)) {
+		o = g_malloc0(sizeof(struct srd_decoder_option));
+		o->id = g_strdup(id);
+		o->desc = g_strdup(desc);
+		o->def = def;
+		g_variant_iter_init(&values_iter, values);
+		while (g_variant_iter_next(&values_iter, "v", &value))
+			o->values = g_slist_append(o->values, value);
+		g_variant_unref(values);
+		options = g_slist_append(options, o);
+	}
+
+	return options;
+}
+
+static GVariant *options_variant(const GSList *options)
+{
+	const struct srd_decoder_option *o;
+	GVariantBuilder b, values;
+	const GSList *l, *m;
+
+	g_variant_builder_init(&b, G_VARIANT_TYPE("a(smsmvav)"));
+	for (l = options; l; l = l->next) {
+		o = l->data;
+		g_variant_builder_init(&values, G_VARIANT_TYPE("av"));
+		for (m = o->values; m; m = m->next)
+			g_variant_builder_add(&values, "v", m->data);
+		g_variant_builder_add(&b, "(smsmvav)", o->id, o->desc, o->def,
+				&values);
+	}
+
+	return g_variant_builder_end(&b);
+}
+
+static GSList *annotation_rows_new(GVariant *v)
+{
+	struct srd_decoder_annotation_row *ann_row;
+	GVariantIter iter, *classes_iter;
+	GSList *ann_rows;
+	const char *id, *desc;
+	gint32 ann_class;
+
+	ann_rows = NULL;
+	g_variant_iter_init(&iter, v);
+	while (g_variant_iter_next(&iter, "(&s&sai)", &id, &desc,
+			&classes_iter)) {
+		ann_row = g_malloc0(sizeof(struct srd_decoder_annotation_row));
+		ann_row->id = g_strdup(id);
+		ann_row->desc = g_strdup(desc);
+		while (g_variant_iter_next(classes_iter, "i", &ann_class))
+			ann_row->ann_classes = g_slist_append(
+					ann_row->ann_classes,
+					GINT_TO_POINTER(ann_class));
+		g_variant_iter_free(classes_iter);
+		ann_rows = g_slist_append(ann_rows, ann_row);
+	}
+
+	return ann_rows;
+}
+
+static GVariant *annotation_rows_variant(const GSList *ann_rows)
+{
+	const struct srd_decoder_annotation_row *ann_row;
+	GVariantBuilder b, classes;
+	const GSList *l, *m;
+
+	g_variant_builder_init(&b, G_VARIANT_TYPE("a(ssai)"));
+	for (l = ann_rows; l; l = l->next) {
+		ann_row = l->data;
+		g_variant_builder_init(&classes, G_VARIANT_TYPE("ai"));
+		for (m = ann_row->ann_classes; m; m = m->next)
+			g_variant_builder_add(&classes, "i",
+					GPOINTER_TO_INT(m->data));
+		g_variant_builder_add(&b, "(ssai)", ann_row->id,
+				ann_row->desc, &classes);
+	}
+
+	return g_variant_builder_end(&b);
+}
+
+/** @endcond */
+
+/**
+ * Compute the signature of the files in a protocol decoder's directory.
+ *
+ * @param dir The directory of the decoder's Python package.
+ *
+ * @return A newly allocated string, or NULL if the directory can't be read.
+ *
+ * @private
+ */
+SRD_PRIV char *srd_index_signature(const char *dir)
+{
+	GChecksum *checksum;
+	GPtrArray *names;
+	GDir *gdir;
+	GStatBuf st;
+	const char *name;
+	char *path, *stat_str, *signature;
+	guint i;
+
+	if (!(gdir = g_dir_open(dir, 0, NULL)))
+		return NULL;
+
+	names = g_ptr_array_new_with_free_func(g_free);
+	while ((name = g_dir_read_name(gdir)))
+		g_ptr_array_add(names, g_strdup(name));
+	g_dir_close(gdir);
+	/* The order in which a directory is read is unspecified. */
+	g_ptr_array_sort(names, strcmp_cb);
+
+	checksum = g_checksum_new(G_CHECKSUM_SHA1);
+	for (i = 0; i < names->len; i++) {
+		path = g_build_filename(dir, names->pdata[i], NULL);
+		/* Skips __pycache__ and such. */
+		if (g_stat(path, &st) == 0 && S_ISREG(st.st_mode)) {
+			stat_str = g_strdup_printf("%s %" G_GINT64_FORMAT
+					" %" G_GINT64_FORMAT "\n",
+					(char *)names->pdata[i],
+					(gint64)st.st_size,
+					(gint64)st.st_mtime);
+			g_checksum_update(checksum, (const guchar *)stat_str,
+					strlen(stat_str));
+			g_free(stat_str);
+		}
+		g_free(path);
+	}
+	signature = g_strdup(g_checksum_get_string(checksum));
+	g_checksum_free(checksum);
+	g_ptr_array_free(names, TRUE);
+
+	return signature;
+}
+
+/**
+ * Load a protocol decoder's metadata from the index.
+ *
+ * The decoder's Python module is not imported.
+ *
+ * @param dir The directory of the decoder's Python package.
+ * @param signature The current signature of its files.
+ *
+ * @return A newly allocated decoder, or NULL if the index has no
+ *         up-to-date entry for the directory.
+ *
+ * @private
+ */
+SRD_PRIV struct srd_decoder *srd_index_lookup(const char *dir,
+		const char *signature)
+{
+	struct srd_decoder *d;
+	GVariant *entry, *meta;
+	const char *entry_signature;
+
+	index_read();
+	if (!(entry = g_hash_table_lookup(index_entries, dir)))
+		return NULL;
+	g_variant_get_child(entry, 0, "&s", &entry_signature);
+	if (strcmp(entry_signature, signature))
+		return NULL;
+
+	meta = g_variant_get_child_value(entry, 1);
+	d = srd_index_decoder_new(meta);
+	g_variant_unref(meta);
+
+	return d;
+}
+
+/**
+ * Create a protocol decoder from its metadata, as kept in the decoder
+ * index and in decoder bundles.
+ *
+ * The decoder's Python module is not imported.
+ *
+ * @param meta The metadata, of SRD_DECODER_META_TYPE.
+ *
+ * @return A newly allocated decoder.
+ *
+ * @private
+ */
+SRD_PRIV struct srd_decoder *srd_index_decoder_new(GVariant *meta)
+{
+	struct srd_decoder *d;
+	GVariant *channels, *opt_channels, *options, *annotations;
+	GVariant *annotation_rows, *binary;
+
+	d = g_malloc0(sizeof(struct srd_decoder));
+	g_variant_get(meta, "(ssssssi@a(sss)@a(sss)@a(smsmvav)"
+			"@a(ss)@a(ssai)@a(ss))", &d->module_name, &d->id,
+			&d->name, &d->longname, &d->desc, &d->license,
+			&d->sample_iteration, &channels, &opt_channels,
+			&options, &annotations, &annotation_rows, &binary);
+
+	d->channels = channels_new(channels, 0);
+	d->opt_channels = channels_new(opt_channels,
+			g_slist_length(d->channels));
+	d->options = options_new(options);
+	d->annotations = pairs_new(annotations);
+	d->annotation_rows = annotation_rows_new(annotation_rows);
+	d->binary = pairs_new(binary);
+
+	g_variant_unref(channels);
+	g_variant_unref(opt_channels);
+	g_variant_unref(options);
+	g_variant_unref(annotations);
+	g_variant_unref(annotation_rows);
+	g_variant_unref(binary);
+
+	return d;
+}
+
+/**
+ * Add a protocol decoder's metadata to the index, replacing any older
+ * entry for its directory. The index file is written by srd_index_save().
+ *
+ * @param dir The directory of the decoder's Python package.
+ * @param signature The current signature of its files.
+ * @param d The decoder, loaded from its Python module.
+ *
+ * @private
+ */
+SRD_PRIV void srd_index_store(const char *dir, const char *signature,
+		const struct srd_decoder *d)
+{
+	GVariant *entry;
+
+	index_read();
+	entry = g_variant_new("(s(ssssssi@a(sss)@a(sss)@a(smsmvav)@a(ss)"
+			"@a(ssai)@a(ss)))", signature, d->module_name, d->id,
+			d->name, d->longname, d->desc, d->license,
+			d->sample_iteration, channels_variant(d->channels),
+			channels_variant(d->opt_channels),
+			options_variant(d->options),
+			pairs_variant(d->annotations),
+			annotation_rows_variant(d->annotation_rows),
+			pairs_variant(d->binary));
+	g_hash_table_insert(index_entries, g_strdup(dir),
+			g_variant_ref_sink(entry));
+	index_dirty = TRUE;
+}
+
+/**
+ * Write the index file, if entries were added to the index.
+ *
+ * Entries of directories which no longer exist are dropped. Failing to
+ * write the file is not an error, decoders are just loaded from their
+ * modules again next time.
+ *
+ * @private
+ */
+SRD_PRIV void srd_index_save(void)
+{
+	GVariantBuilder b;
+	GHashTableIter iter;
+	GVariant *index;
+	GError *error;
+	gpointer dir, entry;
+	char *path, *parent;
+
+	if (!index_entries || !index_dirty)
+		return;
+	index_dirty = FALSE;
+
+	if (!(path = index_path()))
+		return;
+
+	g_variant_builder_init(&b, G_VARIANT_TYPE("a{s" ENTRY_TYPE "}"));
+	g_hash_table_iter_init(&iter, index_entries);
+	while (g_hash_table_iter_next(&iter, &dir, &entry)) {
+		if (g_file_test(dir, G_FILE_TEST_IS_DIR))
+			g_variant_builder_add(&b, "{s@" ENTRY_TYPE "}",
+					dir, entry);
+	}
+	index = g_variant_ref_sink(g_variant_new("(u@a{s" ENTRY_TYPE "})",
+			INDEX_VERSION, g_variant_builder_end(&b)));
+
+	error = NULL;
+	parent = g_path_get_dirname(path);
+	g_mkdir_with_parents(parent, 0755);
+	/* Written to a temporary file first, so readers never see half of it. */
+	if (!g_file_set_contents(path, g_variant_get_data(index),
+			g_variant_get_size(index), &error)) {
+		srd_dbg("Failed to write decoder index: %s.", error->message);
+		g_error_free(error);
+	} else {
+		srd_dbg("Wrote decoder index '%s'.", path);
+	}
+	g_free(parent);
+	g_variant_unref(index);
+	g_free(path);
+}
+
+/**
+ * Forget the index read from the index file.
+ *
+ * @private
+ */
+SRD_PRIV void srd_index_free(void)
+{
+	if (!index_entries)
+		return;
+
+	g_hash_table_destroy(index_entries);
+	index_entries = NULL;
+	index_dirty = FALSE;
+}
@@ -28,10 +28,8 @@
 
 /** @cond PRIVATE */
 
-extern SRD_PRIV GSList *sessions;
-
-/* type_logic.c */
-extern SRD_PRIV PyTypeObject srd_logic_type;
+/* module_sigrokdecode.c */
+extern SRD_PRIV PyTypeObject *srd_logic_type;
 
 /** @endcond */
 
@@ -49,20 +47,7 @@ extern SRD_PRIV PyTypeObject srd_logic_type;
  * @{
  */
 
-/**
- * Set one or more options in a decoder instance.
- *
- * Handled options are removed from the hash.
- *
- * @param di Decoder instance.
- * @param options A GHashTable of options to set.
- *
- * @return SRD_OK upon success, a (negative) error code otherwise.
- *
- * @since 0.1.0
- */
-SRD_API int srd_inst_option_set(struct srd_decoder_inst *di,
-		GHashTable *options)
+static int inst_option_set(struct srd_decoder_inst *di, GHashTable *options)
 {
 	struct srd_decoder_option *sdo;
 	PyObject *py_di_options, *py_optval;
@@ -83,7 +68,7 @@ SRD_API int srd_inst_option_set(struct srd_decoder_inst *di,
 		return SRD_ERR_ARG;
 	}
 
-	if (!PyObject_HasAttrString(di->decoder->py_dec, "options")) {
+	if (!PyObject_HasAttrString(di->py_inst, "options")) {
 		/* Decoder has no options. */
 		if (g_hash_table_size(options) == 0) {
 			/* No options provided. */
@@ -170,6 +155,36 @@ err_out:
 	return ret;
 }
 
+/**
+ * Set one or more options in a decoder instance.
+ *
+ * Handled options are removed from the hash.
+ *
+ * @param di Decoder instance.
+ * @param options A GHashTable of options to set.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.1.0
+ */
+SRD_API int srd_inst_option_set(struct srd_decoder_inst *di,
+		GHashTable *options)
+{
+	struct srd_gil gil;
+	int ret;
+
+	if (!di) {
+		srd_err("Invalid decoder instance.");
+		return SRD_ERR_ARG;
+	}
+
+	srd_session_gil_ensure(di->sess, &gil);
+	ret = inst_option_set(di, options);
+	srd_session_gil_release(di->sess, &gil);
+
+	return ret;
+}
+
 /* Helper GComparefunc for g_slist_find_custom() in srd_inst_channel_set_all() */
 static gint compare_channel_id(const struct srd_channel *pdch,
 			const char *channel_id)
@@ -204,6 +219,7 @@ SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
 	struct srd_channel *pdch;
 	int *new_channelmap, new_channelnum, num_required_channels, i;
 	char *channel_id;
+	struct srd_gil gil;
 
 	srd_dbg("Setting channels for instance %s with list of %d channels, "
 		"unitsize %d.", di->inst_id, g_hash_table_size(new_channels),
@@ -284,9 +300,124 @@ SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
 	g_free(di->dec_channelmap);
 	di->dec_channelmap = new_channelmap;
 
+	/* Unused channels changed, so cached 'pins' objects are stale. */
+	srd_session_gil_ensure(di->sess, &gil);
+	srd_inst_pins_cache_free(di);
+	srd_session_gil_release(di->sess, &gil);
+	srd_inst_channel_extract_build(di);
+
 	return SRD_OK;
 }
 
+static void channel_extract_free(struct srd_decoder_inst *di)
+{
+	if (!di->channel_extract)
+		return;
+
+	g_free(di->channel_extract->bytes);
+	g_free(di->channel_extract->sample_mask);
+	g_free(di->channel_extract);
+	di->channel_extract = NULL;
+}
+
+/**
+ * Return a mask of the bits in a sample unit which carry one of the
+ * instance's channels, in the same byte order as the sample unit.
+ *
+ * @param di The decoder instance.
+ *
+ * @return A newly allocated array of di->data_unitsize bytes, to be freed
+ *         by the caller with g_free().
+ *
+ * @private
+ */
+SRD_PRIV uint8_t *srd_inst_sample_mask_new(const struct srd_decoder_inst *di)
+{
+	uint8_t *mask;
+	int i;
+
+	mask = g_malloc0(di->data_unitsize);
+	for (i = 0; i < di->dec_num_channels; i++) {
+		/* A channelmap value of -1 means "unused optional channel". */
+		if (di->dec_channelmap[i] == -1)
+			continue;
+		mask[di->dec_channelmap[i] / 8] |= 1 << (di->dec_channelmap[i] % 8);
+	}
+
+	return mask;
+}
+
+/**
+ * Precompute how to extract the instance's channels from a sample unit.
+ *
+ * For every byte of the sample unit which carries at least one of the
+ * decoder's channels, a lookup table maps that byte's value straight to
+ * the decoder channel bits, so the sample iterator doesn't need to look
+ * at the channel map at all. If decoder channel n simply is bit n of the
+ * sample, a mask is all that's needed.
+ *
+ * @param di The decoder instance.
+ *
+ * @private
+ */
+SRD_PRIV void srd_inst_channel_extract_build(struct srd_decoder_inst *di)
+{
+	struct srd_channel_extract *ex;
+	struct srd_extract_byte *eb;
+	int byte_offset, bit_offset, i, b, v;
+
+	channel_extract_free(di);
+
+	if (di->dec_num_channels > SRD_EXTRACT_MAX_CHANNELS)
+		/* The sample iterator falls back to using the channel map. */
+		return;
+
+	ex = g_malloc0(sizeof(struct srd_channel_extract));
+	ex->sample_mask = srd_inst_sample_mask_new(di);
+
+	ex->identity = TRUE;
+	for (i = 0; i < di->dec_num_channels; i++) {
+		if (di->dec_channelmap[i] != i) {
+			ex->identity = FALSE;
+			break;
+		}
+	}
+
+	if (ex->identity) {
+		ex->num_bytes = (di->dec_num_channels + 7) / 8;
+		if (di->dec_num_channels == 64)
+			ex->identity_mask = UINT64_MAX;
+		else
+			ex->identity_mask = (1ULL << di->dec_num_channels) - 1;
+		di->channel_extract = ex;
+		return;
+	}
+
+	ex->bytes = g_malloc0(sizeof(struct srd_extract_byte) * di->data_unitsize);
+	for (i = 0; i < di->dec_num_channels; i++) {
+		/* A channelmap value of -1 means "unused optional channel". */
+		if (di->dec_channelmap[i] == -1)
+			continue;
+		byte_offset = di->dec_channelmap[i] / 8;
+		bit_offset = di->dec_channelmap[i] % 8;
+		for (b = 0; b < ex->num_bytes; b++) {
+			if (ex->bytes[b].offset == byte_offset)
+				break;
+		}
+		eb = &ex->bytes[b];
+		if (b == ex->num_bytes) {
+			eb->offset = byte_offset;
+			ex->num_bytes++;
+		}
+		for (v = 0; v < 256; v++) {
+			if (v & (1 << bit_offset))
+				eb->lut[v] |= 1ULL << i;
+		}
+	}
+
+	di->channel_extract = ex;
+}
+
 /**
  * Create a new protocol decoder instance.
  *
@@ -307,6 +438,8 @@ SRD_API struct srd_decoder_inst *srd_inst_new(struct srd_session *sess,
 	struct srd_decoder *dec;
 	struct srd_decoder_inst *di;
 	char *inst_id;
+	PyObject *py_dec;
+	struct srd_gil gil;
 
 	srd_dbg("Creating new %s instance.", decoder_id);
 
@@ -348,24 +481,50 @@ SRD_API struct srd_decoder_inst *srd_inst_new(struct srd_session *sess,
 		 * of the instance's decode() method.
 		 */
 		di->channel_samples = g_malloc(di->dec_num_channels);
+		srd_inst_channel_extract_build(di);
 	}
 
+	srd_session_gil_ensure(sess, &gil);
+
+	/*
+	 * Sessions with an interpreter of their own have their own classes.
+	 * Decoders loaded from the index get imported now.
+	 */
+	if (sess->interp)
+		py_dec = srd_interp_class_get(sess->interp, dec,
+				dec->module_name);
+	else if (srd_decoder_import(dec) == SRD_OK)
+		py_dec = dec->py_dec;
+	else
+		py_dec = NULL;
+
 	/* Create a new instance of this decoder class. */
-	if (!(di->py_inst = PyObject_CallObject(dec->py_dec, NULL))) {
+	if (!py_dec || !(di->py_inst = PyObject_CallObject(py_dec, NULL))) {
 		if (PyErr_Occurred())
 			srd_exception_catch("failed to create %s instance: ",
 					decoder_id);
+		srd_session_gil_release(sess, &gil);
+		channel_extract_free(di);
+		g_free(di->channel_samples);
 		g_free(di->dec_channelmap);
 		g_free(di);
 		return NULL;
 	}
+	((srd_Decoder *)di->py_inst)->di = di;
 
 	if (options && srd_inst_option_set(di, options) != SRD_OK) {
+		((srd_Decoder *)di->py_inst)->di = NULL;
+		Py_DecRef(di->py_inst);
+		srd_session_gil_release(sess, &gil);
+		channel_extract_free(di);
+		g_free(di->channel_samples);
 		g_free(di->dec_channelmap);
 		g_free(di);
 		return NULL;
 	}
 
+	srd_session_gil_release(sess, &gil);
+
 	/* Instance takes input from a frontend by default. */
 	sess->di_list = g_slist_append(sess->di_list, di);
 
@@ -447,68 +606,341 @@ SRD_API struct srd_decoder_inst *srd_inst_find_by_id(struct srd_session *sess,
 	return di;
 }
 
-static struct srd_decoder_inst *srd_sess_inst_find_by_obj(
-		struct srd_session *sess, const GSList *stack,
-		const PyObject *obj)
+static struct srd_class_filter *class_filter_new(const GSList *classes)
 {
-	const GSList *l;
-	struct srd_decoder_inst *tmp, *di;
+	struct srd_class_filter *filter;
 
-	if (session_is_valid(sess) != SRD_OK) {
-		srd_err("Invalid session.");
-		return NULL;
+	filter = g_malloc(sizeof(struct srd_class_filter));
+	filter->num_classes = g_slist_length((GSList *)classes);
+	filter->wanted = g_malloc0(sizeof(gboolean) * filter->num_classes);
+
+	return filter;
+}
+
+static void class_filter_free(struct srd_class_filter *filter)
+{
+	if (!filter)
+		return;
+
+	g_free(filter->wanted);
+	g_free(filter);
+}
+
+/* Subscribe to classes given by ID, in a list of {id, description}. */
+static int class_filter_add(struct srd_class_filter *filter,
+		const GSList *classes, const GSList *ids,
+		const struct srd_decoder *dec)
+{
+	const GSList *l, *c;
+	int i;
+
+	for (l = ids; l; l = l->next) {
+		for (c = classes, i = 0; c; c = c->next, i++) {
+			if (!strcmp(((char **)c->data)[0], l->data))
+				break;
+		}
+		if (!c) {
+			srd_err("Protocol decoder %s has no class '%s'.",
+					dec->id, (char *)l->data);
+			return SRD_ERR_ARG;
+		}
+		filter->wanted[i] = TRUE;
 	}
 
-	di = NULL;
-	for (l = stack ? stack : sess->di_list; di == NULL && l != NULL; l = l->next) {
-		tmp = l->data;
-		if (tmp->py_inst == obj)
-			di = tmp;
-		else if (tmp->next_di)
-			di = srd_sess_inst_find_by_obj(sess, tmp->next_di, obj);
+	return SRD_OK;
+}
+
+/* Subscribe to the annotation classes of rows given by ID. */
+static int class_filter_add_rows(struct srd_class_filter *filter,
+		const GSList *ids, const struct srd_decoder *dec)
+{
+	const struct srd_decoder_annotation_row *row;
+	const GSList *l, *r, *c;
+	int ann_class;
+
+	for (l = ids; l; l = l->next) {
+		for (r = dec->annotation_rows; r; r = r->next) {
+			row = r->data;
+			if (!strcmp(row->id, l->data))
+				break;
+		}
+		if (!r) {
+			srd_err("Protocol decoder %s has no annotation row '%s'.",
+					dec->id, (char *)l->data);
+			return SRD_ERR_ARG;
+		}
+		for (c = row->ann_classes; c; c = c->next) {
+			ann_class = GPOINTER_TO_INT(c->data);
+			if (ann_class >= 0 && ann_class < filter->num_classes)
+				filter->wanted[ann_class] = TRUE;
+		}
 	}
 
-	return di;
+	return SRD_OK;
 }
 
 /**
- * Find a decoder instance by its Python object.
+ * Check whether output of a class passes a filter.
  *
- * I.e. find that instance's instantiation of the sigrokdecode.Decoder class.
- * This will recurse to find the instance anywhere in the stack tree of all
- * sessions.
+ * @param filter The filter, or NULL.
+ * @param output_class The class, or -1 if not known.
  *
- * @param stack Pointer to a GSList of struct srd_decoder_inst, indicating the
- *              stack to search. To start searching at the bottom level of
- *              decoder instances, pass NULL.
- * @param obj The Python class instantiation.
+ * @return FALSE if nobody subscribed to the output, TRUE otherwise. Output
+ *         of an unknown class passes, to be rejected along the usual way.
  *
- * @return Pointer to struct srd_decoder_inst, or NULL if not found.
+ * @private
+ */
+SRD_PRIV gboolean srd_inst_class_wanted(const struct srd_class_filter *filter,
+		int output_class)
+{
+	if (!filter || output_class < 0 || output_class >= filter->num_classes)
+		return TRUE;
+
+	return filter->wanted[output_class];
+}
+
+/**
+ * Subscribe to some of a decoder instance's annotations only.
+ *
+ * Annotations of other classes are dropped as soon as the decoder puts
+ * them out, without converting them, and aren't passed to any callback.
+ * Decoders can also check with self.wants(ann_class) whether anybody
+ * wants an annotation, before formatting its texts.
+ *
+ * Must not be called while the instance's session is decoding.
+ *
+ * @param di The decoder instance.
+ * @param ann_classes List of IDs (char *) of annotation classes to
+ *                    subscribe to. May be NULL.
+ * @param ann_rows List of IDs (char *) of annotation rows, whose classes
+ *                 to subscribe to. May be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise. Both
+ *         lists being NULL subscribes to all annotations (the default).
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_inst_ann_classes_set(struct srd_decoder_inst *di,
+		const GSList *ann_classes, const GSList *ann_rows)
+{
+	struct srd_class_filter *filter;
+
+	if (!di) {
+		srd_err("Invalid decoder instance.");
+		return SRD_ERR_ARG;
+	}
+
+	filter = NULL;
+	if (ann_classes || ann_rows) {
+		filter = class_filter_new(di->decoder->annotations);
+		if (class_filter_add(filter, di->decoder->annotations,
+				ann_classes, di->decoder) != SRD_OK
+				|| class_filter_add_rows(filter, ann_rows,
+				di->decoder) != SRD_OK) {
+			class_filter_free(filter);
+			return SRD_ERR_ARG;
+		}
+	}
+	class_filter_free(di->ann_filter);
+	di->ann_filter = filter;
+
+	return SRD_OK;
+}
+
+/**
+ * Subscribe to some of a decoder instance's binary output only.
+ *
+ * Binary output of other classes is dropped as soon as the decoder puts
+ * it out, and isn't passed to any callback.
+ *
+ * Must not be called while the instance's session is decoding.
+ *
+ * @param di The decoder instance.
+ * @param bin_classes List of IDs (char *) of binary classes to subscribe
+ *                    to, NULL to subscribe to all of them (the default).
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_inst_binary_classes_set(struct srd_decoder_inst *di,
+		const GSList *bin_classes)
+{
+	struct srd_class_filter *filter;
+
+	if (!di) {
+		srd_err("Invalid decoder instance.");
+		return SRD_ERR_ARG;
+	}
+
+	filter = NULL;
+	if (bin_classes) {
+		filter = class_filter_new(di->decoder->binary);
+		if (class_filter_add(filter, di->decoder->binary, bin_classes,
+				di->decoder) != SRD_OK) {
+			class_filter_free(filter);
+			return SRD_ERR_ARG;
+		}
+	}
+	class_filter_free(di->bin_filter);
+	di->bin_filter = filter;
+
+	return SRD_OK;
+}
+
+/**
+ * Get the decoding statistics of a decoder instance.
+ *
+ * They're only accumulated while statistics are enabled for the
+ * instance's session, see srd_session_stats_set(). If the session decodes
+ * in a thread of its own, only call this while it isn't decoding, e.g.
+ * after srd_session_queue_drain().
+ *
+ * @param di The decoder instance.
+ * @param stats Will be filled with the instance's statistics.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_inst_stats_get(const struct srd_decoder_inst *di,
+		struct srd_inst_stats *stats)
+{
+	if (!di || !stats)
+		return SRD_ERR_ARG;
+
+	*stats = di->stats;
+
+	return SRD_OK;
+}
+
+/**
+ * Reset the decoding statistics of a decoder instance to zero.
+ *
+ * The same restrictions as for srd_inst_stats_get() apply.
+ *
+ * @param di The decoder instance.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_inst_stats_reset(struct srd_decoder_inst *di)
+{
+	if (!di)
+		return SRD_ERR_ARG;
+
+	memset(&di->stats, 0, sizeof(di->stats));
+
+	return SRD_OK;
+}
+
+/**
+ * Charge the time spent since the last switch to whoever was running,
+ * and start running something else.
+ *
+ * Only called while the session's statistics are enabled. Every switch
+ * away from an instance is paired with a switch back to the returned
+ * owner, so each instance only gets the time it ran itself.
+ *
+ * @param sess The session.
+ * @param di The decoder instance which starts running, or NULL if the
+ *           time until the next switch isn't charged to any instance.
+ * @param callback TRUE if frontend callbacks for di's output start
+ *                 running, FALSE if di's decode() does.
+ *
+ * @return The previous owner, to switch back to when done.
  *
  * @private
+ */
+SRD_PRIV struct srd_stats_owner srd_inst_stats_switch(struct srd_session *sess,
+		struct srd_decoder_inst *di, gboolean callback)
+{
+	struct srd_stats_owner prev;
+	uint64_t wall_ns, cpu_ns;
+
+	srd_clock_get(&wall_ns, &cpu_ns);
+
+	prev = sess->stats_owner;
+	if (prev.di && prev.callback) {
+		prev.di->stats.callback_wall_ns += wall_ns - sess->stats_wall_ns;
+	} else if (prev.di) {
+		prev.di->stats.decode_wall_ns += wall_ns - sess->stats_wall_ns;
+		prev.di->stats.decode_cpu_ns += cpu_ns - sess->stats_cpu_ns;
+	}
+
+	sess->stats_owner.di = di;
+	sess->stats_owner.callback = callback;
+	sess->stats_wall_ns = wall_ns;
+	sess->stats_cpu_ns = cpu_ns;
+
+	return prev;
+}
+
+/**
+ * Account for a call of an instance's decode(), while the instance's
+ * session has statistics or tracing enabled.
  *
- * @since 0.1.0
+ * @param di The decoder instance.
+ * @param start_samplenum The first sample passed to decode().
+ * @param end_samplenum The end of the samples passed to decode().
+ * @param samples TRUE if decode() gets sample data, FALSE if it gets the
+ *                output of another instance.
+ *
+ * @return What to pass to srd_inst_decode_end() after the call.
+ *
+ * @private
  */
-SRD_PRIV struct srd_decoder_inst *srd_inst_find_by_obj(const GSList *stack,
-		const PyObject *obj)
+SRD_PRIV struct srd_stats_owner srd_inst_decode_begin(
+		struct srd_decoder_inst *di, uint64_t start_samplenum,
+		uint64_t end_samplenum, gboolean samples)
 {
-	struct srd_decoder_inst *di;
 	struct srd_session *sess;
-	GSList *l;
-
-	di = NULL;
-	for (l = sessions; di == NULL && l != NULL; l = l->next) {
-		sess = l->data;
-		di = srd_sess_inst_find_by_obj(sess, stack, obj);
+	struct srd_stats_owner prev;
+
+	sess = di->sess;
+	prev = sess->stats_owner;
+	if (sess->stats) {
+		prev = srd_inst_stats_switch(sess, di, FALSE);
+		di->stats.num_decode_calls++;
+		if (samples)
+			di->stats.num_samples += end_samplenum - start_samplenum;
 	}
+	if (sess->trace_cb)
+		srd_session_trace(sess, SRD_TRACE_DECODE_BEGIN, di, -1, -1,
+				start_samplenum, end_samplenum);
 
-	return di;
+	return prev;
+}
+
+/**
+ * Account for the return of an instance's decode().
+ *
+ * @param di The decoder instance.
+ * @param start_samplenum The same as for srd_inst_decode_begin().
+ * @param end_samplenum The same as for srd_inst_decode_begin().
+ * @param prev What srd_inst_decode_begin() returned.
+ *
+ * @private
+ */
+SRD_PRIV void srd_inst_decode_end(struct srd_decoder_inst *di,
+		uint64_t start_samplenum, uint64_t end_samplenum,
+		struct srd_stats_owner prev)
+{
+	struct srd_session *sess;
+
+	sess = di->sess;
+	if (sess->trace_cb)
+		srd_session_trace(sess, SRD_TRACE_DECODE_END, di, -1, -1,
+				start_samplenum, end_samplenum);
+	if (sess->stats)
+		srd_inst_stats_switch(sess, prev.di, prev.callback);
 }
 
 /** @private */
 SRD_PRIV int srd_inst_start(struct srd_decoder_inst *di)
 {
-	PyObject *py_res;
+	PyObject *py_res, **py_decode;
 	GSList *l;
 	struct srd_decoder_inst *next_di;
 	int ret;
@@ -523,6 +955,18 @@ SRD_PRIV int srd_inst_start(struct srd_decoder_inst *di)
 	}
 	Py_DecRef(py_res);
 
+	/*
+	 * Look up the bound decode() method only once, instead of for every
+	 * chunk of samples or every packet from a lower decoder.
+	 */
+	py_decode = &((srd_Decoder *)di->py_inst)->decode;
+	Py_XDECREF(*py_decode);
+	if (!(*py_decode = PyObject_GetAttrString(di->py_inst, "decode"))) {
+		srd_exception_catch("Protocol decoder instance %s: ",
+				di->inst_id);
+		return SRD_ERR_PYTHON;
+	}
+
 	/* Start all the PDs stacked on top of this one. */
 	for (l = di->next_di; l; l = l->next) {
 		next_di = l->data;
@@ -554,8 +998,9 @@ SRD_PRIV int srd_inst_decode(const struct srd_decoder_inst *di,
 		uint64_t start_samplenum, uint64_t end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen)
 {
-	PyObject *py_res;
+	PyObject *py_res, *py_decode;
 	srd_logic *logic;
+	struct srd_stats_owner stats_prev;
 
 	srd_dbg("Calling decode() on instance %s with %" PRIu64 " bytes "
 		"starting at sample %" PRIu64 ".", di->inst_id, inbuflen,
@@ -579,19 +1024,45 @@ SRD_PRIV int srd_inst_decode(const struct srd_decoder_inst *di,
 	 * Create new srd_logic object. Each iteration around the PD's loop
 	 * will fill one sample into this object.
 	 */
-	logic = PyObject_New(srd_logic, &srd_logic_type);
-	Py_INCREF(logic);
+	if (di->sess->interp)
+		logic = PyObject_New(srd_logic, di->sess->interp->logic_type);
+	else
+		logic = PyObject_New(srd_logic, srd_logic_type);
 	logic->di = (struct srd_decoder_inst *)di;
 	logic->start_samplenum = start_samplenum;
 	logic->itercnt = 0;
 	logic->inbuf = (uint8_t *)inbuf;
 	logic->inbuflen = inbuflen;
 	logic->sample = PyList_New(2);
-	Py_INCREF(logic->sample);
+	logic->data = NULL;
+
+	if (di->sess->instrumented)
+		stats_prev = srd_inst_decode_begin((struct srd_decoder_inst *)di,
+				start_samplenum, end_samplenum, TRUE);
 
 	Py_IncRef(di->py_inst);
-	if (!(py_res = PyObject_CallMethod(di->py_inst, "decode",
-			"KKO", start_samplenum, end_samplenum, logic))) {
+	if ((py_decode = ((srd_Decoder *)di->py_inst)->decode))
+		py_res = PyObject_CallFunction(py_decode, "KKO",
+				start_samplenum, end_samplenum, logic);
+	else
+		py_res = PyObject_CallMethod(di->py_inst, "decode",
+				"KKO", start_samplenum, end_samplenum, logic);
+
+	if (di->sess->instrumented)
+		srd_inst_decode_end((struct srd_decoder_inst *)di,
+				start_samplenum, end_samplenum, stats_prev);
+
+	/*
+	 * The sample data belongs to the frontend, and is gone after this
+	 * call. Make sure the PD can't get at it anymore. Buffer views it
+	 * kept are on a copy, which they keep alive themselves.
+	 */
+	logic->inbuf = NULL;
+	logic->inbuflen = 0;
+	Py_CLEAR(logic->data);
+	Py_DecRef((PyObject *)logic);
+
+	if (!py_res) {
 		srd_exception_catch("Protocol decoder instance %s: ",
 				di->inst_id);
 		return SRD_ERR_PYTHON;
@@ -601,6 +1072,126 @@ SRD_PRIV int srd_inst_decode(const struct srd_decoder_inst *di,
 	return SRD_OK;
 }
 
+/**
+ * Find out how a decoder instance can resynchronize to the sample data
+ * after a fresh start in the middle of it.
+ *
+ * PDs opt in by implementing a resync() method, which returns a tuple
+ * (pattern, num_samples). The pattern has an item of 0, 1 or None (don't
+ * care) per channel, just like for wait_match(). Once the PD's channels
+ * matched the pattern for num_samples samples in a row, a freshly started
+ * instance decodes everything after that just like one which saw all
+ * sample data before. Channels which aren't connected are ignored.
+ *
+ * Must be called with the GIL held, after the instance was started and
+ * its metadata was set.
+ *
+ * @param di The decoder instance.
+ * @param mask Will hold the bits of a sample unit which the pattern looks
+ *             at, or NULL if the instance can't resynchronize. Free with
+ *             g_free().
+ * @param value Will hold the values these bits should have.
+ * @param num_samples Will hold the number of samples they should have
+ *                    these values for.
+ *
+ * @return SRD_OK upon success (even if the instance can't resynchronize),
+ *         a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_inst_resync_get(struct srd_decoder_inst *di,
+		uint8_t **mask, uint8_t **value, uint64_t *num_samples)
+{
+	PyObject *py_res, *py_pattern, *py_item;
+	unsigned long long n;
+	Py_ssize_t num_items, i;
+	gboolean used;
+	long val;
+	int ch;
+
+	*mask = *value = NULL;
+	*num_samples = 0;
+
+	if (!PyObject_HasAttrString(di->py_inst, "resync"))
+		return SRD_OK;
+
+	if (!(py_res = PyObject_CallMethod(di->py_inst, "resync", NULL))) {
+		srd_exception_catch("Protocol decoder instance %s: ",
+				di->inst_id);
+		return SRD_ERR_PYTHON;
+	}
+	if (py_res == Py_None) {
+		/* Not with the current options. */
+		Py_DECREF(py_res);
+		return SRD_OK;
+	}
+
+	if (!PyArg_ParseTuple(py_res, "OK", &py_pattern, &n)
+			|| !PySequence_Check(py_pattern)
+			|| (num_items = PySequence_Size(py_pattern)) > di->dec_num_channels
+			|| n == 0) {
+		PyErr_Clear();
+		srd_err("Protocol decoder instance %s: resync() must return "
+				"a pattern with at most one item per channel, and "
+				"a number of samples.", di->inst_id);
+		Py_DECREF(py_res);
+		return SRD_ERR_PYTHON;
+	}
+
+	*mask = g_malloc0(di->data_unitsize);
+	*value = g_malloc0(di->data_unitsize);
+	used = FALSE;
+	for (i = 0; i < num_items; i++) {
+		py_item = PySequence_GetItem(py_pattern, i);
+		val = py_item == Py_None ? -1 : PyLong_AsLong(py_item);
+		Py_XDECREF(py_item);
+		if (PyErr_Occurred() || val < -1 || val > 1) {
+			PyErr_Clear();
+			srd_err("Protocol decoder instance %s: resync() pattern "
+					"item %zd must be 0, 1 or None.",
+					di->inst_id, i);
+			Py_DECREF(py_res);
+			g_free(*mask);
+			g_free(*value);
+			*mask = *value = NULL;
+			return SRD_ERR_PYTHON;
+		}
+		/* A channelmap value of -1 means "unused optional channel". */
+		if (val == -1 || (ch = di->dec_channelmap[i]) == -1)
+			continue;
+		(*mask)[ch / 8] |= 1 << (ch % 8);
+		if (val)
+			(*value)[ch / 8] |= 1 << (ch % 8);
+		used = TRUE;
+	}
+	Py_DECREF(py_res);
+
+	if (!used) {
+		/* None of the channels it needs are connected. */
+		g_free(*mask);
+		g_free(*value);
+		*mask = *value = NULL;
+		return SRD_OK;
+	}
+	*num_samples = n;
+
+	return SRD_OK;
+}
+
+/** @private */
+SRD_PRIV void srd_inst_pins_cache_free(struct srd_decoder_inst *di)
+{
+	int i;
+
+	if (!di->pins_cache)
+		return;
+
+	for (i = 0; i < (1 << di->dec_num_channels); i++)
+		Py_XDECREF((PyObject *)di->pins_cache[i]);
+	g_free(di->pins_cache);
+	di->pins_cache = NULL;
+}
+
 /** @private */
 SRD_PRIV void srd_inst_free(struct srd_decoder_inst *di)
 {
@@ -609,9 +1200,24 @@ SRD_PRIV void srd_inst_free(struct srd_decoder_inst *di)
 
 	srd_dbg("Freeing instance %s", di->inst_id);
 
+	if (di->sess && di->sess->stats_owner.di == di)
+		di->sess->stats_owner.di = NULL;
+	if (di->sess && di->sess->ann_summaries)
+		srd_ann_summary_inst_remove(di->sess, di);
+	if (di->sess && di->sess->ann_store)
+		srd_ann_store_inst_remove(di->sess, di);
+
+	srd_inst_pins_cache_free(di);
+	channel_extract_free(di);
+	class_filter_free(di->ann_filter);
+	class_filter_free(di->bin_filter);
+	/* The PD object may outlive the instance, if it's referenced elsewhere. */
+	((srd_Decoder *)di->py_inst)->di = NULL;
+	Py_CLEAR(((srd_Decoder *)di->py_inst)->decode);
 	Py_DecRef(di->py_inst);
 	g_free(di->inst_id);
 	g_free(di->dec_channelmap);
+	g_free(di->channel_samples);
 	g_slist_free(di->next_di);
 	for (l = di->pd_output; l; l = l->next) {
 		pdo = l->data;
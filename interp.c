@@ -0,0 +1,211 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include "config.h"
+#include <glib.h>
+
+/**
+ * @file
+ *
+ * Python sub-interpreters of sessions.
+ */
+
+/*
+ * Sessions normally share the main Python interpreter, and thus its GIL:
+ * only one of them runs decoder code at any time, even if they decode in
+ * threads of their own. A session can instead get a sub-interpreter of its
+ * own, into which the sigrokdecode module and the decoder modules it uses
+ * are imported anew. As of Python 3.12, such an interpreter also has a GIL
+ * of its own, so sessions decoding on separate threads run in parallel.
+ *
+ * A struct srd_decoder and its metadata remain those loaded into the main
+ * interpreter. Only the decoder's class is imported into a sub-interpreter,
+ * when the first instance of it is created there.
+ */
+
+/** @cond PRIVATE */
+
+static void class_free(gpointer data)
+{
+	Py_DECREF((PyObject *)data);
+}
+
+/* Make a thread state current again, after Py_EndInterpreter(). */
+static void interp_ended(PyThreadState *saved)
+{
+#if PY_VERSION_HEX >= 0x030C0000
+	/* The interpreter's own GIL is gone, take the main one again. */
+	PyEval_RestoreThread(saved);
+#else
+	/* The GIL is shared, and still held. */
+	PyThreadState_Swap(saved);
+#endif
+}
+
+/** @endcond */
+
+/**
+ * Create a Python sub-interpreter, and import the sigrokdecode module
+ * into it.
+ *
+ * The calling thread must not hold the GIL of a sub-interpreter.
+ *
+ * @return The new interpreter, or NULL upon errors.
+ *
+ * @private
+ */
+SRD_PRIV struct srd_interp *srd_interp_new(void)
+{
+	struct srd_interp *interp;
+	PyGILState_STATE gstate;
+	PyThreadState *saved, *tstate;
+	int ret;
+#if PY_VERSION_HEX >= 0x030C0000
+	PyInterpreterConfig config = {
+		.use_main_obmalloc = 0,
+		.allow_fork = 0,
+		.allow_exec = 0,
+		.allow_threads = 1,
+		.allow_daemon_threads = 0,
+		.check_multi_interp_extensions = 1,
+		.gil = PyInterpreterConfig_OWN_GIL,
+	};
+	PyStatus status;
+#endif
+
+	gstate = srd_gil_ensure();
+	saved = PyThreadState_Get();
+
+#if PY_VERSION_HEX >= 0x030C0000
+	/* This leaves the main interpreter's GIL released. */
+	status = Py_NewInterpreterFromConfig(&tstate, &config);
+	if (PyStatus_Exception(status))
+		tstate = NULL;
+#else
+	tstate = Py_NewInterpreter();
+#endif
+	if (!tstate) {
+		srd_err("Failed to create a Python sub-interpreter.");
+		srd_gil_release(gstate);
+		return NULL;
+	}
+
+	interp = g_malloc0(sizeof(struct srd_interp));
+#if PY_VERSION_HEX >= 0x03090000
+	interp->interp = PyThreadState_GetInterpreter(tstate);
+#else
+	interp->interp = tstate->interp;
+#endif
+	interp->classes = g_hash_table_new_full(g_direct_hash,
+			g_direct_equal, NULL, class_free);
+
+	srd_decoder_searchpaths_apply();
+	ret = srd_module_import(&interp->mod, &interp->logic_type);
+	if (ret != SRD_OK) {
+		g_hash_table_destroy(interp->classes);
+		Py_EndInterpreter(tstate);
+		interp_ended(saved);
+		srd_gil_release(gstate);
+		g_free(interp);
+		return NULL;
+	}
+
+	/*
+	 * Threads get thread states of their own in it, see
+	 * srd_session_gil_ensure().
+	 */
+	PyThreadState_Clear(tstate);
+	PyThreadState_DeleteCurrent();
+	PyEval_RestoreThread(saved);
+	srd_gil_release(gstate);
+
+	return interp;
+}
+
+/**
+ * Shut down a Python sub-interpreter created by srd_interp_new().
+ *
+ * No thread may hold its GIL, or have a thread state in it.
+ *
+ * @param interp The interpreter. Must not be NULL.
+ *
+ * @private
+ */
+SRD_PRIV void srd_interp_free(struct srd_interp *interp)
+{
+	PyGILState_STATE gstate;
+	PyThreadState *saved, *tstate;
+
+	gstate = srd_gil_ensure();
+	tstate = PyThreadState_New(interp->interp);
+#if PY_VERSION_HEX >= 0x030C0000
+	saved = PyEval_SaveThread();
+	PyEval_RestoreThread(tstate);
+#else
+	saved = PyThreadState_Swap(tstate);
+#endif
+
+	g_hash_table_destroy(interp->classes);
+	Py_DECREF((PyObject *)interp->logic_type);
+	Py_DECREF(interp->mod);
+	Py_EndInterpreter(tstate);
+
+	interp_ended(saved);
+	srd_gil_release(gstate);
+	g_free(interp);
+}
+
+/**
+ * Get the Decoder class of a protocol decoder in a sub-interpreter,
+ * importing its module there if needed.
+ *
+ * Must be called with the interpreter's GIL held.
+ *
+ * @param interp The interpreter. Must not be NULL.
+ * @param dec The decoder, as loaded into the main interpreter.
+ * @param module_name The name of the decoder's Python module.
+ *
+ * @return A borrowed reference to the class, or NULL upon errors.
+ *
+ * @private
+ */
+SRD_PRIV PyObject *srd_interp_class_get(struct srd_interp *interp,
+		const struct srd_decoder *dec, const char *module_name)
+{
+	PyObject *py_mod, *py_dec;
+
+	if ((py_dec = g_hash_table_lookup(interp->classes, dec)))
+		return py_dec;
+
+	if (!(py_mod = PyImport_ImportModule(module_name))) {
+		srd_exception_catch("Import of '%s' failed.", module_name);
+		return NULL;
+	}
+	py_dec = PyObject_GetAttrString(py_mod, "Decoder");
+	Py_DECREF(py_mod);
+	if (!py_dec) {
+		srd_exception_catch("Decoder class not found in protocol "
+				"decoder %s: ", module_name);
+		return NULL;
+	}
+
+	g_hash_table_insert(interp->classes, (gpointer)dec, py_dec);
+
+	return py_dec;
+}
@@ -25,45 +25,352 @@
 #include <Python.h> /* First, so we avoid a _POSIX_C_SOURCE warning. */
 #include "libsigrokdecode.h"
 
+/*
+ * Decoders with up to this many channels get a per-instance cache of
+ * their 'pins' objects, so the sample iterator doesn't have to create
+ * a new one for every sample.
+ */
+#define SRD_PINS_CACHE_MAX_CHANNELS 12
+
+/*
+ * GVariant type of a decoder's metadata, in the decoder index and in
+ * decoder bundles: module name, id, name, longname, desc, license, sample
+ * iteration, channels, optional channels, options, annotations, annotation
+ * rows and binary classes.
+ */
+#define SRD_DECODER_META_TYPE \
+	"(ssssssia(sss)a(sss)a(smsmvav)a(ss)a(ssai)a(ss))"
+
+/* Number of entries in enum srd_output_type. */
+#define SRD_NUM_OUTPUT_TYPES (SRD_OUTPUT_META + 1)
+
+/* Decoders with more channels than this don't get an extraction plan. */
+#define SRD_EXTRACT_MAX_CHANNELS 64
+
+/* One byte of a sample unit containing at least one decoder channel. */
+struct srd_extract_byte {
+	/* Offset of this byte within the sample unit. */
+	int offset;
+	/* Maps this byte's value to the decoder channel bits it carries. */
+	uint64_t lut[256];
+};
+
+/*
+ * How to get the decoder's channels out of a sample unit. The result is
+ * a key with bit n set if decoder channel n is high.
+ */
+struct srd_channel_extract {
+	/* Channel n is bit n of the sample, just mask off the rest. */
+	gboolean identity;
+	uint64_t identity_mask;
+	int num_bytes;
+	struct srd_extract_byte *bytes;
+	/* The decoder's channel bits within a sample unit, per byte. */
+	uint8_t *sample_mask;
+	/* Key of the previously extracted sample, if have_last_key. */
+	gboolean have_last_key;
+	uint64_t last_key;
+};
+
+/* Output classes a frontend subscribed to, see srd_inst_ann_classes_set(). */
+struct srd_class_filter {
+	/* Number of classes of the decoder. */
+	int num_classes;
+	/* One flag per class, TRUE if its output is wanted. */
+	gboolean *wanted;
+};
+
+/* What a PD is waiting for, see the Decoder.wait_*() methods. */
+enum srd_wait_type {
+	SRD_WAIT_NONE,
+	SRD_WAIT_SAMPLENUM,
+	SRD_WAIT_EDGE,
+	SRD_WAIT_MATCH,
+};
+
+/*
+ * A condition the sample iterator checks in C, passing on the next sample
+ * for which it holds. The channel bits are laid out like the keys of
+ * struct srd_channel_extract.
+ */
+struct srd_wait_cond {
+	int type;
+	/* SRD_WAIT_SAMPLENUM: the sample number to skip ahead to. */
+	uint64_t samplenum;
+	/* Channel bits to look at, and the value they should have. */
+	uint64_t mask;
+	uint64_t value;
+	/* SRD_WAIT_EDGE: any edge will do, regardless of value. */
+	gboolean any_edge;
+};
+
 /* Custom Python types: */
 
+typedef struct {
+	PyObject_HEAD
+	/*
+	 * The instance this object belongs to, so put() and register()
+	 * don't have to search all sessions for it.
+	 */
+	struct srd_decoder_inst *di;
+	/* Condition set up by the PD for the next sample it wants. */
+	struct srd_wait_cond wait;
+	/*
+	 * The PD's bound decode() method, looked up once by srd_inst_start().
+	 * It references this object, so srd_inst_free() breaks the cycle.
+	 */
+	PyObject *decode;
+} srd_Decoder;
+
 typedef struct {
 	PyObject_HEAD
 	struct srd_decoder_inst *di;
 	uint64_t start_samplenum;
-	unsigned int itercnt;
+	uint64_t itercnt;
 	uint8_t *inbuf;
 	uint64_t inbuflen;
 	PyObject *sample;
+	/* Copy of inbuf for buffer views, made by the first of them. */
+	PyObject *data;
 } srd_logic;
 
+/* Annotations collected for delivery to a batch callback. */
+struct srd_ann_batch {
+	srd_pd_output_batch_callback cb;
+	void *cb_data;
+	/* Deliver the batch once it holds this many annotations. */
+	unsigned int max_count;
+	/* Arrays of struct srd_proto_data and srd_proto_data_annotation. */
+	GArray *pdata;
+	GArray *pda;
+};
+
+/* A copy of a chunk of sample data, waiting to be decoded. */
+struct srd_chunk {
+	uint64_t start_samplenum;
+	uint64_t end_samplenum;
+	uint8_t *buf;
+	uint64_t len;
+};
+
+/* A session's decode thread, and the chunks queued up for it. */
+struct srd_session_queue {
+	unsigned int max_chunks;
+	int backpressure;
+	GThread *thread;
+	/* Protects everything below. */
+	GMutex mutex;
+	/* Signalled whenever any of the below changes. */
+	GCond cond;
+	GQueue chunks;
+	/* The thread is decoding a chunk it took off the queue. */
+	gboolean busy;
+	gboolean stop;
+	/* Error from decoding, to be returned by the next API call. */
+	int error;
+	/* Samples in the queue, plus those in the chunk being decoded. */
+	uint64_t lag;
+	uint64_t num_dropped;
+};
+
+/* A decoder stack running in a process of its own, see worker.c. */
+struct srd_worker {
+	/* The instance receiving sample data, at the bottom of the stack. */
+	struct srd_decoder_inst *di;
+	int pid;
+	/* Socket for commands to, and output from the worker process. */
+	int fd;
+	/* Output received for the current chunk, and how much was parsed. */
+	GByteArray *out;
+	guint parsed;
+	/* The worker is done with the current piece of sample data. */
+	gboolean done;
+	gboolean dead;
+	/* Error from decoding the current chunk. */
+	int ret;
+};
+
+/* A Python sub-interpreter of a session's own, see interp.c. */
+struct srd_interp {
+	PyInterpreterState *interp;
+	/* This interpreter's sigrokdecode module and srd_logic type. */
+	PyObject *mod;
+	PyTypeObject *logic_type;
+	/* Decoder class per struct srd_decoder, imported on first use. */
+	GHashTable *classes;
+};
+
+/* What srd_session_gil_ensure() did, for srd_session_gil_release(). */
+struct srd_gil {
+	PyGILState_STATE gstate;
+	/* Thread state made for the session's own interpreter, if any. */
+	PyThreadState *tstate;
+	/* Thread state the thread gave up for it, if any. */
+	PyThreadState *saved;
+};
+
+/* What the time spent decoding is charged to, see srd_inst_stats_switch(). */
+struct srd_stats_owner {
+	struct srd_decoder_inst *di;
+	/* In frontend callbacks for the instance's output, not in decode(). */
+	gboolean callback;
+};
+
 struct srd_session {
 	int session_id;
 
 	/* List of decoder instances. */
 	GSList *di_list;
 
-	/* List of frontend callbacks to receive decoder output. */
-	GSList *callbacks;
+	/*
+	 * Frontend callbacks to receive decoder output, one list of
+	 * struct srd_pd_callback per output type.
+	 */
+	GSList *callbacks[SRD_NUM_OUTPUT_TYPES];
+
+	/* Batched annotation delivery, NULL if not enabled. */
+	struct srd_ann_batch *ann_batch;
+
+	/* Decoding in a thread of its own, NULL if not enabled. */
+	struct srd_session_queue *queue;
+
+	/* Run every decoder stack in a worker process of its own. */
+	gboolean use_workers;
+	/* struct srd_worker, in di_list order, while started. */
+	GSList *workers;
+	/* Memory shared with the workers, for passing on sample data. */
+	uint8_t *worker_shm;
+
+	/* Python interpreter of its own, NULL to use the main one. */
+	struct srd_interp *interp;
+
+	/* Only convert annotation texts on request. */
+	gboolean ann_text_lazy;
+
+	/* Annotation summaries, NULL if not enabled. */
+	struct srd_ann_summaries *ann_summaries;
+	/* Store of all annotations, NULL if not enabled. */
+	struct srd_ann_store *ann_store;
+
+	/*
+	 * Statistics or tracing are enabled. Decoding only checks this
+	 * when both are disabled.
+	 */
+	gboolean instrumented;
+
+	/* Accumulate struct srd_inst_stats in the session's instances. */
+	gboolean stats;
+	/* Who's running since the timestamps, in nanoseconds. */
+	struct srd_stats_owner stats_owner;
+	uint64_t stats_wall_ns;
+	uint64_t stats_cpu_ns;
+
+	/* Receives trace events, NULL if tracing is disabled. */
+	srd_trace_callback trace_cb;
+	void *trace_cb_data;
 };
 
 /* srd.c */
 SRD_PRIV int srd_decoder_searchpath_add(const char *path);
+SRD_PRIV PyGILState_STATE srd_gil_ensure(void);
+SRD_PRIV void srd_gil_release(PyGILState_STATE gstate);
+SRD_PRIV void srd_decoder_searchpaths_apply(void);
+SRD_PRIV void srd_session_gil_ensure(struct srd_session *sess,
+		struct srd_gil *gil);
+SRD_PRIV void srd_session_gil_release(struct srd_session *sess,
+		struct srd_gil *gil);
+
+/* decoder.c */
+SRD_PRIV int srd_decoder_import(struct srd_decoder *dec);
+SRD_PRIV int *srd_decoder_class_rows_new(const struct srd_decoder *dec,
+		int *num_rows);
+SRD_PRIV int srd_decoder_row_find(const struct srd_decoder *dec,
+		const char *row_id);
+
+/* index.c */
+SRD_PRIV char *srd_index_signature(const char *dir);
+SRD_PRIV struct srd_decoder *srd_index_lookup(const char *dir,
+		const char *signature);
+SRD_PRIV struct srd_decoder *srd_index_decoder_new(GVariant *meta);
+SRD_PRIV void srd_index_store(const char *dir, const char *signature,
+		const struct srd_decoder *d);
+SRD_PRIV void srd_index_save(void);
+SRD_PRIV void srd_index_free(void);
+
+/* bundle.c */
+SRD_PRIV const GPtrArray *srd_bundle_decoders(const char *path);
+SRD_PRIV GVariant *srd_bundle_decoder_get(const char *path,
+		const char *module_name);
+SRD_PRIV void srd_bundle_free_all(void);
 
 /* session.c */
+SRD_PRIV void srd_sessions_lock(void);
+SRD_PRIV void srd_sessions_unlock(void);
 SRD_PRIV int session_is_valid(struct srd_session *sess);
-SRD_PRIV struct srd_pd_callback *srd_pd_output_callback_find(struct srd_session *sess,
-		int output_type);
+SRD_PRIV void srd_pd_output_callback_run(const GSList *callbacks,
+		struct srd_proto_data *pdata);
+SRD_PRIV void srd_ann_batch_add(struct srd_session *sess,
+		const struct srd_proto_data *pdata,
+		const struct srd_proto_data_annotation *pda);
+SRD_PRIV void srd_ann_batch_flush(struct srd_session *sess);
+SRD_PRIV gboolean srd_session_ann_wanted(const struct srd_session *sess);
+SRD_PRIV void srd_session_thread_stop(struct srd_session *sess);
+SRD_PRIV void srd_session_trace(struct srd_session *sess, int type,
+		const struct srd_decoder_inst *di, int output_type,
+		int output_class, uint64_t start_sample, uint64_t end_sample);
 
 /* instance.c */
-SRD_PRIV struct srd_decoder_inst *srd_inst_find_by_obj( const GSList *stack,
-		const PyObject *obj);
 SRD_PRIV int srd_inst_start(struct srd_decoder_inst *di);
 SRD_PRIV int srd_inst_decode(const struct srd_decoder_inst *di,
 		uint64_t start_samplenum, uint64_t end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen);
+SRD_PRIV int srd_inst_resync_get(struct srd_decoder_inst *di,
+		uint8_t **mask, uint8_t **value, uint64_t *num_samples);
+SRD_PRIV void srd_inst_pins_cache_free(struct srd_decoder_inst *di);
+SRD_PRIV void srd_inst_channel_extract_build(struct srd_decoder_inst *di);
+SRD_PRIV uint8_t *srd_inst_sample_mask_new(const struct srd_decoder_inst *di);
 SRD_PRIV void srd_inst_free(struct srd_decoder_inst *di);
 SRD_PRIV void srd_inst_free_all(struct srd_session *sess, GSList *stack);
+SRD_PRIV gboolean srd_inst_class_wanted(const struct srd_class_filter *filter,
+		int output_class);
+SRD_PRIV struct srd_stats_owner srd_inst_stats_switch(struct srd_session *sess,
+		struct srd_decoder_inst *di, gboolean callback);
+SRD_PRIV struct srd_stats_owner srd_inst_decode_begin(
+		struct srd_decoder_inst *di, uint64_t start_samplenum,
+		uint64_t end_samplenum, gboolean samples);
+SRD_PRIV void srd_inst_decode_end(struct srd_decoder_inst *di,
+		uint64_t start_samplenum, uint64_t end_samplenum,
+		struct srd_stats_owner prev);
+
+/* worker.c */
+SRD_PRIV int srd_workers_start(struct srd_session *sess);
+SRD_PRIV void srd_workers_stop(struct srd_session *sess);
+SRD_PRIV int srd_workers_decode(struct srd_session *sess,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen);
+SRD_PRIV int srd_workers_decode_segmented(struct srd_session *sess,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen, unsigned int num_segments);
+
+/* interp.c */
+SRD_PRIV struct srd_interp *srd_interp_new(void);
+SRD_PRIV void srd_interp_free(struct srd_interp *interp);
+SRD_PRIV PyObject *srd_interp_class_get(struct srd_interp *interp,
+		const struct srd_decoder *dec, const char *module_name);
+
+/* summary.c */
+SRD_PRIV void srd_ann_summary_add(struct srd_session *sess,
+		const struct srd_proto_data *pdata,
+		const struct srd_proto_data_annotation *pda);
+SRD_PRIV void srd_ann_summary_inst_remove(struct srd_session *sess,
+		const struct srd_decoder_inst *di);
+
+/* store.c */
+SRD_PRIV void srd_ann_store_add(struct srd_session *sess,
+		const struct srd_proto_data *pdata,
+		const struct srd_proto_data_annotation *pda);
+SRD_PRIV void srd_ann_store_inst_remove(struct srd_session *sess,
+		const struct srd_decoder_inst *di);
 
 /* log.c */
 SRD_PRIV int srd_log(int loglevel, const char *format, ...);
@@ -75,6 +382,7 @@ SRD_PRIV int srd_err(const char *format, ...);
 
 /* module_sigrokdecode.c */
 PyMODINIT_FUNC PyInit_sigrokdecode(void);
+SRD_PRIV int srd_module_import(PyObject **mod, PyTypeObject **logic_type);
 
 /* util.c */
 SRD_PRIV int py_attr_as_str(const PyObject *py_obj, const char *attr,
@@ -83,6 +391,7 @@ SRD_PRIV int py_dictitem_as_str(const PyObject *py_obj, const char *key,
         char **outstr);
 SRD_PRIV int py_str_as_str(const PyObject *py_str, char **outstr);
 SRD_PRIV int py_strseq_to_char(const PyObject *py_strseq, char ***outstr);
+SRD_PRIV void srd_clock_get(uint64_t *wall_ns, uint64_t *cpu_ns);
 
 /* exception.c */
 SRD_PRIV void srd_exception_catch(const char *format, ...);
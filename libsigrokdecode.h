@@ -30,6 +30,8 @@ extern "C" {
 #endif
 
 struct srd_session;
+struct srd_channel_extract;
+struct srd_class_filter;
 
 /**
  * @file
@@ -72,6 +74,7 @@ enum srd_error_code {
 	SRD_ERR_BUG          = -4, /**< Errors hinting at internal bugs */
 	SRD_ERR_PYTHON       = -5, /**< Python C API error */
 	SRD_ERR_DECODERS_DIR = -6, /**< Protocol decoder path invalid */
+	SRD_ERR_QUEUE_FULL   = -7, /**< Session decode queue is full */
 
 	/*
 	 * Note: When adding entries here, don't forget to also update the
@@ -136,6 +139,98 @@ enum srd_configkey {
 	SRD_CONF_SAMPLERATE = 10000,
 };
 
+/** How the logic sample iterator passes samples to a decoder's decode(). */
+enum srd_sample_iteration {
+	/** Every sample in the chunk is passed on (default). */
+	SRD_SAMPLE_ITER_ALL = 10000,
+	/**
+	 * Only samples where at least one of the decoder's channels changed
+	 * are passed on, plus the first sample of each chunk.
+	 */
+	SRD_SAMPLE_ITER_CHANGES,
+};
+
+/** What srd_session_send() does when a session's decode queue is full. */
+enum srd_queue_backpressure {
+	/** Wait until the decode thread has made room. */
+	SRD_QUEUE_BLOCK = 10000,
+	/** Drop the oldest chunk waiting in the queue. */
+	SRD_QUEUE_DROP_OLDEST,
+	/** Don't queue the chunk, and return SRD_ERR_QUEUE_FULL. */
+	SRD_QUEUE_ERROR,
+};
+
+/** State of a session's decode queue, see srd_session_queue_status_get(). */
+struct srd_queue_status {
+	/** Number of chunks waiting to be decoded. */
+	unsigned int depth;
+	/** Maximum number of chunks in the queue. */
+	unsigned int max_depth;
+	/** Number of samples sent, but not yet decoded. */
+	uint64_t lag;
+	/** Number of chunks dropped with SRD_QUEUE_DROP_OLDEST. */
+	uint64_t num_dropped;
+};
+
+/**
+ * Decoding statistics of a decoder instance, see srd_session_stats_set().
+ *
+ * Times are exclusive: time spent in decode() doesn't include the time
+ * spent in stacked instances, or in frontend callbacks for the instance's
+ * output.
+ */
+struct srd_inst_stats {
+	/** Number of calls of the instance's decode(). */
+	uint64_t num_decode_calls;
+	/** Number of samples passed to decode(), if it gets sample data. */
+	uint64_t num_samples;
+	/** Number of put() calls, per output type (enum srd_output_type). */
+	uint64_t num_puts[SRD_OUTPUT_META + 1];
+	/** Wall clock time spent in decode(), in nanoseconds. */
+	uint64_t decode_wall_ns;
+	/** CPU time spent in decode(), in nanoseconds. 0 if not available. */
+	uint64_t decode_cpu_ns;
+	/** Wall clock time spent in frontend callbacks, in nanoseconds. */
+	uint64_t callback_wall_ns;
+};
+
+/** Kinds of trace events, see srd_session_trace_callback_set(). */
+enum srd_trace_event_type {
+	/** An instance's decode() is called. */
+	SRD_TRACE_DECODE_BEGIN = 10000,
+	/** An instance's decode() returned. */
+	SRD_TRACE_DECODE_END,
+	/** An instance called put(). */
+	SRD_TRACE_PUT,
+	/** Frontend callbacks for an instance's output are called. */
+	SRD_TRACE_CALLBACK_BEGIN,
+	/** Frontend callbacks for an instance's output returned. */
+	SRD_TRACE_CALLBACK_END,
+};
+
+/** A trace event, see srd_session_trace_callback_set(). */
+struct srd_trace_event {
+	/** The kind of event (enum srd_trace_event_type). */
+	int type;
+	/** Monotonic clock time of the event, in nanoseconds. */
+	uint64_t timestamp_ns;
+	/**
+	 * The decoder instance. NULL for callbacks delivering a batch of
+	 * annotations, see srd_pd_output_batch_callback_set().
+	 */
+	const struct srd_decoder_inst *di;
+	/** The output type of a put() or callbacks, -1 for decode(). */
+	int output_type;
+	/** The annotation or binary class of a put(), -1 otherwise. */
+	int output_class;
+	/**
+	 * The samples passed to decode(), or covered by the output of a
+	 * put() or callbacks. Both 0 for batch callbacks.
+	 */
+	uint64_t start_sample;
+	uint64_t end_sample;
+};
+
 struct srd_decoder {
 	/** The decoder ID. Must be non-NULL and unique for all decoders. */
 	char *id;
@@ -182,11 +277,23 @@ struct srd_decoder {
 	/** List of decoder options. */
 	GSList *options;
 
-	/** Python module. */
+	/**
+	 * Python module. NULL if the decoder was loaded from the decoder
+	 * index, and no instance of it was created yet.
+	 */
 	void *py_mod;
 
 	/** sigrokdecode.Decoder class. */
 	void *py_dec;
+
+	/**
+	 * Which samples the decoder wants to see, one of the
+	 * SRD_SAMPLE_ITER_* values from enum srd_sample_iteration.
+	 */
+	int sample_iteration;
+
+	/** Name of the Python module, e.g. "i2c". */
+	char *module_name;
 };
 
 /**
@@ -228,6 +335,28 @@ struct srd_decoder_inst {
 	int data_unitsize;
 	uint8_t *channel_samples;
 	GSList *next_di;
+
+	/**
+	 * Cache of 'pins' objects handed to the decoder, indexed by the
+	 * values of its channels (one bit per channel). NULL if not used.
+	 */
+	void **pins_cache;
+
+	/**
+	 * Precomputed plan for extracting this instance's channels from a
+	 * sample, built whenever the channel map changes.
+	 */
+	struct srd_channel_extract *channel_extract;
+
+	/**
+	 * Annotation and binary classes the frontend subscribed to, NULL
+	 * for all of them.
+	 */
+	struct srd_class_filter *ann_filter;
+	struct srd_class_filter *bin_filter;
+
+	/** Only accumulated while the session's statistics are enabled. */
+	struct srd_inst_stats stats;
 };
 
 struct srd_pd_output {
@@ -249,23 +378,71 @@ struct srd_proto_data {
 };
 struct srd_proto_data_annotation {
 	int ann_class;
+	/**
+	 * NULL-terminated array of the annotation's texts, NULL if they're
+	 * only converted on request, see srd_session_ann_text_lazy_set().
+	 * Use srd_ann_text_get() to get them either way.
+	 */
 	char **ann_text;
+	/** The PD's sequence of texts, if not converted. Private. */
+	void *py_texts;
 };
 struct srd_proto_data_binary {
 	int bin_class;
 	uint64_t size;
+	/**
+	 * The data, straight out of the PD's buffer object. Only valid for
+	 * the duration of the callback.
+	 */
 	const unsigned char *data;
 };
 
+/** Annotations in a bucket of samples, see srd_ann_summary_get(). */
+struct srd_ann_summary {
+	/** The bucket's samples, up to the one before end_sample. */
+	uint64_t start_sample;
+	uint64_t end_sample;
+	/** Number of annotations starting in the bucket. */
+	uint64_t num_annotations;
+	/** First text of the first and the last of these annotations. */
+	char *first_text;
+	char *last_text;
+	/** Number of these annotations per annotation class. */
+	uint64_t *class_counts;
+	int num_classes;
+};
+
+/** A stored annotation, see srd_ann_store_find(). */
+struct srd_ann_record {
+	uint64_t start_sample;
+	uint64_t end_sample;
+	int ann_class;
+	/** Number of texts. */
+	unsigned int num_texts;
+	/** The texts, one after the other, each NUL-terminated. */
+	const char *texts;
+};
+
 typedef void (*srd_pd_output_callback)(struct srd_proto_data *pdata,
 					void *cb_data);
 
+typedef void (*srd_trace_callback)(const struct srd_trace_event *event,
+					void *cb_data);
+
 struct srd_pd_callback {
 	int output_type;
 	srd_pd_output_callback cb;
 	void *cb_data;
 };
 
+/**
+ * Callback receiving a batch of annotations. pdata is an array of count
+ * items, whose data fields point to struct srd_proto_data_annotation.
+ * All of it is only valid for the duration of the callback.
+ */
+typedef void (*srd_pd_output_batch_callback)(struct srd_proto_data *pdata,
+					unsigned int count, void *cb_data);
+
 /* srd.c */
 SRD_API int srd_init(const char *path);
 SRD_API int srd_exit(void);
@@ -278,9 +455,35 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 SRD_API int srd_session_send(struct srd_session *sess,
 		uint64_t start_samplenum, uint64_t end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen);
+SRD_API int srd_session_send_segmented(struct srd_session *sess,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen, unsigned int num_segments);
 SRD_API int srd_session_destroy(struct srd_session *sess);
 SRD_API int srd_pd_output_callback_add(struct srd_session *sess,
 		int output_type, srd_pd_output_callback cb, void *cb_data);
+SRD_API int srd_pd_output_batch_callback_set(struct srd_session *sess,
+		srd_pd_output_batch_callback cb, void *cb_data,
+		unsigned int max_count);
+SRD_API int srd_session_queue_set(struct srd_session *sess,
+		unsigned int max_chunks, int backpressure);
+SRD_API int srd_session_interpreter_set(struct srd_session *sess,
+		gboolean own);
+SRD_API int srd_session_workers_set(struct srd_session *sess,
+		gboolean use_workers);
+SRD_API int srd_session_queue_drain(struct srd_session *sess);
+SRD_API int srd_session_queue_status_get(struct srd_session *sess,
+		struct srd_queue_status *status);
+SRD_API int srd_session_stats_set(struct srd_session *sess,
+		gboolean enable);
+SRD_API int srd_session_trace_callback_set(struct srd_session *sess,
+		srd_trace_callback cb, void *cb_data);
+SRD_API int srd_session_ann_text_lazy_set(struct srd_session *sess,
+		gboolean lazy);
+SRD_API unsigned int srd_ann_text_count(
+		const struct srd_proto_data_annotation *pda);
+SRD_API const char *srd_ann_text_get(
+		const struct srd_proto_data_annotation *pda, unsigned int idx);
+SRD_API char **srd_ann_text_dup(const struct srd_proto_data_annotation *pda);
 
 /* decoder.c */
 SRD_API const GSList *srd_decoder_list(void);
@@ -302,6 +505,27 @@ SRD_API int srd_inst_stack(struct srd_session *sess,
 		struct srd_decoder_inst *di_from, struct srd_decoder_inst *di_to);
 SRD_API struct srd_decoder_inst *srd_inst_find_by_id(struct srd_session *sess,
 		const char *inst_id);
+SRD_API int srd_inst_ann_classes_set(struct srd_decoder_inst *di,
+		const GSList *ann_classes, const GSList *ann_rows);
+SRD_API int srd_inst_binary_classes_set(struct srd_decoder_inst *di,
+		const GSList *bin_classes);
+SRD_API int srd_inst_stats_get(const struct srd_decoder_inst *di,
+		struct srd_inst_stats *stats);
+SRD_API int srd_inst_stats_reset(struct srd_decoder_inst *di);
+
+/* summary.c */
+SRD_API int srd_session_ann_summary_set(struct srd_session *sess,
+		uint64_t bucket_samples, unsigned int num_levels);
+SRD_API int srd_ann_summary_get(const struct srd_decoder_inst *di,
+		const char *row_id, unsigned int level, uint64_t start_sample,
+		uint64_t end_sample, GArray **summaries);
+
+/* store.c */
+SRD_API int srd_session_ann_store_set(struct srd_session *sess,
+		gboolean enable);
+SRD_API int srd_ann_store_find(const struct srd_decoder_inst *di,
+		const char *row_id, uint64_t start_sample, uint64_t end_sample,
+		int ann_class, const char *text, GArray **records);
 
 /* log.c */
 typedef int (*srd_log_callback)(void *cb_data, int loglevel,
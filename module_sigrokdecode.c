@@ -24,65 +24,127 @@
 /** @cond PRIVATE */
 
 /* type_decoder.c */
-extern SRD_PRIV PyTypeObject srd_Decoder_type;
+extern SRD_PRIV PyObject *srd_Decoder_type_new(void);
 
 /* type_logic.c */
-extern SRD_PRIV PyTypeObject srd_logic_type;
+extern SRD_PRIV PyObject *srd_logic_type_new(void);
 
 /*
- * When initialized, a reference to this module inside the Python interpreter
- * lives here.
+ * When initialized, a reference to this module inside the (main) Python
+ * interpreter lives here, along with its srd_logic type.
  */
 SRD_PRIV PyObject *mod_sigrokdecode = NULL;
+SRD_PRIV PyTypeObject *srd_logic_type = NULL;
 
 /** @endcond */
 
+/*
+ * The types are created along with the module, so that every Python
+ * interpreter importing it gets types of its own.
+ */
+static int sigrokdecode_exec(PyObject *mod)
+{
+	PyObject *py_type;
+
+	if (!(py_type = srd_Decoder_type_new()))
+		return -1;
+	if (PyModule_AddObject(mod, "Decoder", py_type) == -1) {
+		Py_DECREF(py_type);
+		return -1;
+	}
+	if (!(py_type = srd_logic_type_new()))
+		return -1;
+	if (PyModule_AddObject(mod, "srd_logic", py_type) == -1) {
+		Py_DECREF(py_type);
+		return -1;
+	}
+
+	/* Expose output types as symbols in the sigrokdecode module */
+	if (PyModule_AddIntConstant(mod, "OUTPUT_ANN", SRD_OUTPUT_ANN) == -1)
+		return -1;
+	if (PyModule_AddIntConstant(mod, "OUTPUT_PYTHON", SRD_OUTPUT_PYTHON) == -1)
+		return -1;
+	if (PyModule_AddIntConstant(mod, "OUTPUT_BINARY", SRD_OUTPUT_BINARY) == -1)
+		return -1;
+	if (PyModule_AddIntConstant(mod, "OUTPUT_META", SRD_OUTPUT_META) == -1)
+		return -1;
+	/* Expose meta input symbols. */
+	if (PyModule_AddIntConstant(mod, "SRD_CONF_SAMPLERATE", SRD_CONF_SAMPLERATE) == -1)
+		return -1;
+
+	return 0;
+}
+
+#if PY_VERSION_HEX >= 0x03050000
+static PyModuleDef_Slot sigrokdecode_slots[] = {
+	{Py_mod_exec, sigrokdecode_exec},
+#ifdef Py_mod_multiple_interpreters
+	{Py_mod_multiple_interpreters, Py_MOD_PER_INTERPRETER_GIL_SUPPORTED},
+#endif
+	{0, NULL}
+};
+#endif
+
 static struct PyModuleDef sigrokdecode_module = {
 	PyModuleDef_HEAD_INIT,
 	.m_name = "sigrokdecode",
 	.m_doc = "sigrokdecode module",
+#if PY_VERSION_HEX >= 0x03050000
+	.m_size = 0,
+	.m_slots = sigrokdecode_slots,
+#else
 	.m_size = -1,
+#endif
 };
 
 /** @cond PRIVATE */
 PyMODINIT_FUNC PyInit_sigrokdecode(void)
 {
+#if PY_VERSION_HEX >= 0x03050000
+	/* Multi-phase initialization, so sub-interpreters can import it. */
+	return PyModuleDef_Init(&sigrokdecode_module);
+#else
 	PyObject *mod;
 
-	/* tp_new needs to be assigned here for compiler portability. */
-	srd_Decoder_type.tp_new = PyType_GenericNew;
-	if (PyType_Ready(&srd_Decoder_type) < 0)
+	if (!(mod = PyModule_Create(&sigrokdecode_module)))
 		return NULL;
-
-	srd_logic_type.tp_new = PyType_GenericNew;
-	if (PyType_Ready(&srd_logic_type) < 0)
+	if (sigrokdecode_exec(mod) == -1) {
+		Py_DECREF(mod);
 		return NULL;
+	}
 
-	mod = PyModule_Create(&sigrokdecode_module);
-	Py_INCREF(&srd_Decoder_type);
-	if (PyModule_AddObject(mod, "Decoder",
-	    (PyObject *)&srd_Decoder_type) == -1)
-		return NULL;
-	Py_INCREF(&srd_logic_type);
-	if (PyModule_AddObject(mod, "srd_logic",
-	    (PyObject *)&srd_logic_type) == -1)
-		return NULL;
+	return mod;
+#endif
+}
+/** @endcond */
 
-	/* Expose output types as symbols in the sigrokdecode module */
-	if (PyModule_AddIntConstant(mod, "OUTPUT_ANN", SRD_OUTPUT_ANN) == -1)
-		return NULL;
-	if (PyModule_AddIntConstant(mod, "OUTPUT_PYTHON", SRD_OUTPUT_PYTHON) == -1)
-		return NULL;
-	if (PyModule_AddIntConstant(mod, "OUTPUT_BINARY", SRD_OUTPUT_BINARY) == -1)
-		return NULL;
-	if (PyModule_AddIntConstant(mod, "OUTPUT_META", SRD_OUTPUT_META) == -1)
-		return NULL;
-	/* Expose meta input symbols. */
-	if (PyModule_AddIntConstant(mod, "SRD_CONF_SAMPLERATE", SRD_CONF_SAMPLERATE) == -1)
-		return NULL;
+/**
+ * Import the sigrokdecode module into the current Python interpreter.
+ *
+ * @param mod Will hold a new reference to the module.
+ * @param logic_type Will hold a new reference to its srd_logic type.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_module_import(PyObject **mod, PyTypeObject **logic_type)
+{
+	PyObject *py_mod, *py_type;
 
-	mod_sigrokdecode = mod;
+	if (!(py_mod = PyImport_ImportModule("sigrokdecode"))) {
+		srd_exception_catch("Failed to import the sigrokdecode module: ");
+		return SRD_ERR_PYTHON;
+	}
 
-	return mod;
+	if (!(py_type = PyObject_GetAttrString(py_mod, "srd_logic"))) {
+		srd_exception_catch("Failed to get the srd_logic type: ");
+		Py_DECREF(py_mod);
+		return SRD_ERR_PYTHON;
+	}
+
+	*mod = py_mod;
+	*logic_type = (PyTypeObject *)py_type;
+
+	return SRD_OK;
 }
-/** @endcond */
@@ -22,6 +22,7 @@
 #include "libsigrokdecode.h"
 #include "config.h"
 #include <inttypes.h>
+#include <string.h>
 #include <glib.h>
 
 /**
@@ -43,8 +44,32 @@
 SRD_PRIV GSList *sessions = NULL;
 SRD_PRIV int max_session_id = -1;
 
+/*
+ * Sessions may be created and destroyed by several threads at once, so
+ * the list of sessions and max_session_id are protected by a lock.
+ */
+G_LOCK_DEFINE_STATIC(sessions);
+
 /** @endcond */
 
+/**
+ * Lock the list of all sessions (and max_session_id), for walking it.
+ * srd_session_new() and srd_session_destroy() must not be called while
+ * it is locked.
+ *
+ * @private
+ */
+SRD_PRIV void srd_sessions_lock(void)
+{
+	G_LOCK(sessions);
+}
+
+/** @private */
+SRD_PRIV void srd_sessions_unlock(void)
+{
+	G_UNLOCK(sessions);
+}
+
 /** @private */
 SRD_PRIV int session_is_valid(struct srd_session *sess)
 {
@@ -76,18 +101,222 @@ SRD_API int srd_session_new(struct srd_session **sess)
 		return SRD_ERR_ARG;
 	}
 
-	*sess = g_malloc(sizeof(struct srd_session));
-	(*sess)->session_id = ++max_session_id;
-	(*sess)->di_list = (*sess)->callbacks = NULL;
+	*sess = g_malloc0(sizeof(struct srd_session));
 
 	/* Keep a list of all sessions, so we can clean up as needed. */
+	G_LOCK(sessions);
+	(*sess)->session_id = ++max_session_id;
 	sessions = g_slist_append(sessions, *sess);
+	G_UNLOCK(sessions);
 
 	srd_dbg("Created session %d.", (*sess)->session_id);
 
 	return SRD_OK;
 }
 
+static int session_decode(struct srd_session *sess,
+		uint64_t start_samplenum, uint64_t end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen)
+{
+	struct srd_gil gil;
+	GSList *d;
+	int ret;
+
+	if (sess->workers) {
+		ret = srd_workers_decode(sess, start_samplenum, inbuf, inbuflen);
+		srd_ann_batch_flush(sess);
+		return ret;
+	}
+
+	srd_session_gil_ensure(sess, &gil);
+
+	ret = SRD_OK;
+	for (d = sess->di_list; d; d = d->next) {
+		if ((ret = srd_inst_decode(d->data, start_samplenum,
+				end_samplenum, inbuf, inbuflen)) != SRD_OK)
+			break;
+	}
+
+	/* Deliver the annotations collected while decoding this chunk. */
+	srd_ann_batch_flush(sess);
+
+	srd_session_gil_release(sess, &gil);
+
+	return ret;
+}
+
+static void chunk_free(struct srd_chunk *chunk)
+{
+	g_free(chunk->buf);
+	g_free(chunk);
+}
+
+/* Decode the chunks queued up by srd_session_send(), in order. */
+static gpointer session_thread(gpointer data)
+{
+	struct srd_session *sess;
+	struct srd_session_queue *queue;
+	struct srd_chunk *chunk;
+	int ret;
+
+	sess = data;
+	queue = sess->queue;
+
+	g_mutex_lock(&queue->mutex);
+	while (TRUE) {
+		while (!queue->stop && g_queue_is_empty(&queue->chunks))
+			g_cond_wait(&queue->cond, &queue->mutex);
+		if (queue->stop)
+			break;
+		chunk = g_queue_pop_head(&queue->chunks);
+		queue->busy = TRUE;
+		g_cond_broadcast(&queue->cond);
+		g_mutex_unlock(&queue->mutex);
+
+		ret = session_decode(sess, chunk->start_samplenum,
+				chunk->end_samplenum, chunk->buf, chunk->len);
+
+		g_mutex_lock(&queue->mutex);
+		queue->busy = FALSE;
+		queue->lag -= chunk->end_samplenum - chunk->start_samplenum;
+		if (ret != SRD_OK && queue->error == SRD_OK)
+			queue->error = ret;
+		g_cond_broadcast(&queue->cond);
+		chunk_free(chunk);
+	}
+	g_mutex_unlock(&queue->mutex);
+
+	return NULL;
+}
+
+static int session_thread_start(struct srd_session *sess)
+{
+	struct srd_session_queue *queue;
+	GError *error;
+	char *name;
+
+	queue = sess->queue;
+	if (queue->thread)
+		return SRD_OK;
+
+	srd_dbg("Starting decode thread for session %d.", sess->session_id);
+
+	queue->stop = FALSE;
+	error = NULL;
+	name = g_strdup_printf("srd-session-%d", sess->session_id);
+	queue->thread = g_thread_try_new(name, session_thread, sess, &error);
+	g_free(name);
+	if (!queue->thread) {
+		srd_err("Failed to start decode thread: %s.", error->message);
+		g_error_free(error);
+		return SRD_ERR;
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Stop a session's decode thread, if it's running.
+ *
+ * The chunk being decoded is finished, any others in the queue are
+ * dropped. Must be called with the session's GIL held, see
+ * srd_session_gil_ensure().
+ *
+ * @private
+ */
+SRD_PRIV void srd_session_thread_stop(struct srd_session *sess)
+{
+	struct srd_session_queue *queue;
+	struct srd_chunk *chunk;
+
+	if (!(queue = sess->queue) || !queue->thread)
+		return;
+
+	srd_dbg("Stopping decode thread for session %d.", sess->session_id);
+
+	g_mutex_lock(&queue->mutex);
+	queue->stop = TRUE;
+	g_cond_broadcast(&queue->cond);
+	g_mutex_unlock(&queue->mutex);
+
+	/* The thread needs the GIL to finish its current chunk. */
+	Py_BEGIN_ALLOW_THREADS
+	g_thread_join(queue->thread);
+	Py_END_ALLOW_THREADS
+	queue->thread = NULL;
+
+	while ((chunk = g_queue_pop_head(&queue->chunks)))
+		chunk_free(chunk);
+	queue->lag = 0;
+}
+
+static void session_queue_free(struct srd_session *sess)
+{
+	struct srd_session_queue *queue;
+
+	if (!(queue = sess->queue))
+		return;
+
+	g_mutex_clear(&queue->mutex);
+	g_cond_clear(&queue->cond);
+	g_free(queue);
+	sess->queue = NULL;
+}
+
+static int session_queue_push(struct srd_session *sess,
+		uint64_t start_samplenum, uint64_t end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen)
+{
+	struct srd_session_queue *queue;
+	struct srd_chunk *chunk, *old_chunk;
+	int ret;
+
+	/* The frontend's buffer is only valid for the duration of the call. */
+	chunk = g_malloc(sizeof(struct srd_chunk));
+	chunk->start_samplenum = start_samplenum;
+	chunk->end_samplenum = end_samplenum;
+	chunk->buf = g_malloc(inbuflen);
+	memcpy(chunk->buf, inbuf, inbuflen);
+	chunk->len = inbuflen;
+
+	queue = sess->queue;
+	g_mutex_lock(&queue->mutex);
+
+	/* Report errors from the decode thread once. */
+	if ((ret = queue->error) != SRD_OK) {
+		queue->error = SRD_OK;
+		g_mutex_unlock(&queue->mutex);
+		chunk_free(chunk);
+		return ret;
+	}
+
+	while (g_queue_get_length(&queue->chunks) >= queue->max_chunks) {
+		if (queue->backpressure == SRD_QUEUE_BLOCK) {
+			g_cond_wait(&queue->cond, &queue->mutex);
+		} else if (queue->backpressure == SRD_QUEUE_DROP_OLDEST) {
+			old_chunk = g_queue_pop_head(&queue->chunks);
+			queue->lag -= old_chunk->end_samplenum
+					- old_chunk->start_samplenum;
+			queue->num_dropped++;
+			srd_dbg("Decode queue full, dropped samples %" PRIu64
+				" to %" PRIu64 ".", old_chunk->start_samplenum,
+				old_chunk->end_samplenum);
+			chunk_free(old_chunk);
+		} else {
+			g_mutex_unlock(&queue->mutex);
+			chunk_free(chunk);
+			return SRD_ERR_QUEUE_FULL;
+		}
+	}
+
+	g_queue_push_tail(&queue->chunks, chunk);
+	queue->lag += end_samplenum - start_samplenum;
+	g_cond_broadcast(&queue->cond);
+	g_mutex_unlock(&queue->mutex);
+
+	return SRD_OK;
+}
+
 /**
  * Start a decoding session.
  *
@@ -102,6 +331,7 @@ SRD_API int srd_session_new(struct srd_session **sess)
  */
 SRD_API int srd_session_start(struct srd_session *sess)
 {
+	struct srd_gil gil;
 	GSList *d;
 	struct srd_decoder_inst *di;
 	int ret;
@@ -115,11 +345,19 @@ SRD_API int srd_session_start(struct srd_session *sess)
 
 	/* Run the start() method on all decoders receiving frontend data. */
 	ret = SRD_OK;
+	srd_session_gil_ensure(sess, &gil);
 	for (d = sess->di_list; d; d = d->next) {
 		di = d->data;
 		if ((ret = srd_inst_start(di)) != SRD_OK)
 			break;
 	}
+	/* The workers inherit the instances in their started state. */
+	if (ret == SRD_OK && sess->use_workers)
+		ret = srd_workers_start(sess);
+	srd_session_gil_release(sess, &gil);
+
+	if (ret == SRD_OK && sess->queue)
+		ret = session_thread_start(sess);
 
 	return ret;
 }
@@ -161,6 +399,7 @@ static int srd_inst_send_meta(struct srd_decoder_inst *di, int key,
 SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 		GVariant *data)
 {
+	struct srd_gil gil;
 	GSList *l;
 	int ret;
 
@@ -185,6 +424,12 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 		srd_err("Unknown config key %d.", key);
 		return SRD_ERR_ARG;
 	}
+	if (sess->workers) {
+		srd_err("Cannot change metadata of a session decoding in "
+				"worker processes.");
+		return SRD_ERR;
+	}
+
 	if (!g_variant_is_of_type(data, G_VARIANT_TYPE_UINT64)) {
 		srd_err("Invalid value type: expected uint64, got %s",
 				g_variant_get_type_string(data));
@@ -195,10 +440,12 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 			sess->session_id, g_variant_get_uint64(data));
 
 	ret = SRD_OK;
+	srd_session_gil_ensure(sess, &gil);
 	for (l = sess->di_list; l; l = l->next) {
 		if ((ret = srd_inst_send_meta(l->data, key, data)) != SRD_OK)
 			break;
 	}
+	srd_session_gil_release(sess, &gil);
 
 	g_variant_unref(data);
 
@@ -219,10 +466,18 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
  * @param sess The session to use.
  * @param start_samplenum The sample number of the first sample in this chunk.
  * @param end_samplenum The sample number of the last sample in this chunk.
+ * If the session decodes in a thread of its own (see
+ * srd_session_queue_set()), a copy of the sample data is queued up for
+ * that thread instead, and this returns right away. An error which
+ * occurred while decoding earlier chunks is returned here, or by
+ * srd_session_queue_drain(), whichever comes first.
+ *
  * @param inbuf Pointer to sample data.
  * @param inbuflen Length in bytes of the buffer.
  *
  * @return SRD_OK upon success, a (negative) error code otherwise.
+ *         SRD_ERR_QUEUE_FULL is returned if the session's decode queue
+ *         is full, and it was set up with SRD_QUEUE_ERROR.
  *
  * @since 0.3.0
  */
@@ -230,31 +485,98 @@ SRD_API int srd_session_send(struct srd_session *sess,
 		uint64_t start_samplenum, uint64_t end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen)
 {
-	GSList *d;
-	int ret;
-
 	if (session_is_valid(sess) != SRD_OK) {
 		srd_err("Invalid session.");
 		return SRD_ERR_ARG;
 	}
 
+	if (sess->queue && sess->queue->thread)
+		return session_queue_push(sess, start_samplenum,
+				end_samplenum, inbuf, inbuflen);
+
 	srd_dbg("Calling decode() on all instances with starting sample "
 			"number %" PRIu64 ", %" PRIu64 " bytes at 0x%p",
 			start_samplenum, inbuflen, inbuf);
 
-	for (d = sess->di_list; d; d = d->next) {
-		if ((ret = srd_inst_decode(d->data, start_samplenum,
-				end_samplenum, inbuf, inbuflen)) != SRD_OK)
-			return ret;
+	return session_decode(sess, start_samplenum, end_samplenum,
+			inbuf, inbuflen);
+}
+
+/**
+ * Decode a whole capture in segments, in parallel.
+ *
+ * The sample data is split into up to num_segments segments for every
+ * instance receiving it, and every segment is decoded in a worker process
+ * of its own. Segments start at points where the decoder can pick up
+ * decoding from scratch, as described by the resync() method of its
+ * Decoder class, which returns a (pattern, num_samples) tuple: the
+ * channels which are not None in pattern must have had the given
+ * values for num_samples samples. Decoders without a resync() method
+ * are decoded in one piece.
+ *
+ * Decoding in a segment starts with the samples matching the pattern, and
+ * output starting before the resync point, or where the next segment
+ * takes over, is dropped. The output is passed to the session's
+ * callbacks in sample order, after all segments have been decoded.
+ *
+ * This requires fork(), and all instances of the session must use the
+ * same unit size. It cannot be combined with a decode thread, workers or
+ * a sub-interpreter of the session's own, and fails while any other
+ * session decodes in a thread of its own, see srd_session_workers_set().
+ * The session's instances are not passed the sample data, so further
+ * chunks should not be sent.
+ *
+ * @param sess The session to use.
+ * @param start_samplenum The sample number of the first sample.
+ * @param inbuf Pointer to sample data of the whole capture.
+ * @param inbuflen Length in bytes of the buffer.
+ * @param num_segments The maximum number of segments, usually the number
+ *                     of CPU cores to use. Must be at least 1.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_send_segmented(struct srd_session *sess,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen, unsigned int num_segments)
+{
+	int ret;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
 	}
 
-	return SRD_OK;
+	if (!inbuf || !inbuflen || num_segments < 1) {
+		srd_err("Invalid sample data or number of segments.");
+		return SRD_ERR_ARG;
+	}
+
+	if ((sess->queue && sess->queue->thread) || sess->use_workers
+			|| sess->interp) {
+		srd_err("Segmented decoding can't be combined with a decode "
+			"thread, workers or a sub-interpreter.");
+		return SRD_ERR_ARG;
+	}
+
+	srd_dbg("Decoding %" PRIu64 " bytes at 0x%p in up to %u segments.",
+			inbuflen, inbuf, num_segments);
+
+	ret = srd_workers_decode_segmented(sess, start_samplenum, inbuf,
+			inbuflen, num_segments);
+	srd_ann_batch_flush(sess);
+
+	return ret;
 }
 
 /**
  * Destroy a decoding session.
  *
  * All decoder instances and output callbacks are properly released.
+ * If the session decodes in a thread of its own, chunks which have not
+ * been decoded yet are dropped; use srd_session_queue_drain() first to
+ * avoid that.
  *
  * @param sess The session to be destroyed.
  *
@@ -264,7 +586,8 @@ SRD_API int srd_session_send(struct srd_session *sess,
  */
 SRD_API int srd_session_destroy(struct srd_session *sess)
 {
-	int session_id;
+	struct srd_gil gil;
+	int session_id, i;
 
 	if (!sess) {
 		srd_err("Invalid session.");
@@ -272,11 +595,24 @@ SRD_API int srd_session_destroy(struct srd_session *sess)
 	}
 
 	session_id = sess->session_id;
+	srd_session_gil_ensure(sess, &gil);
+	srd_session_thread_stop(sess);
+	srd_workers_stop(sess);
+	/* Still refers to the instances, and maybe to Python objects. */
+	srd_pd_output_batch_callback_set(sess, NULL, NULL, 0);
 	if (sess->di_list)
 		srd_inst_free_all(sess, NULL);
-	if (sess->callbacks)
-		g_slist_free_full(sess->callbacks, g_free);
+	srd_session_gil_release(sess, &gil);
+	srd_session_ann_summary_set(sess, 0, 0);
+	srd_session_ann_store_set(sess, FALSE);
+	if (sess->interp)
+		srd_interp_free(sess->interp);
+	session_queue_free(sess);
+	for (i = 0; i < SRD_NUM_OUTPUT_TYPES; i++)
+		g_slist_free_full(sess->callbacks[i], g_free);
+	G_LOCK(sessions);
 	sessions = g_slist_remove(sessions, sess);
+	G_UNLOCK(sessions);
 	g_free(sess);
 
 	srd_dbg("Destroyed session %d.", session_id);
@@ -291,12 +627,17 @@ SRD_API int srd_session_destroy(struct srd_session *sess)
  * to the PD controller (except for Python objects, which only go up the
  * stack).
  *
+ * Multiple callbacks can be registered for the same output type, e.g. to
+ * both display and record annotations. They are called in the order in
+ * which they were added.
+ *
  * @param sess The output session in which to register the callback.
- * @param output_type The output type this callback will receive. Only one
- *                    callback per output type can be registered.
+ * @param output_type The output type this callback will receive.
  * @param cb The function to call. Must not be NULL.
  * @param cb_data Private data for the callback function. Can be NULL.
  *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
  * @since 0.3.0
  */
 SRD_API int srd_pd_output_callback_add(struct srd_session *sess,
@@ -309,39 +650,769 @@ SRD_API int srd_pd_output_callback_add(struct srd_session *sess,
 		return SRD_ERR_ARG;
 	}
 
+	if (output_type < 0 || output_type >= SRD_NUM_OUTPUT_TYPES) {
+		srd_err("Invalid output type %d.", output_type);
+		return SRD_ERR_ARG;
+	}
+
+	if (!cb) {
+		srd_err("Invalid callback.");
+		return SRD_ERR_ARG;
+	}
+
 	srd_dbg("Registering new callback for output type %d.", output_type);
 
 	pd_cb = g_malloc(sizeof(struct srd_pd_callback));
 	pd_cb->output_type = output_type;
 	pd_cb->cb = cb;
 	pd_cb->cb_data = cb_data;
-	sess->callbacks = g_slist_append(sess->callbacks, pd_cb);
+	sess->callbacks[output_type] =
+			g_slist_append(sess->callbacks[output_type], pd_cb);
 
 	return SRD_OK;
 }
 
-/** @private */
-SRD_PRIV struct srd_pd_callback *srd_pd_output_callback_find(
-		struct srd_session *sess, int output_type)
+/*
+ * Account for frontend callbacks, while statistics or tracing are enabled.
+ * The time is charged to the instance whose output they get, if any.
+ */
+static struct srd_stats_owner callbacks_begin(struct srd_session *sess,
+		struct srd_decoder_inst *di, int output_type,
+		uint64_t start_sample, uint64_t end_sample)
 {
-	GSList *l;
-	struct srd_pd_callback *tmp, *pd_cb;
+	struct srd_stats_owner prev;
+
+	prev = sess->stats_owner;
+	if (sess->stats)
+		prev = srd_inst_stats_switch(sess, di, TRUE);
+	if (sess->trace_cb)
+		srd_session_trace(sess, SRD_TRACE_CALLBACK_BEGIN, di,
+				output_type, -1, start_sample, end_sample);
+
+	return prev;
+}
+
+static void callbacks_end(struct srd_session *sess,
+		struct srd_decoder_inst *di, int output_type,
+		uint64_t start_sample, uint64_t end_sample,
+		struct srd_stats_owner prev)
+{
+	if (sess->trace_cb)
+		srd_session_trace(sess, SRD_TRACE_CALLBACK_END, di,
+				output_type, -1, start_sample, end_sample);
+	if (sess->stats)
+		srd_inst_stats_switch(sess, prev.di, prev.callback);
+}
+
+/**
+ * Pass decoder output to a list of frontend callbacks.
+ *
+ * @param callbacks The callbacks registered for the output type of pdata,
+ *                  i.e. sess->callbacks[output_type]. May be NULL.
+ * @param pdata The decoder output.
+ *
+ * @private
+ */
+SRD_PRIV void srd_pd_output_callback_run(const GSList *callbacks,
+		struct srd_proto_data *pdata)
+{
+	const GSList *l;
+	struct srd_pd_callback *pd_cb;
+	struct srd_session *sess;
+	struct srd_stats_owner stats_prev;
+
+	if (!callbacks)
+		return;
+
+	sess = pdata->pdo->di->sess;
+	if (sess->instrumented)
+		stats_prev = callbacks_begin(sess, pdata->pdo->di,
+				pdata->pdo->output_type, pdata->start_sample,
+				pdata->end_sample);
+
+	for (l = callbacks; l; l = l->next) {
+		pd_cb = l->data;
+		pd_cb->cb(pdata, pd_cb->cb_data);
+	}
+
+	if (sess->instrumented)
+		callbacks_end(sess, pdata->pdo->di, pdata->pdo->output_type,
+				pdata->start_sample, pdata->end_sample,
+				stats_prev);
+}
+
+/**
+ * Check whether anything takes annotations from a session's instances.
+ *
+ * @param sess The session.
+ *
+ * @return TRUE if there are annotation callbacks, a batch callback,
+ *         annotation summaries or an annotation store.
+ *
+ * @private
+ */
+SRD_PRIV gboolean srd_session_ann_wanted(const struct srd_session *sess)
+{
+	return sess->callbacks[SRD_OUTPUT_ANN] || sess->ann_batch
+			|| sess->ann_summaries || sess->ann_store;
+}
+
+static void ann_batch_clear(struct srd_ann_batch *batch)
+{
+	struct srd_proto_data_annotation *pda;
+	unsigned int i;
+
+	for (i = 0; i < batch->pda->len; i++) {
+		pda = &g_array_index(batch->pda,
+				struct srd_proto_data_annotation, i);
+		g_strfreev(pda->ann_text);
+		Py_XDECREF((PyObject *)pda->py_texts);
+	}
+	g_array_set_size(batch->pdata, 0);
+	g_array_set_size(batch->pda, 0);
+}
+
+/**
+ * Set up batched delivery of annotations.
+ *
+ * Instead of calling the SRD_OUTPUT_ANN callbacks once for every annotation
+ * a decoder puts out, the session collects annotations and passes them to
+ * the batch callback in one go. This happens once per srd_session_send()
+ * call, or earlier whenever max_count annotations have been collected.
+ * Callbacks registered with srd_pd_output_callback_add() still receive
+ * every annotation as well.
+ *
+ * The annotations passed to the batch callback are owned by the session,
+ * and only valid for the duration of the callback.
+ *
+ * Must not be called while the session is decoding.
+ *
+ * @param sess The session in which to set up the batch callback.
+ * @param cb The function to call with a batch of annotations, or NULL
+ *           to disable batched delivery.
+ * @param cb_data Private data for the callback function. Can be NULL.
+ * @param max_count Maximum number of annotations per batch, or 0 for
+ *                  a reasonable default.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_pd_output_batch_callback_set(struct srd_session *sess,
+		srd_pd_output_batch_callback cb, void *cb_data,
+		unsigned int max_count)
+{
+	struct srd_ann_batch *batch;
+	struct srd_gil gil;
 
 	if (session_is_valid(sess) != SRD_OK) {
 		srd_err("Invalid session.");
-		return NULL;
+		return SRD_ERR_ARG;
 	}
 
-	pd_cb = NULL;
-	for (l = sess->callbacks; l; l = l->next) {
-		tmp = l->data;
-		if (tmp->output_type == output_type) {
-			pd_cb = tmp;
-			break;
+	if ((batch = sess->ann_batch)) {
+		/* Don't lose anything collected for the old callback. */
+		srd_session_gil_ensure(sess, &gil);
+		srd_ann_batch_flush(sess);
+		srd_session_gil_release(sess, &gil);
+		g_array_free(batch->pdata, TRUE);
+		g_array_free(batch->pda, TRUE);
+		g_free(batch);
+		sess->ann_batch = NULL;
+	}
+
+	if (!cb)
+		return SRD_OK;
+
+	srd_dbg("Setting up batched annotations for session %d.",
+			sess->session_id);
+
+	batch = g_malloc0(sizeof(struct srd_ann_batch));
+	batch->cb = cb;
+	batch->cb_data = cb_data;
+	batch->max_count = max_count ? max_count : 4096;
+	batch->pdata = g_array_sized_new(FALSE, FALSE,
+			sizeof(struct srd_proto_data), batch->max_count);
+	batch->pda = g_array_sized_new(FALSE, FALSE,
+			sizeof(struct srd_proto_data_annotation), batch->max_count);
+	sess->ann_batch = batch;
+
+	return SRD_OK;
+}
+
+/**
+ * Add an annotation to the session's batch.
+ *
+ * The contents of pdata and pda are copied, the batch takes over
+ * ownership of the annotation strings.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_batch_add(struct srd_session *sess,
+		const struct srd_proto_data *pdata,
+		const struct srd_proto_data_annotation *pda)
+{
+	struct srd_ann_batch *batch;
+
+	batch = sess->ann_batch;
+	g_array_append_val(batch->pdata, *pdata);
+	g_array_append_val(batch->pda, *pda);
+	if (batch->pdata->len >= batch->max_count)
+		srd_ann_batch_flush(sess);
+}
+
+/**
+ * Deliver all annotations collected in the session's batch.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_batch_flush(struct srd_session *sess)
+{
+	struct srd_ann_batch *batch;
+	struct srd_proto_data *pdata;
+	struct srd_stats_owner stats_prev;
+	unsigned int i;
+
+	if (!(batch = sess->ann_batch) || batch->pdata->len == 0)
+		return;
+
+	/* The arrays may have moved while growing, link them up now. */
+	for (i = 0; i < batch->pdata->len; i++) {
+		pdata = &g_array_index(batch->pdata, struct srd_proto_data, i);
+		pdata->data = &g_array_index(batch->pda,
+				struct srd_proto_data_annotation, i);
+	}
+	/*
+	 * A full batch is charged to the instance whose put() filled it up.
+	 * The rest, delivered after all instances are done with a chunk,
+	 * isn't charged to any instance.
+	 */
+	if (sess->instrumented) {
+		if (sess->stats)
+			stats_prev = srd_inst_stats_switch(sess,
+					sess->stats_owner.di, TRUE);
+		if (sess->trace_cb)
+			srd_session_trace(sess, SRD_TRACE_CALLBACK_BEGIN, NULL,
+					SRD_OUTPUT_ANN, -1, 0, 0);
+	}
+	batch->cb((struct srd_proto_data *)batch->pdata->data,
+			batch->pdata->len, batch->cb_data);
+	if (sess->instrumented) {
+		if (sess->trace_cb)
+			srd_session_trace(sess, SRD_TRACE_CALLBACK_END, NULL,
+					SRD_OUTPUT_ANN, -1, 0, 0);
+		if (sess->stats)
+			srd_inst_stats_switch(sess, stats_prev.di,
+					stats_prev.callback);
+	}
+	ann_batch_clear(batch);
+}
+
+/**
+ * Set up a session to decode in a thread of its own.
+ *
+ * srd_session_send() then only queues up a copy of the sample data, and
+ * returns right away, while the session's decode thread runs the
+ * decoders. If the queue is full, what happens depends on backpressure.
+ *
+ * The decode thread is started by srd_session_start(). From then on, the
+ * frontend's output callbacks are called from the decode thread, and
+ * the session's instances must not be changed anymore.
+ *
+ * @param sess The session to set up. Must not have been started.
+ * @param max_chunks The maximum number of chunks waiting to be decoded,
+ *                   or 0 to decode in the caller's thread (the default).
+ * @param backpressure What to do when the queue is full, one of
+ *                     enum srd_queue_backpressure.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_queue_set(struct srd_session *sess,
+		unsigned int max_chunks, int backpressure)
+{
+	struct srd_session_queue *queue;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if (backpressure < SRD_QUEUE_BLOCK || backpressure > SRD_QUEUE_ERROR) {
+		srd_err("Invalid backpressure mode %d.", backpressure);
+		return SRD_ERR_ARG;
+	}
+
+	if (sess->queue && sess->queue->thread) {
+		srd_err("Session %d is already decoding in its own thread.",
+				sess->session_id);
+		return SRD_ERR;
+	}
+
+	session_queue_free(sess);
+	if (!max_chunks)
+		return SRD_OK;
+
+	srd_dbg("Setting up a decode queue of %u chunks for session %d.",
+			max_chunks, sess->session_id);
+
+	queue = g_malloc0(sizeof(struct srd_session_queue));
+	queue->max_chunks = max_chunks;
+	queue->backpressure = backpressure;
+	g_mutex_init(&queue->mutex);
+	g_cond_init(&queue->cond);
+	g_queue_init(&queue->chunks);
+	queue->error = SRD_OK;
+	sess->queue = queue;
+
+	return SRD_OK;
+}
+
+/**
+ * Run each decoder stack of a session in a worker process of its own.
+ *
+ * When the session is started, a worker process is forked off for every
+ * instance receiving sample data from the frontend. It runs that instance
+ * and all instances stacked on top of it, so a session decoding several
+ * independent buses uses several CPU cores. Output is passed back to the
+ * frontend's callbacks in the same order as when decoding in the frontend
+ * process.
+ *
+ * All instances receiving sample data must use the same unit size. Once
+ * the session has been started, its metadata can't be changed anymore,
+ * and SRD_OUTPUT_PYTHON callbacks don't receive any output.
+ *
+ * Workers are forked, and only the forking thread lives on in them. So
+ * starting a session with workers fails while any session decodes in a
+ * thread of its own, see srd_session_queue_set(). The frontend must not
+ * have other threads calling into libsigrokdecode or Python during
+ * srd_session_start() either. The same goes for
+ * srd_session_send_segmented().
+ *
+ * This is only supported on Unix-like systems.
+ *
+ * @param sess The session to set up. Must not have been started.
+ * @param use_workers TRUE to decode in worker processes, FALSE to decode
+ *                    in the frontend process (the default).
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_workers_set(struct srd_session *sess,
+		gboolean use_workers)
+{
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if (sess->workers) {
+		srd_err("Session %d is already decoding in worker processes.",
+				sess->session_id);
+		return SRD_ERR;
+	}
+
+#ifndef G_OS_UNIX
+	if (use_workers) {
+		srd_err("Worker processes are not supported on this platform.");
+		return SRD_ERR;
+	}
+#endif
+
+	if (use_workers && sess->interp) {
+		srd_err("Sessions with a Python interpreter of their own can't "
+				"use worker processes.");
+		return SRD_ERR;
+	}
+
+	sess->use_workers = use_workers;
+
+	return SRD_OK;
+}
+
+/**
+ * Give a session a Python sub-interpreter of its own.
+ *
+ * The session's decoder instances are then created in, and run by, that
+ * interpreter rather than the main one. As of Python 3.12, it also has a
+ * GIL of its own, so sessions decoding on separate threads (e.g. see
+ * srd_session_queue_set()) no longer have to take turns running Python
+ * code, and use several CPU cores. With older Python versions, such
+ * sessions are merely isolated from each other.
+ *
+ * Decoders still have to be loaded with srd_decoder_load() first; each
+ * interpreter imports the modules of those it has instances of.
+ *
+ * @param sess The session to set up. Must not have any decoder instances.
+ * @param own TRUE to give the session an interpreter of its own, FALSE
+ *            to use the main interpreter (the default).
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_interpreter_set(struct srd_session *sess,
+		gboolean own)
+{
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!Py_IsInitialized()) {
+		srd_err("libsigrokdecode is not initialized.");
+		return SRD_ERR;
+	}
+
+	if (sess->di_list) {
+		srd_err("Session %d already has decoder instances.",
+				sess->session_id);
+		return SRD_ERR;
+	}
+
+	if (own && sess->use_workers) {
+		srd_err("Sessions using worker processes can't have a Python "
+				"interpreter of their own.");
+		return SRD_ERR;
+	}
+
+	if (!own && sess->interp) {
+		srd_interp_free(sess->interp);
+		sess->interp = NULL;
+	} else if (own && !sess->interp) {
+		if (!(sess->interp = srd_interp_new()))
+			return SRD_ERR_PYTHON;
+		srd_dbg("Session %d has a Python interpreter of its own.",
+				sess->session_id);
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Enable or disable decoding statistics for a session's instances.
+ *
+ * While enabled, every instance of the session accumulates the number of
+ * decode() calls, samples and put() calls, and the time spent in its
+ * decode() and in the frontend callbacks for its output, see struct
+ * srd_inst_stats. This costs a few clock readings per decode() call of
+ * stacked instances and per callback. While disabled (the default), the
+ * statistics are left alone.
+ *
+ * Instances decoding in worker processes (see srd_session_workers_set()),
+ * and segmented decoding, aren't accounted.
+ *
+ * Must not be called while the session is decoding, e.g. from an output
+ * callback.
+ *
+ * @param sess The session.
+ * @param enable TRUE to accumulate statistics, FALSE to stop doing so.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_stats_set(struct srd_session *sess, gboolean enable)
+{
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	sess->stats = enable;
+	sess->stats_owner.di = NULL;
+	sess->stats_owner.callback = FALSE;
+	sess->instrumented = sess->stats || sess->trace_cb;
+
+	return SRD_OK;
+}
+
+/**
+ * Only convert annotation texts to C strings when asked for them.
+ *
+ * By default, the texts of every annotation are converted to newly
+ * allocated UTF-8 strings before the SRD_OUTPUT_ANN callbacks and the
+ * batch callback get it, in struct srd_proto_data_annotation's ann_text.
+ * Frontends which often don't need the texts, e.g. to count or filter
+ * annotations, or to draw them zoomed out, can avoid this. The texts are
+ * then only converted by srd_ann_text_get(), which mostly doesn't copy
+ * anything, and ann_text is NULL.
+ *
+ * The annotation and its texts are owned by the session, and only valid
+ * for the duration of the callback, which must get the texts itself. To
+ * keep them for later, use srd_ann_text_dup().
+ *
+ * Must not be called while the session is decoding.
+ *
+ * @param sess The session.
+ * @param lazy TRUE to only convert annotation texts on request, FALSE to
+ *             always convert them (the default).
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_ann_text_lazy_set(struct srd_session *sess,
+		gboolean lazy)
+{
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	sess->ann_text_lazy = lazy;
+
+	return SRD_OK;
+}
+
+/**
+ * Get the number of texts of an annotation.
+ *
+ * Only valid in an output callback which got the annotation.
+ *
+ * @param pda The annotation.
+ *
+ * @return The number of texts, 0 upon errors.
+ *
+ * @since 0.3.0
+ */
+SRD_API unsigned int srd_ann_text_count(
+		const struct srd_proto_data_annotation *pda)
+{
+	if (!pda)
+		return 0;
+
+	if (pda->ann_text)
+		return g_strv_length(pda->ann_text);
+	if (pda->py_texts)
+		return PySequence_Fast_GET_SIZE((PyObject *)pda->py_texts);
+
+	return 0;
+}
+
+/**
+ * Get a text of an annotation, as UTF-8.
+ *
+ * For annotations whose texts haven't been converted yet (see
+ * srd_session_ann_text_lazy_set()), the text is converted now. ASCII
+ * texts, which most are, don't need to be copied for this.
+ *
+ * Only valid in an output callback which got the annotation.
+ *
+ * @param pda The annotation.
+ * @param idx The index of the text, from 0 (the longest) to
+ *            srd_ann_text_count() - 1 (the shortest).
+ *
+ * @return The text, or NULL upon errors. Owned by the annotation, and
+ *         only valid for the duration of the callback.
+ *
+ * @since 0.3.0
+ */
+SRD_API const char *srd_ann_text_get(
+		const struct srd_proto_data_annotation *pda, unsigned int idx)
+{
+	const char *text;
+
+	if (idx >= srd_ann_text_count(pda))
+		return NULL;
+
+	if (pda->ann_text)
+		return pda->ann_text[idx];
+
+	text = PyUnicode_AsUTF8(PySequence_Fast_GET_ITEM(
+			(PyObject *)pda->py_texts, idx));
+	if (!text)
+		srd_exception_catch("Failed to convert annotation text: ");
+
+	return text;
+}
+
+/**
+ * Get a copy of all texts of an annotation, as UTF-8.
+ *
+ * Only valid in an output callback which got the annotation.
+ *
+ * @param pda The annotation.
+ *
+ * @return A NULL-terminated array of the texts, or NULL upon errors.
+ *         Free with g_strfreev().
+ *
+ * @since 0.3.0
+ */
+SRD_API char **srd_ann_text_dup(const struct srd_proto_data_annotation *pda)
+{
+	const char *text;
+	char **texts;
+	unsigned int num_texts, i;
+
+	if (!pda)
+		return NULL;
+
+	if (pda->ann_text)
+		return g_strdupv(pda->ann_text);
+
+	num_texts = srd_ann_text_count(pda);
+	texts = g_malloc0(sizeof(char *) * (num_texts + 1));
+	for (i = 0; i < num_texts; i++) {
+		if (!(text = srd_ann_text_get(pda, i))) {
+			g_strfreev(texts);
+			return NULL;
 		}
+		texts[i] = g_strdup(text);
+	}
+
+	return texts;
+}
+
+/**
+ * Set a callback to receive trace events of a session.
+ *
+ * The callback is called for every call of an instance's decode() and its
+ * return, every put() and around the frontend callbacks for every output,
+ * see struct srd_trace_event. Events of nested calls are properly nested,
+ * e.g. decode() of a stacked instance begins and ends while the put()
+ * passing data to it is being handled. This is meant for feeding
+ * timelines and flame graphs, and makes decoding a lot slower. While
+ * disabled (the default), it costs next to nothing.
+ *
+ * The callback is called from the thread decoding the session, and must
+ * not call back into libsigrokdecode. Instances decoding in worker
+ * processes (see srd_session_workers_set()) aren't traced.
+ *
+ * Must not be called while the session is decoding.
+ *
+ * @param sess The session.
+ * @param cb The callback, or NULL to disable tracing.
+ * @param cb_data Passed to the callback.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_trace_callback_set(struct srd_session *sess,
+		srd_trace_callback cb, void *cb_data)
+{
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	sess->trace_cb = cb;
+	sess->trace_cb_data = cb_data;
+	sess->instrumented = sess->stats || sess->trace_cb;
+
+	return SRD_OK;
+}
+
+/**
+ * Pass a trace event to a session's trace callback, which must be set.
+ *
+ * @param sess The session.
+ * @param type The kind of event (enum srd_trace_event_type).
+ * @param di The decoder instance, or NULL.
+ * @param output_type The output type, or -1.
+ * @param output_class The annotation or binary class, or -1.
+ * @param start_sample The first sample concerned.
+ * @param end_sample The end of the samples concerned.
+ *
+ * @private
+ */
+SRD_PRIV void srd_session_trace(struct srd_session *sess, int type,
+		const struct srd_decoder_inst *di, int output_type,
+		int output_class, uint64_t start_sample, uint64_t end_sample)
+{
+	struct srd_trace_event event;
+
+	event.type = type;
+	srd_clock_get(&event.timestamp_ns, NULL);
+	event.di = di;
+	event.output_type = output_type;
+	event.output_class = output_class;
+	event.start_sample = start_sample;
+	event.end_sample = end_sample;
+
+	sess->trace_cb(&event, sess->trace_cb_data);
+}
+
+/**
+ * Wait until a session's decode thread has decoded all queued chunks.
+ *
+ * Must not be called from an output callback.
+ *
+ * @param sess The session to wait for.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise. This
+ *         includes errors which occurred while decoding, and have not
+ *         been returned by srd_session_send() yet.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_queue_drain(struct srd_session *sess)
+{
+	struct srd_session_queue *queue;
+	int ret;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
 	}
 
-	return pd_cb;
+	if (!(queue = sess->queue) || !queue->thread)
+		return SRD_OK;
+
+	g_mutex_lock(&queue->mutex);
+	while (!g_queue_is_empty(&queue->chunks) || queue->busy)
+		g_cond_wait(&queue->cond, &queue->mutex);
+	ret = queue->error;
+	queue->error = SRD_OK;
+	g_mutex_unlock(&queue->mutex);
+
+	return ret;
+}
+
+/**
+ * Get the state of a session's decode queue.
+ *
+ * This shows how far the decoders lag behind the sample data sent to
+ * the session. For sessions which decode in the caller's thread, all
+ * fields are 0.
+ *
+ * @param sess The session to query.
+ * @param status Pointer to a struct srd_queue_status to fill in.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_queue_status_get(struct srd_session *sess,
+		struct srd_queue_status *status)
+{
+	struct srd_session_queue *queue;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!status) {
+		srd_err("Invalid status pointer.");
+		return SRD_ERR_ARG;
+	}
+
+	memset(status, 0, sizeof(struct srd_queue_status));
+	if (!(queue = sess->queue))
+		return SRD_OK;
+
+	g_mutex_lock(&queue->mutex);
+	status->depth = g_queue_get_length(&queue->chunks);
+	status->max_depth = queue->max_chunks;
+	status->lag = queue->lag;
+	status->num_dropped = queue->num_dropped;
+	g_mutex_unlock(&queue->mutex);
+
+	return SRD_OK;
 }
 
 /** @} */
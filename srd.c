@@ -28,10 +28,17 @@
 /* Python module search paths */
 SRD_PRIV GSList *searchpaths = NULL;
 
+/* Thread state of the thread which called srd_init(). */
+static PyThreadState *main_tstate = NULL;
+
 /* session.c */
 extern SRD_PRIV GSList *sessions;
 extern SRD_PRIV int max_session_id;
 
+/* module_sigrokdecode.c */
+extern SRD_PRIV PyObject *mod_sigrokdecode;
+extern SRD_PRIV PyTypeObject *srd_logic_type;
+
 /** @endcond */
 
 /**
@@ -162,7 +169,22 @@ SRD_API int srd_init(const char *path)
 		}
 	}
 
+	if ((ret = srd_module_import(&mod_sigrokdecode,
+			&srd_logic_type)) != SRD_OK) {
+		Py_Finalize();
+		return ret;
+	}
+
+	srd_sessions_lock();
 	max_session_id = 0;
+	srd_sessions_unlock();
+
+	/*
+	 * Sessions may decode in a thread of their own, so only hold the
+	 * GIL while inside libsigrokdecode.
+	 */
+	PyEval_InitThreads();
+	main_tstate = PyEval_SaveThread();
 
 	return SRD_OK;
 }
@@ -177,51 +199,64 @@ SRD_API int srd_init(const char *path)
  * of srd_init() before. Calling this function multiple times in a row, without
  * any successful srd_init() calls in between, is not allowed.
  *
+ * It may be called from another thread than srd_init() was, but no other
+ * thread may be using libsigrokdecode at the time.
+ *
  * @return SRD_OK upon success, a (negative) error code otherwise.
  *
  * @since 0.1.0
  */
 SRD_API int srd_exit(void)
 {
-	GSList *l;
+	struct srd_session *sess;
 
 	srd_dbg("Exiting libsigrokdecode.");
 
-	for (l = sessions; l; l = l->next)
-		srd_session_destroy((struct srd_session *)l->data);
+	/*
+	 * Take the GIL. The thread which called srd_init() gets its thread
+	 * state back, any other thread gets one of its own, which
+	 * Py_Finalize() does away with, together with all others.
+	 */
+	if (main_tstate) {
+		if (PyGILState_GetThisThreadState() == main_tstate)
+			PyEval_RestoreThread(main_tstate);
+		else
+			PyGILState_Ensure();
+		main_tstate = NULL;
+	}
+
+	/* Destroying a session removes it from the list. */
+	for (;;) {
+		srd_sessions_lock();
+		sess = sessions ? sessions->data : NULL;
+		srd_sessions_unlock();
+		if (!sess)
+			break;
+		srd_session_destroy(sess);
+	}
 
 	srd_decoder_unload_all();
+	srd_index_free();
+	srd_bundle_free_all();
 	g_slist_free_full(searchpaths, g_free);
 	searchpaths = NULL;
 
+	Py_XDECREF((PyObject *)srd_logic_type);
+	srd_logic_type = NULL;
+	Py_XDECREF(mod_sigrokdecode);
+	mod_sigrokdecode = NULL;
+
 	/* Py_Finalize() returns void, any finalization errors are ignored. */
 	Py_Finalize();
 
+	srd_sessions_lock();
 	max_session_id = -1;
+	srd_sessions_unlock();
 
 	return SRD_OK;
 }
 
-/**
- * Add an additional search directory for the protocol decoders.
- *
- * The specified directory is prepended (not appended!) to Python's sys.path,
- * in order to search for sigrok protocol decoders in the specified
- * directories first, and in the generic Python module directories (and in
- * the current working directory) last. This avoids conflicts if there are
- * Python modules which have the same name as a sigrok protocol decoder in
- * sys.path or in the current working directory.
- *
- * @param path Path to the directory containing protocol decoders which shall
- *             be added to the Python sys.path, or NULL.
- *
- * @return SRD_OK upon success, a (negative) error code otherwise.
- *
- * @private
- *
- * @since 0.1.0
- */
-SRD_PRIV int srd_decoder_searchpath_add(const char *path)
+static void searchpath_prepend(const char *path)
 {
 	PyObject *py_cur_path, *py_item;
 	GString *new_path;
@@ -229,8 +264,6 @@ SRD_PRIV int srd_decoder_searchpath_add(const char *path)
 	wchar_t *wc_new_path;
 	char *item;
 
-	srd_dbg("Adding '%s' to module path.", path);
-
 	new_path = g_string_sized_new(256);
 	g_string_assign(new_path, path);
 	py_cur_path = PySys_GetObject("path");
@@ -253,9 +286,168 @@ SRD_PRIV int srd_decoder_searchpath_add(const char *path)
 	PySys_SetPath(wc_new_path);
 	g_string_free(new_path, TRUE);
 	g_free(wc_new_path);
+}
+
+/**
+ * Add an additional search directory for the protocol decoders.
+ *
+ * The specified directory is prepended (not appended!) to Python's sys.path,
+ * in order to search for sigrok protocol decoders in the specified
+ * directories first, and in the generic Python module directories (and in
+ * the current working directory) last. This avoids conflicts if there are
+ * Python modules which have the same name as a sigrok protocol decoder in
+ * sys.path or in the current working directory.
+ *
+ * @param path Path to the directory containing protocol decoders which shall
+ *             be added to the Python sys.path, or NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ *
+ * @since 0.1.0
+ */
+SRD_PRIV int srd_decoder_searchpath_add(const char *path)
+{
+	srd_dbg("Adding '%s' to module path.", path);
+
+	searchpath_prepend(path);
 	searchpaths = g_slist_append(searchpaths, g_strdup(path));
 
 	return SRD_OK;
 }
 
+/**
+ * Add all protocol decoder search directories to the sys.path of the
+ * current Python interpreter, in the same order srd_decoder_searchpath_add()
+ * added them to the main interpreter's.
+ *
+ * @private
+ */
+SRD_PRIV void srd_decoder_searchpaths_apply(void)
+{
+	GSList *l;
+
+	for (l = searchpaths; l; l = l->next)
+		searchpath_prepend(l->data);
+}
+
+/**
+ * Take the Python GIL for the calling thread.
+ *
+ * Every API function which (indirectly) calls into Python must do this,
+ * since a session's decode thread may run at the same time. This may be
+ * nested, and is a no-op before srd_init().
+ *
+ * @return The state to pass to srd_gil_release().
+ *
+ * @private
+ */
+SRD_PRIV PyGILState_STATE srd_gil_ensure(void)
+{
+	if (!Py_IsInitialized())
+		return PyGILState_LOCKED;
+
+	return PyGILState_Ensure();
+}
+
+/**
+ * Release the Python GIL taken by srd_gil_ensure().
+ *
+ * @param gstate The state returned by srd_gil_ensure().
+ *
+ * @private
+ */
+SRD_PRIV void srd_gil_release(PyGILState_STATE gstate)
+{
+	if (!Py_IsInitialized())
+		return;
+
+	PyGILState_Release(gstate);
+}
+
+/* The calling thread's current Python thread state, or NULL. */
+static PyThreadState *tstate_current(void)
+{
+#if PY_VERSION_HEX >= 0x030D0000
+	return PyThreadState_GetUnchecked();
+#elif PY_VERSION_HEX >= 0x03060000
+	return _PyThreadState_UncheckedGet();
+#else
+	PyThreadState *tstate;
+
+	tstate = PyThreadState_Swap(NULL);
+	PyThreadState_Swap(tstate);
+
+	return tstate;
+#endif
+}
+
+/**
+ * Take the GIL of the Python interpreter a session decodes in.
+ *
+ * For sessions in the main interpreter, this is srd_gil_ensure(). For
+ * those with an interpreter of their own (see srd_session_interpreter_set()),
+ * the calling thread gets a thread state in that interpreter, and gives
+ * up the one it holds, if any, until srd_session_gil_release().
+ *
+ * This may be nested for the same session, but a thread holding the GIL of
+ * a session's own interpreter must not call srd_gil_ensure().
+ *
+ * @param sess The session. Must not be NULL.
+ * @param gil Will hold what to pass to srd_session_gil_release().
+ *
+ * @private
+ */
+SRD_PRIV void srd_session_gil_ensure(struct srd_session *sess,
+		struct srd_gil *gil)
+{
+	PyThreadState *cur;
+
+	gil->tstate = gil->saved = NULL;
+	if (!sess->interp) {
+		gil->gstate = srd_gil_ensure();
+		return;
+	}
+
+	if ((cur = tstate_current())) {
+#if PY_VERSION_HEX >= 0x03090000
+		if (PyThreadState_GetInterpreter(cur) == sess->interp->interp)
+#else
+		if (cur->interp == sess->interp->interp)
+#endif
+			/* Already there. */
+			return;
+		gil->saved = PyEval_SaveThread();
+	}
+
+	gil->tstate = PyThreadState_New(sess->interp->interp);
+	PyEval_RestoreThread(gil->tstate);
+}
+
+/**
+ * Release the GIL taken by srd_session_gil_ensure().
+ *
+ * @param sess The session. Must not be NULL.
+ * @param gil What srd_session_gil_ensure() returned.
+ *
+ * @private
+ */
+SRD_PRIV void srd_session_gil_release(struct srd_session *sess,
+		struct srd_gil *gil)
+{
+	if (!sess->interp) {
+		srd_gil_release(gil->gstate);
+		return;
+	}
+
+	if (!gil->tstate)
+		return;
+
+	PyThreadState_Clear(gil->tstate);
+	PyThreadState_DeleteCurrent();
+	if (gil->saved)
+		PyEval_RestoreThread(gil->saved);
+}
+
 /** @} */
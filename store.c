@@ -0,0 +1,527 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include "config.h"
+#include <glib.h>
+#include <stdlib.h>
+#include <string.h>
+
+/**
+ * @file
+ *
+ * Store of decoded annotations, indexed for range and text search.
+ */
+
+/*
+ * Every annotation row of every instance keeps its annotations in an
+ * array, which is sorted by start sample as far as it's indexed. New
+ * annotations are just appended, and only indexed by the next lookup.
+ * They mostly follow the indexed ones in order, so indexing them is
+ * cheap. If they don't, they're sorted and merged in.
+ *
+ * Over the sorted array is a segment tree of the greatest end sample of
+ * the annotations below every node. An annotation overlaps a range of
+ * samples if it starts before the range ends, and either starts in the
+ * range or ends after it starts. The former are found by a binary search,
+ * the latter by walking down the tree only where annotations end late
+ * enough, so a lookup takes O(log n) plus the number of annotations found.
+ *
+ * The texts go into a string chunk, where they never move, so found
+ * annotations can refer to them.
+ */
+
+/** @cond PRIVATE */
+
+struct stored_ann {
+	uint64_t start_sample;
+	uint64_t end_sample;
+	/* The texts, one after the other, in the instance's string chunk. */
+	const char *texts;
+	int ann_class;
+	unsigned int num_texts;
+};
+
+struct store_row {
+	/* struct stored_ann, in start sample order up to num_indexed. */
+	GArray *anns;
+	guint num_indexed;
+	/*
+	 * Greatest end sample of the indexed annotations below every node.
+	 * Node 1 is the root, node n has children 2n and 2n + 1, and
+	 * annotation i is leaf num_leaves + i.
+	 */
+	uint64_t *max_end;
+	guint num_leaves;
+};
+
+struct store_inst {
+	int num_classes;
+	/* See srd_decoder_class_rows_new(). */
+	int num_rows;
+	struct store_row *rows;
+	int *class_row;
+	GStringChunk *texts;
+	/* Reused for joining an annotation's texts. */
+	GString *joined;
+};
+
+struct srd_ann_store {
+	/* The store is searched while the session thread adds to it. */
+	GMutex mutex;
+	/* Maps a decoder instance to its struct store_inst. */
+	GHashTable *insts;
+};
+
+struct store_query {
+	const struct store_row *row;
+	uint64_t start_sample;
+	int ann_class;
+	const char *text;
+	GArray *records;
+};
+
+static struct store_inst *store_inst_new(const struct srd_decoder *dec)
+{
+	struct store_inst *si;
+	int r;
+
+	si = g_malloc0(sizeof(struct store_inst));
+	si->num_classes = g_slist_length(dec->annotations);
+	si->class_row = srd_decoder_class_rows_new(dec, &si->num_rows);
+	si->rows = g_malloc0(sizeof(struct store_row) * si->num_rows);
+	for (r = 0; r < si->num_rows; r++)
+		si->rows[r].anns = g_array_new(FALSE, FALSE,
+				sizeof(struct stored_ann));
+	si->texts = g_string_chunk_new(64 * 1024);
+	si->joined = g_string_new(NULL);
+
+	return si;
+}
+
+static void store_inst_free(struct store_inst *si)
+{
+	int r;
+
+	for (r = 0; r < si->num_rows; r++) {
+		g_array_free(si->rows[r].anns, TRUE);
+		g_free(si->rows[r].max_end);
+	}
+	g_free(si->rows);
+	g_free(si->class_row);
+	g_string_chunk_free(si->texts);
+	g_string_free(si->joined, TRUE);
+	g_free(si);
+}
+
+static int ann_cmp(const void *a, const void *b)
+{
+	const struct stored_ann *ann_a = a, *ann_b = b;
+
+	if (ann_a->start_sample != ann_b->start_sample)
+		return ann_a->start_sample < ann_b->start_sample ? -1 : 1;
+	if (ann_a->end_sample != ann_b->end_sample)
+		return ann_a->end_sample < ann_b->end_sample ? -1 : 1;
+
+	return 0;
+}
+
+/* Merge the sorted annotations from mid on into the sorted ones before. */
+static void row_merge(struct store_row *row, guint mid)
+{
+	struct stored_ann *anns;
+	GArray *merged;
+	guint i, j, len;
+
+	anns = (struct stored_ann *)row->anns->data;
+	len = row->anns->len;
+	merged = g_array_sized_new(FALSE, FALSE, sizeof(struct stored_ann),
+			len);
+	for (i = 0, j = mid; i < mid && j < len; ) {
+		if (ann_cmp(&anns[j], &anns[i]) < 0)
+			g_array_append_val(merged, anns[j++]);
+		else
+			g_array_append_val(merged, anns[i++]);
+	}
+	g_array_append_vals(merged, anns + i, mid - i);
+	g_array_append_vals(merged, anns + j, len - j);
+
+	g_array_free(row->anns, TRUE);
+	row->anns = merged;
+}
+
+static void row_tree_update(struct store_row *row, guint idx)
+{
+	guint node;
+
+	node = row->num_leaves + idx;
+	row->max_end[node] = g_array_index(row->anns, struct stored_ann,
+			idx).end_sample;
+	for (node /= 2; node; node /= 2)
+		row->max_end[node] = MAX(row->max_end[2 * node],
+				row->max_end[2 * node + 1]);
+}
+
+static void row_tree_build(struct store_row *row)
+{
+	guint i, node;
+
+	for (row->num_leaves = 1; row->num_leaves < row->anns->len; )
+		row->num_leaves *= 2;
+	g_free(row->max_end);
+	row->max_end = g_malloc0(sizeof(uint64_t) * 2 * row->num_leaves);
+
+	for (i = 0; i < row->anns->len; i++)
+		row->max_end[row->num_leaves + i] = g_array_index(row->anns,
+				struct stored_ann, i).end_sample;
+	for (node = row->num_leaves - 1; node; node--)
+		row->max_end[node] = MAX(row->max_end[2 * node],
+				row->max_end[2 * node + 1]);
+}
+
+/* Index the annotations added since the last lookup. */
+static void row_index(struct store_row *row)
+{
+	struct stored_ann *anns;
+	guint i, first, len;
+	gboolean merged;
+
+	first = row->num_indexed;
+	len = row->anns->len;
+	if (first == len)
+		return;
+
+	anns = (struct stored_ann *)row->anns->data;
+	for (i = MAX(first, 1); i < len; i++) {
+		if (anns[i].start_sample < anns[i - 1].start_sample)
+			break;
+	}
+	merged = FALSE;
+	if (i < len) {
+		qsort(anns + first, len - first, sizeof(struct stored_ann),
+				ann_cmp);
+		if (first && ann_cmp(&anns[first], &anns[first - 1]) < 0) {
+			row_merge(row, first);
+			merged = TRUE;
+		}
+	}
+
+	if (merged || len > row->num_leaves || !row->max_end) {
+		row_tree_build(row);
+	} else {
+		for (i = first; i < len; i++)
+			row_tree_update(row, i);
+	}
+	row->num_indexed = len;
+}
+
+/* Index of the first annotation starting at or after a sample. */
+static guint row_lower_bound(const struct store_row *row, uint64_t sample)
+{
+	guint lo, hi, mid;
+
+	lo = 0;
+	hi = row->anns->len;
+	while (lo < hi) {
+		mid = lo + (hi - lo) / 2;
+		if (g_array_index(row->anns, struct stored_ann,
+				mid).start_sample < sample)
+			lo = mid + 1;
+		else
+			hi = mid;
+	}
+
+	return lo;
+}
+
+static void record_add(struct store_query *q, const struct stored_ann *ann)
+{
+	struct srd_ann_record record;
+	const char *text;
+	unsigned int i;
+
+	if (q->ann_class >= 0 && ann->ann_class != q->ann_class)
+		return;
+
+	if (q->text) {
+		text = ann->texts;
+		for (i = 0; i < ann->num_texts; i++) {
+			if (!strcmp(text, q->text))
+				break;
+			text += strlen(text) + 1;
+		}
+		if (i == ann->num_texts)
+			return;
+	}
+
+	record.start_sample = ann->start_sample;
+	record.end_sample = ann->end_sample;
+	record.ann_class = ann->ann_class;
+	record.num_texts = ann->num_texts;
+	record.texts = ann->texts;
+	g_array_append_val(q->records, record);
+}
+
+/*
+ * Add the annotations of a subtree before index end, which end after the
+ * query's start sample, in order.
+ */
+static void row_tree_find(struct store_query *q, guint node, guint first,
+		guint count, guint end)
+{
+	if (first >= end || q->row->max_end[node] <= q->start_sample)
+		return;
+
+	if (node >= q->row->num_leaves) {
+		record_add(q, &g_array_index(q->row->anns, struct stored_ann,
+				first));
+		return;
+	}
+
+	count /= 2;
+	row_tree_find(q, 2 * node, first, count, end);
+	row_tree_find(q, 2 * node + 1, first + count, count, end);
+}
+
+/** @endcond */
+
+/**
+ * Add an annotation to the session's annotation store.
+ *
+ * Must be called with the GIL held, if the annotation's texts weren't
+ * converted.
+ *
+ * @param sess The session, with the annotation store enabled.
+ * @param pdata The annotation's output data.
+ * @param pda The annotation.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_store_add(struct srd_session *sess,
+		const struct srd_proto_data *pdata,
+		const struct srd_proto_data_annotation *pda)
+{
+	struct srd_ann_store *store;
+	struct srd_decoder_inst *di;
+	struct store_inst *si;
+	struct stored_ann ann;
+	const char *text;
+	unsigned int i;
+
+	store = sess->ann_store;
+	di = pdata->pdo->di;
+
+	g_mutex_lock(&store->mutex);
+
+	if (!(si = g_hash_table_lookup(store->insts, di))) {
+		si = store_inst_new(di->decoder);
+		g_hash_table_insert(store->insts, di, si);
+	}
+	if (pda->ann_class < 0 || pda->ann_class >= si->num_classes) {
+		g_mutex_unlock(&store->mutex);
+		return;
+	}
+
+	ann.start_sample = pdata->start_sample;
+	ann.end_sample = pdata->end_sample;
+	ann.ann_class = pda->ann_class;
+	ann.num_texts = srd_ann_text_count(pda);
+	if (ann.num_texts == 1) {
+		/* Single texts repeat a lot, e.g. bits, so share them. */
+		if (!(text = srd_ann_text_get(pda, 0)))
+			text = "";
+		ann.texts = g_string_chunk_insert_const(si->texts, text);
+	} else {
+		g_string_truncate(si->joined, 0);
+		for (i = 0; i < ann.num_texts; i++) {
+			if (!(text = srd_ann_text_get(pda, i)))
+				text = "";
+			g_string_append_len(si->joined, text, strlen(text) + 1);
+		}
+		ann.texts = g_string_chunk_insert_len(si->texts,
+				si->joined->str, si->joined->len);
+	}
+	g_array_append_val(si->rows[si->class_row[ann.ann_class]].anns, ann);
+
+	g_mutex_unlock(&store->mutex);
+}
+
+/**
+ * Throw away the stored annotations of a decoder instance.
+ *
+ * @param sess The session, with the annotation store enabled.
+ * @param di The decoder instance, which is about to be freed.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_store_inst_remove(struct srd_session *sess,
+		const struct srd_decoder_inst *di)
+{
+	struct srd_ann_store *store;
+
+	store = sess->ann_store;
+	g_mutex_lock(&store->mutex);
+	g_hash_table_remove(store->insts, di);
+	g_mutex_unlock(&store->mutex);
+}
+
+/**
+ * Keep all annotations of the session, for searching them.
+ *
+ * Frontends which need to find annotations after decoding, e.g. those
+ * in view, or all bytes of some value, would otherwise record and scan
+ * them all themselves. With the store enabled, the session keeps every
+ * annotation of every instance, and srd_ann_store_find() looks them up
+ * by annotation row and range of samples, in logarithmic time, and by
+ * class and text.
+ *
+ * Annotations the frontend didn't subscribe to aren't stored, see
+ * srd_inst_ann_classes_set(). They're stored without any annotation
+ * callbacks, and with worker processes, too.
+ *
+ * Must not be called while the session is decoding. Enabling the store
+ * again throws away the annotations stored so far.
+ *
+ * @param sess The session.
+ * @param enable TRUE to store annotations, FALSE not to (the default),
+ *               which throws away the stored ones.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_ann_store_set(struct srd_session *sess,
+		gboolean enable)
+{
+	struct srd_ann_store *store;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if ((store = sess->ann_store)) {
+		g_hash_table_destroy(store->insts);
+		g_mutex_clear(&store->mutex);
+		g_free(store);
+		sess->ann_store = NULL;
+	}
+
+	if (!enable)
+		return SRD_OK;
+
+	store = g_malloc0(sizeof(struct srd_ann_store));
+	g_mutex_init(&store->mutex);
+	store->insts = g_hash_table_new_full(g_direct_hash, g_direct_equal,
+			NULL, (GDestroyNotify)store_inst_free);
+	sess->ann_store = store;
+
+	return SRD_OK;
+}
+
+/**
+ * Find stored annotations of an annotation row.
+ *
+ * An annotation is found if it overlaps the range of samples, i.e. it
+ * starts before end_sample, and either ends after start_sample or starts
+ * at or after it. Looking up a range takes logarithmic time, plus the
+ * time for the annotations in it, so class and text searches are
+ * quickest in a narrow range.
+ *
+ * Can be called while the session is decoding in its thread, see
+ * srd_session_queue_set().
+ *
+ * @param di The decoder instance.
+ * @param row_id The ID of the annotation row, or NULL for the annotation
+ *               classes in no row.
+ * @param start_sample The first sample of the range.
+ * @param end_sample The sample after the last one of the range. Use
+ *                   G_MAXUINT64 for all annotations from start_sample on.
+ * @param ann_class The annotation class to find, or -1 for all of them.
+ * @param text A text the annotations must have, as any of their texts,
+ *             or NULL for any texts.
+ * @param records Gets a newly allocated array of struct srd_ann_record,
+ *                in start sample order. Free it with g_array_free(). The
+ *                texts it refers to are owned by the store, and valid
+ *                until the store is disabled or the instance is freed.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_ann_store_find(const struct srd_decoder_inst *di,
+		const char *row_id, uint64_t start_sample, uint64_t end_sample,
+		int ann_class, const char *text, GArray **records)
+{
+	struct srd_ann_store *store;
+	struct store_inst *si;
+	struct store_row *row;
+	struct store_query q;
+	guint first, end, i;
+	int r;
+
+	if (!di || !records) {
+		srd_err("Invalid arguments.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!(store = di->sess->ann_store)) {
+		srd_err("The annotation store isn't enabled.");
+		return SRD_ERR_ARG;
+	}
+
+	if (start_sample >= end_sample) {
+		srd_err("Invalid sample range.");
+		return SRD_ERR_ARG;
+	}
+
+	if ((r = srd_decoder_row_find(di->decoder, row_id)) < 0) {
+		srd_err("Invalid annotation row '%s'.", row_id);
+		return SRD_ERR_ARG;
+	}
+
+	*records = g_array_new(FALSE, FALSE, sizeof(struct srd_ann_record));
+
+	g_mutex_lock(&store->mutex);
+
+	if (!(si = g_hash_table_lookup(store->insts, di))) {
+		/* No annotations yet. */
+		g_mutex_unlock(&store->mutex);
+		return SRD_OK;
+	}
+	row = &si->rows[r];
+	row_index(row);
+
+	q.row = row;
+	q.start_sample = start_sample;
+	q.ann_class = ann_class;
+	q.text = text;
+	q.records = *records;
+
+	/* Those starting before the range, but ending in it... */
+	first = row_lower_bound(row, start_sample);
+	row_tree_find(&q, 1, 0, row->num_leaves, first);
+	/* ...and those starting in it. */
+	end = row_lower_bound(row, end_sample);
+	for (i = first; i < end; i++)
+		record_add(&q, &g_array_index(row->anns, struct stored_ann, i));
+
+	g_mutex_unlock(&store->mutex);
+
+	return SRD_OK;
+}
@@ -0,0 +1,445 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include "config.h"
+#include <glib.h>
+#include <inttypes.h>
+#include <string.h>
+
+/**
+ * @file
+ *
+ * Annotation summaries for zoomed out views.
+ */
+
+/*
+ * Every annotation row of every instance has a few levels of buckets of
+ * samples, each level's buckets SUMMARY_LEVEL_FACTOR times as wide as the
+ * previous level's. An annotation is counted in the bucket of every level
+ * its start sample falls into, as it's put out.
+ *
+ * Buckets are kept in arrays indexed by bucket number, so a range of
+ * samples is looked up without searching. Empty buckets are just NULL.
+ *
+ * A bucket's last text is only copied when the row's annotations move on
+ * to another bucket, or when it's looked up. Until then, the row keeps
+ * the text of its latest annotation in a buffer that's reused.
+ */
+
+/** @cond PRIVATE */
+
+#define SUMMARY_LEVEL_FACTOR 8
+#define SUMMARY_MAX_LEVELS 16
+
+#define NO_BUCKET G_MAXUINT64
+
+struct summary_bucket {
+	uint64_t count;
+	char *first_text;
+	char *last_text;
+	/* Number of annotations per class. */
+	uint64_t *class_counts;
+};
+
+struct summary_row {
+	/* Per level, struct summary_bucket * indexed by bucket number. */
+	GPtrArray **levels;
+	/* Per level, the bucket of the latest annotation, or NO_BUCKET. */
+	uint64_t *open;
+	/* First text of the latest annotation. */
+	GString *last_text;
+};
+
+struct summary_inst {
+	unsigned int num_levels;
+	int num_classes;
+	/* See srd_decoder_class_rows_new(). */
+	int num_rows;
+	struct summary_row *rows;
+	/* Row of every annotation class. */
+	int *class_row;
+};
+
+struct srd_ann_summaries {
+	/* Summaries are looked up while the session thread adds to them. */
+	GMutex mutex;
+	/* Bucket width of the first level. */
+	uint64_t bucket_samples;
+	unsigned int num_levels;
+	/* Maps a decoder instance to its struct summary_inst. */
+	GHashTable *insts;
+};
+
+static void bucket_free(struct summary_bucket *b)
+{
+	if (!b)
+		return;
+
+	g_free(b->first_text);
+	g_free(b->last_text);
+	g_free(b->class_counts);
+	g_free(b);
+}
+
+static struct summary_inst *summary_inst_new(const struct srd_decoder *dec,
+		unsigned int num_levels)
+{
+	struct summary_inst *si;
+	struct summary_row *row;
+	unsigned int level;
+	int r;
+
+	si = g_malloc0(sizeof(struct summary_inst));
+	si->num_levels = num_levels;
+	si->num_classes = g_slist_length(dec->annotations);
+	si->class_row = srd_decoder_class_rows_new(dec, &si->num_rows);
+
+	si->rows = g_malloc0(sizeof(struct summary_row) * si->num_rows);
+	for (r = 0; r < si->num_rows; r++) {
+		row = &si->rows[r];
+		row->levels = g_malloc(sizeof(GPtrArray *) * num_levels);
+		row->open = g_malloc(sizeof(uint64_t) * num_levels);
+		for (level = 0; level < num_levels; level++) {
+			row->levels[level] = g_ptr_array_new_with_free_func(
+					(GDestroyNotify)bucket_free);
+			row->open[level] = NO_BUCKET;
+		}
+		row->last_text = g_string_new(NULL);
+	}
+
+	return si;
+}
+
+static void summary_inst_free(struct summary_inst *si)
+{
+	struct summary_row *row;
+	unsigned int level;
+	int r;
+
+	for (r = 0; r < si->num_rows; r++) {
+		row = &si->rows[r];
+		for (level = 0; level < si->num_levels; level++)
+			g_ptr_array_free(row->levels[level], TRUE);
+		g_free(row->levels);
+		g_free(row->open);
+		g_string_free(row->last_text, TRUE);
+	}
+	g_free(si->rows);
+	g_free(si->class_row);
+	g_free(si);
+}
+
+/* Give the open bucket of a level the text of the row's latest annotation. */
+static void bucket_last_text_set(struct summary_row *row, unsigned int level)
+{
+	struct summary_bucket *b;
+
+	if (row->open[level] == NO_BUCKET)
+		return;
+
+	b = g_ptr_array_index(row->levels[level], row->open[level]);
+	g_free(b->last_text);
+	b->last_text = g_strdup(row->last_text->str);
+}
+
+static void summary_clear(struct srd_ann_summary *summary)
+{
+	g_free(summary->first_text);
+	g_free(summary->last_text);
+	g_free(summary->class_counts);
+}
+
+/** @endcond */
+
+/**
+ * Add an annotation to the session's annotation summaries.
+ *
+ * Must be called with the GIL held, if the annotation's texts weren't
+ * converted.
+ *
+ * @param sess The session, with annotation summaries enabled.
+ * @param pdata The annotation's output data.
+ * @param pda The annotation.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_summary_add(struct srd_session *sess,
+		const struct srd_proto_data *pdata,
+		const struct srd_proto_data_annotation *pda)
+{
+	struct srd_ann_summaries *sums;
+	struct srd_decoder_inst *di;
+	struct summary_inst *si;
+	struct summary_row *row;
+	struct summary_bucket *b;
+	GPtrArray *buckets;
+	const char *text;
+	uint64_t width, n;
+	unsigned int level;
+
+	sums = sess->ann_summaries;
+	di = pdata->pdo->di;
+	if (!(text = srd_ann_text_get(pda, 0)))
+		text = "";
+
+	g_mutex_lock(&sums->mutex);
+
+	if (!(si = g_hash_table_lookup(sums->insts, di))) {
+		si = summary_inst_new(di->decoder, sums->num_levels);
+		g_hash_table_insert(sums->insts, di, si);
+	}
+	if (pda->ann_class < 0 || pda->ann_class >= si->num_classes) {
+		g_mutex_unlock(&sums->mutex);
+		return;
+	}
+	row = &si->rows[si->class_row[pda->ann_class]];
+
+	width = sums->bucket_samples;
+	for (level = 0; level < sums->num_levels; level++) {
+		buckets = row->levels[level];
+		n = pdata->start_sample / width;
+		if (n != row->open[level]) {
+			/* The latest annotation was the last of its bucket. */
+			bucket_last_text_set(row, level);
+			if (n >= buckets->len)
+				g_ptr_array_set_size(buckets, n + 1);
+			if (!(b = g_ptr_array_index(buckets, n))) {
+				b = g_malloc0(sizeof(struct summary_bucket));
+				b->first_text = g_strdup(text);
+				b->class_counts = g_malloc0(sizeof(uint64_t)
+						* si->num_classes);
+				g_ptr_array_index(buckets, n) = b;
+			}
+			row->open[level] = n;
+		} else {
+			b = g_ptr_array_index(buckets, n);
+		}
+		b->count++;
+		b->class_counts[pda->ann_class]++;
+		width *= SUMMARY_LEVEL_FACTOR;
+	}
+	g_string_assign(row->last_text, text);
+
+	g_mutex_unlock(&sums->mutex);
+}
+
+/**
+ * Throw away the annotation summaries of a decoder instance.
+ *
+ * @param sess The session, with annotation summaries enabled.
+ * @param di The decoder instance, which is about to be freed.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_summary_inst_remove(struct srd_session *sess,
+		const struct srd_decoder_inst *di)
+{
+	struct srd_ann_summaries *sums;
+
+	sums = sess->ann_summaries;
+	g_mutex_lock(&sums->mutex);
+	g_hash_table_remove(sums->insts, di);
+	g_mutex_unlock(&sums->mutex);
+}
+
+/**
+ * Keep summaries of the annotations at several zoom levels.
+ *
+ * Drawing all annotations of a large capture zoomed out takes ages, and
+ * most of them end up in the same few pixels anyway. Instead, the session
+ * can count the annotations of every instance's annotation rows in buckets
+ * of samples, as they're put out. Level 0 has buckets of bucket_samples
+ * samples, and every further level has buckets 8 times as wide. A frontend
+ * then gets the level whose buckets are about a pixel wide, with
+ * srd_ann_summary_get(), which takes as long as there are buckets on the
+ * screen.
+ *
+ * An annotation is counted in the buckets its start sample falls into.
+ * Annotations of classes in no annotation row are summarized in a row of
+ * their own. Annotations the frontend didn't subscribe to aren't
+ * summarized, see srd_inst_ann_classes_set().
+ *
+ * The buckets are kept for the whole capture, one pointer for every
+ * bucket up to the last annotation, so bucket_samples shouldn't be much
+ * less than the number of samples of a pixel at the highest zoom level
+ * the summaries are used for.
+ *
+ * Must not be called while the session is decoding. Enabling the
+ * summaries again throws away the ones so far.
+ *
+ * @param sess The session.
+ * @param bucket_samples Number of samples in a bucket of level 0, or 0 to
+ *                       disable the summaries (the default).
+ * @param num_levels Number of levels, 1 to 16.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_session_ann_summary_set(struct srd_session *sess,
+		uint64_t bucket_samples, unsigned int num_levels)
+{
+	struct srd_ann_summaries *sums;
+	uint64_t width;
+	unsigned int level;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if (bucket_samples) {
+		if (num_levels < 1 || num_levels > SUMMARY_MAX_LEVELS) {
+			srd_err("Invalid number of summary levels %u.",
+					num_levels);
+			return SRD_ERR_ARG;
+		}
+		width = bucket_samples;
+		for (level = 1; level < num_levels; level++) {
+			if (width > G_MAXUINT64 / SUMMARY_LEVEL_FACTOR) {
+				srd_err("Summary buckets too wide.");
+				return SRD_ERR_ARG;
+			}
+			width *= SUMMARY_LEVEL_FACTOR;
+		}
+	}
+
+	if ((sums = sess->ann_summaries)) {
+		g_hash_table_destroy(sums->insts);
+		g_mutex_clear(&sums->mutex);
+		g_free(sums);
+		sess->ann_summaries = NULL;
+	}
+
+	if (!bucket_samples)
+		return SRD_OK;
+
+	sums = g_malloc0(sizeof(struct srd_ann_summaries));
+	g_mutex_init(&sums->mutex);
+	sums->bucket_samples = bucket_samples;
+	sums->num_levels = num_levels;
+	sums->insts = g_hash_table_new_full(g_direct_hash, g_direct_equal,
+			NULL, (GDestroyNotify)summary_inst_free);
+	sess->ann_summaries = sums;
+
+	srd_dbg("Summarizing annotations in buckets of %" PRIu64
+			" samples, %u levels.", bucket_samples, num_levels);
+
+	return SRD_OK;
+}
+
+/**
+ * Get the summaries of an annotation row for a range of samples.
+ *
+ * Can be called while the session is decoding in its thread, see
+ * srd_session_queue_set(). Buckets which are still being added to may
+ * have more annotations by the next call.
+ *
+ * @param di The decoder instance.
+ * @param row_id The ID of the annotation row, or NULL for the annotation
+ *               classes in no row.
+ * @param level The zoom level, its buckets are bucket_samples * 8^level
+ *              samples wide, see srd_session_ann_summary_set().
+ * @param start_sample The first sample of the range.
+ * @param end_sample The sample after the last one of the range.
+ * @param summaries Gets a newly allocated array of struct srd_ann_summary,
+ *                  one for every bucket with annotations which overlaps
+ *                  the range, in order. Free it with g_array_free(), or
+ *                  g_array_unref(), which also frees the summaries.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.3.0
+ */
+SRD_API int srd_ann_summary_get(const struct srd_decoder_inst *di,
+		const char *row_id, unsigned int level, uint64_t start_sample,
+		uint64_t end_sample, GArray **summaries)
+{
+	struct srd_ann_summaries *sums;
+	struct srd_ann_summary summary;
+	struct summary_inst *si;
+	struct summary_row *row;
+	struct summary_bucket *b;
+	GPtrArray *buckets;
+	uint64_t width, n, last;
+	unsigned int i;
+	int r;
+
+	if (!di || !summaries) {
+		srd_err("Invalid arguments.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!(sums = di->sess->ann_summaries)) {
+		srd_err("Annotation summaries aren't enabled.");
+		return SRD_ERR_ARG;
+	}
+
+	if (level >= sums->num_levels) {
+		srd_err("Invalid summary level %u.", level);
+		return SRD_ERR_ARG;
+	}
+
+	if (start_sample >= end_sample) {
+		srd_err("Invalid sample range.");
+		return SRD_ERR_ARG;
+	}
+
+	if ((r = srd_decoder_row_find(di->decoder, row_id)) < 0) {
+		srd_err("Invalid annotation row '%s'.", row_id);
+		return SRD_ERR_ARG;
+	}
+
+	*summaries = g_array_new(FALSE, FALSE, sizeof(struct srd_ann_summary));
+	g_array_set_clear_func(*summaries, (GDestroyNotify)summary_clear);
+
+	g_mutex_lock(&sums->mutex);
+
+	if (!(si = g_hash_table_lookup(sums->insts, di))) {
+		/* No annotations yet. */
+		g_mutex_unlock(&sums->mutex);
+		return SRD_OK;
+	}
+	row = &si->rows[r];
+	buckets = row->levels[level];
+	bucket_last_text_set(row, level);
+
+	width = sums->bucket_samples;
+	for (i = 0; i < level; i++)
+		width *= SUMMARY_LEVEL_FACTOR;
+
+	last = (end_sample - 1) / width;
+	for (n = start_sample / width; n < buckets->len && n <= last; n++) {
+		if (!(b = g_ptr_array_index(buckets, n)))
+			continue;
+		summary.start_sample = n * width;
+		summary.end_sample = summary.start_sample + width;
+		summary.num_annotations = b->count;
+		summary.first_text = g_strdup(b->first_text);
+		summary.last_text = g_strdup(b->last_text);
+		summary.class_counts = g_memdup(b->class_counts,
+				sizeof(uint64_t) * si->num_classes);
+		summary.num_classes = si->num_classes;
+		g_array_append_val(*summaries, summary);
+	}
+
+	g_mutex_unlock(&sums->mutex);
+
+	return SRD_OK;
+}
@@ -0,0 +1,1322 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+ */
+
+#include "../libsigrokdecode.h" /* First, to avoid compiler warning. */
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <inttypes.h>
+#include <glib.h>
+#include <glib/gstdio.h>
+
+/*
+ * Simple throughput benchmarks for libsigrokdecode.
+ *
+ * Run all of them with "make bench", or a subset by passing their names
+ * to tests/bench. Every benchmark feeds generated sample data through a
+ * real decoding session and reports the achieved rate, except for
+ * "startup", which times loading all decoders.
+ *
+ * The "proto-<pd>" benchmarks (or all of them, with "proto") decode a
+ * signal generated for one of the major PDs each, and also report their
+ * peak memory use. Their samplerate, bitrate and idle ratio can be set
+ * with options, see "tests/bench --help".
+ */
+
+#define CHUNK_SIZE (1024 * 1024)
+
+struct bench {
+	const char *name;
+	const char *desc;
+	/* Returns the number of samples decoded, or 0 on failure. */
+	uint64_t (*run)(void);
+};
+
+static uint64_t num_annotations;
+
+static void count_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	(void)pdata;
+	(void)cb_data;
+
+	num_annotations++;
+}
+
+/*
+ * Generate an 8N1 UART signal on bit 0 of each (1 byte) sample, with the
+ * line idling high in between bytes for idle_bits bit times. The data
+ * bytes simply count up.
+ */
+static void gen_uart(uint8_t *buf, uint64_t num_samples, uint64_t samplerate,
+		uint64_t baudrate, int idle_bits)
+{
+	uint64_t i, bitnum;
+	int frame_bits, bitpos, byte, bit;
+
+	frame_bits = 10 + idle_bits;
+	for (i = 0; i < num_samples; i++) {
+		bitnum = i * baudrate / samplerate;
+		bitpos = bitnum % frame_bits;
+		byte = (bitnum / frame_bits) & 0xff;
+		if (bitpos == 0)
+			bit = 0;
+		else if (bitpos <= 8)
+			bit = (byte >> (bitpos - 1)) & 1;
+		else
+			bit = 1;
+		/* RX on bit 0, TX idles high on bit 1. */
+		buf[i] = bit | 0x02;
+	}
+}
+
+/*
+ * Generate JTAG traffic in 16-bit samples, with the JTAG signals spread
+ * over both bytes (see jtag_channels[]) and unrelated activity on the
+ * remaining channels. TMS and TDI come from an LFSR, and change on the
+ * falling TCK edge.
+ */
+static void gen_jtag(uint8_t *buf, uint64_t num_samples, int clk_div)
+{
+	uint64_t i;
+	uint16_t sample, lfsr;
+	int tck, old_tck;
+
+	lfsr = 0xace1;
+	old_tck = 0;
+	for (i = 0; i < num_samples; i++) {
+		tck = (i / clk_div) & 1;
+		if (old_tck && !tck)
+			lfsr = (lfsr >> 1) ^ (-(lfsr & 1) & 0xb400);
+		old_tck = tck;
+		/* Unrelated channels 0 and 7 toggle all the time. */
+		sample = (i & 1) | ((i & 2) << 6);
+		sample |= (lfsr & 1) << 9;		/* TDI */
+		sample |= ((lfsr >> 3) & 1) << 10;	/* TDO */
+		sample |= tck << 3;			/* TCK */
+		sample |= ((lfsr >> 7) & 1) << 12;	/* TMS */
+		sample |= 1 << 14;			/* TRST# */
+		sample |= 1 << 15;			/* SRST# */
+		buf[i * 2] = sample & 0xff;
+		buf[i * 2 + 1] = sample >> 8;
+	}
+}
+
+/*
+ * Generate an idle bus in 8-bit samples: channels 0 and 1 stay high, except
+ * for a single low sample on channel 1 every glitch_period samples (if not
+ * 0). Unrelated channel 7 toggles all the time.
+ */
+static void gen_idle(uint8_t *buf, uint64_t num_samples, uint64_t glitch_period)
+{
+	uint64_t i;
+
+	for (i = 0; i < num_samples; i++) {
+		buf[i] = 0x03 | ((i & 1) << 7);
+		if (glitch_period && i % glitch_period == glitch_period / 2)
+			buf[i] &= ~0x02;
+	}
+}
+
+static const struct {
+	const char *id;
+	int channel;
+} jtag_channels[] = {
+	{"tdi", 9}, {"tdo", 10}, {"tck", 3}, {"tms", 12},
+	{"trst", 14}, {"srst", 15}, {"rtck", 5},
+};
+
+static uint64_t feed(struct srd_session *sess, const uint8_t *buf,
+		uint64_t num_samples, int unitsize)
+{
+	uint64_t i, len;
+
+	for (i = 0; i < num_samples * unitsize; i += len) {
+		len = MIN(CHUNK_SIZE, num_samples * unitsize - i);
+		if (srd_session_send(sess, i / unitsize,
+				(i + len) / unitsize, buf + i, len) != SRD_OK)
+			return 0;
+	}
+
+	return num_samples;
+}
+
+static struct srd_session *session_new(void)
+{
+	struct srd_session *sess;
+
+	srd_session_new(&sess);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, count_cb, NULL);
+
+	return sess;
+}
+
+static int session_start(struct srd_session *sess, uint64_t samplerate)
+{
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(samplerate));
+
+	return srd_session_start(sess);
+}
+
+/*
+ * UART is one of the decoders which looks at every single sample, so this
+ * mostly measures the cost of the sample iterator.
+ */
+static uint64_t bench_uart(void)
+{
+	struct srd_session *sess;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_uart(buf, num_samples, 1000000, 115200, 2);
+
+	sess = session_new();
+	srd_inst_new(sess, "uart", NULL);
+	ret = 0;
+	if (session_start(sess, 1000000) == SRD_OK)
+		ret = feed(sess, buf, num_samples, 1);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+static void count_batch_cb(struct srd_proto_data *pdata, unsigned int count,
+		void *cb_data)
+{
+	(void)pdata;
+	(void)cb_data;
+
+	num_annotations += count;
+}
+
+/*
+ * The same as the UART benchmark, but with annotations delivered in
+ * batches instead of one callback per annotation.
+ */
+static uint64_t bench_uart_batch(void)
+{
+	struct srd_session *sess;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_uart(buf, num_samples, 1000000, 115200, 2);
+
+	srd_session_new(&sess);
+	srd_pd_output_batch_callback_set(sess, count_batch_cb, NULL, 0);
+	srd_inst_new(sess, "uart", NULL);
+	ret = 0;
+	if (session_start(sess, 1000000) == SRD_OK)
+		ret = feed(sess, buf, num_samples, 1);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+/*
+ * The same as the UART benchmark, but decoding in the session's own thread.
+ * This measures the overhead of queueing up copies of the sample data.
+ */
+static uint64_t bench_uart_thread(void)
+{
+	struct srd_session *sess;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_uart(buf, num_samples, 1000000, 115200, 2);
+
+	sess = session_new();
+	srd_session_queue_set(sess, 8, SRD_QUEUE_BLOCK);
+	srd_inst_new(sess, "uart", NULL);
+	ret = 0;
+	if (session_start(sess, 1000000) == SRD_OK)
+		ret = feed(sess, buf, num_samples, 1);
+	if (srd_session_queue_drain(sess) != SRD_OK)
+		ret = 0;
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+/*
+ * UART with four MIDI decoders stacked on top, so every Python packet from
+ * UART is dispatched to four instances.
+ */
+static uint64_t bench_stack(void)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di_uart;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+	int i;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_uart(buf, num_samples, 1000000, 115200, 0);
+
+	sess = session_new();
+	di_uart = srd_inst_new(sess, "uart", NULL);
+	for (i = 0; i < 4; i++)
+		srd_inst_stack(sess, di_uart, srd_inst_new(sess, "midi", NULL));
+	ret = 0;
+	if (session_start(sess, 1000000) == SRD_OK)
+		ret = feed(sess, buf, num_samples, 1);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+/*
+ * Four independent UART instances, decoding in the frontend process or
+ * in a worker process each.
+ */
+static uint64_t run_uart4(gboolean use_workers)
+{
+	struct srd_session *sess;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+	int i;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_uart(buf, num_samples, 1000000, 115200, 0);
+
+	sess = session_new();
+	srd_session_workers_set(sess, use_workers);
+	for (i = 0; i < 4; i++)
+		srd_inst_new(sess, "uart", NULL);
+	ret = 0;
+	if (session_start(sess, 1000000) == SRD_OK)
+		ret = feed(sess, buf, num_samples, 1);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+static uint64_t bench_uart4(void)
+{
+	return run_uart4(FALSE);
+}
+
+static uint64_t bench_uart4_workers(void)
+{
+	return run_uart4(TRUE);
+}
+
+/*
+ * The whole capture decoded at once, in 4 segments in parallel. The idle
+ * time in between bytes gives the decoder points to resynchronize at.
+ */
+static uint64_t bench_uart_segmented(void)
+{
+	struct srd_session *sess;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_uart(buf, num_samples, 1000000, 115200, 12);
+
+	sess = session_new();
+	srd_inst_new(sess, "uart", NULL);
+	ret = 0;
+	if (session_start(sess, 1000000) == SRD_OK
+			&& srd_session_send_segmented(sess, 0, buf,
+				num_samples, 4) == SRD_OK)
+		ret = num_samples;
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+/*
+ * A 7-channel JTAG decoder fed from a 16-channel capture, with unrelated
+ * channels toggling. This mostly measures extracting the decoder's channels
+ * from the samples.
+ */
+static uint64_t bench_jtag(void)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di;
+	GHashTable *channels;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+	unsigned int i;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples * 2);
+	gen_jtag(buf, num_samples, 8);
+
+	sess = session_new();
+	di = srd_inst_new(sess, "jtag", NULL);
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, g_free,
+			(GDestroyNotify)g_variant_unref);
+	for (i = 0; i < G_N_ELEMENTS(jtag_channels); i++)
+		g_hash_table_insert(channels, g_strdup(jtag_channels[i].id),
+			g_variant_ref_sink(g_variant_new_int32(jtag_channels[i].channel)));
+	ret = 0;
+	if (srd_inst_channel_set_all(di, channels, 2) == SRD_OK
+			&& session_start(sess, 1000000) == SRD_OK)
+		ret = feed(sess, buf, num_samples, 2);
+	g_hash_table_destroy(channels);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+/*
+ * A mostly idle I2C bus, with a START/STOP pair every million samples.
+ * I2C only looks at samples where SCL or SDA change, so this measures
+ * scanning the sample data for changes.
+ */
+static uint64_t bench_i2c_idle(void)
+{
+	struct srd_session *sess;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+
+	num_samples = 100 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_idle(buf, num_samples, 1000 * 1000);
+
+	sess = session_new();
+	srd_inst_new(sess, "i2c", NULL);
+	ret = 0;
+	if (session_start(sess, 1000000) == SRD_OK)
+		ret = feed(sess, buf, num_samples, 1);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+/*
+ * An idle CAN bus. The CAN PD waits for the dominant level of a SOF, so
+ * this measures scanning the sample data for a pattern.
+ */
+static uint64_t bench_can_idle(void)
+{
+	struct srd_session *sess;
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+
+	num_samples = 100 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_idle(buf, num_samples, 0);
+
+	sess = session_new();
+	srd_inst_new(sess, "can", NULL);
+	ret = 0;
+	if (session_start(sess, 8000000) == SRD_OK)
+		ret = feed(sess, buf, num_samples, 1);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return ret;
+}
+
+/*
+ * UART decoding in the last of many sessions, each holding several
+ * instances. Looking up the instance for every put() must not depend on
+ * how many other sessions and instances there are.
+ */
+static uint64_t bench_sessions(void)
+{
+	struct srd_session *sess[64];
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+	unsigned int i, j;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_uart(buf, num_samples, 1000000, 115200, 0);
+
+	for (i = 0; i < G_N_ELEMENTS(sess); i++) {
+		sess[i] = session_new();
+		for (j = 0; j < 8; j++)
+			srd_inst_new(sess[i], "uart", NULL);
+	}
+	ret = 0;
+	if (session_start(sess[i - 1], 1000000) == SRD_OK)
+		ret = feed(sess[i - 1], buf, num_samples, 1);
+	for (i = 0; i < G_N_ELEMENTS(sess); i++)
+		srd_session_destroy(sess[i]);
+	g_free(buf);
+
+	return ret;
+}
+
+static void count_session_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	(void)pdata;
+
+	(*(uint64_t *)cb_data)++;
+}
+
+struct parallel_job {
+	const uint8_t *buf;
+	uint64_t num_samples;
+	gboolean own_interp;
+	uint64_t count;
+	gboolean ok;
+};
+
+/*
+ * Set up a session, decode a whole buffer with it and destroy it again,
+ * all in the calling thread.
+ */
+static gpointer parallel_thread(gpointer data)
+{
+	struct parallel_job *job;
+	struct srd_session *sess;
+	uint64_t i, len;
+
+	job = data;
+	job->ok = srd_session_new(&sess) == SRD_OK;
+	if (!job->ok)
+		return NULL;
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN,
+			count_session_cb, &job->count);
+	if (srd_session_interpreter_set(sess, job->own_interp) != SRD_OK)
+		job->ok = FALSE;
+	srd_inst_new(sess, "uart", NULL);
+	if (session_start(sess, 1000000) != SRD_OK)
+		job->ok = FALSE;
+
+	for (i = 0; job->ok && i < job->num_samples; i += len) {
+		len = MIN(CHUNK_SIZE, job->num_samples - i);
+		if (srd_session_send(sess, i, i + len, job->buf + i, len) != SRD_OK)
+			job->ok = FALSE;
+	}
+
+	srd_session_destroy(sess);
+
+	return NULL;
+}
+
+/*
+ * UART in several sessions at once, each created, used and destroyed by
+ * a thread of its own, like a server would for each of its clients. The
+ * main Python interpreter is used, or one of each session's own. With a
+ * GIL per interpreter (Python 3.12 or later), the rate should scale with
+ * the number of sessions, up to the number of CPU cores.
+ */
+static uint64_t run_parallel(unsigned int num_sessions, gboolean own_interp)
+{
+	struct parallel_job jobs[8];
+	GThread *threads[8];
+	uint8_t *buf;
+	uint64_t num_samples, ret;
+	unsigned int s;
+
+	num_samples = 10 * 1000 * 1000;
+	buf = g_malloc(num_samples);
+	gen_uart(buf, num_samples, 1000000, 115200, 0);
+
+	for (s = 0; s < num_sessions; s++) {
+		jobs[s].buf = buf;
+		jobs[s].num_samples = num_samples;
+		jobs[s].own_interp = own_interp;
+		jobs[s].count = 0;
+		jobs[s].ok = FALSE;
+		threads[s] = g_thread_new("bench", parallel_thread, &jobs[s]);
+	}
+
+	ret = num_samples * num_sessions;
+	for (s = 0; s < num_sessions; s++) {
+		g_thread_join(threads[s]);
+		if (!jobs[s].ok)
+			ret = 0;
+		num_annotations += jobs[s].count;
+	}
+	g_free(buf);
+
+	return ret;
+}
+
+static uint64_t bench_interp1(void)
+{
+	return run_parallel(1, TRUE);
+}
+
+static uint64_t bench_interp2(void)
+{
+	return run_parallel(2, TRUE);
+}
+
+static uint64_t bench_interp4(void)
+{
+	return run_parallel(4, TRUE);
+}
+
+static uint64_t bench_interp8(void)
+{
+	return run_parallel(8, TRUE);
+}
+
+static uint64_t bench_shared4(void)
+{
+	return run_parallel(4, FALSE);
+}
+
+static const struct bench benchmarks[] = {
+	{"uart", "UART, 115200 baud at 1MHz, every sample", bench_uart},
+	{"uart-batch", "UART, annotations delivered in batches", bench_uart_batch},
+	{"uart-thread", "UART, decoding in the session's thread", bench_uart_thread},
+	{"stack", "UART with 4 stacked MIDI instances", bench_stack},
+	{"uart4", "4 UART instances", bench_uart4},
+	{"uart4-workers", "4 UART instances, in a worker process each", bench_uart4_workers},
+	{"uart-segmented", "UART with idle gaps, in 4 segments in parallel", bench_uart_segmented},
+	{"jtag", "JTAG, 7 of 16 channels, TCK = samplerate / 16", bench_jtag},
+	{"i2c-idle", "I2C, idle bus with a START/STOP every 1M samples", bench_i2c_idle},
+	{"can-idle", "CAN, idle bus", bench_can_idle},
+	{"sessions", "UART in the last of 64 sessions of 8 instances", bench_sessions},
+	{"interp1", "UART in 1 session thread, with its own interpreter", bench_interp1},
+	{"interp2", "UART in 2 session threads, an interpreter each", bench_interp2},
+	{"interp4", "UART in 4 session threads, an interpreter each", bench_interp4},
+	{"interp8", "UART in 8 session threads, an interpreter each", bench_interp8},
+	{"shared4", "UART in 4 session threads, sharing the main interpreter", bench_shared4},
+	{NULL, NULL, NULL},
+};
+
+/*
+ * Time srd_init() and srd_decoder_load_all(), as done by frontends at
+ * startup. Returns the time in seconds, or a negative value on failure.
+ */
+static double startup_time(void)
+{
+	GTimer *timer;
+	double secs;
+
+	timer = g_timer_new();
+	if (srd_init(DECODERS_DIR) != SRD_OK) {
+		g_timer_destroy(timer);
+		return -1;
+	}
+	srd_log_loglevel_set(SRD_LOG_NONE);
+	srd_decoder_load_all();
+	secs = g_timer_elapsed(timer, NULL);
+	srd_exit();
+	g_timer_destroy(timer);
+
+	return secs;
+}
+
+/*
+ * Startup with an empty decoder index, which imports all decoder modules
+ * (and fills the index), and with a filled one.
+ */
+static int bench_startup(void)
+{
+	char *dir, *path;
+	double cold, warm;
+
+	if (!(dir = g_dir_make_tmp("srd-bench-XXXXXX", NULL)))
+		return EXIT_FAILURE;
+	g_setenv("SIGROKDECODE_CACHE_DIR", dir, TRUE);
+	cold = startup_time();
+	warm = startup_time();
+	g_unsetenv("SIGROKDECODE_CACHE_DIR");
+	path = g_build_filename(dir, "decoders.index", NULL);
+	g_remove(path);
+	g_free(path);
+	g_rmdir(dir);
+	g_free(dir);
+
+	if (cold < 0 || warm < 0) {
+		printf("%-16s FAILED\n", "startup");
+		return EXIT_FAILURE;
+	}
+	printf("%-16s %12.1f ms cold %12.1f ms from the decoder index\n",
+		"startup", cold * 1000, warm * 1000);
+
+	return EXIT_SUCCESS;
+}
+
+static gboolean wanted(const char *name, int argc, char **argv)
+{
+	int i;
+
+	if (argc < 2)
+		return TRUE;
+	for (i = 1; i < argc; i++) {
+		if (!strcmp(argv[i], name))
+			return TRUE;
+	}
+
+	return FALSE;
+}
+
+/*
+ * Protocol benchmarks: one for each of the major PDs, fed with a signal
+ * generated for it. Each generator builds one period of its signal as a
+ * sequence of symbols (sample values) at symbols_per_bit times the bitrate,
+ * which is repeated and stretched to the samplerate. The data counts up,
+ * so the signal is always the same for the same parameters.
+ */
+
+#define PROTO_FRAMES 64
+
+struct gen_params {
+	uint64_t samplerate;
+	uint64_t bitrate;
+	/* Fraction of the time the bus is idle, in between frames. */
+	double idle;
+};
+
+struct proto {
+	const char *id;
+	const char *desc;
+	uint64_t samplerate;
+	uint64_t bitrate;
+	unsigned int symbols_per_bit;
+	void (*gen)(GByteArray *p, const struct gen_params *gp);
+	/* Adds the options needed for the given parameters, if any. */
+	void (*options)(GHashTable *options, const struct gen_params *gp);
+};
+
+static void sym(GByteArray *p, uint8_t value, unsigned int count)
+{
+	while (count--)
+		g_byte_array_append(p, &value, 1);
+}
+
+/* Pad the frame starting at symbol start with idle symbols. */
+static void idle(GByteArray *p, guint start, uint8_t value,
+		const struct gen_params *gp)
+{
+	sym(p, value, (p->len - start) * gp->idle / (1 - gp->idle) + 0.5);
+}
+
+static gboolean parity(uint64_t bits)
+{
+	gboolean p;
+
+	for (p = FALSE; bits; bits &= bits - 1)
+		p = !p;
+
+	return p;
+}
+
+/* UART 8N1 on rx (channel 0), tx (channel 1) idles high. */
+static void gen_proto_uart(GByteArray *p, const struct gen_params *gp)
+{
+	guint start;
+	int f, i;
+
+	for (f = 0; f < PROTO_FRAMES * 4; f++) {
+		start = p->len;
+		sym(p, 0x02, 1);
+		for (i = 0; i < 8; i++)
+			sym(p, 0x02 | ((f >> i) & 1), 1);
+		sym(p, 0x03, 1);
+		idle(p, start, 0x03, gp);
+	}
+}
+
+/* SPI mode 0 transfers of 8 bytes: clk 0, miso 1, mosi 2, cs# 3. */
+static void gen_proto_spi(GByteArray *p, const struct gen_params *gp)
+{
+	guint start;
+	uint8_t mosi, miso, v;
+	int f, i, b;
+
+	for (f = 0; f < PROTO_FRAMES; f++) {
+		start = p->len;
+		sym(p, 0x08, 2);
+		for (i = 0; i < 8; i++) {
+			mosi = f * 8 + i;
+			miso = ~mosi;
+			for (b = 7; b >= 0; b--) {
+				v = (((miso >> b) & 1) << 1)
+					| (((mosi >> b) & 1) << 2);
+				sym(p, v, 1);
+				sym(p, v | 0x01, 1);
+			}
+		}
+		sym(p, 0x00, 1);
+		sym(p, 0x08, 1);
+		idle(p, start, 0x08, gp);
+	}
+}
+
+/* One I2C bit in 4 symbols: scl 0, sda 1. */
+static void i2c_bit(GByteArray *p, int bit)
+{
+	uint8_t sda;
+
+	sda = bit ? 0x02 : 0x00;
+	sym(p, sda, 2);
+	sym(p, sda | 0x01, 2);
+}
+
+/* I2C writes of 4 bytes to address 0x50, all ACKed. */
+static void gen_proto_i2c(GByteArray *p, const struct gen_params *gp)
+{
+	guint start;
+	int f, i, b, byte;
+
+	for (f = 0; f < PROTO_FRAMES; f++) {
+		start = p->len;
+		/* START: SDA falls while SCL is high. */
+		sym(p, 0x03, 2);
+		sym(p, 0x01, 2);
+		for (i = 0; i < 5; i++) {
+			byte = i ? (f * 4 + i - 1) & 0xff : 0x50 << 1;
+			for (b = 7; b >= 0; b--)
+				i2c_bit(p, (byte >> b) & 1);
+			i2c_bit(p, 0);
+		}
+		/* STOP: SDA rises while SCL is high. */
+		sym(p, 0x00, 1);
+		sym(p, 0x01, 1);
+		sym(p, 0x03, 2);
+		idle(p, start, 0x03, gp);
+	}
+}
+
+/* Append a bit to a CAN frame, with bit stuffing. */
+static void can_bit(GByteArray *p, int bit, int *run, int *last)
+{
+	if (*run == 5) {
+		sym(p, !*last, 1);
+		*last = !*last;
+		*run = 1;
+	}
+	sym(p, bit, 1);
+	*run = (bit == *last) ? *run + 1 : 1;
+	*last = bit;
+}
+
+/* CAN 2.0A data frames of 8 bytes on can_rx (channel 0). */
+static void gen_proto_can(GByteArray *p, const struct gen_params *gp)
+{
+	guint start;
+	uint16_t crc;
+	int f, i, n, bit, run, last;
+
+	for (f = 0; f < PROTO_FRAMES; f++) {
+		start = p->len;
+		run = 0;
+		last = -1;
+		crc = 0;
+		/* SOF, ID, RTR, IDE, r0, DLC and data, then the CRC. */
+		for (i = 0; i < 19 + 64 + 15; i++) {
+			if (i == 0)
+				bit = 0;
+			else if (i < 12)
+				bit = (((f & 0x3ff) | 0x100) >> (11 - i)) & 1;
+			else if (i < 15)
+				bit = 0;
+			else if (i < 19)
+				bit = (8 >> (18 - i)) & 1;
+			else if (i < 19 + 64) {
+				n = i - 19;
+				bit = (((f * 8 + n / 8) & 0xff) >> (7 - n % 8)) & 1;
+			} else
+				bit = (crc >> (19 + 64 + 14 - i)) & 1;
+			if (i < 19 + 64) {
+				crc = (crc << 1) ^ ((bit ^ (crc >> 14)) & 1
+					? 0x4599 : 0);
+				crc &= 0x7fff;
+			}
+			can_bit(p, bit, &run, &last);
+		}
+		/* CRC delimiter, ACK, ACK delimiter, EOF and intermission. */
+		sym(p, 1, 1);
+		sym(p, 0, 1);
+		sym(p, 1, 11);
+		idle(p, start, 1, gp);
+	}
+}
+
+/* USB packets of a DATA0 PID and 8 bytes, NRZI coded: dp 0, dm 1. */
+static void gen_proto_usb(GByteArray *p, const struct gen_params *gp)
+{
+	guint start;
+	uint8_t j, level;
+	int f, i, b, byte, ones;
+
+	/* Full-speed J is D+ high, low-speed J is D- high. */
+	j = gp->bitrate > 1500000 ? 0x01 : 0x02;
+	for (f = 0; f < PROTO_FRAMES; f++) {
+		start = p->len;
+		level = j;
+		ones = 0;
+		for (i = 0; i < 10; i++) {
+			if (i == 0)
+				byte = 0x80;	/* SYNC */
+			else if (i == 1)
+				byte = 0xc3;	/* DATA0 */
+			else
+				byte = f * 8 + i - 2;
+			for (b = 0; b < 8; b++) {
+				if ((byte >> b) & 1) {
+					sym(p, level, 1);
+					if (++ones < 6)
+						continue;
+					/* Stuff a 0 after six 1s. */
+					level ^= 0x03;
+					sym(p, level, 1);
+				} else {
+					level ^= 0x03;
+					sym(p, level, 1);
+				}
+				ones = 0;
+			}
+		}
+		/* EOP: SE0 for two bit times, then J. */
+		sym(p, 0x00, 2);
+		sym(p, j, 1);
+		idle(p, start, j, gp);
+	}
+}
+
+static void usb_options(GHashTable *options, const struct gen_params *gp)
+{
+	g_hash_table_insert(options, g_strdup("signalling"),
+		g_variant_ref_sink(g_variant_new_string(gp->bitrate > 1500000
+			? "full-speed" : "low-speed")));
+}
+
+/*
+ * 1-Wire: a reset with presence pulse, then a Skip ROM command and 8 bytes.
+ * One symbol is a microsecond at the default bitrate (64us slots); owr is
+ * channel 0, pwr 1.
+ */
+static void gen_proto_onewire(GByteArray *p, const struct gen_params *gp)
+{
+	guint start;
+	int f, i, b, byte;
+
+	for (f = 0; f < PROTO_FRAMES; f++) {
+		start = p->len;
+		sym(p, 0x02, 500);
+		sym(p, 0x03, 15);
+		sym(p, 0x02, 120);
+		sym(p, 0x03, 365);
+		for (i = 0; i < 9; i++) {
+			byte = i ? (f * 8 + i - 1) & 0xff : 0xcc;
+			for (b = 0; b < 8; b++) {
+				if ((byte >> b) & 1) {
+					sym(p, 0x02, 6);
+					sym(p, 0x03, 58);
+				} else {
+					sym(p, 0x02, 55);
+					sym(p, 0x03, 9);
+				}
+			}
+		}
+		idle(p, start, 0x03, gp);
+	}
+}
+
+/* One JTAG clock cycle: tdi 0, tdo 1, tck 2, tms 3, trst# 4, srst# 5. */
+static void jtag_cycle(GByteArray *p, int tms, int tdi, int tdo)
+{
+	uint8_t v;
+
+	v = 0x30 | (tms << 3) | (tdo << 1) | tdi;
+	sym(p, v, 1);
+	sym(p, v | 0x04, 1);
+}
+
+/* JTAG: a TAP reset, an 8-bit IR scan and a 32-bit DR scan. */
+static void gen_proto_jtag(GByteArray *p, const struct gen_params *gp)
+{
+	static const int to_shift_ir[] = {0, 1, 1, 0, 0};
+	static const int to_shift_dr[] = {1, 0, 0};
+	guint start;
+	uint32_t dr;
+	int f, i;
+
+	for (f = 0; f < PROTO_FRAMES; f++) {
+		start = p->len;
+		for (i = 0; i < 5; i++)
+			jtag_cycle(p, 1, 0, 0);
+		for (i = 0; i < 5; i++)
+			jtag_cycle(p, to_shift_ir[i], 0, 0);
+		for (i = 0; i < 8; i++)
+			jtag_cycle(p, i == 7, (f >> i) & 1, i == 0);
+		/* Update-IR, then on to Shift-DR. */
+		jtag_cycle(p, 1, 0, 0);
+		for (i = 0; i < 3; i++)
+			jtag_cycle(p, to_shift_dr[i], 0, 0);
+		dr = f * 0x01010101;
+		for (i = 0; i < 32; i++)
+			jtag_cycle(p, i == 31, (dr >> i) & 1, (~dr >> i) & 1);
+		/* Update-DR, Run-Test/Idle. */
+		jtag_cycle(p, 1, 0, 0);
+		jtag_cycle(p, 0, 0, 0);
+		sym(p, 0x30, 2);
+		idle(p, start, 0x30, gp);
+	}
+}
+
+/* One SWD clock cycle, swdio held over it: swclk 0, swdio 1. */
+static void swd_cycle(GByteArray *p, int swdio)
+{
+	sym(p, swdio << 1, 1);
+	sym(p, (swdio << 1) | 0x01, 1);
+}
+
+/* SWD: a line reset, then reads of the DP's IDCODE and of AP registers. */
+static void gen_proto_swd(GByteArray *p, const struct gen_params *gp)
+{
+	guint start;
+	uint32_t data;
+	int f, i, apndp, addr, req;
+
+	start = p->len;
+	for (i = 0; i < 56; i++)
+		swd_cycle(p, 1);
+	swd_cycle(p, 0);
+	swd_cycle(p, 0);
+	for (f = 0; f < PROTO_FRAMES; f++) {
+		if (f)
+			start = p->len;
+		apndp = f & 1;
+		addr = apndp ? f & 3 : 0;
+		/* Start, APnDP, RnW, A[2:3], parity, stop, park. */
+		req = 1 | (apndp << 1) | (1 << 2) | (addr << 3);
+		req |= parity(req & 0x1e) << 5;
+		req |= 1 << 7;
+		for (i = 0; i < 8; i++)
+			swd_cycle(p, (req >> i) & 1);
+		/* Turnaround, then ACK OK. */
+		swd_cycle(p, 1);
+		swd_cycle(p, 1);
+		swd_cycle(p, 0);
+		swd_cycle(p, 0);
+		data = apndp ? f * 0x01010101 : 0x2ba01477;
+		for (i = 0; i < 32; i++)
+			swd_cycle(p, (data >> i) & 1);
+		swd_cycle(p, parity(data));
+		/* Turnaround back to the host. */
+		swd_cycle(p, 0);
+		sym(p, 0x00, 2);
+		idle(p, start, 0x00, gp);
+	}
+}
+
+/*
+ * I2S, 16-bit stereo: sck 0, ws 1, sd 2. WS changes a bit before the MSB,
+ * and is high for the left channel, like the PD expects. The stream is
+ * continuous, so there's no idle time.
+ */
+static void gen_proto_i2s(GByteArray *p, const struct gen_params *gp)
+{
+	uint16_t word;
+	uint8_t v;
+	int f, i;
+
+	(void)gp;
+
+	for (f = 0; f < PROTO_FRAMES * 2; f++) {
+		for (i = 0; i < 32; i++) {
+			word = (i < 16 ? f : ~f) * 0x0101;
+			v = (((word >> (15 - i % 16)) & 1) << 2)
+				| ((~((i + 1) / 16) & 1) << 1);
+			sym(p, v, 1);
+			sym(p, v | 0x01, 1);
+		}
+	}
+}
+
+/* Biphase-mark code a number of bits, LSB first. */
+static void spdif_bits(GByteArray *p, uint8_t *level, uint32_t bits, int n)
+{
+	int i;
+
+	for (i = 0; i < n; i++) {
+		*level ^= 1;
+		sym(p, *level, 1);
+		if ((bits >> i) & 1)
+			*level ^= 1;
+		sym(p, *level, 1);
+	}
+}
+
+/*
+ * S/PDIF frames of two subframes with 20-bit samples, on data (channel 0).
+ * One symbol is half a bit. The stream is continuous, so there's no idle
+ * time.
+ */
+static void gen_proto_spdif(GByteArray *p, const struct gen_params *gp)
+{
+	/* Preamble pulse widths in symbols: B, M, W. */
+	static const int preambles[3][4] = {
+		{3, 1, 1, 3}, {3, 3, 1, 1}, {3, 2, 1, 2},
+	};
+	const int *pre;
+	uint32_t bits;
+	uint8_t level;
+	int f, sf, i;
+
+	(void)gp;
+
+	level = 0;
+	for (f = 0; f < PROTO_FRAMES * 3; f++) {
+		for (sf = 0; sf < 2; sf++) {
+			pre = preambles[sf ? 2 : (f % 192 ? 1 : 0)];
+			for (i = 0; i < 4; i++) {
+				level ^= 1;
+				sym(p, level, pre[i]);
+			}
+			/* Aux, audio sample, V, U, C, then even parity. */
+			bits = ((f * 0x1111 + sf) & 0xfffff) << 4;
+			bits |= parity(bits) << 27;
+			spdif_bits(p, &level, bits, 28);
+		}
+	}
+}
+
+static void uart_options(GHashTable *options, const struct gen_params *gp)
+{
+	g_hash_table_insert(options, g_strdup("baudrate"),
+		g_variant_ref_sink(g_variant_new_int64(gp->bitrate)));
+}
+
+static void can_options(GHashTable *options, const struct gen_params *gp)
+{
+	g_hash_table_insert(options, g_strdup("bitrate"),
+		g_variant_ref_sink(g_variant_new_int64(gp->bitrate)));
+}
+
+static const struct proto protocols[] = {
+	{"uart", "8N1", 1000000, 115200, 1, gen_proto_uart, uart_options},
+	{"spi", "mode 0, 8 bytes per transfer", 8000000, 1000000, 2,
+		gen_proto_spi, NULL},
+	{"i2c", "4 byte writes", 4000000, 100000, 4, gen_proto_i2c, NULL},
+	{"can", "8 byte data frames", 8000000, 500000, 1, gen_proto_can,
+		can_options},
+	{"usb_signalling", "full-speed, 8 byte DATA0 packets", 48000000,
+		12000000, 1, gen_proto_usb, usb_options},
+	{"onewire_link", "standard speed, reset and 9 bytes", 1000000,
+		15625, 64, gen_proto_onewire, NULL},
+	{"jtag", "8-bit IR and 32-bit DR scans", 8000000, 1000000, 2,
+		gen_proto_jtag, NULL},
+	{"swd", "DP and AP reads", 8000000, 1000000, 2, gen_proto_swd, NULL},
+	{"i2s", "16-bit stereo at 48kHz, no idle", 12288000, 1536000, 2,
+		gen_proto_i2s, NULL},
+	{"spdif", "48kHz, no idle", 24576000, 3072000, 2, gen_proto_spdif,
+		NULL},
+	{NULL, NULL, 0, 0, 0, NULL, NULL},
+};
+
+/* Overrides of the protocols' defaults, from the command line. */
+static gint64 opt_samplerate = 0;
+static gint64 opt_bitrate = 0;
+static gdouble opt_idle = 0.25;
+static gint64 opt_samples = 10 * 1000 * 1000;
+
+static const GOptionEntry optargs[] = {
+	{"samplerate", 'r', 0, G_OPTION_ARG_INT64, &opt_samplerate,
+		"Samplerate of the protocol benchmarks", "<Hz>"},
+	{"bitrate", 'b', 0, G_OPTION_ARG_INT64, &opt_bitrate,
+		"Bitrate of the protocol benchmarks", "<bit/s>"},
+	{"idle", 'i', 0, G_OPTION_ARG_DOUBLE, &opt_idle,
+		"Fraction of the time the bus is idle (default 0.25)", "<ratio>"},
+	{"samples", 'n', 0, G_OPTION_ARG_INT64, &opt_samples,
+		"Number of samples per protocol benchmark", "<n>"},
+	{NULL, 0, 0, 0, NULL, NULL, NULL},
+};
+
+/*
+ * Peak memory use, in kB: the high water mark of the resident set size,
+ * which can be reset on Linux. Returns 0 where that isn't available.
+ */
+static uint64_t peak_rss(void)
+{
+	char *status, *line;
+	uint64_t kb;
+
+	kb = 0;
+	if (g_file_get_contents("/proc/self/status", &status, NULL, NULL)) {
+		if ((line = strstr(status, "VmHWM:")))
+			kb = g_ascii_strtoull(line + 6, NULL, 10);
+		g_free(status);
+	}
+
+	return kb;
+}
+
+static void peak_rss_reset(void)
+{
+	FILE *f;
+
+	if ((f = fopen("/proc/self/clear_refs", "w"))) {
+		fputs("5", f);
+		fclose(f);
+	}
+}
+
+/*
+ * Decode a protocol's signal. Returns the number of samples decoded, or 0
+ * on failure, the time it took, and the memory used for decoding on top of
+ * what was in use before, in kB.
+ */
+static uint64_t run_proto(const struct proto *pr, double *secs,
+		uint64_t *mem_kb)
+{
+	struct gen_params gp;
+	struct srd_session *sess;
+	GHashTable *options;
+	GTimer *timer;
+	GByteArray *p;
+	uint8_t *buf;
+	uint64_t symbolrate, i, before, ret;
+
+	gp.samplerate = opt_samplerate ? (uint64_t)opt_samplerate
+			: pr->samplerate;
+	gp.bitrate = opt_bitrate ? (uint64_t)opt_bitrate : pr->bitrate;
+	gp.idle = opt_idle;
+	symbolrate = gp.bitrate * pr->symbols_per_bit;
+
+	p = g_byte_array_new();
+	pr->gen(p, &gp);
+	buf = g_malloc(opt_samples);
+	for (i = 0; i < (uint64_t)opt_samples; i++)
+		buf[i] = p->data[(i * symbolrate / gp.samplerate) % p->len];
+	g_byte_array_free(p, TRUE);
+
+	peak_rss_reset();
+	before = peak_rss();
+	timer = g_timer_new();
+	ret = 0;
+	sess = session_new();
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, g_free,
+			(GDestroyNotify)g_variant_unref);
+	if (pr->options)
+		pr->options(options, &gp);
+	if (srd_inst_new(sess, pr->id, options)
+			&& session_start(sess, gp.samplerate) == SRD_OK)
+		ret = feed(sess, buf, opt_samples, 1);
+	g_hash_table_destroy(options);
+	srd_session_destroy(sess);
+	*secs = g_timer_elapsed(timer, NULL);
+	*mem_kb = peak_rss() - before;
+	g_timer_destroy(timer);
+	g_free(buf);
+
+	return ret;
+}
+
+static int bench_protocols(int argc, char **argv)
+{
+	const struct proto *pr;
+	uint64_t num_samples, mem_kb;
+	double secs;
+	char name[32];
+	int ret;
+
+	ret = EXIT_SUCCESS;
+	for (pr = protocols; pr->id; pr++) {
+		g_snprintf(name, sizeof(name), "proto-%s", pr->id);
+		if (!wanted(name, argc, argv) && !wanted("proto", argc, argv))
+			continue;
+		num_annotations = 0;
+		num_samples = run_proto(pr, &secs, &mem_kb);
+		if (!num_samples) {
+			printf("%-16s FAILED\n", name);
+			ret = EXIT_FAILURE;
+			continue;
+		}
+		printf("%-16s %12.0f samples/s %10.0f annotations/s "
+			"%8.1f MiB peak  (%s)\n", name, num_samples / secs,
+			num_annotations / secs, mem_kb / 1024.0, pr->desc);
+	}
+
+	return ret;
+}
+
+int main(int argc, char **argv)
+{
+	const struct bench *b;
+	GOptionContext *ctx;
+	GError *error;
+	GTimer *timer;
+	uint64_t num_samples;
+	double secs;
+	int ret;
+
+	ctx = g_option_context_new("[BENCHMARK...]");
+	g_option_context_add_main_entries(ctx, optargs, NULL);
+	error = NULL;
+	if (!g_option_context_parse(ctx, &argc, &argv, &error)) {
+		fprintf(stderr, "%s\n", error->message);
+		g_error_free(error);
+		g_option_context_free(ctx);
+		return EXIT_FAILURE;
+	}
+	g_option_context_free(ctx);
+	if (opt_samplerate < 0 || opt_bitrate < 0 || opt_samples < 1
+			|| opt_idle < 0 || opt_idle >= 1) {
+		fprintf(stderr, "Invalid protocol benchmark parameters.\n");
+		return EXIT_FAILURE;
+	}
+
+	/* This needs libsigrokdecode uninitialized. */
+	ret = EXIT_SUCCESS;
+	if (wanted("startup", argc, argv))
+		ret = bench_startup();
+
+	if (srd_init(DECODERS_DIR) != SRD_OK)
+		return EXIT_FAILURE;
+	srd_log_loglevel_set(SRD_LOG_NONE);
+	srd_decoder_load_all();
+
+	timer = g_timer_new();
+	for (b = benchmarks; b->name; b++) {
+		if (!wanted(b->name, argc, argv))
+			continue;
+		num_annotations = 0;
+		g_timer_start(timer);
+		num_samples = b->run();
+		secs = g_timer_elapsed(timer, NULL);
+		if (!num_samples) {
+			printf("%-16s FAILED\n", b->name);
+			ret = EXIT_FAILURE;
+			continue;
+		}
+		printf("%-16s %12.0f samples/s %10.0f annotations/s  (%s)\n",
+			b->name, num_samples / secs, num_annotations / secs,
+			b->desc);
+	}
+	g_timer_destroy(timer);
+
+	if (bench_protocols(argc, argv) != EXIT_SUCCESS)
+		ret = EXIT_FAILURE;
+
+	srd_exit();
+
+	return ret;
+}
@@ -86,6 +86,30 @@ START_TEST(test_init_exit_3)
 }
 END_TEST
 
+static gpointer exit_thread(gpointer data)
+{
+	(void)data;
+
+	return GINT_TO_POINTER(srd_exit());
+}
+
+/*
+ * Check whether srd_exit() works from another thread than the one
+ * which called srd_init().
+ */
+START_TEST(test_init_exit_thread)
+{
+	GThread *thread;
+	int ret;
+
+	ret = srd_init(NULL);
+	fail_unless(ret == SRD_OK, "srd_init() failed: %d.", ret);
+	thread = g_thread_new("srd-exit", exit_thread, NULL);
+	ret = GPOINTER_TO_INT(g_thread_join(thread));
+	fail_unless(ret == SRD_OK, "srd_exit() failed: %d.", ret);
+}
+END_TEST
+
 Suite *suite_core(void)
 {
 	Suite *s;
@@ -98,6 +122,7 @@ Suite *suite_core(void)
 	tcase_add_test(tc, test_init_exit);
 	tcase_add_test(tc, test_init_exit_2);
 	tcase_add_test(tc, test_init_exit_3);
+	tcase_add_test(tc, test_init_exit_thread);
 	suite_add_tcase(s, tc);
 
 	return s;
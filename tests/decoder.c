@@ -20,6 +20,10 @@
 
 #include "../libsigrokdecode.h" /* First, to avoid compiler warning. */
 #include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <glib.h>
+#include <glib/gstdio.h>
 #include <check.h>
 #include "lib.h"
 
@@ -112,6 +116,27 @@ START_TEST(test_load_valid_and_bogus)
 }
 END_TEST
 
+/*
+ * Check whether srd_decoder_load() picks up the sample_iteration attribute.
+ * If a PD ends up with the wrong iteration mode this test will fail.
+ */
+START_TEST(test_load_sample_iteration)
+{
+	struct srd_decoder *dec;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	srd_decoder_load("i2c");
+	dec = srd_decoder_get_by_id("uart");
+	fail_unless(dec->sample_iteration == SRD_SAMPLE_ITER_ALL,
+		"uart doesn't iterate over all samples.");
+	dec = srd_decoder_get_by_id("i2c");
+	fail_unless(dec->sample_iteration == SRD_SAMPLE_ITER_CHANGES,
+		"i2c doesn't iterate over changes only.");
+	srd_exit();
+}
+END_TEST
+
 /*
  * Check whether srd_decoder_load() fails when run multiple times.
  * If it returns a value != SRD_OK (or segfaults) this test will fail.
@@ -148,6 +173,50 @@ START_TEST(test_load_nonexisting_pd_dir)
 }
 END_TEST
 
+/* Load all PDs from DECODERS_DIR and a file with the given contents. */
+static guint load_all_with_file(const char *contents, gsize len)
+{
+	char *path;
+	guint num_decoders;
+	int fd;
+
+	fd = g_file_open_tmp("srd-bundle-XXXXXX", &path, NULL);
+	fail_unless(fd >= 0);
+	close(fd);
+	fail_unless(g_file_set_contents(path, contents, len, NULL));
+	srd_init(path);
+	fail_unless(srd_decoder_load_all() == SRD_OK);
+	num_decoders = g_slist_length((GSList *)srd_decoder_list());
+	srd_exit();
+	g_remove(path);
+	g_free(path);
+
+	return num_decoders;
+}
+
+/*
+ * Check whether broken decoder bundles in the search path are ignored.
+ */
+START_TEST(test_load_all_bogus_bundle)
+{
+	/* A zip archive starting with a stored, 5 bytes long MANIFEST. */
+	static const char bogus_bundle[] =
+		"PK\x03\x04\x14\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+		"\x00\x00\x00\x00\x05\x00\x00\x00\x05\x00\x00\x00"
+		"\x08\x00\x00\x00MANIFESTbogus";
+	guint num_decoders;
+
+	srd_init(DECODERS_DIR);
+	fail_unless(srd_decoder_load_all() == SRD_OK);
+	num_decoders = g_slist_length((GSList *)srd_decoder_list());
+	srd_exit();
+
+	fail_unless(load_all_with_file("bogus", 5) == num_decoders);
+	fail_unless(load_all_with_file(bogus_bundle,
+			sizeof(bogus_bundle) - 1) == num_decoders);
+}
+END_TEST
+
 /*
  * Check whether srd_decoder_list() returns a non-empty list.
  * If it returns an empty list (or segfaults) this test will fail.
@@ -302,6 +371,75 @@ START_TEST(test_doc_get_null)
 }
 END_TEST
 
+/* Load all PDs, and check uart's metadata and that it can be used. */
+static guint load_all_check(void)
+{
+	struct srd_decoder *dec;
+	struct srd_session *sess;
+	char *doc;
+	guint num_decoders;
+
+	srd_init(DECODERS_DIR);
+	fail_unless(srd_decoder_load_all() == SRD_OK);
+	num_decoders = g_slist_length((GSList *)srd_decoder_list());
+	dec = srd_decoder_get_by_id("uart");
+	fail_unless(dec != NULL);
+	fail_unless(!strcmp(dec->module_name, "uart"));
+	fail_unless(g_slist_length(dec->channels) == 0);
+	fail_unless(g_slist_length(dec->opt_channels) == 2);
+	fail_unless(g_slist_length(dec->options) > 0);
+	fail_unless(g_slist_length(dec->annotations) > 0);
+	fail_unless(g_slist_length(dec->annotation_rows) > 0);
+	fail_unless(g_slist_length(dec->binary) > 0);
+	fail_unless(dec->sample_iteration == SRD_SAMPLE_ITER_ALL);
+	fail_unless((doc = srd_decoder_doc_get(dec)) != NULL);
+	g_free(doc);
+	srd_session_new(&sess);
+	fail_unless(srd_inst_new(sess, "uart", NULL) != NULL);
+	srd_exit();
+
+	return num_decoders;
+}
+
+/*
+ * Check whether decoders loaded from the index, the second time around,
+ * are the same as those loaded from their modules.
+ */
+START_TEST(test_index_load)
+{
+	char *path;
+	guint num_imported, num_indexed;
+
+	num_imported = load_all_check();
+	path = g_build_filename(g_getenv("SIGROKDECODE_CACHE_DIR"),
+			"decoders.index", NULL);
+	fail_unless(g_file_test(path, G_FILE_TEST_IS_REGULAR),
+			"No index was written.");
+	g_free(path);
+	num_indexed = load_all_check();
+	fail_unless(num_imported == num_indexed, "%u decoders imported, "
+			"%u loaded from the index.", num_imported, num_indexed);
+}
+END_TEST
+
+/*
+ * Check whether a broken index file is ignored.
+ */
+START_TEST(test_index_bogus)
+{
+	char *path;
+	guint num_imported, num_bogus;
+
+	num_imported = load_all_check();
+	path = g_build_filename(g_getenv("SIGROKDECODE_CACHE_DIR"),
+			"decoders.index", NULL);
+	fail_unless(g_file_set_contents(path, "bogus", -1, NULL));
+	g_free(path);
+	num_bogus = load_all_check();
+	fail_unless(num_imported == num_bogus);
+}
+END_TEST
+
 Suite *suite_decoder(void)
 {
 	Suite *s;
@@ -318,7 +456,9 @@ Suite *suite_decoder(void)
 	tcase_add_test(tc, test_load_bogus);
 	tcase_add_test(tc, test_load_valid_and_bogus);
 	tcase_add_test(tc, test_load_multiple);
+	tcase_add_test(tc, test_load_sample_iteration);
 	tcase_add_test(tc, test_load_nonexisting_pd_dir);
+	tcase_add_test(tc, test_load_all_bogus_bundle);
 	suite_add_tcase(s, tc);
 
 	tc = tcase_create("list");
@@ -331,15 +471,24 @@ Suite *suite_decoder(void)
 	suite_add_tcase(s, tc);
 
 	tc = tcase_create("get_by_id");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
 	tcase_add_test(tc, test_get_by_id);
 	tcase_add_test(tc, test_get_by_id_multiple);
 	tcase_add_test(tc, test_get_by_id_bogus);
 	suite_add_tcase(s, tc);
 
 	tc = tcase_create("doc_get");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
 	tcase_add_test(tc, test_doc_get);
 	tcase_add_test(tc, test_doc_get_null);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("index");
+	tcase_set_timeout(tc, 0);
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_index_load);
+	tcase_add_test(tc, test_index_bogus);
+	suite_add_tcase(s, tc);
+
 	return s;
 }
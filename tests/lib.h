@@ -23,6 +23,8 @@
 
 void srdtest_setup(void);
 void srdtest_teardown(void);
+char *srdtest_pd_dir_new(const char *module_name, const char *source);
+void srdtest_dir_remove(const char *dir);
 
 Suite *suite_core(void);
 Suite *suite_decoder(void);
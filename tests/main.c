@@ -20,17 +20,75 @@
 
 #include "../libsigrokdecode.h" /* First, to avoid compiler warning. */
 #include <stdlib.h>
+#include <glib.h>
+#include <glib/gstdio.h>
 #include <check.h>
 #include "lib.h"
 
+static char *cache_dir;
+
 void srdtest_setup(void)
 {
 	/* Silence libsigrokdecode while the unit tests run. */
 	srd_log_loglevel_set(SRD_LOG_NONE);
+
+	/* Write the decoder index to a cache of our own, not the user's. */
+	cache_dir = g_dir_make_tmp("srd-cache-XXXXXX", NULL);
+	fail_unless(cache_dir != NULL);
+	g_setenv("SIGROKDECODE_CACHE_DIR", cache_dir, TRUE);
 }
 
 void srdtest_teardown(void)
 {
+	g_unsetenv("SIGROKDECODE_CACHE_DIR");
+	srdtest_dir_remove(cache_dir);
+	g_free(cache_dir);
+	cache_dir = NULL;
+}
+
+/*
+ * Make a decoder search path with a single PD, of the given module name
+ * and pd.py source. Remove it with srdtest_dir_remove().
+ */
+char *srdtest_pd_dir_new(const char *module_name, const char *source)
+{
+	char *dir, *pd_dir, *path;
+
+	dir = g_dir_make_tmp("srd-pd-XXXXXX", NULL);
+	fail_unless(dir != NULL);
+	pd_dir = g_build_filename(dir, module_name, NULL);
+	fail_unless(g_mkdir(pd_dir, 0700) == 0);
+	path = g_build_filename(pd_dir, "__init__.py", NULL);
+	fail_unless(g_file_set_contents(path, "from .pd import Decoder\n",
+			-1, NULL));
+	g_free(path);
+	path = g_build_filename(pd_dir, "pd.py", NULL);
+	fail_unless(g_file_set_contents(path, source, -1, NULL));
+	g_free(path);
+	g_free(pd_dir);
+
+	return dir;
+}
+
+/* Remove a directory and everything in it. */
+void srdtest_dir_remove(const char *dir)
+{
+	GDir *d;
+	const char *name;
+	char *path;
+
+	if (!(d = g_dir_open(dir, 0, NULL)))
+		return;
+	while ((name = g_dir_read_name(d))) {
+		path = g_build_filename(dir, name, NULL);
+		if (g_file_test(path, G_FILE_TEST_IS_DIR))
+			srdtest_dir_remove(path);
+		else
+			g_remove(path);
+		g_free(path);
+	}
+	g_dir_close(d);
+	g_rmdir(dir);
 }
 
 int main(void)
@@ -22,6 +22,7 @@
 #include "../libsigrokdecode.h"
 #include <stdint.h>
 #include <stdlib.h>
+#include <inttypes.h>
 #include <check.h>
 #include "lib.h"
 
@@ -136,6 +137,60 @@ START_TEST(test_session_destroy_bogus)
 }
 END_TEST
 
+#define NUM_THREADS 4
+#define NUM_THREAD_SESSIONS 200
+
+/* Create and destroy sessions, and keep the last few of them. */
+static gpointer new_destroy_thread(gpointer data)
+{
+	struct srd_session *sess;
+	int *ids, i;
+
+	ids = data;
+	for (i = 0; i < NUM_THREAD_SESSIONS; i++) {
+		if (srd_session_new(&sess) != SRD_OK)
+			return NULL;
+		ids[i] = sess->session_id;
+		if (i < NUM_THREAD_SESSIONS - 10)
+			srd_session_destroy(sess);
+	}
+
+	return NULL;
+}
+
+/*
+ * Check whether sessions can be created and destroyed by several threads
+ * at once, getting unique IDs, and whether srd_exit() destroys the ones
+ * which are left.
+ */
+START_TEST(test_session_new_destroy_threads)
+{
+	GThread *threads[NUM_THREADS];
+	int ids[NUM_THREADS][NUM_THREAD_SESSIONS];
+	gboolean seen[NUM_THREADS * NUM_THREAD_SESSIONS + 1];
+	int t, i, id;
+
+	srd_init(NULL);
+	memset(ids, 0, sizeof(ids));
+	for (t = 0; t < NUM_THREADS; t++)
+		threads[t] = g_thread_new("srd-session", new_destroy_thread,
+				ids[t]);
+	for (t = 0; t < NUM_THREADS; t++)
+		g_thread_join(threads[t]);
+
+	memset(seen, 0, sizeof(seen));
+	for (t = 0; t < NUM_THREADS; t++) {
+		for (i = 0; i < NUM_THREAD_SESSIONS; i++) {
+			id = ids[t][i];
+			fail_unless(id > 0 && id < (int)G_N_ELEMENTS(seen)
+					&& !seen[id], "Bad session ID %d.", id);
+			seen[id] = TRUE;
+		}
+	}
+	fail_unless(srd_exit() == SRD_OK);
+}
+END_TEST
+
 static void conf_check_ok(struct srd_session *sess, int key, uint64_t x)
 {
 	int ret;
@@ -224,6 +279,1167 @@ START_TEST(test_session_metadata_set_bogus)
 }
 END_TEST
 
+static void dummy_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	(void)pdata;
+	(void)cb_data;
+}
+
+/*
+ * Check whether srd_pd_output_callback_add() works, also with multiple
+ * callbacks for the same output type.
+ * If it returns != SRD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_session_callback_add)
+{
+	int ret, i;
+	struct srd_session *sess;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+	for (i = 0; i < 3; i++) {
+		ret = srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN,
+				dummy_cb, NULL);
+		fail_unless(ret == SRD_OK, "srd_pd_output_callback_add() "
+				"%d failed: %d.", i, ret);
+	}
+	ret = srd_pd_output_callback_add(sess, SRD_OUTPUT_BINARY,
+			dummy_cb, NULL);
+	fail_unless(ret == SRD_OK, "srd_pd_output_callback_add() failed: "
+			"%d.", ret);
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_pd_output_callback_add() fails with invalid input.
+ * If it returns SRD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_session_callback_add_bogus)
+{
+	struct srd_session *sess;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+	fail_unless(srd_pd_output_callback_add(NULL, SRD_OUTPUT_ANN,
+			dummy_cb, NULL) != SRD_OK);
+	fail_unless(srd_pd_output_callback_add(sess, -1,
+			dummy_cb, NULL) != SRD_OK);
+	fail_unless(srd_pd_output_callback_add(sess, 123,
+			dummy_cb, NULL) != SRD_OK);
+	fail_unless(srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN,
+			NULL, NULL) != SRD_OK);
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static uint64_t num_binary;
+
+static void binary_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	struct srd_proto_data_binary *pdb;
+
+	(void)cb_data;
+
+	pdb = pdata->data;
+	fail_unless(pdb->size == 1 && pdb->data[0] == 0x55);
+	num_binary++;
+}
+
+/*
+ * Check whether binary output reaches the callbacks intact.
+ */
+START_TEST(test_session_binary_output)
+{
+	struct srd_session *sess;
+	uint8_t buf[10000];
+	int i, bitpos;
+
+	/* 0x55 bytes at 10 samples per bit, with an idle bit in between. */
+	for (i = 0; i < (int)sizeof(buf); i++) {
+		bitpos = (i / 10) % 11;
+		buf[i] = bitpos == 0 ? 0 : bitpos <= 8 ? bitpos & 1 : 1;
+	}
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	num_binary = 0;
+	srd_session_new(&sess);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_BINARY, binary_cb, NULL);
+	srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	srd_session_start(sess);
+	srd_session_send(sess, 0, sizeof(buf), buf, sizeof(buf));
+	/* Every byte goes out as RX and as RX/TX. */
+	fail_unless(num_binary > 0 && num_binary % 2 == 0);
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static uint64_t num_ann_classes[14], num_bin_classes[3];
+
+static void class_count_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	struct srd_proto_data_annotation *pda;
+	struct srd_proto_data_binary *pdb;
+
+	(void)cb_data;
+
+	if (pdata->pdo->output_type == SRD_OUTPUT_ANN) {
+		pda = pdata->data;
+		num_ann_classes[pda->ann_class]++;
+	} else {
+		pdb = pdata->data;
+		num_bin_classes[pdb->bin_class]++;
+	}
+}
+
+/*
+ * Check whether instances only put out the annotation and binary classes
+ * subscribed to.
+ */
+START_TEST(test_session_subscribe)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di;
+	GSList *ids;
+	uint8_t buf[10000];
+	int i, bitpos;
+
+	for (i = 0; i < (int)sizeof(buf); i++) {
+		bitpos = (i / 10) % 11;
+		buf[i] = bitpos == 0 ? 0 : bitpos <= 8 ? bitpos & 1 : 1;
+	}
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, class_count_cb, NULL);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_BINARY, class_count_cb,
+			NULL);
+	di = srd_inst_new(sess, "uart", NULL);
+
+	/* Unknown classes and rows are rejected. */
+	ids = g_slist_append(NULL, "nonexistent");
+	fail_unless(srd_inst_ann_classes_set(di, ids, NULL) != SRD_OK);
+	fail_unless(srd_inst_ann_classes_set(di, NULL, ids) != SRD_OK);
+	fail_unless(srd_inst_binary_classes_set(di, ids) != SRD_OK);
+	fail_unless(srd_inst_ann_classes_set(NULL, NULL, NULL) != SRD_OK);
+	g_slist_free(ids);
+
+	/* The RX row has the data, start, parity and stop bit classes. */
+	ids = g_slist_append(NULL, "rx-data");
+	fail_unless(srd_inst_ann_classes_set(di, NULL, ids) == SRD_OK);
+	g_slist_free(ids);
+	ids = g_slist_append(NULL, "rxtx");
+	fail_unless(srd_inst_binary_classes_set(di, ids) == SRD_OK);
+	g_slist_free(ids);
+
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	srd_session_start(sess);
+	memset(num_ann_classes, 0, sizeof(num_ann_classes));
+	memset(num_bin_classes, 0, sizeof(num_bin_classes));
+	srd_session_send(sess, 0, sizeof(buf), buf, sizeof(buf));
+	fail_unless(num_ann_classes[0] > 0 && num_ann_classes[2] > 0);
+	/* No data bits, nor anything of the TX row. */
+	fail_unless(num_ann_classes[12] == 0 && num_ann_classes[1] == 0);
+	fail_unless(num_bin_classes[2] == num_ann_classes[0]);
+	fail_unless(num_bin_classes[0] == 0 && num_bin_classes[1] == 0);
+
+	/* Back to everything. */
+	srd_inst_ann_classes_set(di, NULL, NULL);
+	srd_session_send(sess, sizeof(buf), 2 * sizeof(buf), buf, sizeof(buf));
+	fail_unless(num_ann_classes[12] > 0);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/* Keeps a view of the sample data, and puts out its first byte later. */
+static const char *memview_pd =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 2\n"
+	"    id = 'memview'\n"
+	"    name = 'memview'\n"
+	"    longname = 'Memoryview test'\n"
+	"    desc = 'Keeps a view of the sample data.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = ['memview']\n"
+	"    channels = ({'id': 'data', 'name': 'Data', 'desc': 'Data'},)\n"
+	"    annotations = (('byte', 'Byte'),)\n"
+	"\n"
+	"    def __init__(self, **kwargs):\n"
+	"        self.view = None\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self, ss, es, data):\n"
+	"        if self.view is not None:\n"
+	"            self.put(ss, es, self.out_ann,\n"
+	"                     [0, ['%d' % self.view[0]]])\n"
+	"        self.view = memoryview(data)\n";
+
+static char kept_text[16];
+
+static void kept_text_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	(void)cb_data;
+
+	g_strlcpy(kept_text, srd_ann_text_get(pdata->data, 0),
+			sizeof(kept_text));
+}
+
+/*
+ * Check whether a view of the sample data a PD keeps after decode()
+ * still has the data, after the frontend overwrote and freed it.
+ */
+START_TEST(test_session_buffer_kept)
+{
+	struct srd_session *sess;
+	uint8_t *chunk;
+	char *dir;
+
+	dir = srdtest_pd_dir_new("memview", memview_pd);
+	srd_init(dir);
+	fail_unless(srd_decoder_load("memview") == SRD_OK);
+	srd_session_new(&sess);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, kept_text_cb, NULL);
+	fail_unless(srd_inst_new(sess, "memview", NULL) != NULL);
+	srd_session_start(sess);
+
+	chunk = g_malloc(100);
+	memset(chunk, 0xaa, 100);
+	srd_session_send(sess, 0, 100, chunk, 100);
+	memset(chunk, 0x55, 100);
+	g_free(chunk);
+	chunk = g_malloc0(100);
+	kept_text[0] = '\0';
+	srd_session_send(sess, 100, 200, chunk, 100);
+	g_free(chunk);
+	fail_unless(!strcmp(kept_text, "170"), "Kept view read '%s'.",
+			kept_text);
+
+	srd_session_destroy(sess);
+	srd_exit();
+	srdtest_dir_remove(dir);
+	g_free(dir);
+}
+END_TEST
+
+/*
+ * Puts out the number of each sample it sees. It only wants to see
+ * falling edges on 'a', and tries to wait for edges on 'b' too.
+ */
+static const char *waitedge_pd =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 2\n"
+	"    id = 'waitedge'\n"
+	"    name = 'waitedge'\n"
+	"    longname = 'Edge wait test'\n"
+	"    desc = 'Waits for falling edges.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = ['waitedge']\n"
+	"    channels = ({'id': 'a', 'name': 'A', 'desc': 'A'},)\n"
+	"    optional_channels = ({'id': 'b', 'name': 'B', 'desc': 'B'},)\n"
+	"    annotations = (('sample', 'Sample'), ('error', 'Error'))\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self, ss, es, data):\n"
+	"        for (self.samplenum, pins) in data:\n"
+	"            self.put(self.samplenum, self.samplenum, self.out_ann,\n"
+	"                     [0, ['%d' % self.samplenum]])\n"
+	"            try:\n"
+	"                self.wait_edge(1)\n"
+	"            except ValueError:\n"
+	"                self.put(self.samplenum, self.samplenum, self.out_ann,\n"
+	"                         [1, ['unconnected']])\n"
+	"            self.wait_edge(0, 'falling')\n";
+
+static void append_text_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	GString *s;
+
+	s = cb_data;
+	g_string_append_printf(s, "%s ", srd_ann_text_get(pdata->data, 0));
+}
+
+/*
+ * Check whether Decoder.wait_edge() skips to the next edge, and raises
+ * a ValueError for a channel which isn't connected.
+ */
+START_TEST(test_session_wait_edge)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di;
+	GHashTable *channels;
+	GString *s;
+	uint8_t buf[100];
+	char *dir;
+	int i;
+
+	/* Falling edges on bit 0 at samples 30 and 80. */
+	for (i = 0; i < (int)sizeof(buf); i++)
+		buf[i] = (i < 30 || (i >= 60 && i < 80)) ? 0x03 : 0x02;
+
+	dir = srdtest_pd_dir_new("waitedge", waitedge_pd);
+	srd_init(dir);
+	fail_unless(srd_decoder_load("waitedge") == SRD_OK);
+	srd_session_new(&sess);
+	s = g_string_new(NULL);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, append_text_cb, s);
+	fail_unless((di = srd_inst_new(sess, "waitedge", NULL)) != NULL);
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, g_free,
+			(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, g_strdup("a"),
+			g_variant_ref_sink(g_variant_new_int32(0)));
+	fail_unless(srd_inst_channel_set_all(di, channels, 1) == SRD_OK);
+	g_hash_table_destroy(channels);
+	srd_session_start(sess);
+	srd_session_send(sess, 0, sizeof(buf), buf, sizeof(buf));
+	fail_unless(!strcmp(s->str, "0 unconnected 30 unconnected "
+			"80 unconnected "), "Got '%s'.", s->str);
+
+	srd_session_destroy(sess);
+	srd_exit();
+	g_string_free(s, TRUE);
+	srdtest_dir_remove(dir);
+	g_free(dir);
+}
+END_TEST
+
+/* Map the channels 'a' and 'b' of an instance to the given bits. */
+static void channels_ab_set(struct srd_decoder_inst *di, int a, int b,
+		int unitsize)
+{
+	GHashTable *channels;
+
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, g_free,
+			(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, g_strdup("a"),
+			g_variant_ref_sink(g_variant_new_int32(a)));
+	g_hash_table_insert(channels, g_strdup("b"),
+			g_variant_ref_sink(g_variant_new_int32(b)));
+	fail_unless(srd_inst_channel_set_all(di, channels, unitsize) == SRD_OK);
+	g_hash_table_destroy(channels);
+}
+
+/* Puts out the number of each sample it gets, in 'changes' mode. */
+static const char *changes_pd =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 2\n"
+	"    id = 'changes'\n"
+	"    name = 'changes'\n"
+	"    longname = 'Changes test'\n"
+	"    desc = 'Gets samples where its channels change.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = ['changes']\n"
+	"    sample_iteration = 'changes'\n"
+	"    channels = ({'id': 'a', 'name': 'A', 'desc': 'A'},\n"
+	"                {'id': 'b', 'name': 'B', 'desc': 'B'})\n"
+	"    annotations = (('sample', 'Sample'),)\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self, ss, es, data):\n"
+	"        for (self.samplenum, pins) in data:\n"
+	"            self.put(self.samplenum, self.samplenum, self.out_ann,\n"
+	"                     [0, ['%d' % self.samplenum]])\n";
+
+/*
+ * Check whether a PD with sample_iteration = 'changes' only gets the
+ * first sample of each chunk, and the samples where any of its channels
+ * change, while the channels it doesn't use toggle all the time.
+ */
+START_TEST(test_session_sample_iteration_changes)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di;
+	GString *s;
+	uint8_t buf[150];
+	char *dir;
+	int i;
+
+	/*
+	 * 'a' is bit 2, 'b' is bit 5, all other bits toggle every sample.
+	 * 'a' changes at samples 10 and 60, 'b' at 25, 40, 100 and 130.
+	 */
+	for (i = 0; i < (int)sizeof(buf); i++) {
+		buf[i] = (i & 1) ? 0xdb : 0x00;
+		if (i >= 10 && i < 60)
+			buf[i] |= 1 << 2;
+		if ((i >= 25 && i < 40) || (i >= 100 && i < 130))
+			buf[i] |= 1 << 5;
+	}
+
+	dir = srdtest_pd_dir_new("changes", changes_pd);
+	srd_init(dir);
+	fail_unless(srd_decoder_load("changes") == SRD_OK);
+	srd_session_new(&sess);
+	s = g_string_new(NULL);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, append_text_cb, s);
+	fail_unless((di = srd_inst_new(sess, "changes", NULL)) != NULL);
+	channels_ab_set(di, 2, 5, 1);
+	srd_session_start(sess);
+	/* Chunks start at 0, 50 and 100. */
+	for (i = 0; i < 3; i++)
+		srd_session_send(sess, i * 50, (i + 1) * 50, buf + i * 50, 50);
+	fail_unless(!strcmp(s->str, "0 10 25 40 50 60 100 130 "),
+			"Got '%s'.", s->str);
+
+	srd_session_destroy(sess);
+	srd_exit();
+	g_string_free(s, TRUE);
+	srdtest_dir_remove(dir);
+	g_free(dir);
+}
+END_TEST
+
+/* Puts out what data.find_change() returns for a few sample numbers. */
+static const char *findchange_pd =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 2\n"
+	"    id = 'findchange'\n"
+	"    name = 'findchange'\n"
+	"    longname = 'find_change() test'\n"
+	"    desc = 'Looks for changes of its channels.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = ['findchange']\n"
+	"    channels = ({'id': 'a', 'name': 'A', 'desc': 'A'},\n"
+	"                {'id': 'b', 'name': 'B', 'desc': 'B'})\n"
+	"    annotations = (('sample', 'Sample'),)\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self, ss, es, data):\n"
+	"        for n in (0, 17, 35, 75, 10):\n"
+	"            r = data.find_change(n)\n"
+	"            t = 'none' if r is None else '%d' % r\n"
+	"            self.put(ss, es, self.out_ann, [0, [t]])\n";
+
+/*
+ * Check whether srd_logic.find_change() finds the right samples. With a
+ * unitsize of 2, the scan compares blocks of 16 samples, starting with
+ * the one after the given sample.
+ */
+START_TEST(test_session_find_change)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di;
+	GString *s;
+	uint8_t buf[2 * 80];
+	uint16_t sample;
+	char *dir;
+	int i;
+
+	/*
+	 * 'a' is bit 3, 'b' is bit 9, all other bits toggle every sample.
+	 *  - 'b' changes at 17, the first sample of the second block
+	 *    scanned from 0 (and also the one scanned from 10).
+	 *  - 'a' changes at 35, one past the first block scanned from 17.
+	 *  - 'b' changes at 75, in the partial block at the end of the scan
+	 *    from 35.
+	 *  - Nothing changes after 75.
+	 */
+	for (i = 0; i < 80; i++) {
+		sample = (i & 1) ? 0xfdf7 : 0x0000;
+		if (i >= 17 && i < 75)
+			sample |= 1 << 9;
+		if (i >= 35)
+			sample |= 1 << 3;
+		buf[2 * i] = sample & 0xff;
+		buf[2 * i + 1] = sample >> 8;
+	}
+
+	dir = srdtest_pd_dir_new("findchange", findchange_pd);
+	srd_init(dir);
+	fail_unless(srd_decoder_load("findchange") == SRD_OK);
+	srd_session_new(&sess);
+	s = g_string_new(NULL);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, append_text_cb, s);
+	fail_unless((di = srd_inst_new(sess, "findchange", NULL)) != NULL);
+	channels_ab_set(di, 3, 9, 2);
+	srd_session_start(sess);
+	srd_session_send(sess, 0, 80, buf, sizeof(buf));
+	fail_unless(!strcmp(s->str, "17 35 75 none 17 "), "Got '%s'.",
+			s->str);
+
+	srd_session_destroy(sess);
+	srd_exit();
+	g_string_free(s, TRUE);
+	srdtest_dir_remove(dir);
+	g_free(dir);
+}
+END_TEST
+
+/*
+ * Check whether srd_session_queue_set() works, and fails with invalid input.
+ */
+START_TEST(test_session_queue_set)
+{
+	struct srd_session *sess;
+	struct srd_queue_status status;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+	fail_unless(srd_session_queue_set(sess, 4, SRD_QUEUE_BLOCK) == SRD_OK);
+	fail_unless(srd_session_queue_set(sess, 8, SRD_QUEUE_ERROR) == SRD_OK);
+	fail_unless(srd_session_queue_status_get(sess, &status) == SRD_OK);
+	fail_unless(status.max_depth == 8 && status.depth == 0);
+	fail_unless(srd_session_queue_set(sess, 0, SRD_QUEUE_BLOCK) == SRD_OK);
+	fail_unless(srd_session_queue_set(NULL, 4, SRD_QUEUE_BLOCK) != SRD_OK);
+	fail_unless(srd_session_queue_set(sess, 4, 0) != SRD_OK);
+	fail_unless(srd_session_queue_status_get(sess, NULL) != SRD_OK);
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static uint64_t num_annotations, sum_start_samples;
+
+static void count_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	(void)cb_data;
+
+	num_annotations++;
+	sum_start_samples += pdata->start_sample;
+}
+
+/*
+ * Decode some UART traffic with two instances, with or without a decode
+ * thread, worker processes or a Python interpreter of the session's own.
+ */
+static uint64_t decode_uart(unsigned int max_chunks, gboolean use_workers,
+		gboolean own_interp)
+{
+	struct srd_session *sess;
+	struct srd_queue_status status;
+	uint8_t buf[10000];
+	int i, bitpos, ret;
+
+	/* 0x55 bytes at 10 samples per bit, with an idle bit in between. */
+	for (i = 0; i < (int)sizeof(buf); i++) {
+		bitpos = (i / 10) % 11;
+		buf[i] = bitpos == 0 ? 0 : bitpos <= 8 ? bitpos & 1 : 1;
+	}
+
+	num_annotations = 0;
+	srd_session_new(&sess);
+	srd_session_queue_set(sess, max_chunks, SRD_QUEUE_BLOCK);
+	srd_session_workers_set(sess, use_workers);
+	fail_unless(srd_session_interpreter_set(sess, own_interp) == SRD_OK);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, count_cb, NULL);
+	srd_inst_new(sess, "uart", NULL);
+	srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	fail_unless(srd_session_start(sess) == SRD_OK);
+	for (i = 0; i < 100; i++) {
+		ret = srd_session_send(sess, i * sizeof(buf),
+				(i + 1) * sizeof(buf), buf, sizeof(buf));
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	}
+	fail_unless(srd_session_queue_drain(sess) == SRD_OK);
+	srd_session_queue_status_get(sess, &status);
+	fail_unless(status.depth == 0 && status.lag == 0);
+	srd_session_destroy(sess);
+
+	return num_annotations;
+}
+
+/*
+ * Check whether decoding in a session's own thread yields the same
+ * annotations as decoding in the caller's thread.
+ */
+START_TEST(test_session_queue_decode)
+{
+	uint64_t num_sync, num_async;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	num_sync = decode_uart(0, FALSE, FALSE);
+	num_async = decode_uart(4, FALSE, FALSE);
+	fail_unless(num_sync > 0, "No annotations.");
+	fail_unless(num_sync == num_async, "%" PRIu64 " annotations "
+			"decoded in the caller's thread, %" PRIu64 " in the "
+			"session's thread.", num_sync, num_async);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether workers aren't forked while another session decodes in a
+ * thread of its own.
+ */
+START_TEST(test_session_workers_threads)
+{
+	struct srd_session *sess1, *sess2;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess1);
+	srd_session_queue_set(sess1, 4, SRD_QUEUE_BLOCK);
+	srd_inst_new(sess1, "uart", NULL);
+	fail_unless(srd_session_start(sess1) == SRD_OK);
+	srd_session_new(&sess2);
+	srd_session_workers_set(sess2, TRUE);
+	srd_inst_new(sess2, "uart", NULL);
+	fail_unless(srd_session_start(sess2) != SRD_OK);
+	srd_session_destroy(sess1);
+	fail_unless(srd_session_start(sess2) == SRD_OK);
+	srd_session_destroy(sess2);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether decoding in worker processes yields the same annotations
+ * as decoding in the frontend process.
+ */
+START_TEST(test_session_workers_decode)
+{
+	uint64_t num_local, num_workers;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	num_local = decode_uart(0, FALSE, FALSE);
+	num_workers = decode_uart(0, TRUE, FALSE);
+	fail_unless(num_local > 0, "No annotations.");
+	fail_unless(num_local == num_workers, "%" PRIu64 " annotations "
+			"decoded in the frontend process, %" PRIu64 " in "
+			"worker processes.", num_local, num_workers);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Decode UART traffic with idle gaps in one go, either in the caller's
+ * thread or in segments.
+ */
+static uint64_t decode_uart_gaps(unsigned int num_segments)
+{
+	struct srd_session *sess;
+	uint8_t *buf;
+	int i, bitpos, ret;
+	const int len = 200000;
+
+	/*
+	 * Groups of four 0x55 bytes at 10 samples per bit, followed by 30
+	 * idle bits, more than a frame's worth. TX idles high.
+	 */
+	buf = g_malloc(len);
+	for (i = 0; i < len; i++) {
+		bitpos = (i / 10) % 74;
+		if (bitpos >= 44)
+			buf[i] = 1;
+		else
+			buf[i] = bitpos % 11 == 0 ? 0 : bitpos % 11 <= 8
+				? (bitpos % 11) & 1 : 1;
+		buf[i] |= 0x02;
+	}
+
+	num_annotations = sum_start_samples = 0;
+	srd_session_new(&sess);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, count_cb, NULL);
+	srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	fail_unless(srd_session_start(sess) == SRD_OK);
+	if (num_segments)
+		ret = srd_session_send_segmented(sess, 0, buf, len,
+				num_segments);
+	else
+		ret = srd_session_send(sess, 0, len, buf, len);
+	fail_unless(ret == SRD_OK, "Decoding failed: %d.", ret);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return num_annotations;
+}
+
+/*
+ * Check whether decoding a capture in segments yields the same annotations
+ * as decoding it in one go.
+ */
+START_TEST(test_session_segmented_decode)
+{
+	uint64_t num_whole, num_segmented, sum_whole;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	num_whole = decode_uart_gaps(0);
+	sum_whole = sum_start_samples;
+	num_segmented = decode_uart_gaps(4);
+	fail_unless(num_whole > 0, "No annotations.");
+	fail_unless(num_whole == num_segmented, "%" PRIu64 " annotations "
+			"decoded in one go, %" PRIu64 " in segments.",
+			num_whole, num_segmented);
+	fail_unless(sum_whole == sum_start_samples,
+			"Annotations differ when decoding in segments.");
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether sessions with a Python interpreter of their own yield the
+ * same annotations as those using the main one, also when decoding in a
+ * thread of their own.
+ */
+START_TEST(test_session_interpreter_decode)
+{
+	uint64_t num_main, num_own, num_own_async;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	num_main = decode_uart(0, FALSE, FALSE);
+	num_own = decode_uart(0, FALSE, TRUE);
+	num_own_async = decode_uart(4, FALSE, TRUE);
+	fail_unless(num_main > 0, "No annotations.");
+	fail_unless(num_main == num_own, "%" PRIu64 " annotations decoded "
+			"in the main interpreter, %" PRIu64 " in the session's "
+			"own.", num_main, num_own);
+	fail_unless(num_own == num_own_async);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether a session's interpreter can only be set up before it
+ * has instances, and not together with worker processes.
+ */
+START_TEST(test_session_interpreter_set_bogus)
+{
+	struct srd_session *sess;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	fail_unless(srd_session_interpreter_set(NULL, TRUE) != SRD_OK);
+	srd_session_new(&sess);
+	srd_session_workers_set(sess, TRUE);
+	fail_unless(srd_session_interpreter_set(sess, TRUE) != SRD_OK);
+	srd_session_workers_set(sess, FALSE);
+	srd_inst_new(sess, "uart", NULL);
+	fail_unless(srd_session_interpreter_set(sess, TRUE) != SRD_OK);
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether an instance's statistics account for all sample data and
+ * output, only while enabled, and can be reset.
+ */
+START_TEST(test_session_stats)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di;
+	struct srd_inst_stats stats;
+	uint8_t buf[10000];
+	int i, bitpos;
+
+	for (i = 0; i < (int)sizeof(buf); i++) {
+		bitpos = (i / 10) % 11;
+		buf[i] = bitpos == 0 ? 0 : bitpos <= 8 ? bitpos & 1 : 1;
+	}
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	num_annotations = 0;
+	srd_session_new(&sess);
+	fail_unless(srd_session_stats_set(NULL, TRUE) != SRD_OK);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, count_cb, NULL);
+	di = srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	srd_session_start(sess);
+
+	/* Nothing is accounted while disabled. */
+	srd_session_send(sess, 0, sizeof(buf), buf, sizeof(buf));
+	fail_unless(srd_inst_stats_get(di, &stats) == SRD_OK);
+	fail_unless(stats.num_decode_calls == 0 && stats.num_samples == 0);
+	fail_unless(stats.num_puts[SRD_OUTPUT_ANN] == 0);
+
+	fail_unless(srd_session_stats_set(sess, TRUE) == SRD_OK);
+	num_annotations = 0;
+	for (i = 1; i <= 10; i++)
+		srd_session_send(sess, i * sizeof(buf), (i + 1) * sizeof(buf),
+				buf, sizeof(buf));
+	srd_inst_stats_get(di, &stats);
+	fail_unless(stats.num_decode_calls == 10);
+	fail_unless(stats.num_samples == 10 * sizeof(buf));
+	fail_unless(num_annotations > 0);
+	fail_unless(stats.num_puts[SRD_OUTPUT_ANN] == num_annotations);
+	fail_unless(stats.decode_wall_ns > 0);
+
+	fail_unless(srd_inst_stats_reset(di) == SRD_OK);
+	srd_inst_stats_get(di, &stats);
+	fail_unless(stats.num_decode_calls == 0 && stats.decode_wall_ns == 0);
+	fail_unless(srd_inst_stats_get(NULL, &stats) != SRD_OK);
+	fail_unless(srd_inst_stats_get(di, NULL) != SRD_OK);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static uint64_t text_len;
+
+static void text_check(const struct srd_proto_data_annotation *pda,
+		gboolean lazy)
+{
+	char **texts;
+	unsigned int i;
+
+	fail_unless(lazy ? !pda->ann_text : pda->ann_text != NULL);
+	fail_unless(srd_ann_text_count(pda) > 0);
+	fail_unless(srd_ann_text_get(pda, srd_ann_text_count(pda)) == NULL);
+	texts = srd_ann_text_dup(pda);
+	for (i = 0; i < srd_ann_text_count(pda); i++)
+		fail_unless(!strcmp(texts[i], srd_ann_text_get(pda, i)));
+	fail_unless(texts[i] == NULL);
+	text_len += strlen(texts[0]);
+	g_strfreev(texts);
+}
+
+static void text_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	text_check(pdata->data, GPOINTER_TO_INT(cb_data));
+}
+
+static void text_batch_cb(struct srd_proto_data *pdata, unsigned int count,
+		void *cb_data)
+{
+	unsigned int i;
+
+	for (i = 0; i < count; i++)
+		text_check(pdata[i].data, GPOINTER_TO_INT(cb_data));
+}
+
+/* Decode some UART traffic, and return the length of all long texts. */
+static uint64_t decode_uart_texts(gboolean lazy, gboolean batch)
+{
+	struct srd_session *sess;
+	uint8_t buf[10000];
+	int i, bitpos;
+
+	for (i = 0; i < (int)sizeof(buf); i++) {
+		bitpos = (i / 10) % 11;
+		buf[i] = bitpos == 0 ? 0 : bitpos <= 8 ? bitpos & 1 : 1;
+	}
+
+	text_len = 0;
+	srd_session_new(&sess);
+	fail_unless(srd_session_ann_text_lazy_set(sess, lazy) == SRD_OK);
+	if (batch)
+		srd_pd_output_batch_callback_set(sess, text_batch_cb,
+				GINT_TO_POINTER(lazy), 100);
+	else
+		srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, text_cb,
+				GINT_TO_POINTER(lazy));
+	srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	srd_session_start(sess);
+	for (i = 0; i < 10; i++)
+		srd_session_send(sess, i * sizeof(buf), (i + 1) * sizeof(buf),
+				buf, sizeof(buf));
+	srd_session_destroy(sess);
+
+	return text_len;
+}
+
+/*
+ * Check whether annotation texts converted on request are the same as
+ * those converted right away, with and without batches.
+ */
+START_TEST(test_session_ann_text_lazy)
+{
+	uint64_t len;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	fail_unless(srd_session_ann_text_lazy_set(NULL, TRUE) != SRD_OK);
+	fail_unless(srd_ann_text_count(NULL) == 0);
+	fail_unless(srd_ann_text_get(NULL, 0) == NULL);
+	len = decode_uart_texts(FALSE, FALSE);
+	fail_unless(len > 0);
+	fail_unless(decode_uart_texts(TRUE, FALSE) == len);
+	fail_unless(decode_uart_texts(FALSE, TRUE) == len);
+	fail_unless(decode_uart_texts(TRUE, TRUE) == len);
+	srd_exit();
+}
+END_TEST
+
+/* Sum up the annotations of an annotation row's summaries. */
+static uint64_t summary_count(struct srd_decoder_inst *di, const char *row_id,
+		unsigned int level, int ann_class)
+{
+	GArray *summaries;
+	struct srd_ann_summary *summary;
+	uint64_t count, prev_end;
+	unsigned int i;
+	int ret;
+
+	ret = srd_ann_summary_get(di, row_id, level, 0, 20000, &summaries);
+	fail_unless(ret == SRD_OK);
+	count = prev_end = 0;
+	for (i = 0; i < summaries->len; i++) {
+		summary = &g_array_index(summaries, struct srd_ann_summary, i);
+		fail_unless(summary->start_sample >= prev_end);
+		fail_unless(summary->end_sample - summary->start_sample
+				== 100 * (1 << (3 * level)));
+		fail_unless(summary->first_text && summary->last_text);
+		fail_unless(summary->num_annotations > 0);
+		prev_end = summary->end_sample;
+		if (ann_class < 0)
+			count += summary->num_annotations;
+		else
+			count += summary->class_counts[ann_class];
+	}
+	g_array_free(summaries, TRUE);
+
+	return count;
+}
+
+/*
+ * Check whether annotation summaries count every annotation once on
+ * every level, and fail with invalid input.
+ */
+START_TEST(test_session_ann_summary)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di;
+	GArray *summaries;
+	uint8_t buf[10000];
+	uint64_t num_rx;
+	unsigned int level;
+	int i, bitpos;
+
+	for (i = 0; i < (int)sizeof(buf); i++) {
+		bitpos = (i / 10) % 11;
+		buf[i] = bitpos == 0 ? 0 : bitpos <= 8 ? bitpos & 1 : 1;
+	}
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	fail_unless(srd_session_ann_summary_set(NULL, 100, 3) != SRD_OK);
+	fail_unless(srd_session_ann_summary_set(sess, 100, 0) != SRD_OK);
+	fail_unless(srd_session_ann_summary_set(sess, 100, 17) != SRD_OK);
+	fail_unless(srd_session_ann_summary_set(sess, 100, 3) == SRD_OK);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, class_count_cb, NULL);
+	di = srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	srd_session_start(sess);
+	memset(num_ann_classes, 0, sizeof(num_ann_classes));
+	srd_session_send(sess, 0, sizeof(buf), buf, sizeof(buf));
+	srd_session_send(sess, sizeof(buf), 2 * sizeof(buf), buf, sizeof(buf));
+
+	fail_unless(srd_ann_summary_get(di, "nonexistent", 0, 0, 100,
+			&summaries) != SRD_OK);
+	fail_unless(srd_ann_summary_get(di, NULL, 3, 0, 100,
+			&summaries) != SRD_OK);
+	fail_unless(srd_ann_summary_get(di, NULL, 0, 100, 100,
+			&summaries) != SRD_OK);
+
+	num_rx = num_ann_classes[0] + num_ann_classes[2] + num_ann_classes[4]
+			+ num_ann_classes[6] + num_ann_classes[8];
+	fail_unless(num_rx > 0 && num_ann_classes[12] > 0);
+	for (level = 0; level < 3; level++) {
+		fail_unless(summary_count(di, "rx-data", level, -1) == num_rx);
+		fail_unless(summary_count(di, "rx-data", level, 0)
+				== num_ann_classes[0]);
+		fail_unless(summary_count(di, "rx-data-bits", level, 12)
+				== num_ann_classes[12]);
+		fail_unless(summary_count(di, "tx-data", level, -1) == 0);
+	}
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether the annotation store finds annotations by range, class
+ * and text, and fails with invalid input.
+ */
+START_TEST(test_session_ann_store)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di;
+	struct srd_ann_record *rec, *all;
+	GArray *records, *everything;
+	uint8_t buf[10000];
+	uint64_t num_rx, num_overlapping;
+	unsigned int i;
+	char *text;
+	int bitpos;
+
+	for (i = 0; i < sizeof(buf); i++) {
+		bitpos = (i / 10) % 11;
+		buf[i] = bitpos == 0 ? 0 : bitpos <= 8 ? bitpos & 1 : 1;
+	}
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	fail_unless(srd_session_ann_store_set(NULL, TRUE) != SRD_OK);
+	fail_unless(srd_session_ann_store_set(sess, TRUE) == SRD_OK);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, class_count_cb, NULL);
+	di = srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	srd_session_start(sess);
+	memset(num_ann_classes, 0, sizeof(num_ann_classes));
+	srd_session_send(sess, 0, sizeof(buf), buf, sizeof(buf));
+	srd_session_send(sess, sizeof(buf), 2 * sizeof(buf), buf, sizeof(buf));
+
+	fail_unless(srd_ann_store_find(di, "nonexistent", 0, 100, -1, NULL,
+			&records) != SRD_OK);
+	fail_unless(srd_ann_store_find(di, NULL, 100, 100, -1, NULL,
+			&records) != SRD_OK);
+
+	/* All of a row, in order. */
+	fail_unless(srd_ann_store_find(di, "rx-data", 0, G_MAXUINT64, -1,
+			NULL, &everything) == SRD_OK);
+	num_rx = num_ann_classes[0] + num_ann_classes[2] + num_ann_classes[4]
+			+ num_ann_classes[6] + num_ann_classes[8];
+	fail_unless(num_rx > 0 && everything->len == num_rx);
+	for (i = 1; i < everything->len; i++)
+		fail_unless(g_array_index(everything, struct srd_ann_record,
+				i).start_sample >= g_array_index(everything,
+				struct srd_ann_record, i - 1).start_sample);
+
+	/* A range, including what starts before it and ends in it. */
+	num_overlapping = 0;
+	for (i = 0; i < everything->len; i++) {
+		all = &g_array_index(everything, struct srd_ann_record, i);
+		if (all->start_sample < 5005 && (all->end_sample > 5000
+				|| all->start_sample >= 5000))
+			num_overlapping++;
+	}
+	srd_ann_store_find(di, "rx-data", 5000, 5005, -1, NULL, &records);
+	fail_unless(num_overlapping > 0 && records->len == num_overlapping);
+	g_array_free(records, TRUE);
+
+	/* All data bytes are the same. */
+	srd_ann_store_find(di, "rx-data", 0, G_MAXUINT64, 0, NULL, &records);
+	fail_unless(records->len == num_ann_classes[0]);
+	rec = &g_array_index(records, struct srd_ann_record, 0);
+	fail_unless(rec->ann_class == 0 && rec->num_texts > 0);
+	text = g_strdup(rec->texts);
+	g_array_free(records, TRUE);
+	srd_ann_store_find(di, "rx-data", 0, G_MAXUINT64, -1, text, &records);
+	fail_unless(records->len == num_ann_classes[0]);
+	g_array_free(records, TRUE);
+	srd_ann_store_find(di, "rx-data", 0, G_MAXUINT64, 12, NULL, &records);
+	fail_unless(records->len == 0);
+	g_array_free(records, TRUE);
+	g_free(text);
+	g_array_free(everything, TRUE);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static uint64_t num_trace_events[5];
+#define NUM_TRACE_EVENTS(type) num_trace_events[(type) - SRD_TRACE_DECODE_BEGIN]
+static uint64_t num_trace_ann_puts, last_timestamp;
+static int trace_depth, max_trace_depth;
+
+static void trace_cb(const struct srd_trace_event *event, void *cb_data)
+{
+	(void)cb_data;
+
+	fail_unless(event->type >= SRD_TRACE_DECODE_BEGIN
+			&& event->type <= SRD_TRACE_CALLBACK_END);
+	fail_unless(event->timestamp_ns >= last_timestamp);
+	last_timestamp = event->timestamp_ns;
+	NUM_TRACE_EVENTS(event->type)++;
+
+	if (event->type == SRD_TRACE_DECODE_BEGIN
+			|| event->type == SRD_TRACE_CALLBACK_BEGIN)
+		max_trace_depth = MAX(max_trace_depth, ++trace_depth);
+	else if (event->type != SRD_TRACE_PUT)
+		fail_unless(--trace_depth >= 0);
+	else if (event->output_type == SRD_OUTPUT_ANN)
+		num_trace_ann_puts++;
+}
+
+/*
+ * Check whether tracing reports properly nested decode() calls and
+ * callbacks, and every put().
+ */
+START_TEST(test_session_trace)
+{
+	struct srd_session *sess;
+	uint8_t buf[10000];
+	int i, bitpos;
+
+	for (i = 0; i < (int)sizeof(buf); i++) {
+		bitpos = (i / 10) % 11;
+		buf[i] = bitpos == 0 ? 0 : bitpos <= 8 ? bitpos & 1 : 1;
+	}
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	num_annotations = 0;
+	srd_session_new(&sess);
+	fail_unless(srd_session_trace_callback_set(NULL, trace_cb, NULL)
+			!= SRD_OK);
+	fail_unless(srd_session_trace_callback_set(sess, trace_cb, NULL)
+			== SRD_OK);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, count_cb, NULL);
+	srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1152000));
+	srd_session_start(sess);
+	for (i = 0; i < 10; i++)
+		srd_session_send(sess, i * sizeof(buf), (i + 1) * sizeof(buf),
+				buf, sizeof(buf));
+
+	fail_unless(trace_depth == 0 && max_trace_depth == 2);
+	fail_unless(NUM_TRACE_EVENTS(SRD_TRACE_DECODE_BEGIN) == 10);
+	fail_unless(NUM_TRACE_EVENTS(SRD_TRACE_CALLBACK_BEGIN)
+			== num_annotations);
+	fail_unless(num_annotations > 0);
+	fail_unless(num_trace_ann_puts == num_annotations);
+
+	/* Nothing is traced anymore once disabled. */
+	srd_session_trace_callback_set(sess, NULL, NULL);
+	srd_session_send(sess, 10 * sizeof(buf), 11 * sizeof(buf), buf,
+			sizeof(buf));
+	fail_unless(NUM_TRACE_EVENTS(SRD_TRACE_DECODE_BEGIN) == 10);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
 Suite *suite_session(void)
 {
 	Suite *s;
@@ -238,6 +1454,7 @@ Suite *suite_session(void)
 	tcase_add_test(tc, test_session_new_multiple);
 	tcase_add_test(tc, test_session_destroy);
 	tcase_add_test(tc, test_session_destroy_bogus);
+	tcase_add_test(tc, test_session_new_destroy_threads);
 	suite_add_tcase(s, tc);
 
 	tc = tcase_create("config");
@@ -246,5 +1463,49 @@ Suite *suite_session(void)
 	tcase_add_test(tc, test_session_metadata_set_bogus);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("callback");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_callback_add);
+	tcase_add_test(tc, test_session_callback_add_bogus);
+	tcase_add_test(tc, test_session_binary_output);
+	tcase_add_test(tc, test_session_subscribe);
+	tcase_add_test(tc, test_session_buffer_kept);
+	tcase_add_test(tc, test_session_wait_edge);
+	tcase_add_test(tc, test_session_sample_iteration_changes);
+	tcase_add_test(tc, test_session_find_change);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("queue");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_queue_set);
+	tcase_add_test(tc, test_session_queue_decode);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("workers");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_workers_decode);
+	tcase_add_test(tc, test_session_workers_threads);
+	tcase_add_test(tc, test_session_segmented_decode);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("interpreter");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_interpreter_decode);
+	tcase_add_test(tc, test_session_interpreter_set_bogus);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("annotation");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_ann_text_lazy);
+	tcase_add_test(tc, test_session_ann_summary);
+	tcase_add_test(tc, test_session_ann_store);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("stats");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_stats);
+	tcase_add_test(tc, test_session_trace);
+	suite_add_tcase(s, tc);
+
 	return s;
 }
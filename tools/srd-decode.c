@@ -0,0 +1,736 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+ */
+
+#include "../libsigrokdecode.h" /* First, to avoid compiler warning. */
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <inttypes.h>
+#include <glib.h>
+
+/*
+ * Batch decoding of raw captures, without a frontend.
+ *
+ * The capture is a file of raw samples, unitsize bytes each, as written
+ * by e.g. "sigrok-cli -O binary". It's mapped into memory, and handed to
+ * the decoders in large chunks straight out of the mapping. Decoder
+ * stacks are given like with sigrok-cli, e.g.
+ *
+ *   srd-decode -r 1M -P uart:baudrate=115200:rx=0,midi capture.bin
+ *
+ * Annotations are written as text. Like with sigrok-cli, -B uart=rx writes
+ * one binary class of one decoder instead, as it comes. A trace of
+ * every decode() call, put() and output callback can be written as JSON,
+ * to be loaded into chrome://tracing or Perfetto. At the end,
+ * the time spent in every stage and the resulting rates are reported, as
+ * well as the time every decoder instance spent decoding by itself.
+ */
+
+#define DEFAULT_CHUNK_SIZE (4 * 1024 * 1024)
+
+static gchar **opt_pds = NULL;
+static gchar *opt_samplerate = NULL;
+static gint opt_unitsize = 1;
+static gint opt_chunk_size = DEFAULT_CHUNK_SIZE;
+static gint opt_segments = 0;
+static gchar *opt_annotations = NULL;
+static gchar *opt_binary = NULL;
+static gchar *opt_binary_file = NULL;
+static gchar *opt_trace = NULL;
+static gchar *opt_decoders_dir = NULL;
+static gint opt_loglevel = SRD_LOG_WARN;
+static gboolean opt_quiet = FALSE;
+static gchar **opt_input = NULL;
+
+static const GOptionEntry optargs[] = {
+	{"protocol-decoders", 'P', 0, G_OPTION_ARG_STRING_ARRAY, &opt_pds,
+		"Protocol decoder stack to run (may be repeated)",
+		"<pd>[:<key>=<value>...][,<pd>...]"},
+	{"samplerate", 'r', 0, G_OPTION_ARG_STRING, &opt_samplerate,
+		"Samplerate of the capture, e.g. 1M", "<rate>"},
+	{"unitsize", 'u', 0, G_OPTION_ARG_INT, &opt_unitsize,
+		"Bytes per sample (default 1)", "<bytes>"},
+	{"chunk-size", 'c', 0, G_OPTION_ARG_INT, &opt_chunk_size,
+		"Bytes of sample data per srd_session_send() (default 4MiB)",
+		"<bytes>"},
+	{"segments", 's', 0, G_OPTION_ARG_INT, &opt_segments,
+		"Decode the capture in up to this many segments in parallel",
+		"<n>"},
+	{"output-annotations", 'A', 0, G_OPTION_ARG_FILENAME, &opt_annotations,
+		"Write annotations to this file (default stdout)", "<file>"},
+	{"output-binary", 'B', 0, G_OPTION_ARG_STRING, &opt_binary,
+		"Write this binary class of this decoder, instead of the "
+		"annotations", "<pd>=<class>"},
+	{"binary-file", 'b', 0, G_OPTION_ARG_FILENAME, &opt_binary_file,
+		"Write binary output to this file (default stdout)", "<file>"},
+	{"trace", 'T', 0, G_OPTION_ARG_FILENAME, &opt_trace,
+		"Write a trace of decoding to this file, in Chrome's trace "
+		"event format (slows down decoding)", "<file>"},
+	{"decoders-dir", 'd', 0, G_OPTION_ARG_FILENAME, &opt_decoders_dir,
+		"Additional protocol decoder search path", "<path>"},
+	{"loglevel", 'l', 0, G_OPTION_ARG_INT, &opt_loglevel,
+		"libsigrokdecode loglevel (default 2)", "<level>"},
+	{"quiet", 'q', 0, G_OPTION_ARG_NONE, &opt_quiet,
+		"Don't report the time spent in every stage", NULL},
+	{G_OPTION_REMAINING, 0, 0, G_OPTION_ARG_FILENAME_ARRAY, &opt_input,
+		NULL, "<capture file>"},
+	{NULL, 0, 0, 0, NULL, NULL, NULL},
+};
+
+struct output {
+	FILE *ann_file;
+	FILE *bin_file;
+	/* Maps a decoder to a NULL-terminated array of its class IDs. */
+	GHashTable *ann_classes;
+	uint64_t num_annotations;
+	/* The binary class given with -B. */
+	const struct srd_decoder *bin_dec;
+	int bin_class;
+	uint64_t num_binary_bytes;
+	/* Time spent in the output callbacks, in microseconds. */
+	gint64 usecs;
+	/* All instances, in the order given with -P. */
+	GSList *insts;
+};
+
+static const char **ann_classes_new(const struct srd_decoder *dec)
+{
+	const char **classes;
+	const GSList *l;
+	int i;
+
+	classes = g_malloc0((g_slist_length(dec->annotations) + 1)
+			* sizeof(char *));
+	for (i = 0, l = dec->annotations; l; l = l->next, i++)
+		classes[i] = ((char **)l->data)[0];
+
+	return classes;
+}
+
+static void ann_batch_cb(struct srd_proto_data *pdata, unsigned int count,
+		void *cb_data)
+{
+	struct output *out;
+	struct srd_proto_data_annotation *pda;
+	struct srd_decoder_inst *di;
+	const char **classes, *text;
+	gint64 start;
+	unsigned int i, j;
+
+	out = cb_data;
+	start = g_get_monotonic_time();
+	out->num_annotations += count;
+	for (i = 0; out->ann_file && i < count; i++) {
+		di = pdata[i].pdo->di;
+		pda = pdata[i].data;
+		classes = g_hash_table_lookup(out->ann_classes, di->decoder);
+		fprintf(out->ann_file, "%" PRIu64 "-%" PRIu64 " %s: %s:",
+			pdata[i].start_sample, pdata[i].end_sample,
+			di->inst_id, classes[pda->ann_class]);
+		for (j = 0; (text = srd_ann_text_get(pda, j)); j++)
+			fprintf(out->ann_file, " \"%s\"", text);
+		fputc('\n', out->ann_file);
+	}
+	out->usecs += g_get_monotonic_time() - start;
+}
+
+static void binary_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	struct output *out;
+	struct srd_proto_data_binary *pdb;
+	gint64 start;
+
+	out = cb_data;
+	pdb = pdata->data;
+	/* Other decoders' instances aren't subscribed to anything. */
+	if (pdata->pdo->di->decoder != out->bin_dec
+			|| pdb->bin_class != out->bin_class)
+		return;
+	start = g_get_monotonic_time();
+	out->num_binary_bytes += pdb->size;
+	fwrite(pdb->data, 1, pdb->size, out->bin_file);
+	out->usecs += g_get_monotonic_time() - start;
+}
+
+struct trace {
+	FILE *file;
+	uint64_t num_events;
+	/* Time of the first event, in nanoseconds. */
+	uint64_t start_ns;
+};
+
+static const char *output_types[] = {
+	"annotation", "python", "binary", "meta",
+};
+
+static void json_string_write(FILE *f, const char *str)
+{
+	fputc('"', f);
+	for (; *str; str++) {
+		if (*str == '"' || *str == '\\')
+			fprintf(f, "\\%c", *str);
+		else if ((unsigned char)*str < 0x20)
+			fprintf(f, "\\u%04x", *str);
+		else
+			fputc(*str, f);
+	}
+	fputc('"', f);
+}
+
+/*
+ * Write a trace event in Chrome's trace event format: decode() calls and
+ * callbacks as duration events, put() calls as instant events.
+ */
+static void trace_cb(const struct srd_trace_event *event, void *cb_data)
+{
+	struct trace *trace;
+	const char *inst_id, *cat, *ph;
+	char *name;
+
+	trace = cb_data;
+	if (!trace->num_events++)
+		trace->start_ns = event->timestamp_ns;
+	else
+		fputc(',', trace->file);
+
+	inst_id = event->di ? event->di->inst_id : "session";
+	switch (event->type) {
+	case SRD_TRACE_DECODE_BEGIN:
+	case SRD_TRACE_DECODE_END:
+		cat = "decode";
+		ph = event->type == SRD_TRACE_DECODE_BEGIN ? "B" : "E";
+		name = g_strdup(inst_id);
+		break;
+	case SRD_TRACE_PUT:
+		cat = "put";
+		ph = "i";
+		name = g_strdup_printf("%s put %s", inst_id,
+				output_types[event->output_type]);
+		break;
+	default:
+		cat = "callback";
+		ph = event->type == SRD_TRACE_CALLBACK_BEGIN ? "B" : "E";
+		name = g_strdup_printf("%s %s callbacks", inst_id,
+				output_types[event->output_type]);
+		break;
+	}
+
+	fprintf(trace->file, "\n{\"name\":");
+	json_string_write(trace->file, name);
+	fprintf(trace->file, ",\"cat\":\"%s\",\"ph\":\"%s\",%s"
+		"\"ts\":%.3f,\"pid\":1,\"tid\":1,\"args\":{\"start\":%"
+		PRIu64 ",\"end\":%" PRIu64, cat, ph,
+		event->type == SRD_TRACE_PUT ? "\"s\":\"t\"," : "",
+		(event->timestamp_ns - trace->start_ns) / 1000.0,
+		event->start_sample, event->end_sample);
+	if (event->output_class >= 0)
+		fprintf(trace->file, ",\"class\":%d", event->output_class);
+	fprintf(trace->file, "}}");
+	g_free(name);
+}
+
+/* Parse a samplerate like "1000000", "8M" or "12.5k". */
+static gboolean samplerate_parse(const char *str, uint64_t *samplerate)
+{
+	double rate;
+	char *end;
+
+	rate = g_ascii_strtod(str, &end);
+	if (end == str || rate <= 0)
+		return FALSE;
+	switch (*end) {
+	case 'k':
+	case 'K':
+		rate *= 1e3;
+		end++;
+		break;
+	case 'm':
+	case 'M':
+		rate *= 1e6;
+		end++;
+		break;
+	case 'g':
+	case 'G':
+		rate *= 1e9;
+		end++;
+		break;
+	}
+	if (*end && g_ascii_strcasecmp(end, "hz"))
+		return FALSE;
+	*samplerate = (uint64_t)(rate + 0.5);
+
+	return *samplerate > 0;
+}
+
+static const struct srd_channel *channel_find(const struct srd_decoder *dec,
+		const char *id)
+{
+	const GSList *l;
+	const struct srd_channel *pdch;
+
+	for (l = dec->channels; l; l = l->next) {
+		pdch = l->data;
+		if (!strcmp(pdch->id, id))
+			return pdch;
+	}
+	for (l = dec->opt_channels; l; l = l->next) {
+		pdch = l->data;
+		if (!strcmp(pdch->id, id))
+			return pdch;
+	}
+
+	return NULL;
+}
+
+/* Convert an option's value to the type of its default value. */
+static GVariant *option_value_new(const struct srd_decoder_option *o,
+		const char *value)
+{
+	char *end;
+	gint64 i;
+	double d;
+
+	if (!o->def)
+		return g_variant_new_string(value);
+	if (g_variant_is_of_type(o->def, G_VARIANT_TYPE_INT64)) {
+		i = g_ascii_strtoll(value, &end, 0);
+		if (end == value || *end)
+			return NULL;
+		return g_variant_new_int64(i);
+	} else if (g_variant_is_of_type(o->def, G_VARIANT_TYPE_DOUBLE)) {
+		d = g_ascii_strtod(value, &end);
+		if (end == value || *end)
+			return NULL;
+		return g_variant_new_double(d);
+	}
+
+	return g_variant_new_string(value);
+}
+
+/*
+ * Create an instance from a "<pd>:<key>=<value>:..." spec, where keys are
+ * either channel IDs, mapped to the given channel of the capture, or
+ * option IDs.
+ */
+static struct srd_decoder_inst *inst_new(struct srd_session *sess,
+		const char *spec)
+{
+	struct srd_decoder *dec;
+	struct srd_decoder_inst *di;
+	const struct srd_decoder_option *o;
+	const GSList *l;
+	GHashTable *options, *channels;
+	GVariant *value;
+	char **fields, **kv, *end;
+	gint64 ch;
+	int i;
+
+	fields = g_strsplit(spec, ":", 0);
+	if (srd_decoder_load(fields[0]) != SRD_OK
+			|| !(dec = srd_decoder_get_by_id(fields[0]))) {
+		g_printerr("Protocol decoder '%s' not found.\n", fields[0]);
+		g_strfreev(fields);
+		return NULL;
+	}
+
+	di = NULL;
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, g_free,
+			(GDestroyNotify)g_variant_unref);
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, g_free,
+			(GDestroyNotify)g_variant_unref);
+	for (i = 1; fields[i]; i++) {
+		kv = g_strsplit(fields[i], "=", 2);
+		if (!kv[0] || !kv[1]) {
+			g_printerr("Invalid argument '%s' for '%s'.\n",
+				fields[i], fields[0]);
+			g_strfreev(kv);
+			goto out;
+		}
+		if (channel_find(dec, kv[0])) {
+			ch = g_ascii_strtoll(kv[1], &end, 10);
+			if (end == kv[1] || *end || ch < 0
+					|| ch >= opt_unitsize * 8) {
+				g_printerr("Invalid channel '%s' for '%s'.\n",
+					kv[1], kv[0]);
+				g_strfreev(kv);
+				goto out;
+			}
+			g_hash_table_insert(channels, g_strdup(kv[0]),
+				g_variant_ref_sink(g_variant_new_int32(ch)));
+			g_strfreev(kv);
+			continue;
+		}
+		o = NULL;
+		for (l = dec->options; l && !o; l = l->next) {
+			if (!strcmp(((struct srd_decoder_option *)l->data)->id,
+					kv[0]))
+				o = l->data;
+		}
+		if (!o) {
+			g_printerr("Unknown channel or option '%s' for '%s'.\n",
+				kv[0], fields[0]);
+			g_strfreev(kv);
+			goto out;
+		}
+		if (!(value = option_value_new(o, kv[1]))) {
+			g_printerr("Invalid value '%s' for option '%s'.\n",
+				kv[1], kv[0]);
+			g_strfreev(kv);
+			goto out;
+		}
+		g_hash_table_insert(options, g_strdup(kv[0]),
+				g_variant_ref_sink(value));
+		g_strfreev(kv);
+	}
+
+	if (!(di = srd_inst_new(sess, fields[0], options))) {
+		g_printerr("Failed to create a '%s' instance.\n", fields[0]);
+		goto out;
+	}
+	if (g_hash_table_size(channels) && srd_inst_channel_set_all(di,
+			channels, opt_unitsize) != SRD_OK) {
+		g_printerr("Invalid channels for '%s'.\n", fields[0]);
+		di = NULL;
+	}
+
+out:
+	g_hash_table_destroy(channels);
+	g_hash_table_destroy(options);
+	g_strfreev(fields);
+
+	return di;
+}
+
+/* Set up the stacks given with -P, as "<spec>,<spec>,...". */
+static gboolean stacks_new(struct srd_session *sess, struct output *out)
+{
+	struct srd_decoder_inst *di, *di_prev;
+	char **specs;
+	int i, j;
+
+	for (i = 0; opt_pds[i]; i++) {
+		specs = g_strsplit(opt_pds[i], ",", 0);
+		di_prev = NULL;
+		for (j = 0; specs[j]; j++) {
+			if (!(di = inst_new(sess, specs[j]))) {
+				g_strfreev(specs);
+				return FALSE;
+			}
+			out->insts = g_slist_append(out->insts, di);
+			if (!g_hash_table_contains(out->ann_classes,
+					di->decoder))
+				g_hash_table_insert(out->ann_classes,
+					di->decoder,
+					ann_classes_new(di->decoder));
+			if (di_prev && srd_inst_stack(sess, di_prev,
+					di) != SRD_OK) {
+				g_strfreev(specs);
+				return FALSE;
+			}
+			di_prev = di;
+		}
+		g_strfreev(specs);
+	}
+
+	return TRUE;
+}
+
+/* Subscribe the instances of the decoder given with -B to its class. */
+static gboolean binary_setup(struct output *out)
+{
+	struct srd_decoder_inst *di;
+	const GSList *l;
+	GSList *ids;
+	char **kv;
+	int i;
+
+	kv = g_strsplit(opt_binary, "=", 2);
+	if (!kv[0] || !kv[1]) {
+		g_printerr("Invalid binary output '%s', need <pd>=<class>.\n",
+			opt_binary);
+		g_strfreev(kv);
+		return FALSE;
+	}
+
+	for (l = out->insts; l && !out->bin_dec; l = l->next) {
+		di = l->data;
+		if (!strcmp(di->decoder->id, kv[0]))
+			out->bin_dec = di->decoder;
+	}
+	if (!out->bin_dec) {
+		g_printerr("Protocol decoder '%s' isn't in any stack.\n",
+			kv[0]);
+		g_strfreev(kv);
+		return FALSE;
+	}
+	out->bin_class = -1;
+	for (i = 0, l = out->bin_dec->binary; l; l = l->next, i++) {
+		if (!strcmp(((char **)l->data)[0], kv[1]))
+			out->bin_class = i;
+	}
+	if (out->bin_class < 0) {
+		g_printerr("Protocol decoder '%s' has no binary class '%s'.\n",
+			kv[0], kv[1]);
+		g_strfreev(kv);
+		return FALSE;
+	}
+
+	ids = g_slist_append(NULL, kv[1]);
+	for (l = out->insts; l; l = l->next) {
+		di = l->data;
+		if (di->decoder == out->bin_dec)
+			srd_inst_binary_classes_set(di, ids);
+	}
+	g_slist_free(ids);
+	g_strfreev(kv);
+
+	return TRUE;
+}
+
+static int decode(struct srd_session *sess, const uint8_t *buf,
+		uint64_t len)
+{
+	uint64_t chunk, i, n;
+	int ret;
+
+	if (opt_segments > 0)
+		return srd_session_send_segmented(sess, 0, buf, len,
+				opt_segments);
+
+	/* Whole samples only. */
+	chunk = MAX(opt_chunk_size / opt_unitsize, 1) * opt_unitsize;
+	for (i = 0; i < len; i += n) {
+		n = MIN(chunk, len - i);
+		ret = srd_session_send(sess, i / opt_unitsize,
+				(i + n) / opt_unitsize, buf + i, n);
+		if (ret != SRD_OK)
+			return ret;
+	}
+
+	return SRD_OK;
+}
+
+static void report(const char *stage, gint64 usecs, uint64_t num_samples,
+		const char *info)
+{
+	g_printerr("%-10s %10.1f ms", stage, usecs / 1000.0);
+	if (num_samples && usecs > 0)
+		g_printerr(" %14.0f samples/s", num_samples * 1e6 / usecs);
+	else
+		g_printerr(" %24s", "");
+	g_printerr("  %s\n", info);
+}
+
+/* Report the time every instance spent in its decode(). */
+static void report_insts(const GSList *insts)
+{
+	const struct srd_decoder_inst *di;
+	struct srd_inst_stats stats;
+	uint64_t num_puts;
+	char *stage, *info;
+	int i;
+
+	for (; insts; insts = insts->next) {
+		di = insts->data;
+		srd_inst_stats_get(di, &stats);
+		if (!stats.num_decode_calls)
+			continue;
+		num_puts = 0;
+		for (i = 0; i <= SRD_OUTPUT_META; i++)
+			num_puts += stats.num_puts[i];
+		stage = g_strdup_printf("    %s", di->inst_id);
+		info = g_strdup_printf("%" PRIu64 " decode calls, %" PRIu64
+				" puts, %.1f ms CPU, %.1f ms in callbacks",
+				stats.num_decode_calls, num_puts,
+				stats.decode_cpu_ns / 1e6,
+				stats.callback_wall_ns / 1e6);
+		report(stage, stats.decode_wall_ns / 1000, stats.num_samples,
+				info);
+		g_free(info);
+		g_free(stage);
+	}
+}
+
+int main(int argc, char **argv)
+{
+	GOptionContext *ctx;
+	GError *error;
+	GMappedFile *file;
+	struct srd_session *sess;
+	struct output out;
+	struct trace trace;
+	const uint8_t *buf;
+	uint64_t samplerate, len, num_samples;
+	gint64 t_start, t_setup, t_map, t_decode;
+	char *info;
+	int ret;
+
+	ctx = g_option_context_new(NULL);
+	g_option_context_set_summary(ctx, "Decode a raw capture file with "
+		"libsigrokdecode.");
+	g_option_context_add_main_entries(ctx, optargs, NULL);
+	error = NULL;
+	if (!g_option_context_parse(ctx, &argc, &argv, &error)) {
+		g_printerr("%s\n", error->message);
+		g_error_free(error);
+		g_option_context_free(ctx);
+		return EXIT_FAILURE;
+	}
+	g_option_context_free(ctx);
+
+	if (!opt_pds || !opt_input || !opt_input[0] || opt_input[1]) {
+		g_printerr("Need one capture file, and at least one -P.\n");
+		return EXIT_FAILURE;
+	}
+	if (opt_unitsize < 1 || opt_chunk_size < 1) {
+		g_printerr("Invalid unitsize or chunk size.\n");
+		return EXIT_FAILURE;
+	}
+	samplerate = 0;
+	if (opt_samplerate && !samplerate_parse(opt_samplerate, &samplerate)) {
+		g_printerr("Invalid samplerate '%s'.\n", opt_samplerate);
+		return EXIT_FAILURE;
+	}
+
+	memset(&out, 0, sizeof(out));
+	/* Binary output replaces the annotations, unless both are asked for. */
+	if (opt_binary && (!opt_binary_file || !strcmp(opt_binary_file, "-"))) {
+		if (opt_annotations && !strcmp(opt_annotations, "-")) {
+			g_printerr("Annotations and binary output can't both "
+				"go to stdout.\n");
+			return EXIT_FAILURE;
+		}
+		out.bin_file = stdout;
+	} else if (opt_binary && !(out.bin_file = fopen(opt_binary_file,
+			"wb"))) {
+		g_printerr("Can't open '%s'.\n", opt_binary_file);
+		return EXIT_FAILURE;
+	}
+	if ((!opt_annotations && !opt_binary) || (opt_annotations
+			&& !strcmp(opt_annotations, "-"))) {
+		out.ann_file = stdout;
+	} else if (opt_annotations && !(out.ann_file = fopen(opt_annotations,
+			"w"))) {
+		g_printerr("Can't open '%s'.\n", opt_annotations);
+		return EXIT_FAILURE;
+	}
+	if (out.bin_file)
+		setvbuf(out.bin_file, NULL, _IOFBF, 1024 * 1024);
+	if (out.ann_file)
+		setvbuf(out.ann_file, NULL, _IOFBF, 1024 * 1024);
+	memset(&trace, 0, sizeof(trace));
+	if (opt_trace) {
+		if (!(trace.file = fopen(opt_trace, "w"))) {
+			g_printerr("Can't open '%s'.\n", opt_trace);
+			return EXIT_FAILURE;
+		}
+		setvbuf(trace.file, NULL, _IOFBF, 1024 * 1024);
+		fprintf(trace.file, "{\"traceEvents\":[");
+	}
+	out.ann_classes = g_hash_table_new_full(g_direct_hash,
+			g_direct_equal, NULL, g_free);
+
+	ret = EXIT_FAILURE;
+	sess = NULL;
+	file = NULL;
+
+	/* Setup: load the decoders, and create the stacks. */
+	t_start = g_get_monotonic_time();
+	srd_log_loglevel_set(opt_loglevel);
+	if (srd_init(opt_decoders_dir) != SRD_OK)
+		goto done;
+	srd_session_new(&sess);
+	srd_session_ann_text_lazy_set(sess, TRUE);
+	srd_pd_output_batch_callback_set(sess, ann_batch_cb, &out, 0);
+	if (out.bin_file)
+		srd_pd_output_callback_add(sess, SRD_OUTPUT_BINARY, binary_cb,
+				&out);
+	srd_session_stats_set(sess, !opt_quiet);
+	if (trace.file)
+		srd_session_trace_callback_set(sess, trace_cb, &trace);
+	if (!stacks_new(sess, &out))
+		goto done;
+	if (opt_binary && !binary_setup(&out))
+		goto done;
+	if (samplerate)
+		srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+				g_variant_new_uint64(samplerate));
+	if (srd_session_start(sess) != SRD_OK) {
+		g_printerr("Failed to start the session.\n");
+		goto done;
+	}
+	t_setup = g_get_monotonic_time() - t_start;
+
+	/* Map the capture. Nothing is read until the decoders get to it. */
+	t_start = g_get_monotonic_time();
+	if (!(file = g_mapped_file_new(opt_input[0], FALSE, &error))) {
+		g_printerr("%s\n", error->message);
+		g_error_free(error);
+		goto done;
+	}
+	buf = (const uint8_t *)g_mapped_file_get_contents(file);
+	len = g_mapped_file_get_length(file);
+	len -= len % opt_unitsize;
+	num_samples = len / opt_unitsize;
+	t_map = g_get_monotonic_time() - t_start;
+
+	t_start = g_get_monotonic_time();
+	if (len && decode(sess, buf, len) != SRD_OK) {
+		g_printerr("Decoding failed.\n");
+		goto done;
+	}
+	t_decode = g_get_monotonic_time() - t_start;
+	ret = EXIT_SUCCESS;
+
+	if (!opt_quiet) {
+		report("setup", t_setup, 0, "loading decoders, creating stacks");
+		info = g_strdup_printf("%" PRIu64 " samples of %d bytes",
+				num_samples, opt_unitsize);
+		report("map", t_map, 0, info);
+		g_free(info);
+		info = g_strdup_printf("%" PRIu64 " annotations, %" PRIu64
+				" bytes of binary output", out.num_annotations,
+				out.num_binary_bytes);
+		report("decode", t_decode, num_samples, info);
+		g_free(info);
+		report("  output", out.usecs, 0, "writing output, in decode");
+		report("  decoders", t_decode - out.usecs, num_samples,
+			"decode without writing output");
+		report_insts(out.insts);
+	}
+
+done:
+	if (sess)
+		srd_session_destroy(sess);
+	srd_exit();
+	if (file)
+		g_mapped_file_unref(file);
+	if (out.ann_file && out.ann_file != stdout)
+		fclose(out.ann_file);
+	if (out.bin_file && out.bin_file != stdout)
+		fclose(out.bin_file);
+	if (trace.file) {
+		fprintf(trace.file, "\n]}\n");
+		fclose(trace.file);
+	}
+	g_hash_table_destroy(out.ann_classes);
+	g_slist_free(out.insts);
+
+	return ret;
+}
@@ -21,10 +21,7 @@
 #include "libsigrokdecode.h"
 #include "config.h"
 #include <inttypes.h>
-
-typedef struct {
-        PyObject_HEAD
-} srd_Decoder;
+#include <string.h>
 
 /* This is only used for nicer srd_dbg() output. */
 static const char *OUTPUT_TYPES[] = {
@@ -35,11 +32,11 @@ static const char *OUTPUT_TYPES[] = {
 };
 
 static int convert_annotation(struct srd_decoder_inst *di, PyObject *obj,
-		struct srd_proto_data *pdata)
+		struct srd_proto_data_annotation *pda)
 {
 	PyObject *py_tmp;
 	struct srd_pd_output *pdo;
-	struct srd_proto_data_annotation *pda;
+	Py_ssize_t i;
 	int ann_class;
 	char **ann_text;
 
@@ -82,28 +79,41 @@ static int convert_annotation(struct srd_decoder_inst *di, PyObject *obj,
 			"second element was not a list.", di->decoder->name);
 		return SRD_ERR_PYTHON;
 	}
-	if (py_strseq_to_char(py_tmp, &ann_text) != SRD_OK) {
-		srd_err("Protocol decoder %s submitted annotation list, but "
-			"second element was malformed.", di->decoder->name);
-		return SRD_ERR_PYTHON;
+	if (!di->sess->ann_text_lazy) {
+		if (py_strseq_to_char(py_tmp, &ann_text) != SRD_OK)
+			goto malformed;
+		pda->py_texts = NULL;
+	} else {
+		/* Only converted on request, just check that it will work. */
+		for (i = 0; i < PyList_Size(py_tmp); i++) {
+			if (!PyUnicode_Check(PyList_GetItem(py_tmp, i)))
+				goto malformed;
+		}
+		ann_text = NULL;
+		pda->py_texts = py_tmp;
 	}
 
-	pda = g_malloc(sizeof(struct srd_proto_data_annotation));
 	pda->ann_class = ann_class;
 	pda->ann_text = ann_text;
-	pdata->data = pda;
 
 	return SRD_OK;
+
+malformed:
+	srd_err("Protocol decoder %s submitted annotation list, but "
+		"second element was malformed.", di->decoder->name);
+	return SRD_ERR_PYTHON;
 }
 
+/*
+ * Convert binary output to srd_proto_data_binary. Its data points right
+ * into the PD's buffer object, until PyBuffer_Release(view).
+ */
 static int convert_binary(struct srd_decoder_inst *di, PyObject *obj,
-		struct srd_proto_data *pdata)
+		struct srd_proto_data_binary *pdb, Py_buffer *view)
 {
-	struct srd_proto_data_binary *pdb;
 	PyObject *py_tmp;
-	Py_ssize_t size;
 	int bin_class;
-	char *class_name, *buf;
+	char *class_name;
 
 	/* Should be a tuple of (binary class, bytes). */
 	if (!PyTuple_Check(obj)) {
@@ -117,7 +127,7 @@ static int convert_binary(struct srd_decoder_inst *di, PyObject *obj,
 	if (PyTuple_Size(obj) != 2) {
 		srd_err("Protocol decoder %s submitted SRD_OUTPUT_BINARY tuple "
 				"with %d elements instead of 2", di->decoder->name,
-				PyList_Size(obj));
+				(int)PyTuple_Size(obj));
 		return SRD_ERR_PYTHON;
 	}
 
@@ -135,30 +145,29 @@ static int convert_binary(struct srd_decoder_inst *di, PyObject *obj,
 		return SRD_ERR_PYTHON;
 	}
 
-	/* Second element should be bytes. */
+	/*
+	 * Second element should be bytes, or anything else with a
+	 * contiguous buffer (bytearray, memoryview, array, ...).
+	 */
 	py_tmp = PyTuple_GetItem(obj, 1);
-	if (!PyBytes_Check(py_tmp)) {
+	if (PyObject_GetBuffer(py_tmp, view, PyBUF_SIMPLE) == -1) {
+		PyErr_Clear();
 		srd_err("Protocol decoder %s submitted SRD_OUTPUT_BINARY tuple, "
-			"but second element was not bytes.", di->decoder->name);
+			"but second element was not bytes-like.", di->decoder->name);
 		return SRD_ERR_PYTHON;
 	}
 
 	/* Consider an empty set of bytes a bug. */
-	if (PyBytes_Size(py_tmp) == 0) {
+	if (view->len == 0) {
+		PyBuffer_Release(view);
 		srd_err("Protocol decoder %s submitted SRD_OUTPUT_BINARY "
 				"with empty data set.", di->decoder->name);
 		return SRD_ERR_PYTHON;
 	}
 
-	pdb = g_malloc(sizeof(struct srd_proto_data_binary));
-	if (PyBytes_AsStringAndSize(py_tmp, &buf, &size) == -1)
-		return SRD_ERR_PYTHON;
 	pdb->bin_class = bin_class;
-	pdb->size = size;
-	if (!(pdb->data = g_try_malloc(pdb->size)))
-		return SRD_ERR_MALLOC;
-	memcpy((void *)pdb->data, (const void *)buf, pdb->size);
-	pdata->data = pdb;
+	pdb->size = view->len;
+	pdb->data = view->buf;
 
 	return SRD_OK;
 }
@@ -193,18 +202,38 @@ static int convert_meta(struct srd_proto_data *pdata, PyObject *obj)
 	return SRD_OK;
 }
 
+/* The annotation or binary class of output, -1 if none. */
+static int output_class(const struct srd_pd_output *pdo, PyObject *obj)
+{
+	PyObject *py_class;
+
+	if (pdo->output_type != SRD_OUTPUT_ANN
+			&& pdo->output_type != SRD_OUTPUT_BINARY)
+		return -1;
+	if ((!PyList_Check(obj) && !PyTuple_Check(obj))
+			|| PySequence_Fast_GET_SIZE(obj) < 1)
+		return -1;
+	py_class = PySequence_Fast_GET_ITEM(obj, 0);
+
+	return PyLong_Check(py_class) ? PyLong_AsLong(py_class) : -1;
+}
+
 static PyObject *Decoder_put(PyObject *self, PyObject *args)
 {
 	GSList *l;
-	PyObject *py_data, *py_res;
+	PyObject *py_data, *py_res, *py_args, *py_decode;
 	struct srd_decoder_inst *di, *next_di;
 	struct srd_pd_output *pdo;
-	struct srd_proto_data *pdata;
+	struct srd_proto_data pdata;
+	struct srd_proto_data_annotation pda;
+	struct srd_proto_data_binary pdb;
+	struct srd_stats_owner stats_prev;
+	Py_buffer view;
 	uint64_t start_sample, end_sample;
 	int output_id;
-	struct srd_pd_callback *cb;
+	GSList *cbs;
 
-	if (!(di = srd_inst_find_by_obj(NULL, self))) {
+	if (!(di = ((srd_Decoder *)self)->di)) {
 		/* Shouldn't happen. */
 		srd_dbg("put(): self instance not found.");
 		return NULL;
@@ -231,61 +260,120 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 		 di->inst_id, start_sample, end_sample,
 		 OUTPUT_TYPES[pdo->output_type], output_id);
 
-	pdata = g_malloc0(sizeof(struct srd_proto_data));
-	pdata->start_sample = start_sample;
-	pdata->end_sample = end_sample;
-	pdata->pdo = pdo;
+	memset(&pdata, 0, sizeof(pdata));
+	pdata.start_sample = start_sample;
+	pdata.end_sample = end_sample;
+	pdata.pdo = pdo;
+
+	py_args = NULL;
+
+	/* All frontend callbacks registered for this output type. */
+	cbs = di->sess->callbacks[pdo->output_type];
+
+	if (di->sess->instrumented) {
+		if (di->sess->stats)
+			di->stats.num_puts[pdo->output_type]++;
+		if (di->sess->trace_cb)
+			srd_session_trace(di->sess, SRD_TRACE_PUT, di,
+					pdo->output_type, output_class(pdo,
+					py_data), start_sample, end_sample);
+	}
 
 	switch (pdo->output_type) {
 	case SRD_OUTPUT_ANN:
-		/* Annotations are only fed to callbacks. */
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
-			/* Convert from PyDict to srd_proto_data_annotation. */
-			if (convert_annotation(di, py_data, pdata) != SRD_OK) {
-				/* An error was already logged. */
-				break;
-			}
-			cb->cb(pdata, cb->cb_data);
+		/* Nobody may take annotations at all. */
+		if (!srd_session_ann_wanted(di->sess))
+			break;
+		/* Drop what nobody subscribed to, before converting it. */
+		if (di->ann_filter && !srd_inst_class_wanted(di->ann_filter,
+				output_class(pdo, py_data)))
+			break;
+		/* Convert from PyList to srd_proto_data_annotation. */
+		if (convert_annotation(di, py_data, &pda) != SRD_OK) {
+			/* An error was already logged. */
+			break;
+		}
+		pdata.data = &pda;
+		srd_pd_output_callback_run(cbs, &pdata);
+		if (di->sess->ann_summaries)
+			srd_ann_summary_add(di->sess, &pdata, &pda);
+		if (di->sess->ann_store)
+			srd_ann_store_add(di->sess, &pdata, &pda);
+		if (!di->sess->ann_batch) {
+			g_strfreev(pda.ann_text);
+			break;
 		}
+		/*
+		 * The batch takes over the annotation strings. Lazy texts
+		 * are kept in a tuple, the PD may still change its list.
+		 */
+		if (pda.py_texts && !(pda.py_texts = PySequence_Tuple(
+				pda.py_texts))) {
+			srd_exception_catch("Protocol decoder %s annotation: ",
+					di->decoder->name);
+			break;
+		}
+		srd_ann_batch_add(di->sess, &pdata, &pda);
 		break;
 	case SRD_OUTPUT_PYTHON:
+		/* The same arguments go to all stacked instances. */
+		if (di->next_di && !(py_args = Py_BuildValue("(KKO)",
+				start_sample, end_sample, py_data)))
+			return NULL;
 		for (l = di->next_di; l; l = l->next) {
 			next_di = l->data;
-			srd_spew("Sending %d-%d to instance %s",
+			srd_spew("Sending %" PRIu64 "-%" PRIu64 " to instance %s",
 				 start_sample, end_sample, next_di->inst_id);
-			if (!(py_res = PyObject_CallMethod(
-				next_di->py_inst, "decode", "KKO", start_sample,
-				end_sample, py_data))) {
+			if (di->sess->instrumented)
+				stats_prev = srd_inst_decode_begin(next_di,
+						start_sample, end_sample, FALSE);
+			py_decode = ((srd_Decoder *)next_di->py_inst)->decode;
+			if (py_decode)
+				py_res = PyObject_Call(py_decode, py_args, NULL);
+			else
+				py_res = PyObject_CallMethod(next_di->py_inst,
+						"decode", "KKO", start_sample,
+						end_sample, py_data);
+			if (di->sess->instrumented)
+				srd_inst_decode_end(next_di, start_sample,
+						end_sample, stats_prev);
+			if (!py_res) {
 				srd_exception_catch("Calling %s decode(): ",
 							next_di->inst_id);
 			}
 			Py_XDECREF(py_res);
 		}
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
+		Py_XDECREF(py_args);
+		if (cbs) {
 			/* Frontends aren't really supposed to get Python
 			 * callbacks, but it's useful for testing. */
-			pdata->data = py_data;
-			cb->cb(pdata, cb->cb_data);
+			pdata.data = py_data;
+			srd_pd_output_callback_run(cbs, &pdata);
 		}
 		break;
 	case SRD_OUTPUT_BINARY:
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
-			/* Convert from PyDict to srd_proto_data_binary. */
-			if (convert_binary(di, py_data, pdata) != SRD_OK) {
+		if (di->bin_filter && !srd_inst_class_wanted(di->bin_filter,
+				output_class(pdo, py_data)))
+			break;
+		if (cbs) {
+			/* Convert from PyTuple to srd_proto_data_binary. */
+			if (convert_binary(di, py_data, &pdb, &view) != SRD_OK) {
 				/* An error was already logged. */
 				break;
 			}
-			cb->cb(pdata, cb->cb_data);
+			pdata.data = &pdb;
+			srd_pd_output_callback_run(cbs, &pdata);
+			PyBuffer_Release(&view);
 		}
 		break;
 	case SRD_OUTPUT_META:
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
+		if (cbs) {
 			/* Annotations need converting from PyObject. */
-			if (convert_meta(pdata, py_data) != SRD_OK) {
+			if (convert_meta(&pdata, py_data) != SRD_OK) {
 				/* An exception was already set up. */
 				break;
 			}
-			cb->cb(pdata, cb->cb_data);
+			srd_pd_output_callback_run(cbs, &pdata);
 		}
 		break;
 	default:
@@ -294,8 +382,6 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 		break;
 	}
 
-	g_free(pdata);
-
 	Py_RETURN_NONE;
 }
 
@@ -315,7 +401,7 @@ static PyObject *Decoder_register(PyObject *self, PyObject *args,
 	meta_type_gv = NULL;
 	meta_name = meta_descr = NULL;
 
-	if (!(di = srd_inst_find_by_obj(NULL, self))) {
+	if (!(di = ((srd_Decoder *)self)->di)) {
 		PyErr_SetString(PyExc_Exception, "decoder instance not found");
 		return NULL;
 	}
@@ -329,6 +415,12 @@ static PyObject *Decoder_register(PyObject *self, PyObject *args,
 		return NULL;
 	}
 
+	if (output_type < 0 || output_type >= SRD_NUM_OUTPUT_TYPES) {
+		PyErr_Format(PyExc_ValueError, "Invalid output type %d.",
+				output_type);
+		return NULL;
+	}
+
 	/* Check if the meta value's type is supported. */
 	if (output_type == SRD_OUTPUT_META) {
 		if (meta_type_py == &PyLong_Type)
@@ -365,21 +457,200 @@ static PyObject *Decoder_register(PyObject *self, PyObject *args,
 	return py_new_output_id;
 }
 
+static PyObject *Decoder_wants(PyObject *self, PyObject *args)
+{
+	struct srd_decoder_inst *di;
+	int ann_class;
+
+	if (!(di = ((srd_Decoder *)self)->di)) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		return NULL;
+	}
+
+	if (!PyArg_ParseTuple(args, "i", &ann_class))
+		return NULL;
+
+	/* Nobody gets any annotations without callbacks or the like. */
+	if (!srd_session_ann_wanted(di->sess))
+		Py_RETURN_FALSE;
+
+	return PyBool_FromLong(srd_inst_class_wanted(di->ann_filter,
+			ann_class));
+}
+
+static PyObject *Decoder_wait_samplenum(PyObject *self, PyObject *args)
+{
+	struct srd_wait_cond *wait;
+	uint64_t samplenum;
+
+	if (!PyArg_ParseTuple(args, "K", &samplenum))
+		return NULL;
+
+	wait = &((srd_Decoder *)self)->wait;
+	wait->type = SRD_WAIT_SAMPLENUM;
+	wait->samplenum = samplenum;
+
+	Py_RETURN_NONE;
+}
+
+/*
+ * Edges and patterns are checked against the instance's extracted channel
+ * bits, which decoders with a lot of channels don't have.
+ */
+static struct srd_decoder_inst *wait_channels_check(PyObject *self)
+{
+	struct srd_decoder_inst *di;
+
+	if (!(di = ((srd_Decoder *)self)->di)) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		return NULL;
+	}
+
+	if (!di->channel_extract) {
+		PyErr_Format(PyExc_ValueError, "Cannot wait for channels of "
+				"decoders with more than %d channels.",
+				SRD_EXTRACT_MAX_CHANNELS);
+		return NULL;
+	}
+
+	return di;
+}
+
+static PyObject *Decoder_wait_edge(PyObject *self, PyObject *args)
+{
+	struct srd_decoder_inst *di;
+	struct srd_wait_cond *wait;
+	const char *edge;
+	int channel;
+
+	edge = "any";
+	if (!PyArg_ParseTuple(args, "i|s", &channel, &edge))
+		return NULL;
+
+	if (!(di = wait_channels_check(self)))
+		return NULL;
+
+	if (channel < 0 || channel >= di->dec_num_channels) {
+		PyErr_Format(PyExc_ValueError, "Invalid channel %d.", channel);
+		return NULL;
+	}
+
+	/* An unused optional channel never changes. */
+	if (di->dec_channelmap[channel] == -1) {
+		PyErr_Format(PyExc_ValueError, "Channel %d is not connected.",
+				channel);
+		return NULL;
+	}
+
+	wait = &((srd_Decoder *)self)->wait;
+	wait->mask = 1ULL << channel;
+	if (!strcmp(edge, "rising")) {
+		wait->value = wait->mask;
+		wait->any_edge = FALSE;
+	} else if (!strcmp(edge, "falling")) {
+		wait->value = 0;
+		wait->any_edge = FALSE;
+	} else if (!strcmp(edge, "any")) {
+		wait->any_edge = TRUE;
+	} else {
+		PyErr_Format(PyExc_ValueError, "Invalid edge '%s'.", edge);
+		return NULL;
+	}
+	wait->type = SRD_WAIT_EDGE;
+
+	Py_RETURN_NONE;
+}
+
+static PyObject *Decoder_wait_match(PyObject *self, PyObject *args)
+{
+	struct srd_decoder_inst *di;
+	struct srd_wait_cond *wait;
+	PyObject *py_pattern, *py_item;
+	uint64_t mask, value;
+	Py_ssize_t num_items, i;
+	long val;
+
+	if (!PyArg_ParseTuple(args, "O", &py_pattern))
+		return NULL;
+
+	if (!(di = wait_channels_check(self)))
+		return NULL;
+
+	if (!PySequence_Check(py_pattern)
+			|| (num_items = PySequence_Size(py_pattern)) > di->dec_num_channels) {
+		PyErr_SetString(PyExc_ValueError, "Pattern must be a sequence "
+				"with at most one item per channel.");
+		return NULL;
+	}
+
+	/* None means "don't care", anything else must be 0 or 1. */
+	mask = value = 0;
+	for (i = 0; i < num_items; i++) {
+		if (!(py_item = PySequence_GetItem(py_pattern, i)))
+			return NULL;
+		if (py_item == Py_None) {
+			Py_DECREF(py_item);
+			continue;
+		}
+		val = PyLong_Check(py_item) ? PyLong_AsLong(py_item) : -1;
+		Py_DECREF(py_item);
+		if (val != 0 && val != 1) {
+			PyErr_Format(PyExc_ValueError, "Pattern item %zd must be "
+					"0, 1 or None.", i);
+			return NULL;
+		}
+		if (di->dec_channelmap[i] == -1) {
+			PyErr_Format(PyExc_ValueError, "Channel %zd is not "
+					"connected, its pattern item must be None.", i);
+			return NULL;
+		}
+		mask |= 1ULL << i;
+		if (val)
+			value |= 1ULL << i;
+	}
+
+	wait = &((srd_Decoder *)self)->wait;
+	wait->mask = mask;
+	wait->value = value;
+	wait->type = SRD_WAIT_MATCH;
+
+	Py_RETURN_NONE;
+}
+
 static PyMethodDef Decoder_methods[] = {
 	{"put", Decoder_put, METH_VARARGS,
 	 "Accepts a dictionary with the following keys: startsample, endsample, data"},
 	{"register", (PyCFunction)Decoder_register, METH_VARARGS|METH_KEYWORDS,
 			"Register a new output stream"},
+	{"wants", Decoder_wants, METH_VARARGS,
+	 "Check whether annotations of the given class are wanted at all"},
+	{"wait_samplenum", Decoder_wait_samplenum, METH_VARARGS,
+	 "Skip all samples before the given sample number"},
+	{"wait_edge", Decoder_wait_edge, METH_VARARGS,
+	 "Skip all samples until the next 'rising', 'falling' or 'any' edge "
+	 "on the given channel"},
+	{"wait_match", Decoder_wait_match, METH_VARARGS,
+	 "Skip all samples until the channels match a pattern of 0, 1 or "
+	 "None (don't care) per channel"},
 	{NULL, NULL, 0, NULL}
 };
 
-/** @cond PRIVATE */
-SRD_PRIV PyTypeObject srd_Decoder_type = {
-	PyVarObject_HEAD_INIT(NULL, 0)
-	.tp_name = "sigrokdecode.Decoder",
-	.tp_basicsize = sizeof(srd_Decoder),
-	.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
-	.tp_doc = "sigrok Decoder base class",
-	.tp_methods = Decoder_methods,
+static PyType_Slot srd_Decoder_slots[] = {
+	{Py_tp_doc, "sigrok Decoder base class"},
+	{Py_tp_methods, Decoder_methods},
+	{Py_tp_new, PyType_GenericNew},
+	{0, NULL}
+};
+
+static PyType_Spec srd_Decoder_spec = {
+	.name = "sigrokdecode.Decoder",
+	.basicsize = sizeof(srd_Decoder),
+	.flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+	.slots = srd_Decoder_slots,
 };
-/** @endcond */
+
+/** @private */
+SRD_PRIV PyObject *srd_Decoder_type_new(void)
+{
+	return PyType_FromSpec(&srd_Decoder_spec);
+}
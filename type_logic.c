@@ -28,35 +28,257 @@ static PyObject *srd_logic_iter(PyObject *self)
 	return self;
 }
 
+/*
+ * Convert the bit-packed sample to an array of bytes, with only 0x01
+ * and 0x00 values, so the PD doesn't need to do any bitshifting.
+ *
+ * This walks the channel map for every sample, and is only used for
+ * decoders with too many channels for a precomputed extraction plan.
+ */
+static gboolean srd_logic_unpack_channelmap(struct srd_decoder_inst *di,
+		const uint8_t *sample_pos)
+{
+	uint8_t sample;
+	int byte_offset, bit_offset, i;
+	gboolean changed;
+
+	changed = FALSE;
+	for (i = 0; i < di->dec_num_channels; i++) {
+		/* A channelmap value of -1 means "unused optional channel". */
+		if (di->dec_channelmap[i] == -1) {
+			/* Value of unused channel is 0xff, instead of 0 or 1. */
+			sample = 0xff;
+		} else {
+			byte_offset = di->dec_channelmap[i] / 8;
+			bit_offset = di->dec_channelmap[i] % 8;
+			sample = *(sample_pos + byte_offset) & (1 << bit_offset) ? 1 : 0;
+		}
+		if (di->channel_samples[i] != sample) {
+			di->channel_samples[i] = sample;
+			changed = TRUE;
+		}
+	}
+
+	return changed;
+}
+
+/*
+ * Extract the decoder's channels from a sample, using the instance's
+ * precomputed extraction plan.
+ *
+ * Returns TRUE if any of the decoder's channels differ from the
+ * previously unpacked sample. The channel values are also stored as
+ * one bit per channel in pins_key, for looking up cached pins objects.
+ */
+static gboolean srd_logic_unpack(struct srd_decoder_inst *di,
+		const uint8_t *sample_pos, uint64_t *pins_key)
+{
+	struct srd_channel_extract *ex;
+	uint64_t key;
+	int i;
+
+	if (!(ex = di->channel_extract)) {
+		*pins_key = 0;
+		return srd_logic_unpack_channelmap(di, sample_pos);
+	}
+
+	key = 0;
+	if (ex->identity) {
+		for (i = 0; i < ex->num_bytes; i++)
+			key |= (uint64_t)sample_pos[i] << (8 * i);
+		key &= ex->identity_mask;
+	} else {
+		for (i = 0; i < ex->num_bytes; i++)
+			key |= ex->bytes[i].lut[sample_pos[ex->bytes[i].offset]];
+	}
+	*pins_key = key;
+
+	if (ex->have_last_key && key == ex->last_key)
+		return FALSE;
+	ex->have_last_key = TRUE;
+	ex->last_key = key;
+
+	/* Only unpack into bytes when something actually changed. */
+	for (i = 0; i < di->dec_num_channels; i++) {
+		/* Value of unused channel is 0xff, instead of 0 or 1. */
+		if (di->dec_channelmap[i] == -1)
+			di->channel_samples[i] = 0xff;
+		else
+			di->channel_samples[i] = (key >> i) & 1;
+	}
+
+	return TRUE;
+}
+
+/*
+ * Return a new reference to a bytes object holding the unpacked channel
+ * values. For decoders with few channels there are only a handful of
+ * possible values, so these objects are created once and then shared.
+ */
+static PyObject *srd_logic_pins_get(struct srd_decoder_inst *di,
+		uint64_t pins_key)
+{
+	PyObject *py_pins;
+
+	if (di->dec_num_channels > SRD_PINS_CACHE_MAX_CHANNELS)
+		return PyBytes_FromStringAndSize((const char *)di->channel_samples,
+				di->dec_num_channels);
+
+	if (!di->pins_cache)
+		di->pins_cache = g_malloc0(sizeof(PyObject *)
+				* (1 << di->dec_num_channels));
+
+	if (!(py_pins = di->pins_cache[pins_key])) {
+		py_pins = PyBytes_FromStringAndSize((const char *)di->channel_samples,
+				di->dec_num_channels);
+		if (!py_pins)
+			return NULL;
+		di->pins_cache[pins_key] = py_pins;
+	}
+	Py_INCREF(py_pins);
+
+	return py_pins;
+}
+
+/* Bytes compared per step by srd_logic_find_change(). */
+#define SCAN_BLOCK_SIZE 32
+
+/*
+ * Return the index of the first of num_samples samples at buf in which
+ * any of the bits set in mask differ from the reference sample ref, or
+ * num_samples if there is no such sample.
+ *
+ * If the unit size evenly divides the block size, the reference and mask
+ * are replicated across a block, and the samples are compared a block of
+ * 64-bit words at a time. This is plain C, but compilers readily turn it
+ * into vector instructions. Only the block containing a difference (and
+ * any partial block at the end) is then looked at sample by sample.
+ */
+static uint64_t srd_logic_find_change(const uint8_t *buf, uint64_t num_samples,
+		unsigned int unitsize, const uint8_t *ref, const uint8_t *mask)
+{
+	uint64_t ref_words[SCAN_BLOCK_SIZE / 8], mask_words[SCAN_BLOCK_SIZE / 8];
+	uint64_t words[SCAN_BLOCK_SIZE / 8], num_bytes, pos, diff, i;
+	unsigned int b, w;
+
+	num_bytes = num_samples * unitsize;
+	pos = 0;
+	if (SCAN_BLOCK_SIZE % unitsize == 0) {
+		for (b = 0; b < SCAN_BLOCK_SIZE; b++) {
+			((uint8_t *)ref_words)[b] = ref[b % unitsize] & mask[b % unitsize];
+			((uint8_t *)mask_words)[b] = mask[b % unitsize];
+		}
+		for (; pos + SCAN_BLOCK_SIZE <= num_bytes; pos += SCAN_BLOCK_SIZE) {
+			memcpy(words, buf + pos, SCAN_BLOCK_SIZE);
+			diff = 0;
+			for (w = 0; w < SCAN_BLOCK_SIZE / 8; w++)
+				diff |= (words[w] & mask_words[w]) ^ ref_words[w];
+			if (diff)
+				break;
+		}
+	}
+
+	for (i = pos / unitsize; i < num_samples; i++) {
+		for (b = 0; b < unitsize; b++) {
+			if ((buf[i * unitsize + b] ^ ref[b]) & mask[b])
+				return i;
+		}
+	}
+
+	return num_samples;
+}
+
+/* Check whether the sample with the given channel bits ends a wait. */
+static gboolean srd_logic_wait_met(const struct srd_wait_cond *wait,
+		gboolean have_prev_key, uint64_t prev_key, uint64_t key)
+{
+	switch (wait->type) {
+	case SRD_WAIT_EDGE:
+		if (!have_prev_key || !((prev_key ^ key) & wait->mask))
+			return FALSE;
+		return wait->any_edge || (key & wait->mask) == wait->value;
+	case SRD_WAIT_MATCH:
+		return (key & wait->mask) == wait->value;
+	default:
+		return TRUE;
+	}
+}
+
 static PyObject *srd_logic_iternext(PyObject *self)
 {
 	srd_logic *logic;
+	struct srd_decoder_inst *di;
+	struct srd_channel_extract *ex;
+	struct srd_wait_cond *wait;
 	PyObject *py_samplenum, *py_samples;
-	uint8_t *sample_pos, sample;
-	int byte_offset, bit_offset, i;
+	uint8_t *sample_pos;
+	uint64_t num_samples, pins_key, prev_key;
+	gboolean changed, have_prev_key, skipped;
 
 	logic = (srd_logic *)self;
-	if (logic->itercnt >= logic->inbuflen / logic->di->data_unitsize) {
-		/* End iteration loop. */
-		return NULL;
+	di = logic->di;
+	num_samples = logic->inbuflen / di->data_unitsize;
+	wait = &((srd_Decoder *)di->py_inst)->wait;
+
+	/*
+	 * If the PD waits for a specific sample number, jump right to it
+	 * without looking at any of the samples in between. If it's not in
+	 * this chunk, the wait carries over into the next one.
+	 */
+	skipped = FALSE;
+	if (wait->type == SRD_WAIT_SAMPLENUM) {
+		if (wait->samplenum >= logic->start_samplenum + num_samples) {
+			/* End iteration loop. */
+			logic->itercnt = num_samples;
+			return NULL;
+		}
+		if (wait->samplenum > logic->start_samplenum + logic->itercnt)
+			logic->itercnt = wait->samplenum - logic->start_samplenum;
+		wait->type = SRD_WAIT_NONE;
+		skipped = TRUE;
 	}
 
 	/*
-	 * Convert the bit-packed sample to an array of bytes, with only 0x01
-	 * and 0x00 values, so the PD doesn't need to do any bitshifting.
+	 * In SRD_SAMPLE_ITER_CHANGES mode, skip over all samples where none
+	 * of the decoder's channels changed. The first sample of a chunk is
+	 * always passed on, so the PD sees the current state of all channels.
+	 * If the PD waits for an edge or a pattern, skip over all samples
+	 * until one of them matches.
 	 */
-	sample_pos = logic->inbuf + logic->itercnt * logic->di->data_unitsize;
-	for (i = 0; i < logic->di->dec_num_channels; i++) {
-		/* A channelmap value of -1 means "unused optional channel". */
-		if (logic->di->dec_channelmap[i] == -1) {
-			/* Value of unused channel is 0xff, instead of 0 or 1. */
-			logic->di->channel_samples[i] = 0xff;
-		} else {
-			byte_offset = logic->di->dec_channelmap[i] / 8;
-			bit_offset = logic->di->dec_channelmap[i] % 8;
-			sample = *(sample_pos + byte_offset) & (1 << bit_offset) ? 1 : 0;
-			logic->di->channel_samples[i] = sample;
+	while (logic->itercnt < num_samples) {
+		ex = di->channel_extract;
+		have_prev_key = ex && ex->have_last_key;
+		prev_key = ex ? ex->last_key : 0;
+		sample_pos = logic->inbuf + logic->itercnt * di->data_unitsize;
+		changed = srd_logic_unpack(di, sample_pos, &pins_key);
+		if (skipped)
+			break;
+		if (wait->type != SRD_WAIT_NONE) {
+			if (srd_logic_wait_met(wait, have_prev_key, prev_key,
+					pins_key)) {
+				wait->type = SRD_WAIT_NONE;
+				break;
+			}
+		} else if (changed || logic->itercnt == 0
+				|| di->decoder->sample_iteration != SRD_SAMPLE_ITER_CHANGES) {
+			break;
 		}
+		/*
+		 * Nothing of interest in this sample, and neither in the ones
+		 * after it with the same channel values, so skip over those.
+		 */
+		if (ex)
+			logic->itercnt += 1 + srd_logic_find_change(
+				sample_pos + di->data_unitsize,
+				num_samples - logic->itercnt - 1,
+				di->data_unitsize, sample_pos, ex->sample_mask);
+		else
+			logic->itercnt++;
+	}
+
+	if (logic->itercnt >= num_samples) {
+		/* End iteration loop. */
+		return NULL;
 	}
 
 	/* Prepare the next samplenum/sample list in this iteration. */
@@ -64,8 +286,8 @@ static PyObject *srd_logic_iternext(PyObject *self)
 	    PyLong_FromUnsignedLongLong(logic->start_samplenum +
 					logic->itercnt);
 	PyList_SetItem(logic->sample, 0, py_samplenum);
-	py_samples = PyBytes_FromStringAndSize((const char *)logic->di->channel_samples,
-					       logic->di->dec_num_channels);
+	if (!(py_samples = srd_logic_pins_get(di, pins_key)))
+		return NULL;
 	PyList_SetItem(logic->sample, 1, py_samples);
 	Py_INCREF(logic->sample);
 	logic->itercnt++;
@@ -73,14 +295,198 @@ static PyObject *srd_logic_iternext(PyObject *self)
 	return logic->sample;
 }
 
-/** @cond PRIVATE */
-SRD_PRIV PyTypeObject srd_logic_type = {
-	PyVarObject_HEAD_INIT(NULL, 0)
-	.tp_name = "srd_logic",
-	.tp_basicsize = sizeof(srd_logic),
-	.tp_flags = Py_TPFLAGS_DEFAULT,
-	.tp_doc = "Sigrokdecode logic sample object",
-	.tp_iter = srd_logic_iter,
-	.tp_iternext = srd_logic_iternext,
+static void srd_logic_dealloc(PyObject *self)
+{
+	srd_logic *logic;
+	PyTypeObject *type;
+
+	logic = (srd_logic *)self;
+	type = Py_TYPE(self);
+	Py_XDECREF(logic->sample);
+	Py_XDECREF(logic->data);
+	PyObject_Del(self);
+#if PY_VERSION_HEX >= 0x03080000
+	/* Instances of heap types hold a reference to their type. */
+	Py_DECREF(type);
+#endif
+}
+
+/*
+ * Export the raw, bit-packed sample chunk as a read-only buffer, so PDs
+ * can scan it in bulk (e.g. via memoryview) instead of sample by sample.
+ *
+ * The sample data is owned by the frontend, and gone after decode(), but
+ * PDs may keep views on it for longer. So views are on a bytes copy of
+ * the chunk instead, made once per decode() call, which they keep alive.
+ */
+static int srd_logic_getbuffer(PyObject *self, Py_buffer *view, int flags)
+{
+	srd_logic *logic;
+
+	logic = (srd_logic *)self;
+	if (!logic->inbuf) {
+		PyErr_SetString(PyExc_BufferError, "Sample data is only "
+				"available during decode().");
+		view->obj = NULL;
+		return -1;
+	}
+
+	if (!logic->data && !(logic->data = PyBytes_FromStringAndSize(
+			(const char *)logic->inbuf, logic->inbuflen))) {
+		view->obj = NULL;
+		return -1;
+	}
+
+	return PyObject_GetBuffer(logic->data, view, flags);
+}
+
+static PyObject *srd_logic_get_unitsize(PyObject *self, void *closure)
+{
+	(void)closure;
+
+	return PyLong_FromLong(((srd_logic *)self)->di->data_unitsize);
+}
+
+static PyObject *srd_logic_get_start_samplenum(PyObject *self, void *closure)
+{
+	(void)closure;
+
+	return PyLong_FromUnsignedLongLong(((srd_logic *)self)->start_samplenum);
+}
+
+static PyObject *srd_logic_get_num_samples(PyObject *self, void *closure)
+{
+	srd_logic *logic;
+
+	(void)closure;
+
+	logic = (srd_logic *)self;
+
+	return PyLong_FromUnsignedLongLong(logic->inbuflen
+			/ logic->di->data_unitsize);
+}
+
+static PyObject *srd_logic_get_channelmap(PyObject *self, void *closure)
+{
+	srd_logic *logic;
+	PyObject *py_channelmap;
+	int i;
+
+	(void)closure;
+
+	logic = (srd_logic *)self;
+	if (!(py_channelmap = PyTuple_New(logic->di->dec_num_channels)))
+		return NULL;
+	for (i = 0; i < logic->di->dec_num_channels; i++)
+		PyTuple_SET_ITEM(py_channelmap, i,
+				PyLong_FromLong(logic->di->dec_channelmap[i]));
+
+	return py_channelmap;
+}
+
+static PyGetSetDef srd_logic_getset[] = {
+	{"unitsize", srd_logic_get_unitsize, NULL,
+	 "Number of bytes per sample in the sample data", NULL},
+	{"start_samplenum", srd_logic_get_start_samplenum, NULL,
+	 "Sample number of the first sample in the sample data", NULL},
+	{"num_samples", srd_logic_get_num_samples, NULL,
+	 "Number of samples in the sample data", NULL},
+	{"channelmap", srd_logic_get_channelmap, NULL,
+	 "Bit position of each PD channel in a sample, -1 if unused", NULL},
+	{NULL, NULL, NULL, NULL, NULL}
 };
-/** @endcond */
+
+/*
+ * Let PDs which scan the sample data themselves find the next change on
+ * their channels just as quickly as the sample iterator does.
+ */
+static PyObject *srd_logic_find_change_py(PyObject *self, PyObject *args)
+{
+	srd_logic *logic;
+	struct srd_decoder_inst *di;
+	uint64_t samplenum, num_samples, idx, ret;
+	uint8_t *mask;
+
+	if (!PyArg_ParseTuple(args, "K", &samplenum))
+		return NULL;
+
+	logic = (srd_logic *)self;
+	di = logic->di;
+	if (!logic->inbuf) {
+		PyErr_SetString(PyExc_ValueError, "Sample data is only "
+				"available during decode().");
+		return NULL;
+	}
+
+	num_samples = logic->inbuflen / di->data_unitsize;
+	if (samplenum < logic->start_samplenum
+			|| samplenum >= logic->start_samplenum + num_samples) {
+		PyErr_Format(PyExc_ValueError, "Sample %" PRIu64 " is not "
+				"in the sample data.", samplenum);
+		return NULL;
+	}
+	idx = samplenum - logic->start_samplenum;
+
+	if (di->channel_extract)
+		mask = di->channel_extract->sample_mask;
+	else
+		mask = srd_inst_sample_mask_new(di);
+	ret = srd_logic_find_change(
+			logic->inbuf + (idx + 1) * di->data_unitsize,
+			num_samples - idx - 1, di->data_unitsize,
+			logic->inbuf + idx * di->data_unitsize, mask);
+	if (!di->channel_extract)
+		g_free(mask);
+
+	if (ret == num_samples - idx - 1)
+		Py_RETURN_NONE;
+
+	return PyLong_FromUnsignedLongLong(samplenum + 1 + ret);
+}
+
+static PyMethodDef srd_logic_methods[] = {
+	{"find_change", srd_logic_find_change_py, METH_VARARGS,
+	 "Return the number of the first sample after the given one in which "
+	 "any of the PD's channels differ from it, or None if there is none "
+	 "in the sample data"},
+	{NULL, NULL, 0, NULL}
+};
+
+static PyType_Slot srd_logic_slots[] = {
+	{Py_tp_doc, "Sigrokdecode logic sample object"},
+	{Py_tp_iter, srd_logic_iter},
+	{Py_tp_iternext, srd_logic_iternext},
+	{Py_tp_dealloc, srd_logic_dealloc},
+	{Py_tp_methods, srd_logic_methods},
+	{Py_tp_getset, srd_logic_getset},
+	{Py_bf_getbuffer, srd_logic_getbuffer},
+	{0, NULL}
+};
+
+/* Only decode() calls get srd_logic objects, PDs can't make their own. */
+static PyType_Spec srd_logic_spec = {
+	.name = "srd_logic",
+	.basicsize = sizeof(srd_logic),
+#ifdef Py_TPFLAGS_DISALLOW_INSTANTIATION
+	.flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_DISALLOW_INSTANTIATION,
+#else
+	.flags = Py_TPFLAGS_DEFAULT,
+#endif
+	.slots = srd_logic_slots,
+};
+
+/** @private */
+SRD_PRIV PyObject *srd_logic_type_new(void)
+{
+	PyObject *py_type;
+
+	if (!(py_type = PyType_FromSpec(&srd_logic_spec)))
+		return NULL;
+
+#ifndef Py_TPFLAGS_DISALLOW_INSTANTIATION
+	/* Before Python 3.10, the type would inherit object's tp_new. */
+	((PyTypeObject *)py_type)->tp_new = NULL;
+#endif
+
+	return py_type;
+}
@@ -21,6 +21,7 @@
 #include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
 #include "libsigrokdecode.h"
 #include "config.h"
+#include <time.h>
 
 /**
  * Get the value of a Python object's attribute, returned as a newly
@@ -172,7 +173,7 @@ err_out:
  */
 SRD_PRIV int py_strseq_to_char(const PyObject *py_strseq, char ***outstr)
 {
-	PyObject *py_str;
+	PyObject *py_item, *py_str;
 	int list_len, i;
 	char **out, *str;
 
@@ -182,15 +183,48 @@ SRD_PRIV int py_strseq_to_char(const PyObject *py_strseq, char ***outstr)
 		return SRD_ERR_MALLOC;
 	}
 	for (i = 0; i < list_len; i++) {
-		if (!(py_str = PyUnicode_AsEncodedString(
-		    PySequence_GetItem((PyObject *)py_strseq, i), "utf-8", NULL)))
-			return SRD_ERR_PYTHON;
-		if (!(str = PyBytes_AS_STRING(py_str)))
+		py_item = PySequence_GetItem((PyObject *)py_strseq, i);
+		py_str = py_item ? PyUnicode_AsEncodedString(py_item, "utf-8",
+				NULL) : NULL;
+		Py_XDECREF(py_item);
+		if (!py_str) {
+			out[i] = NULL;
+			g_strfreev(out);
 			return SRD_ERR_PYTHON;
+		}
+		str = PyBytes_AS_STRING(py_str);
 		out[i] = g_strdup(str);
+		Py_DECREF(py_str);
 	}
 	out[i] = NULL;
 	*outstr = out;
 
 	return SRD_OK;
 }
+
+/**
+ * Read the clocks used for decoding statistics and tracing.
+ *
+ * @param wall_ns Will hold the monotonic wall clock time, in nanoseconds.
+ * @param cpu_ns Will hold the CPU time used by the calling thread, in
+ *               nanoseconds, or 0 if not available. May be NULL.
+ *
+ * @private
+ */
+SRD_PRIV void srd_clock_get(uint64_t *wall_ns, uint64_t *cpu_ns)
+{
+#ifdef CLOCK_THREAD_CPUTIME_ID
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	*wall_ns = (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+	if (cpu_ns) {
+		clock_gettime(CLOCK_THREAD_CPUTIME_ID, &ts);
+		*cpu_ns = (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+	}
+#else
+	*wall_ns = (uint64_t)g_get_monotonic_time() * 1000;
+	if (cpu_ns)
+		*cpu_ns = 0;
+#endif
+}
@@ -0,0 +1,987 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include "config.h"
+#include <glib.h>
+
+#ifdef G_OS_UNIX
+#include <errno.h>
+#include <poll.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/socket.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#endif
+
+/**
+ * @file
+ *
+ * Running decoder stacks in worker processes.
+ */
+
+/*
+ * Every instance receiving sample data from the frontend can be run in a
+ * worker process of its own, together with all instances stacked on top
+ * of it. The workers are forked off by srd_session_start(), after start()
+ * was called on all instances. They thus inherit the complete decoder
+ * state, and pointers into it (e.g. to a struct srd_pd_output) mean the
+ * same in the frontend process and in the workers.
+ *
+ * Sample data is copied into a memory area shared with all workers, and
+ * only its location is sent to each worker over a socket. The workers send
+ * their annotation, binary and meta output back over the same socket. The
+ * frontend process collects that for a whole chunk, and then passes it to
+ * its callbacks in the same order as if all instances had decoded in the
+ * frontend process.
+ */
+
+#ifdef G_OS_UNIX
+
+/** @cond PRIVATE */
+
+/* session.c */
+extern SRD_PRIV GSList *sessions;
+
+/** @endcond */
+
+/* Size of the memory area for passing sample data to the workers. */
+#define WORKER_SHM_SIZE (4 * 1024 * 1024)
+
+#ifndef MSG_NOSIGNAL
+#define MSG_NOSIGNAL 0
+#endif
+
+enum {
+	WORKER_CMD_DECODE,
+	WORKER_CMD_EXIT,
+};
+
+/* Sent by the frontend process. */
+struct worker_cmd {
+	int type;
+	uint64_t start_samplenum;
+	uint64_t end_samplenum;
+	/* Number of bytes of sample data in the shared memory area. */
+	uint64_t len;
+};
+
+enum {
+	WORKER_MSG_OUTPUT,
+	WORKER_MSG_DONE,
+};
+
+/* Sent by a worker, followed by len bytes for WORKER_MSG_OUTPUT. */
+struct worker_msg {
+	int type;
+	/* WORKER_MSG_DONE: the return value of srd_inst_decode(). */
+	int ret;
+	uint64_t start_sample;
+	uint64_t end_sample;
+	struct srd_pd_output *pdo;
+	uint64_t len;
+};
+
+/* Output collected by a worker while decoding a chunk. */
+static GByteArray *worker_out = NULL;
+
+/*
+ * Output starting outside of these samples is dropped by the worker,
+ * see srd_workers_decode_segmented().
+ */
+static uint64_t worker_keep_start = 0;
+static uint64_t worker_keep_end = UINT64_MAX;
+
+static int send_all(int fd, const void *buf, size_t len)
+{
+	const uint8_t *p;
+	ssize_t ret;
+
+	for (p = buf; len > 0; p += ret, len -= ret) {
+		if ((ret = send(fd, p, len, MSG_NOSIGNAL)) < 0) {
+			if (errno == EINTR) {
+				ret = 0;
+				continue;
+			}
+			return SRD_ERR;
+		}
+	}
+
+	return SRD_OK;
+}
+
+static int recv_all(int fd, void *buf, size_t len)
+{
+	uint8_t *p;
+	ssize_t ret;
+
+	for (p = buf; len > 0; p += ret, len -= ret) {
+		if ((ret = read(fd, p, len)) <= 0) {
+			if (ret < 0 && errno == EINTR) {
+				ret = 0;
+				continue;
+			}
+			return SRD_ERR;
+		}
+	}
+
+	return SRD_OK;
+}
+
+/*
+ * Output callback in the worker process, for all output types which the
+ * frontend process wants.
+ */
+static void worker_output_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	struct srd_proto_data_annotation *pda;
+	struct srd_proto_data_binary *pdb;
+	struct worker_msg msg;
+	const char *type;
+	gint32 val;
+	guint hdr_pos;
+	int i;
+
+	(void)cb_data;
+
+	if (pdata->start_sample < worker_keep_start
+			|| pdata->start_sample >= worker_keep_end)
+		return;
+
+	memset(&msg, 0, sizeof(msg));
+	msg.type = WORKER_MSG_OUTPUT;
+	msg.start_sample = pdata->start_sample;
+	msg.end_sample = pdata->end_sample;
+	msg.pdo = pdata->pdo;
+	hdr_pos = worker_out->len;
+	g_byte_array_append(worker_out, (const guint8 *)&msg, sizeof(msg));
+
+	switch (pdata->pdo->output_type) {
+	case SRD_OUTPUT_ANN:
+		/* Class, number of strings, then the NUL-terminated strings. */
+		pda = pdata->data;
+		val = pda->ann_class;
+		g_byte_array_append(worker_out, (const guint8 *)&val, sizeof(val));
+		val = srd_ann_text_count(pda);
+		g_byte_array_append(worker_out, (const guint8 *)&val, sizeof(val));
+		for (i = 0; i < val; i++) {
+			if (!(type = srd_ann_text_get(pda, i)))
+				type = "";
+			g_byte_array_append(worker_out, (const guint8 *)type,
+					strlen(type) + 1);
+		}
+		break;
+	case SRD_OUTPUT_BINARY:
+		/* Class, then the data. */
+		pdb = pdata->data;
+		val = pdb->bin_class;
+		g_byte_array_append(worker_out, (const guint8 *)&val, sizeof(val));
+		g_byte_array_append(worker_out, pdb->data, pdb->size);
+		break;
+	case SRD_OUTPUT_META:
+		/* NUL-terminated type string, then the serialized value. */
+		type = g_variant_get_type_string(pdata->data);
+		g_byte_array_append(worker_out, (const guint8 *)type,
+				strlen(type) + 1);
+		i = worker_out->len;
+		g_byte_array_set_size(worker_out,
+				i + g_variant_get_size(pdata->data));
+		g_variant_store(pdata->data, worker_out->data + i);
+		break;
+	default:
+		g_byte_array_set_size(worker_out, hdr_pos);
+		return;
+	}
+
+	msg.len = worker_out->len - hdr_pos - sizeof(msg);
+	memcpy(worker_out->data + hdr_pos, &msg, sizeof(msg));
+}
+
+/*
+ * Only the forking thread lives on in the child. Locks held by other
+ * threads at the time stay locked there, so the child could deadlock.
+ * Sessions' decode threads are known not to be running, but the frontend
+ * must not have threads of its own calling into libsigrokdecode or Python
+ * either.
+ */
+static gboolean threads_running(void)
+{
+	struct srd_session *sess;
+	GSList *l;
+	gboolean running;
+
+	running = FALSE;
+	srd_sessions_lock();
+	for (l = sessions; l; l = l->next) {
+		sess = l->data;
+		if (sess->queue && sess->queue->thread)
+			running = TRUE;
+	}
+	srd_sessions_unlock();
+
+	return running;
+}
+
+/*
+ * Fork a worker process. Must be called with the GIL held. The list of
+ * sessions is locked across the fork, so the worker finds it intact.
+ */
+static pid_t worker_fork(void)
+{
+	pid_t pid;
+
+	srd_sessions_lock();
+#if PY_VERSION_HEX >= 0x03070000
+	PyOS_BeforeFork();
+	pid = fork();
+	if (pid == 0)
+		PyOS_AfterFork_Child();
+	else
+		PyOS_AfterFork_Parent();
+#else
+	if ((pid = fork()) == 0)
+		PyOS_AfterFork();
+#endif
+	srd_sessions_unlock();
+
+	return pid;
+}
+
+/*
+ * Set up a freshly forked worker process. Besides those of all sessions'
+ * workers, the sockets of the given other workers are closed.
+ */
+static void worker_init(struct srd_session *sess, GSList *siblings)
+{
+	static struct srd_pd_callback forward_cbs[SRD_NUM_OUTPUT_TYPES];
+	struct srd_session *other_sess;
+	struct srd_worker *w;
+	GSList *l, *m;
+	gboolean wanted;
+	int i;
+
+	/* Don't keep other workers' sockets open. */
+	for (l = sessions; l; l = l->next) {
+		other_sess = l->data;
+		for (m = other_sess->workers; m; m = m->next) {
+			w = m->data;
+			close(w->fd);
+		}
+	}
+	for (l = siblings; l; l = l->next) {
+		w = l->data;
+		close(w->fd);
+	}
+
+	/* Pass all output the frontend process wants on to it. */
+	for (i = 0; i < SRD_NUM_OUTPUT_TYPES; i++) {
+		wanted = sess->callbacks[i] != NULL;
+		if (i == SRD_OUTPUT_ANN)
+			wanted = srd_session_ann_wanted(sess);
+		if (i == SRD_OUTPUT_PYTHON)
+			/* Python objects can't be passed on. */
+			wanted = FALSE;
+		sess->callbacks[i] = NULL;
+		if (!wanted)
+			continue;
+		forward_cbs[i].output_type = i;
+		forward_cbs[i].cb = worker_output_cb;
+		forward_cbs[i].cb_data = NULL;
+		sess->callbacks[i] = g_slist_append(NULL, &forward_cbs[i]);
+	}
+	sess->ann_batch = NULL;
+	/* The frontend process summarizes and stores what it gets. */
+	sess->ann_summaries = NULL;
+	sess->ann_store = NULL;
+	/* Annotation texts go right into the messages. */
+	sess->ann_text_lazy = TRUE;
+	worker_out = g_byte_array_new();
+}
+
+/* The worker process' main loop. Never returns. */
+static void worker_run(struct srd_session *sess, struct srd_decoder_inst *di,
+		int fd)
+{
+	struct worker_cmd cmd;
+	struct worker_msg msg;
+
+	worker_init(sess, NULL);
+
+	while (recv_all(fd, &cmd, sizeof(cmd)) == SRD_OK) {
+		if (cmd.type == WORKER_CMD_EXIT)
+			break;
+		memset(&msg, 0, sizeof(msg));
+		msg.type = WORKER_MSG_DONE;
+		msg.ret = srd_inst_decode(di, cmd.start_samplenum,
+				cmd.end_samplenum, sess->worker_shm, cmd.len);
+		g_byte_array_append(worker_out, (const guint8 *)&msg, sizeof(msg));
+		if (send_all(fd, worker_out->data, worker_out->len) != SRD_OK)
+			break;
+		g_byte_array_set_size(worker_out, 0);
+	}
+
+	/* Leave all cleanup to the frontend process. */
+	_exit(0);
+}
+
+/* The same sample data goes to every worker. */
+static int unitsize_check(struct srd_session *sess)
+{
+	struct srd_decoder_inst *di;
+	GSList *l;
+
+	for (l = sess->di_list; l; l = l->next) {
+		di = l->data;
+		if (di->data_unitsize != ((struct srd_decoder_inst *)
+				sess->di_list->data)->data_unitsize) {
+			srd_err("All instances must use the same unit size "
+				"to decode in worker processes.");
+			return SRD_ERR_ARG;
+		}
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Fork off a worker process for every instance of a session which
+ * receives sample data from the frontend.
+ *
+ * Must be called with the GIL held, after all instances were started.
+ *
+ * @param sess The session.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_workers_start(struct srd_session *sess)
+{
+	struct srd_decoder_inst *di;
+	struct srd_worker *w;
+	GSList *l;
+	void *shm;
+	pid_t pid;
+	int fds[2], ret;
+
+	if (sess->workers || !sess->di_list)
+		return SRD_OK;
+
+	if (threads_running()) {
+		srd_err("Can't fork worker processes while a session decodes "
+				"in a thread of its own.");
+		return SRD_ERR;
+	}
+
+	if ((ret = unitsize_check(sess)) != SRD_OK)
+		return ret;
+
+	shm = mmap(NULL, WORKER_SHM_SIZE, PROT_READ | PROT_WRITE,
+			MAP_SHARED | MAP_ANONYMOUS, -1, 0);
+	if (shm == MAP_FAILED) {
+		srd_err("Failed to set up shared memory: %s.", g_strerror(errno));
+		return SRD_ERR_MALLOC;
+	}
+	sess->worker_shm = shm;
+
+	for (l = sess->di_list; l; l = l->next) {
+		di = l->data;
+		if (socketpair(AF_UNIX, SOCK_STREAM, 0, fds) < 0) {
+			srd_err("Failed to create socket: %s.", g_strerror(errno));
+			srd_workers_stop(sess);
+			return SRD_ERR;
+		}
+		if ((pid = worker_fork()) < 0) {
+			srd_err("Failed to fork worker: %s.", g_strerror(errno));
+			close(fds[0]);
+			close(fds[1]);
+			srd_workers_stop(sess);
+			return SRD_ERR;
+		}
+		if (pid == 0) {
+			close(fds[0]);
+			worker_run(sess, di, fds[1]);
+		}
+		close(fds[1]);
+
+		srd_dbg("Instance %s decodes in worker process %d.",
+				di->inst_id, (int)pid);
+
+		w = g_malloc0(sizeof(struct srd_worker));
+		w->di = di;
+		w->pid = pid;
+		w->fd = fds[0];
+		w->out = g_byte_array_new();
+		sess->workers = g_slist_append(sess->workers, w);
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Stop all worker processes of a session.
+ *
+ * @param sess The session.
+ *
+ * @private
+ */
+SRD_PRIV void srd_workers_stop(struct srd_session *sess)
+{
+	struct srd_worker *w;
+	struct worker_cmd cmd;
+	GSList *l;
+
+	memset(&cmd, 0, sizeof(cmd));
+	cmd.type = WORKER_CMD_EXIT;
+	for (l = sess->workers; l; l = l->next) {
+		w = l->data;
+		if (!w->dead)
+			send_all(w->fd, &cmd, sizeof(cmd));
+	}
+
+	for (l = sess->workers; l; l = l->next) {
+		w = l->data;
+		close(w->fd);
+		waitpid(w->pid, NULL, 0);
+		g_byte_array_free(w->out, TRUE);
+		g_free(w);
+	}
+	g_slist_free(sess->workers);
+	sess->workers = NULL;
+
+	if (sess->worker_shm) {
+		munmap(sess->worker_shm, WORKER_SHM_SIZE);
+		sess->worker_shm = NULL;
+	}
+}
+
+/*
+ * Look for the WORKER_MSG_DONE message in the output received from a
+ * worker so far.
+ */
+static void worker_parse(struct srd_worker *w)
+{
+	struct worker_msg msg;
+
+	while (w->parsed + sizeof(msg) <= w->out->len) {
+		memcpy(&msg, w->out->data + w->parsed, sizeof(msg));
+		if (w->parsed + sizeof(msg) + msg.len > w->out->len)
+			break;
+		w->parsed += sizeof(msg) + msg.len;
+		if (msg.type == WORKER_MSG_DONE) {
+			w->done = TRUE;
+			if (msg.ret != SRD_OK)
+				w->ret = msg.ret;
+		}
+	}
+}
+
+/* Wait until all workers are done decoding the current piece. */
+static int workers_wait(GSList *workers)
+{
+	struct srd_worker *w;
+	struct pollfd *pfds;
+	GSList *l;
+	uint8_t buf[65536];
+	ssize_t len;
+	int num_pfds, ret, i;
+
+	pfds = g_malloc(sizeof(struct pollfd) * g_slist_length(workers));
+	ret = SRD_OK;
+	while (TRUE) {
+		num_pfds = 0;
+		for (l = workers; l; l = l->next) {
+			w = l->data;
+			if (w->done || w->dead)
+				continue;
+			pfds[num_pfds].fd = w->fd;
+			pfds[num_pfds].events = POLLIN;
+			pfds[num_pfds].revents = 0;
+			num_pfds++;
+		}
+		if (!num_pfds)
+			break;
+		if (poll(pfds, num_pfds, -1) < 0) {
+			if (errno == EINTR)
+				continue;
+			srd_err("Failed to wait for workers: %s.",
+					g_strerror(errno));
+			ret = SRD_ERR;
+			break;
+		}
+		for (l = workers, i = 0; l; l = l->next) {
+			w = l->data;
+			if (w->done || w->dead)
+				continue;
+			if (!pfds[i++].revents)
+				continue;
+			if ((len = read(w->fd, buf, sizeof(buf))) <= 0) {
+				if (len < 0 && errno == EINTR)
+					continue;
+				srd_err("Worker process for instance %s died.",
+						w->di->inst_id);
+				w->dead = TRUE;
+				ret = SRD_ERR;
+				continue;
+			}
+			g_byte_array_append(w->out, buf, len);
+			worker_parse(w);
+		}
+	}
+	g_free(pfds);
+
+	return ret;
+}
+
+/* Pass one output message from a worker to the frontend's callbacks. */
+static void worker_output_dispatch(struct srd_session *sess,
+		const struct worker_msg *msg, const uint8_t *payload)
+{
+	struct srd_proto_data pdata;
+	struct srd_proto_data_annotation pda;
+	struct srd_proto_data_binary pdb;
+	GVariant *variant;
+	GSList *cbs;
+	const char *type;
+	gpointer data;
+	gint32 val;
+	gsize size;
+	int i;
+
+	memset(&pdata, 0, sizeof(pdata));
+	pdata.start_sample = msg->start_sample;
+	pdata.end_sample = msg->end_sample;
+	pdata.pdo = msg->pdo;
+	cbs = sess->callbacks[msg->pdo->output_type];
+
+	switch (msg->pdo->output_type) {
+	case SRD_OUTPUT_ANN:
+		memcpy(&val, payload, sizeof(val));
+		pda.ann_class = val;
+		memcpy(&val, payload + sizeof(val), sizeof(val));
+		pda.ann_text = g_malloc0(sizeof(char *) * (val + 1));
+		pda.py_texts = NULL;
+		type = (const char *)payload + 2 * sizeof(val);
+		for (i = 0; i < val; i++) {
+			pda.ann_text[i] = g_strdup(type);
+			type += strlen(type) + 1;
+		}
+		pdata.data = &pda;
+		if (cbs)
+			srd_pd_output_callback_run(cbs, &pdata);
+		if (sess->ann_summaries)
+			srd_ann_summary_add(sess, &pdata, &pda);
+		if (sess->ann_store)
+			srd_ann_store_add(sess, &pdata, &pda);
+		if (sess->ann_batch)
+			/* The batch takes over the annotation strings. */
+			srd_ann_batch_add(sess, &pdata, &pda);
+		else
+			g_strfreev(pda.ann_text);
+		break;
+	case SRD_OUTPUT_BINARY:
+		memcpy(&val, payload, sizeof(val));
+		pdb.bin_class = val;
+		pdb.size = msg->len - sizeof(val);
+		pdb.data = payload + sizeof(val);
+		pdata.data = &pdb;
+		srd_pd_output_callback_run(cbs, &pdata);
+		break;
+	case SRD_OUTPUT_META:
+		type = (const char *)payload;
+		size = msg->len - strlen(type) - 1;
+		data = g_memdup(type + strlen(type) + 1, size);
+		variant = g_variant_new_from_data(G_VARIANT_TYPE(type), data,
+				size, FALSE, g_free, data);
+		pdata.data = g_variant_ref_sink(variant);
+		srd_pd_output_callback_run(cbs, &pdata);
+		g_variant_unref(variant);
+		break;
+	}
+}
+
+/*
+ * Pass the output a worker sent for the current piece on to the frontend's
+ * callbacks. Returns the worker's result of decoding it.
+ */
+static int worker_output_flush(struct srd_session *sess, struct srd_worker *w)
+{
+	struct worker_msg msg;
+	uint64_t i;
+	int ret;
+
+	for (i = 0; i + sizeof(msg) <= w->parsed; i += sizeof(msg) + msg.len) {
+		memcpy(&msg, w->out->data + i, sizeof(msg));
+		if (msg.type == WORKER_MSG_OUTPUT)
+			worker_output_dispatch(sess, &msg,
+					w->out->data + i + sizeof(msg));
+	}
+	g_byte_array_remove_range(w->out, 0, w->parsed);
+	w->parsed = 0;
+	ret = w->ret;
+	w->ret = SRD_OK;
+
+	return ret;
+}
+
+/**
+ * Decode a chunk of sample data in a session's worker processes.
+ *
+ * @param sess The session.
+ * @param start_samplenum The sample number of the first sample in the chunk.
+ * @param inbuf The sample data.
+ * @param inbuflen Length in bytes of the sample data.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_workers_decode(struct srd_session *sess,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen)
+{
+	struct srd_worker *w;
+	struct worker_cmd cmd;
+	GSList *l;
+	uint64_t unitsize, piece_len, pos, len;
+	int ret, worker_ret;
+
+	w = sess->workers->data;
+	unitsize = w->di->data_unitsize;
+	piece_len = WORKER_SHM_SIZE / unitsize * unitsize;
+
+	ret = SRD_OK;
+	for (pos = 0; pos < inbuflen; pos += len) {
+		len = MIN(piece_len, inbuflen - pos);
+		memcpy(sess->worker_shm, inbuf + pos, len);
+
+		memset(&cmd, 0, sizeof(cmd));
+		cmd.type = WORKER_CMD_DECODE;
+		cmd.start_samplenum = start_samplenum + pos / unitsize;
+		cmd.end_samplenum = cmd.start_samplenum + len / unitsize;
+		cmd.len = len;
+		for (l = sess->workers; l; l = l->next) {
+			w = l->data;
+			w->done = FALSE;
+			if (w->dead)
+				continue;
+			if (send_all(w->fd, &cmd, sizeof(cmd)) != SRD_OK) {
+				srd_err("Worker process for instance %s died.",
+						w->di->inst_id);
+				w->dead = TRUE;
+				ret = SRD_ERR;
+			}
+		}
+
+		/* The shared memory area is reused for the next piece. */
+		if (workers_wait(sess->workers) != SRD_OK)
+			ret = SRD_ERR;
+	}
+
+	/* Pass on the output, one decoder stack after the other. */
+	for (l = sess->workers; l; l = l->next) {
+		worker_ret = worker_output_flush(sess, l->data);
+		if (worker_ret != SRD_OK && ret == SRD_OK)
+			ret = worker_ret;
+	}
+
+	return ret;
+}
+
+/* A segment of the sample data, and the worker decoding it. */
+struct segment {
+	/* Samples to decode, relative to the start of the sample data. */
+	uint64_t start;
+	uint64_t end;
+	/* Output starting in these (absolute) samples is passed on. */
+	uint64_t keep_start;
+	uint64_t keep_end;
+};
+
+/*
+ * Find the first sample, at or after 'from', by which the bits in mask have
+ * had the given value for run_len samples in a row, counting from 'from'.
+ * Returns num_samples if there is none.
+ */
+static uint64_t resync_find(const uint8_t *inbuf, uint64_t num_samples,
+		int unitsize, uint64_t from, const uint8_t *mask,
+		const uint8_t *value, uint64_t run_len)
+{
+	const uint8_t *sample;
+	uint64_t i, run;
+	int b;
+
+	run = 0;
+	for (i = from; i < num_samples; i++) {
+		sample = inbuf + i * unitsize;
+		for (b = 0; b < unitsize; b++) {
+			if ((sample[b] & mask[b]) != value[b])
+				break;
+		}
+		if (b < unitsize)
+			run = 0;
+		else if (++run == run_len)
+			return i;
+	}
+
+	return num_samples;
+}
+
+/*
+ * Split the sample data into up to num_segments segments, each starting
+ * at a point where the instance can resynchronize. Without a resync
+ * pattern (mask is NULL), there is just one segment.
+ */
+static GArray *segments_plan(const struct srd_decoder_inst *di,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t num_samples, unsigned int num_segments,
+		const uint8_t *mask, const uint8_t *value, uint64_t run_len)
+{
+	struct segment seg, *prev, *next;
+	GArray *segs;
+	uint64_t from, resync;
+	guint i;
+
+	segs = g_array_new(FALSE, TRUE, sizeof(struct segment));
+	memset(&seg, 0, sizeof(seg));
+	g_array_append_val(segs, seg);
+
+	for (i = 1; mask && i < num_segments; i++) {
+		prev = &g_array_index(segs, struct segment, segs->len - 1);
+		from = MAX(num_samples * i / num_segments,
+				prev->keep_start - start_samplenum + 1);
+		resync = resync_find(inbuf, num_samples, di->data_unitsize,
+				from, mask, value, run_len);
+		if (resync >= num_samples)
+			break;
+		/* Start decoding with the matching samples, as a warm-up. */
+		seg.start = resync - run_len + 1;
+		seg.keep_start = start_samplenum + resync;
+		g_array_append_val(segs, seg);
+	}
+
+	/* Every worker decodes up to where the next one takes over. */
+	for (i = 0; i < segs->len; i++) {
+		prev = &g_array_index(segs, struct segment, i);
+		if (i + 1 < segs->len) {
+			next = &g_array_index(segs, struct segment, i + 1);
+			prev->end = next->keep_start - start_samplenum;
+			prev->keep_end = next->keep_start;
+		} else {
+			prev->end = num_samples;
+			prev->keep_end = UINT64_MAX;
+		}
+	}
+	/* Output before the sample data belongs to the first segment. */
+	g_array_index(segs, struct segment, 0).keep_start = 0;
+
+	return segs;
+}
+
+/* Decode one segment in a worker process. Never returns. */
+static void segment_run(struct srd_session *sess, struct srd_decoder_inst *di,
+		int fd, GSList *siblings, uint64_t start_samplenum,
+		const uint8_t *inbuf, const struct segment *seg)
+{
+	struct worker_msg msg;
+
+	worker_init(sess, siblings);
+	worker_keep_start = seg->keep_start;
+	worker_keep_end = seg->keep_end;
+
+	memset(&msg, 0, sizeof(msg));
+	msg.type = WORKER_MSG_DONE;
+	msg.ret = srd_inst_decode(di, start_samplenum + seg->start,
+			start_samplenum + seg->end,
+			inbuf + seg->start * di->data_unitsize,
+			(seg->end - seg->start) * di->data_unitsize);
+	g_byte_array_append(worker_out, (const guint8 *)&msg, sizeof(msg));
+	send_all(fd, worker_out->data, worker_out->len);
+
+	_exit(0);
+}
+
+/**
+ * Decode a whole capture in segments, in parallel worker processes.
+ *
+ * For every instance receiving sample data, the capture is split into
+ * segments at points where the instance can resynchronize, see
+ * srd_inst_resync_get(). A worker process is forked off for every segment.
+ * It starts decoding a little early, with the samples matching the resync
+ * pattern, and stops where the next segment's worker takes over. Output
+ * starting before or after the segment is dropped, so nothing is passed
+ * on twice. The workers inherit the sample data, so nothing is copied.
+ *
+ * Must be called without the GIL held.
+ *
+ * @param sess The session.
+ * @param start_samplenum The sample number of the first sample.
+ * @param inbuf The sample data.
+ * @param inbuflen Length in bytes of the sample data.
+ * @param num_segments The maximum number of segments per instance.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_workers_decode_segmented(struct srd_session *sess,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen, unsigned int num_segments)
+{
+	PyGILState_STATE gstate;
+	struct srd_decoder_inst *di;
+	struct srd_worker *w;
+	struct segment *seg;
+	GSList *workers, *l;
+	GArray *segs;
+	uint8_t *mask, *value;
+	uint64_t num_samples, run_len;
+	guint i;
+	pid_t pid;
+	int fds[2], ret, worker_ret;
+
+	if (!sess->di_list)
+		return SRD_OK;
+
+	if (threads_running()) {
+		srd_err("Can't fork worker processes while a session decodes "
+				"in a thread of its own.");
+		return SRD_ERR;
+	}
+
+	if ((ret = unitsize_check(sess)) != SRD_OK)
+		return ret;
+	di = sess->di_list->data;
+	num_samples = inbuflen / di->data_unitsize;
+
+	workers = NULL;
+	gstate = srd_gil_ensure();
+	for (l = sess->di_list; l && ret == SRD_OK; l = l->next) {
+		di = l->data;
+		if ((ret = srd_inst_resync_get(di, &mask, &value,
+				&run_len)) != SRD_OK)
+			break;
+		segs = segments_plan(di, start_samplenum, inbuf, num_samples,
+				num_segments, mask, value, run_len);
+		g_free(mask);
+		g_free(value);
+		srd_dbg("Decoding instance %s in %u segment(s).", di->inst_id,
+				segs->len);
+
+		for (i = 0; i < segs->len; i++) {
+			seg = &g_array_index(segs, struct segment, i);
+			if (socketpair(AF_UNIX, SOCK_STREAM, 0, fds) < 0) {
+				srd_err("Failed to create socket: %s.",
+						g_strerror(errno));
+				ret = SRD_ERR;
+				break;
+			}
+			if ((pid = worker_fork()) < 0) {
+				srd_err("Failed to fork worker: %s.",
+						g_strerror(errno));
+				close(fds[0]);
+				close(fds[1]);
+				ret = SRD_ERR;
+				break;
+			}
+			if (pid == 0) {
+				close(fds[0]);
+				segment_run(sess, di, fds[1], workers,
+						start_samplenum, inbuf, seg);
+			}
+			close(fds[1]);
+
+			w = g_malloc0(sizeof(struct srd_worker));
+			w->di = di;
+			w->pid = pid;
+			w->fd = fds[0];
+			w->out = g_byte_array_new();
+			workers = g_slist_append(workers, w);
+		}
+		g_array_free(segs, TRUE);
+	}
+	srd_gil_release(gstate);
+
+	/* Even after errors, let the workers already running finish. */
+	if (workers_wait(workers) != SRD_OK && ret == SRD_OK)
+		ret = SRD_ERR;
+
+	/* Pass on the output in sample order, one decoder stack after the other. */
+	for (l = workers; l; l = l->next) {
+		w = l->data;
+		if (ret == SRD_OK) {
+			worker_ret = worker_output_flush(sess, w);
+			if (worker_ret != SRD_OK)
+				ret = worker_ret;
+		}
+		close(w->fd);
+		waitpid(w->pid, NULL, 0);
+		g_byte_array_free(w->out, TRUE);
+		g_free(w);
+	}
+	g_slist_free(workers);
+
+	return ret;
+}
+
+#else
+
+SRD_PRIV int srd_workers_start(struct srd_session *sess)
+{
+	(void)sess;
+
+	srd_err("Worker processes are not supported on this platform.");
+
+	return SRD_ERR;
+}
+
+SRD_PRIV void srd_workers_stop(struct srd_session *sess)
+{
+	(void)sess;
+}
+
+SRD_PRIV int srd_workers_decode(struct srd_session *sess,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen)
+{
+	(void)sess;
+	(void)start_samplenum;
+	(void)inbuf;
+	(void)inbuflen;
+
+	return SRD_ERR;
+}
+
+SRD_PRIV int srd_workers_decode_segmented(struct srd_session *sess,
+		uint64_t start_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen, unsigned int num_segments)
+{
+	(void)sess;
+	(void)start_samplenum;
+	(void)inbuf;
+	(void)inbuflen;
+	(void)num_segments;
+
+	srd_err("Worker processes are not supported on this platform.");
+
+	return SRD_ERR;
+}
+
+#endif